@@ -0,0 +1,263 @@
+# analytics.py
+# Supply-chain analytics for manufacturers from daily rollups, never from raw events.
+#
+# Three summary tables are upserted in the same transaction as the rows they count,
+# like review_summaries and batch_touchpoints:
+#   - analytics_stage_daily (manufacturer, day, batch, stage): events recorded, and the
+#     dwell of the stage, i.e. the time from an event in that stage to the product's
+#     next event, counted on the day that next event arrives;
+#   - analytics_transit_daily (manufacturer, day, batch, from, to location): consecutive
+#     events of a product at different locations, with the time between them;
+#   - analytics_recall_daily (manufacturer, day, brand): recalls and recalled products.
+# ledger.append_events and product_ingest call record_events() with each new event and
+# the product's previous one, which append_events reads with the chain head it locks
+# anyway. The events are summed per row in Python first, so a call costs two plain
+# VALUES upserts. POST /recalls/add calls record_recall(). Rows are keyed per batch, so
+# concurrent appends only wait on each other where batch_touchpoints already makes them,
+# and the upserts run in key order so they cannot deadlock. Days are UTC.
+#
+# The endpoints sum a manufacturer's rows over a date range (the primary key prefix);
+# their cost grows with days x batches x stages, not with events. rebuild() recomputes
+# everything from traceability_log and product_recalls, for rows written around the API.
+#
+#   python analytics.py               # rebuild every manufacturer's rollups
+#   python analytics.py MFR_ABC123
+import datetime
+from typing import List, Optional
+
+from psycopg2.extras import execute_values
+
+STAGE_UPSERT_SQL = """
+INSERT INTO analytics_stage_daily (manufacturer_id, day, batch_number, stage, event_count, dwell_count, dwell_seconds, dwell_seconds_max)
+VALUES %s
+ON CONFLICT (manufacturer_id, day, batch_number, stage) DO UPDATE SET
+    event_count = analytics_stage_daily.event_count + EXCLUDED.event_count,
+    dwell_count = analytics_stage_daily.dwell_count + EXCLUDED.dwell_count,
+    dwell_seconds = analytics_stage_daily.dwell_seconds + EXCLUDED.dwell_seconds,
+    dwell_seconds_max = GREATEST(analytics_stage_daily.dwell_seconds_max, EXCLUDED.dwell_seconds_max)
+"""
+
+TRANSIT_UPSERT_SQL = """
+INSERT INTO analytics_transit_daily (manufacturer_id, day, batch_number, from_location, to_location,
+                                     trip_count, transit_seconds, transit_seconds_min, transit_seconds_max)
+VALUES %s
+ON CONFLICT (manufacturer_id, day, batch_number, from_location, to_location) DO UPDATE SET
+    trip_count = analytics_transit_daily.trip_count + EXCLUDED.trip_count,
+    transit_seconds = analytics_transit_daily.transit_seconds + EXCLUDED.transit_seconds,
+    transit_seconds_min = LEAST(analytics_transit_daily.transit_seconds_min, EXCLUDED.transit_seconds_min),
+    transit_seconds_max = GREATEST(analytics_transit_daily.transit_seconds_max, EXCLUDED.transit_seconds_max)
+"""
+
+# Every product of the batch carries the recall, so each of its manufacturers and brands counts it
+RECALL_UPSERT_SQL = """
+INSERT INTO analytics_recall_daily (manufacturer_id, day, brand, recall_count, product_count)
+SELECT p.manufacturer_id, (%(recall_date)s::timestamptz AT TIME ZONE 'UTC')::date, p.brand, 1, count(*)
+FROM products p
+WHERE p.batch_number = %(batch_number)s
+GROUP BY p.manufacturer_id, p.brand
+ORDER BY p.manufacturer_id, p.brand
+ON CONFLICT (manufacturer_id, day, brand) DO UPDATE SET
+    recall_count = analytics_recall_daily.recall_count + EXCLUDED.recall_count,
+    product_count = analytics_recall_daily.product_count + EXCLUDED.product_count
+"""
+
+RANGE_FILTER = "manufacturer_id = %(manufacturer_id)s AND day BETWEEN %(start)s AND %(end)s"
+BATCH_FILTER = "AND (%(batch_number)s::text IS NULL OR batch_number = %(batch_number)s)"
+
+STAGES_SQL = f"""
+SELECT COALESCE(json_agg(json_build_object(
+    'stage', stage, 'event_count', event_count, 'dwell_count', dwell_count,
+    'avg_dwell_seconds', round((dwell_seconds / NULLIF(dwell_count, 0))::numeric, 1),
+    'max_dwell_seconds', CASE WHEN dwell_count > 0 THEN round(dwell_seconds_max::numeric, 1) END
+) ORDER BY event_count DESC, stage), '[]')::text
+FROM (
+    SELECT stage, sum(event_count) AS event_count, sum(dwell_count) AS dwell_count,
+           sum(dwell_seconds) AS dwell_seconds, max(dwell_seconds_max) AS dwell_seconds_max
+    FROM analytics_stage_daily
+    WHERE {RANGE_FILTER} {BATCH_FILTER}
+    GROUP BY stage
+) s
+"""
+
+TRANSIT_SQL = f"""
+SELECT COALESCE(json_agg(json_build_object(
+    'from_location', from_location, 'to_location', to_location, 'trip_count', trip_count,
+    'avg_seconds', round((transit_seconds / trip_count)::numeric, 1),
+    'min_seconds', round(transit_seconds_min::numeric, 1), 'max_seconds', round(transit_seconds_max::numeric, 1)
+) ORDER BY trip_count DESC, from_location, to_location), '[]')::text
+FROM (
+    SELECT from_location, to_location, sum(trip_count) AS trip_count, sum(transit_seconds) AS transit_seconds,
+           min(transit_seconds_min) AS transit_seconds_min, max(transit_seconds_max) AS transit_seconds_max
+    FROM analytics_transit_daily
+    WHERE {RANGE_FILTER} {BATCH_FILTER}
+      AND (%(location)s::text IS NULL OR from_location = %(location)s OR to_location = %(location)s)
+    GROUP BY from_location, to_location
+    ORDER BY trip_count DESC, from_location, to_location
+    LIMIT %(limit)s
+) t
+"""
+
+# Every day of the range, with 0 for days without events
+EVENTS_PER_DAY_SQL = f"""
+SELECT json_agg(json_build_object('day', d.day::date, 'event_count', COALESCE(c.event_count, 0)) ORDER BY d.day)::text
+FROM generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS d (day)
+LEFT JOIN (
+    SELECT day, sum(event_count) AS event_count
+    FROM analytics_stage_daily
+    WHERE {RANGE_FILTER} {BATCH_FILTER}
+      AND (%(stage)s::text IS NULL OR stage = %(stage)s)
+    GROUP BY day
+) c ON c.day = d.day::date
+"""
+
+RECALLS_SQL = f"""
+SELECT COALESCE(json_agg(json_build_object(
+    'brand', brand, 'recall_count', recall_count, 'product_count', product_count
+) ORDER BY recall_count DESC, brand), '[]')::text
+FROM (
+    SELECT brand, sum(recall_count) AS recall_count, sum(product_count) AS product_count
+    FROM analytics_recall_daily
+    WHERE {RANGE_FILTER}
+    GROUP BY brand
+) r
+"""
+
+# Recomputes the rollups of the given manufacturers (all of them when %(manufacturers)s is NULL)
+REBUILD_SQL = """
+DELETE FROM analytics_stage_daily WHERE %(manufacturers)s::text[] IS NULL OR manufacturer_id = ANY(%(manufacturers)s);
+DELETE FROM analytics_transit_daily WHERE %(manufacturers)s::text[] IS NULL OR manufacturer_id = ANY(%(manufacturers)s);
+DELETE FROM analytics_recall_daily WHERE %(manufacturers)s::text[] IS NULL OR manufacturer_id = ANY(%(manufacturers)s);
+
+CREATE TEMPORARY TABLE analytics_steps AS
+SELECT p.manufacturer_id, p.batch_number, l.location, l.stage, l.timestamp, (l.timestamp AT TIME ZONE 'UTC')::date AS day,
+       lag(l.timestamp) OVER w AS previous_at, lag(l.location) OVER w AS previous_location, lag(l.stage) OVER w AS previous_stage
+FROM traceability_log l JOIN products p ON p.id = l.product_id
+WHERE %(manufacturers)s::text[] IS NULL OR p.manufacturer_id = ANY(%(manufacturers)s)
+WINDOW w AS (PARTITION BY l.product_id ORDER BY l.log_id);
+
+INSERT INTO analytics_stage_daily (manufacturer_id, day, batch_number, stage, event_count, dwell_count, dwell_seconds, dwell_seconds_max)
+SELECT manufacturer_id, day, batch_number, stage, sum(events), sum(dwells), COALESCE(sum(seconds), 0), COALESCE(max(seconds), 0)
+FROM (
+    SELECT manufacturer_id, day, batch_number, stage, 1 AS events, 0 AS dwells, NULL::double precision AS seconds
+    FROM analytics_steps
+    UNION ALL
+    SELECT manufacturer_id, day, batch_number, previous_stage, 0, 1, extract(epoch FROM timestamp - previous_at)::double precision
+    FROM analytics_steps WHERE previous_at IS NOT NULL
+) s
+GROUP BY manufacturer_id, day, batch_number, stage;
+
+INSERT INTO analytics_transit_daily (manufacturer_id, day, batch_number, from_location, to_location,
+                                     trip_count, transit_seconds, transit_seconds_min, transit_seconds_max)
+SELECT manufacturer_id, day, batch_number, previous_location, location, count(*),
+       sum(extract(epoch FROM timestamp - previous_at)), min(extract(epoch FROM timestamp - previous_at)),
+       max(extract(epoch FROM timestamp - previous_at))
+FROM analytics_steps
+WHERE previous_at IS NOT NULL AND previous_location <> location
+GROUP BY manufacturer_id, day, batch_number, previous_location, location;
+
+INSERT INTO analytics_recall_daily (manufacturer_id, day, brand, recall_count, product_count)
+SELECT p.manufacturer_id, (r.recall_date AT TIME ZONE 'UTC')::date, p.brand, count(DISTINCT r.recall_id), count(*)
+FROM product_recalls r JOIN products p ON p.batch_number = r.batch_number
+WHERE %(manufacturers)s::text[] IS NULL OR p.manufacturer_id = ANY(%(manufacturers)s)
+GROUP BY 1, 2, 3;
+
+DROP TABLE analytics_steps;
+"""
+
+
+def record_events(cursor, steps: List[tuple]):
+    """
+    Folds new events into the stage and transit rollups. Each step is (manufacturer_id,
+    batch_number, timestamp, location, stage, previous_at, previous_location,
+    previous_stage); the previous fields are None for a product's first event.
+    """
+    stages, transits = {}, {}
+    for manufacturer_id, batch_number, timestamp, location, stage, previous_at, previous_location, previous_stage in steps:
+        day = timestamp.astimezone(datetime.timezone.utc).date()
+        stages.setdefault((manufacturer_id, day, batch_number, stage), [0, 0, 0.0, 0.0])[0] += 1
+        if previous_at is None:
+            continue
+        seconds = (timestamp - previous_at).total_seconds()
+        if previous_stage is not None:
+            dwell = stages.setdefault((manufacturer_id, day, batch_number, previous_stage), [0, 0, 0.0, 0.0])
+            dwell[1] += 1
+            dwell[2] += seconds
+            dwell[3] = max(dwell[3], seconds)
+        if previous_location is not None and previous_location != location:
+            key = (manufacturer_id, day, batch_number, previous_location, location)
+            trip = transits.setdefault(key, [0, 0.0, seconds, seconds])
+            trip[0] += 1
+            trip[1] += seconds
+            trip[2], trip[3] = min(trip[2], seconds), max(trip[3], seconds)
+    # In key order, so concurrent writers lock the shared rows in the same order
+    if stages:
+        execute_values(cursor, STAGE_UPSERT_SQL, [key + tuple(value) for key, value in sorted(stages.items())],
+                       page_size=len(stages))
+    if transits:
+        execute_values(cursor, TRANSIT_UPSERT_SQL, [key + tuple(value) for key, value in sorted(transits.items())],
+                       page_size=len(transits))
+
+
+def record_recall(cursor, batch_number: str, recall_date: datetime.datetime):
+    cursor.execute(RECALL_UPSERT_SQL, {"batch_number": batch_number, "recall_date": recall_date})
+
+
+def _fetch(cursor, sql: str, params: dict) -> str:
+    cursor.execute(sql, params)
+    return cursor.fetchone()[0]
+
+
+def stage_stats(cursor, manufacturer_id: str, start: datetime.date, end: datetime.date,
+                batch_number: Optional[str] = None) -> str:
+    """Events and dwell per stage over [start, end] as a JSON array (text), most frequent stage first."""
+    return _fetch(cursor, STAGES_SQL, {"manufacturer_id": manufacturer_id, "start": start, "end": end,
+                                       "batch_number": batch_number})
+
+
+def transit_stats(cursor, manufacturer_id: str, start: datetime.date, end: datetime.date,
+                  batch_number: Optional[str] = None, location: Optional[str] = None, limit: int = 50) -> str:
+    """Transit times per (from, to) location pair over [start, end] as a JSON array (text), busiest first."""
+    return _fetch(cursor, TRANSIT_SQL, {"manufacturer_id": manufacturer_id, "start": start, "end": end,
+                                        "batch_number": batch_number, "location": location, "limit": limit})
+
+
+def events_per_day(cursor, manufacturer_id: str, start: datetime.date, end: datetime.date,
+                   batch_number: Optional[str] = None, stage: Optional[str] = None) -> str:
+    """Event counts for every day of [start, end] as a JSON array (text)."""
+    return _fetch(cursor, EVENTS_PER_DAY_SQL, {"manufacturer_id": manufacturer_id, "start": start, "end": end,
+                                               "batch_number": batch_number, "stage": stage})
+
+
+def recall_stats(cursor, manufacturer_id: str, start: datetime.date, end: datetime.date) -> str:
+    """Recalls and recalled products per brand over [start, end] as a JSON array (text)."""
+    return _fetch(cursor, RECALLS_SQL, {"manufacturer_id": manufacturer_id, "start": start, "end": end})
+
+
+def rebuild(cursor, manufacturer_ids: Optional[List[str]] = None):
+    """
+    Recomputes the rollups of the given manufacturers (or of all of them) from
+    traceability_log and product_recalls. Run it with writers quiet: events appended
+    meanwhile may be counted twice. Events already archived out of the log
+    (log_partitions.py) are no longer seen. The caller owns the transaction.
+    """
+    cursor.execute(REBUILD_SQL, {"manufacturers": manufacturer_ids})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import psycopg2
+
+    from main import settings
+
+    parser = argparse.ArgumentParser(description="Rebuild the supply-chain analytics rollups.")
+    parser.add_argument("manufacturer_ids", nargs="*", help="Manufacturers to rebuild (default: all)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.DATABASE_URL)
+    cursor = conn.cursor()
+    rebuild(cursor, args.manufacturer_ids or None)
+    conn.commit()
+    print(f"Rebuilt analytics rollups for {', '.join(args.manufacturer_ids) or 'every manufacturer'}")
+    cursor.close()
+    conn.close()
@@ -0,0 +1,521 @@
+# anchoring.py
+# Background anchoring of traceability events to the Traceability smart contract.
+#
+# The API never talks to the chain inside a request. Instead every new
+# traceability_log row gets a matching row in the anchor_outbox table, written in
+# the same transaction. AnchorWorker drains that outbox on a background thread,
+# sends the transactions with a locally managed nonce, retries failures with
+# exponential backoff and finally fills in traceability_log.blockchain_tx_id.
+#
+# BatchAnchorWorker is the high-volume variant: it folds up to N pending event
+# hashes into one Merkle tree, anchors only the root via recordBatchRoot, and keeps
+# each row's Merkle proof next to it so inclusion can be verified offline.
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from psycopg2.extras import RealDictCursor, execute_values
+from web3.exceptions import TransactionNotFound
+
+from merkle import build_tree, merkle_proof, merkle_root
+
+logger = logging.getLogger("bharatfoodtrace.anchoring")
+
+# Minimal ABI needed for our contract interaction
+CONTRACT_ABI = [
+    {"name":"recordTraceEvent","type":"function","stateMutability":"nonpayable","inputs":[{"type":"bytes32","name":"_productBatchId"},{"type":"bytes32","name":"_eventHash"}],"outputs":[]},
+    {"name":"getTraceEvents","type":"function","stateMutability":"view","inputs":[{"type":"bytes32","name":"_productBatchId"}],"outputs":[{"type":"bytes32[]","name":""}]},
+    {"name":"recordBatchRoot","type":"function","stateMutability":"nonpayable","inputs":[{"type":"bytes32","name":"_merkleRoot"},{"type":"uint256","name":"_leafCount"}],"outputs":[]},
+    {"name":"batchRecordedAt","type":"function","stateMutability":"view","inputs":[{"type":"bytes32","name":""}],"outputs":[{"type":"uint256","name":""}]},
+    {"name":"BatchRootRecorded","type":"event","inputs":[{"type":"bytes32","name":"merkleRoot","indexed":True},{"type":"uint256","name":"leafCount","indexed":False},{"type":"address","name":"recorder","indexed":False},{"type":"uint256","name":"timestamp","indexed":False}],"anonymous":False},
+    {"name":"EventRecorded","type":"event","inputs":[{"type":"bytes32","name":"productBatchId","indexed":True},{"type":"bytes32","name":"eventHash","indexed":False},{"type":"address","name":"recorder","indexed":False},{"type":"uint256","name":"timestamp","indexed":False}],"anonymous":False}
+]
+
+
+def product_batch_id(product_id: str) -> bytes:
+    """bytes32 key under which a product's events are stored on-chain."""
+    return hashlib.sha256(product_id.encode()).digest()
+
+
+def enqueue_anchors(cursor, log_ids: List[int]):
+    """Adds traceability_log rows to the outbox. Call inside the INSERT's transaction."""
+    if log_ids:
+        execute_values(cursor, "INSERT INTO anchor_outbox (log_id) VALUES %s ON CONFLICT (log_id) DO NOTHING",
+                       [(log_id,) for log_id in log_ids], page_size=len(log_ids))
+
+
+class NonceManager:
+    """Hands out sequential nonces without an RPC round-trip per transaction.
+
+    The first call syncs with the node's pending transaction count; after that the
+    nonce is incremented locally. Call reset() after a failed send so the next
+    transaction re-syncs instead of leaving a gap.
+    """
+
+    def __init__(self, w3, address: str):
+        self.w3 = w3
+        self.address = address
+        self._next = None
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            if self._next is None:
+                self._next = self.w3.eth.get_transaction_count(self.address, "pending")
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def reset(self):
+        with self._lock:
+            self._next = None
+
+
+class AnchorWorker:
+    """Drains anchor_outbox and records each pending event hash on-chain.
+
+    Rows are claimed with a lease (FOR UPDATE SKIP LOCKED), so a row is never claimed
+    twice while it is being sent. That does not make several workers safe: NonceManager
+    counts nonces per process, and two workers signing with the same key would reuse
+    them. Run one worker per key; the API elects one process for it (db.LeaderLock).
+    A pass sends all its transactions and then polls their receipts together for at
+    most receipt_timeout, so it ends well inside the lease (lease_seconds must exceed
+    receipt_timeout) and a row is not re-claimed while its receipt is awaited.
+    run_once() does a single drain pass and is what tests drive directly, e.g.
+    against Web3(EthereumTesterProvider()) or a local Hardhat/anvil node.
+    """
+
+    def __init__(self, get_conn, release_conn, w3, contract, account, chain_id: int,
+                 batch_size: int = 20, poll_interval: float = 2.0, max_attempts: int = 10,
+                 base_backoff: float = 2.0, max_backoff: float = 300.0,
+                 receipt_timeout: float = 120.0, lease_seconds: float = 300.0, on_anchored=None,
+                 receipt_poll_interval: float = 1.0):
+        if lease_seconds <= receipt_timeout:
+            raise ValueError("lease_seconds must exceed receipt_timeout, or rows are re-claimed while their receipts are awaited")
+        self.get_conn = get_conn
+        self.release_conn = release_conn
+        self.w3 = w3
+        self.contract = contract
+        self.account = account
+        self.chain_id = chain_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.receipt_timeout = receipt_timeout
+        self.receipt_poll_interval = receipt_poll_interval
+        self.lease_seconds = lease_seconds
+        self.on_anchored = on_anchored  # Called with the product ids whose events were just anchored
+        self.nonces = NonceManager(w3, account.address)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="anchor-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self):
+        """Wakes the worker early, e.g. right after a new event was committed."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = self.run_once()
+            except Exception:
+                logger.exception("Anchoring pass failed")
+                processed = 0
+            if processed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    # --- Draining ---
+    def run_once(self) -> int:
+        """Claims up to batch_size due rows, anchors them and returns how many were handled."""
+        items = self._claim()
+        if not items:
+            return 0
+
+        # Send everything first so the transactions share blocks, then wait for all receipts at once.
+        sent = []
+        for item in items:
+            if item["tx_hash"]:
+                sent.append(item)
+                continue
+            try:
+                item["tx_hash"] = self._send(item)
+                self._mark_sent(item)
+                sent.append(item)
+            except Exception as e:
+                self.nonces.reset()
+                self._mark_failed(item, e, keep_tx_hash=False)
+
+        receipts = self._collect_receipts([item["tx_hash"] for item in sent])
+        for item in sent:
+            self._confirm(item, receipts)
+        return len(items)
+
+    def _claim(self):
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                """
+                UPDATE anchor_outbox o
+                SET next_attempt_at = now() + make_interval(secs => %s)
+                FROM traceability_log t
+                WHERE o.log_id = t.log_id AND o.log_id IN (
+                    SELECT log_id FROM anchor_outbox
+                    WHERE status = 'pending' AND batch_id IS NULL AND next_attempt_at <= now()
+                    ORDER BY log_id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING o.log_id, o.attempts, o.tx_hash, t.product_id, t.current_hash
+                """,
+                (self.lease_seconds, self.batch_size)
+            )
+            items = sorted(cursor.fetchall(), key=lambda row: row["log_id"])
+            conn.commit()
+            cursor.close()
+            return [dict(item) for item in items]
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_conn(conn)
+
+    def _send(self, item) -> str:
+        return self._transact(self.contract.functions.recordTraceEvent(
+            product_batch_id(item["product_id"]), bytes.fromhex(item["current_hash"])
+        ))
+
+    def _transact(self, function_call) -> str:
+        tx_data = function_call.build_transaction({
+            'chainId': self.chain_id,
+            'gas': 2000000,
+            'gasPrice': self.w3.eth.gas_price,
+            'from': self.account.address,
+            'nonce': self.nonces.next(),
+        })
+        signed_tx = self.account.sign_transaction(tx_data)
+        return self.w3.to_hex(self.w3.eth.send_raw_transaction(signed_tx.raw_transaction))
+
+    def _confirm(self, item, receipts: dict):
+        error, keep_tx_hash = self._outcome(receipts, item["tx_hash"])
+        if error:
+            self._mark_failed(item, error, keep_tx_hash)
+        else:
+            self._mark_anchored(item)
+
+    def _collect_receipts(self, tx_hashes: List[str]) -> dict:
+        """Polls the receipts of all tx_hashes until each has one or receipt_timeout has passed; tx_hash -> receipt."""
+        receipts, errors = {}, {}
+        pending = list(dict.fromkeys(tx_hashes))
+        deadline = time.monotonic() + self.receipt_timeout
+        while pending:
+            for tx_hash in pending:
+                try:
+                    receipts[tx_hash] = self.w3.eth.get_transaction_receipt(tx_hash)
+                except TransactionNotFound:
+                    pass
+                except Exception as e:
+                    errors[tx_hash] = e
+            pending = [tx_hash for tx_hash in pending if tx_hash not in receipts]
+            if not pending or time.monotonic() >= deadline or self._stopping.wait(self.receipt_poll_interval):
+                break
+        for tx_hash in pending:
+            receipts[tx_hash] = errors.get(tx_hash)  # None, or why the node could not be asked
+        return receipts
+
+    def _outcome(self, receipts: dict, tx_hash: str):
+        """(error, keep_tx_hash) for a sent transaction; error is None if it succeeded."""
+        receipt = receipts.get(tx_hash)
+        if receipt is None or isinstance(receipt, Exception):
+            # Still unconfirmed (or the node is unreachable): keep the hash and check it again later.
+            return TimeoutError(f"No receipt for {tx_hash} within {self.receipt_timeout}s: {receipt or 'not mined yet'}"), True
+        if receipt.status != 1:
+            return RuntimeError(f"Transaction {tx_hash} reverted"), False
+        return None, False
+
+    # --- Outbox bookkeeping ---
+    def _execute(self, query, params):
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_conn(conn)
+
+    def _mark_sent(self, item):
+        self._execute("UPDATE anchor_outbox SET tx_hash = %s WHERE log_id = %s", (item["tx_hash"], item["log_id"]))
+
+    def _mark_anchored(self, item):
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE traceability_log SET blockchain_tx_id = %s WHERE log_id = %s', (item["tx_hash"], item["log_id"]))
+            cursor.execute('DELETE FROM anchor_outbox WHERE log_id = %s', (item["log_id"],))
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_conn(conn)
+        self._notify_anchored([item["product_id"]])
+
+    def _notify_anchored(self, product_ids):
+        if self.on_anchored and product_ids:
+            try:
+                self.on_anchored(product_ids)
+            except Exception:
+                logger.exception("on_anchored callback failed")
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.base_backoff * (2 ** (attempts - 1)), self.max_backoff)
+
+    def _retry_params(self, item, error, keep_tx_hash: bool, label: str):
+        attempts = item["attempts"] + 1
+        status = 'failed' if attempts >= self.max_attempts else 'pending'
+        retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.backoff(attempts))
+        logger.warning("Could not anchor %s (attempt %s/%s): %s", label, attempts, self.max_attempts, error)
+        return (attempts, status, retry_at, str(error)[:1000], item["tx_hash"] if keep_tx_hash else None)
+
+    def _mark_failed(self, item, error, keep_tx_hash: bool):
+        self._execute(
+            """
+            UPDATE anchor_outbox
+            SET attempts = %s, status = %s, next_attempt_at = %s, last_error = %s, tx_hash = %s
+            WHERE log_id = %s
+            """,
+            self._retry_params(item, error, keep_tx_hash, f"log_id {item['log_id']}") + (item["log_id"],)
+        )
+
+
+class BatchAnchorWorker(AnchorWorker):
+    """Anchors pending events as Merkle batches: one recordBatchRoot transaction per batch.
+
+    A pass first retries due batches from earlier passes, then folds up to
+    batch_size unbatched outbox rows into a new tree. Batch membership, the root
+    and every row's proof are committed before the transaction is sent, so a
+    retry re-sends exactly the same root. Retry state lives on anchor_batches.
+    recordBatchRoot rejects a root that is already recorded, e.g. by a send that
+    raised after the node accepted it, or by another sender. So a retried batch
+    whose root is on-chain, or one whose transaction reverted, is checked with
+    batchRecordedAt and marked anchored instead of being re-sent.
+    """
+
+    def run_once(self) -> int:
+        batches = self._claim_batches()
+        unrecorded = []
+        for batch in batches:
+            if self._root_recorded(batch):
+                self._mark_batch_anchored(batch, recorded=True)
+            else:
+                unrecorded.append(batch)
+        batch = self._form_batch()
+        if batch:
+            batches.append(batch)
+            unrecorded.append(batch)
+        sent = [batch for batch in unrecorded if self._send_batch(batch)]
+        receipts = self._collect_receipts([batch["tx_hash"] for batch in sent])
+        for batch in sent:
+            error, keep_tx_hash = self._outcome(receipts, batch["tx_hash"])
+            if error and not keep_tx_hash and self._root_recorded(batch):
+                self._mark_batch_anchored(batch, recorded=True)  # Reverted: the root was recorded before
+            elif error:
+                self._mark_batch_failed(batch, error, keep_tx_hash)
+            else:
+                self._mark_batch_anchored(batch)
+        return sum(batch["leaf_count"] for batch in batches)
+
+    def _root_recorded(self, batch) -> bool:
+        try:
+            return self.contract.functions.batchRecordedAt(bytes.fromhex(batch["merkle_root"])).call() > 0
+        except Exception:
+            logger.warning("Could not check whether batch %s is recorded", batch["batch_id"], exc_info=True)
+            return False
+
+    def _recording_tx(self, batch) -> Optional[str]:
+        """The transaction that recorded the batch root: from chain_events if indexed, else the contract's logs."""
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT tx_hash FROM chain_events
+                WHERE event_name = 'BatchRootRecorded' AND event_hash = %s AND contract_address = %s
+                ORDER BY block_number LIMIT 1
+                """,
+                (batch["merkle_root"], self.contract.address)
+            )
+            row = cursor.fetchone()
+            conn.rollback()
+            cursor.close()
+        finally:
+            self.release_conn(conn)
+        if row:
+            return row[0]
+        try:
+            logs = self.contract.events.BatchRootRecorded.get_logs(
+                argument_filters={"merkleRoot": bytes.fromhex(batch["merkle_root"])}, from_block=0
+            )
+        except Exception:
+            logger.warning("Could not look up the transaction that recorded batch %s", batch["batch_id"], exc_info=True)
+            return None
+        return self.w3.to_hex(logs[0].transactionHash) if logs else None
+
+    def _claim_batches(self):
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                """
+                UPDATE anchor_batches
+                SET next_attempt_at = now() + make_interval(secs => %s)
+                WHERE batch_id IN (
+                    SELECT batch_id FROM anchor_batches
+                    WHERE status = 'pending' AND next_attempt_at <= now()
+                    ORDER BY batch_id
+                    LIMIT 10
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING batch_id, merkle_root, leaf_count, attempts, tx_hash
+                """,
+                (self.lease_seconds,)
+            )
+            batches = [dict(row) for row in cursor.fetchall()]
+            conn.commit()
+            cursor.close()
+            return batches
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_conn(conn)
+
+    def _form_batch(self):
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                """
+                SELECT o.log_id, t.current_hash
+                FROM anchor_outbox o JOIN traceability_log t ON t.log_id = o.log_id
+                WHERE o.status = 'pending' AND o.batch_id IS NULL
+                ORDER BY o.log_id
+                LIMIT %s
+                FOR UPDATE OF o SKIP LOCKED
+                """,
+                (self.batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                conn.rollback()
+                return None
+
+            levels = build_tree([row["current_hash"] for row in rows])
+            root = merkle_root(levels)
+            cursor.execute(
+                """
+                INSERT INTO anchor_batches (merkle_root, leaf_count, next_attempt_at)
+                VALUES (%s, %s, now() + make_interval(secs => %s))
+                RETURNING batch_id, merkle_root, leaf_count, attempts, tx_hash
+                """,
+                (root, len(rows), self.lease_seconds)
+            )
+            batch = dict(cursor.fetchone())
+            log_ids = [row["log_id"] for row in rows]
+            cursor.execute("UPDATE anchor_outbox SET batch_id = %s WHERE log_id = ANY(%s)", (batch["batch_id"], log_ids))
+            execute_values(
+                cursor,
+                """
+                UPDATE traceability_log t
+                SET anchor_batch_id = v.batch_id, merkle_root = v.merkle_root, merkle_proof = v.merkle_proof::jsonb
+                FROM (VALUES %s) AS v (log_id, batch_id, merkle_root, merkle_proof)
+                WHERE t.log_id = v.log_id
+                """,
+                [(log_id, batch["batch_id"], root, json.dumps(merkle_proof(levels, i))) for i, log_id in enumerate(log_ids)]
+            )
+            conn.commit()
+            cursor.close()
+            return batch
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_conn(conn)
+
+    def _send_batch(self, batch) -> bool:
+        """Sends the batch root unless a retry already did; False if sending failed."""
+        if batch["tx_hash"]:
+            return True
+        try:
+            batch["tx_hash"] = self._transact(self.contract.functions.recordBatchRoot(
+                bytes.fromhex(batch["merkle_root"]), batch["leaf_count"]
+            ))
+            self._execute("UPDATE anchor_batches SET tx_hash = %s WHERE batch_id = %s", (batch["tx_hash"], batch["batch_id"]))
+            return True
+        except Exception as e:
+            self.nonces.reset()
+            self._mark_batch_failed(batch, e, keep_tx_hash=False)
+            return False
+
+    def _mark_batch_anchored(self, batch, recorded: bool = False):
+        """recorded: the root was found on-chain, so blockchain_tx_id is the transaction that recorded it."""
+        if recorded:
+            batch["tx_hash"] = self._recording_tx(batch) or batch["tx_hash"]
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE anchor_batches SET status = 'anchored', blockchain_tx_id = %s, anchored_at = now() WHERE batch_id = %s",
+                (batch["tx_hash"], batch["batch_id"])
+            )
+            cursor.execute(
+                'UPDATE traceability_log SET blockchain_tx_id = %s WHERE anchor_batch_id = %s RETURNING product_id',
+                (batch["tx_hash"], batch["batch_id"])
+            )
+            product_ids = sorted({row[0] for row in cursor.fetchall()})
+            cursor.execute('DELETE FROM anchor_outbox WHERE batch_id = %s', (batch["batch_id"],))
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_conn(conn)
+        self._notify_anchored(product_ids)
+
+    def _mark_batch_failed(self, batch, error, keep_tx_hash: bool):
+        self._execute(
+            """
+            UPDATE anchor_batches
+            SET attempts = %s, status = %s, next_attempt_at = %s, last_error = %s, tx_hash = %s
+            WHERE batch_id = %s
+            """,
+            self._retry_params(batch, error, keep_tx_hash, f"batch {batch['batch_id']}") + (batch["batch_id"],)
+        )
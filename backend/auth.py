@@ -0,0 +1,109 @@
+# auth.py
+# Who is calling, and password hashing, without slowing the request path.
+#
+# Access tokens carry the account's email (sub), its scope ("manufacturer" or
+# "consumer") and its id (uid). Manufacturer endpoints therefore know the caller's id
+# without a `SELECT id FROM manufacturers WHERE email = ...` per request. The id is
+# still confirmed against the database, since accounts can be deleted, but through
+# PrincipalCache: a TTL cache of account rows, so an active caller costs one primary
+# key lookup per TTL. Tokens issued before ids were added are resolved by email
+# through the same cache.
+#
+# PasswordHasher runs bcrypt (through passlib) at a configurable cost on its own thread
+# limiter. A login burst then queues for a few CPU-bound threads instead of filling the
+# blocking pool that serves queries. A hash made at another cost is re-hashed at the
+# configured one on the next successful login.
+import threading
+from typing import Optional, Tuple
+
+from anyio import CapacityLimiter, to_thread
+from passlib.context import CryptContext
+
+from cache import MemoryCache
+from metrics import timed
+
+SCOPE_TABLES = {"manufacturer": "manufacturers", "consumer": "consumers"}
+
+
+class Principal:
+    """The authenticated account of a request."""
+
+    def __init__(self, account_id: str, email: str, scope: str):
+        self.account_id = account_id
+        self.email = email
+        self.scope = scope
+
+    def __repr__(self):
+        return f"Principal({self.scope} {self.account_id} {self.email})"
+
+
+class PrincipalCache:
+    """Account rows by "<scope>:<id>" (or "<scope>:email:<email>" for tokens without uid), for ttl_seconds."""
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 10000):
+        self._cache = MemoryCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    @staticmethod
+    def _key(scope: str, account_id: Optional[str], email: str) -> str:
+        return f"{scope}:{account_id}" if account_id else f"{scope}:email:{email}"
+
+    def resolve(self, cursor, scope: str, email: str, account_id: Optional[str] = None) -> Optional[Principal]:
+        """The account behind a token's claims, or None if it no longer exists (misses are not cached)."""
+        key = self._key(scope, account_id, email)
+        row = self._cache.get(key)
+        if row is None:
+            table = SCOPE_TABLES[scope]
+            if account_id:
+                cursor.execute(f"SELECT id, email FROM {table} WHERE id = %s", (account_id,))
+            else:
+                cursor.execute(f"SELECT id, email FROM {table} WHERE email = %s", (email,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            row = (row[0], row[1])
+            self._cache.set(key, row)
+        if row[1] != email:  # The token outlived an email change
+            return None
+        return Principal(row[0], row[1], scope)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+class PasswordHasher:
+    """bcrypt at `rounds` on at most `threads` threads; hash() and verify() are awaited from async handlers."""
+
+    def __init__(self, rounds: int = 12, threads: int = 2):
+        self.rounds = rounds
+        self.threads = threads
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self._limiter = None
+        self._limiter_lock = threading.Lock()
+
+    @property
+    def limiter(self) -> CapacityLimiter:
+        # Created on first use, inside the event loop of the worker process that uses it
+        with self._limiter_lock:
+            if self._limiter is None:
+                self._limiter = CapacityLimiter(self.threads)
+            return self._limiter
+
+    def hash_blocking(self, password: str) -> str:
+        with timed("bcrypt"):
+            return self.context.hash(password)
+
+    def verify_blocking(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """(matches, new hash if the stored one should be replaced, e.g. made at another cost)."""
+        with timed("bcrypt"):
+            return self.context.verify_and_update(password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await to_thread.run_sync(self.hash_blocking, password, limiter=self.limiter)
+
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await to_thread.run_sync(self.verify_blocking, password, hashed_password, limiter=self.limiter)
+
+    def stats(self) -> dict:
+        statistics = self.limiter.statistics()
+        return {"rounds": self.rounds, "threads": self.threads, "busy": statistics.borrowed_tokens,
+                "waiting": statistics.tasks_waiting}
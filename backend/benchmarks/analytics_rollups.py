@@ -0,0 +1,222 @@
+# analytics_rollups.py
+# Supply-chain analytics on a large synthetic event log: the daily rollups read by the
+# /analytics endpoints (analytics.py) against the same answers aggregated from
+# traceability_log, products and product_recalls.
+#
+# --manufacturers M --products P --events E seeds P products (ids ANLY_*) spread over M
+# manufacturers, batches of --batch-size, and E events per product. Each product
+# starts on one of --days days and moves through manufacturing, warehouse,
+# distribution and retail across --locations sites. One batch in 50 is recalled. The
+# rollups are then filled with analytics.rebuild(). Each query runs --runs times for
+# manufacturer 0, over a random --window days of the seeded span. It reports
+# p50/p95/p99 per query and checks that both sides count the same events.
+# --cleanup removes the synthetic rows.
+#
+#   python benchmarks/analytics_rollups.py --products 200000 --events 12 --days 365 --window 30 --runs 50
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analytics import events_per_day, rebuild, recall_stats, stage_stats, transit_stats  # noqa: E402
+from load_test import percentile  # noqa: E402
+
+SEED_START = datetime.date(2025, 1, 1)
+
+SEED_PRODUCTS_SQL = """
+INSERT INTO products (id, name, brand, category, batch_number, manufacturer_id)
+SELECT 'ANLY_' || lpad(i::text, 9, '0'), 'Analytics Bench ' || i, 'Brand ' || (i / %(batch_size)s %% %(manufacturers)s) || '-' || (i / %(batch_size)s %% 7),
+       'Snacks', 'ANLY-' || (i / %(batch_size)s), 'bench-analytics-' || (i / %(batch_size)s %% %(manufacturers)s)
+FROM generate_series(%(start)s, %(stop)s) AS i
+"""
+
+SEED_EVENTS_SQL = """
+INSERT INTO traceability_log (product_id, timestamp, location, stage, actor, status, previous_hash, current_hash)
+SELECT 'ANLY_' || lpad(i::text, 9, '0'),
+       %(seed_start)s::timestamptz + make_interval(days => (i / %(batch_size)s) %% %(days)s, hours => n * (4 + i %% 9)),
+       'Site ' || ((i / %(batch_size)s * 7 + n * 13) %% %(locations)s),
+       (ARRAY['manufacturing', 'warehouse', 'distribution', 'retail'])[1 + n * 4 / %(events)s],
+       'actor-' || ((i + n) %% 97), 'Completed', 'anly', 'anly-' || i || '-' || n
+FROM generate_series(%(start)s, %(stop)s) AS i, generate_series(0, %(events)s - 1) AS n
+"""
+
+SEED_RECALLS_SQL = """
+INSERT INTO product_recalls (batch_number, reason, recall_date)
+SELECT 'ANLY-' || b, 'Analytics benchmark', %(seed_start)s::timestamptz + make_interval(days => b %% %(days)s + 3)
+FROM generate_series(0, %(batches)s - 1) AS b WHERE b %% 50 = 0
+"""
+
+# The same answers without the rollups: every event of the manufacturer's products,
+# each paired with the product's previous event, then filtered to the range
+RAW_STEPS = """
+WITH steps AS (
+    SELECT l.stage, l.location, l.timestamp, (l.timestamp AT TIME ZONE 'UTC')::date AS day,
+           lag(l.timestamp) OVER w AS previous_at, lag(l.location) OVER w AS previous_location,
+           lag(l.stage) OVER w AS previous_stage
+    FROM products p JOIN traceability_log l ON l.product_id = p.id
+    WHERE p.manufacturer_id = %(manufacturer_id)s
+    WINDOW w AS (PARTITION BY l.product_id ORDER BY l.log_id)
+)
+"""
+
+RAW_STAGES_SQL = RAW_STEPS + """
+SELECT s.stage, s.event_count, d.dwell_count, d.avg_dwell_seconds, d.max_dwell_seconds
+FROM (SELECT stage, count(*) AS event_count FROM steps WHERE day BETWEEN %(start)s AND %(end)s GROUP BY stage) s
+LEFT JOIN (
+    SELECT previous_stage AS stage, count(*) AS dwell_count, avg(extract(epoch FROM timestamp - previous_at)) AS avg_dwell_seconds,
+           max(extract(epoch FROM timestamp - previous_at)) AS max_dwell_seconds
+    FROM steps WHERE previous_at IS NOT NULL AND day BETWEEN %(start)s AND %(end)s GROUP BY previous_stage
+) d ON d.stage = s.stage
+ORDER BY s.event_count DESC
+"""
+
+RAW_TRANSIT_SQL = RAW_STEPS + """
+SELECT previous_location, location, count(*), avg(extract(epoch FROM timestamp - previous_at)),
+       min(extract(epoch FROM timestamp - previous_at)), max(extract(epoch FROM timestamp - previous_at))
+FROM steps
+WHERE previous_at IS NOT NULL AND previous_location <> location AND day BETWEEN %(start)s AND %(end)s
+GROUP BY previous_location, location
+ORDER BY count(*) DESC
+LIMIT 50
+"""
+
+RAW_EVENTS_PER_DAY_SQL = """
+SELECT d.day::date, COALESCE(c.event_count, 0)
+FROM generate_series(%(start)s::date, %(end)s::date, interval '1 day') AS d (day)
+LEFT JOIN (
+    SELECT (l.timestamp AT TIME ZONE 'UTC')::date AS day, count(*) AS event_count
+    FROM traceability_log l JOIN products p ON p.id = l.product_id
+    WHERE p.manufacturer_id = %(manufacturer_id)s
+      AND l.timestamp >= %(start)s::date AT TIME ZONE 'UTC' AND l.timestamp < (%(end)s::date + 1) AT TIME ZONE 'UTC'
+    GROUP BY 1
+) c ON c.day = d.day::date
+ORDER BY d.day
+"""
+
+RAW_RECALLS_SQL = """
+SELECT p.brand, count(DISTINCT r.recall_id), count(*)
+FROM product_recalls r JOIN products p ON p.batch_number = r.batch_number
+WHERE p.manufacturer_id = %(manufacturer_id)s
+  AND r.recall_date >= %(start)s::date AT TIME ZONE 'UTC' AND r.recall_date < (%(end)s::date + 1) AT TIME ZONE 'UTC'
+GROUP BY p.brand
+"""
+
+
+def seed(conn, args, chunk: int = 50000):
+    cursor = conn.cursor()
+    execute_params = {"manufacturers": args.manufacturers, "batch_size": args.batch_size, "events": args.events,
+                      "days": args.days, "locations": args.locations, "seed_start": SEED_START}
+    cursor.execute(
+        """
+        INSERT INTO manufacturers (id, company_name, email, hashed_password, fssai_license)
+        SELECT 'bench-analytics-' || m, 'Analytics Bench ' || m, 'analytics' || m || '@example.com', 'x', 'FSSAI-ANLY-' || m
+        FROM generate_series(0, %(manufacturers)s - 1) AS m
+        ON CONFLICT (id) DO NOTHING
+        """,
+        execute_params
+    )
+    cursor.execute("SELECT count(*) FROM products WHERE id LIKE 'ANLY\\_%%'")
+    existing = cursor.fetchone()[0]
+    for start in range(existing, args.products, chunk):
+        stop = min(start + chunk, args.products) - 1
+        for sql in (SEED_PRODUCTS_SQL, SEED_EVENTS_SQL):
+            cursor.execute(sql, {**execute_params, "start": start, "stop": stop})
+        conn.commit()
+        print(f"  seeded {stop + 1:,} products", flush=True)
+    if existing < args.products:
+        cursor.execute(SEED_RECALLS_SQL, {**execute_params, "batches": -(-args.products // args.batch_size)})
+        started = time.perf_counter()
+        rebuild(cursor, [f"bench-analytics-{m}" for m in range(args.manufacturers)])
+        conn.commit()
+        print(f"  rebuilt the analytics rollups in {time.perf_counter() - started:.1f}s", flush=True)
+    cursor.execute("ANALYZE")
+    conn.commit()
+    cursor.close()
+
+
+def timed(fn, ranges, runs: int) -> dict:
+    samples = []
+    for start, end in ranges[:runs]:
+        started = time.perf_counter()
+        fn(start, end)
+        samples.append(time.perf_counter() - started)
+    return {name: round(percentile(samples, pct) * 1000, 2) for name, pct in (("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99))}
+
+
+def raw(cursor, sql: str, manufacturer_id: str):
+    def run(start, end):
+        cursor.execute(sql, {"manufacturer_id": manufacturer_id, "start": start, "end": end})
+        return cursor.fetchall()
+    return run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark analytics rollups against raw-table aggregation.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--manufacturers", type=int, default=4)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=100, help="Products per batch")
+    parser.add_argument("--events", type=int, default=12, help="Traceability events per product")
+    parser.add_argument("--days", type=int, default=365, help="Days the products' first events are spread over")
+    parser.add_argument("--locations", type=int, default=500)
+    parser.add_argument("--window", type=int, default=30, help="Days per queried range")
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic rows and exit")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+    cursor = conn.cursor()
+    if args.cleanup:
+        for table in ("analytics_stage_daily", "analytics_transit_daily", "analytics_recall_daily"):
+            cursor.execute(f"DELETE FROM {table} WHERE manufacturer_id LIKE 'bench-analytics-%%'")
+        cursor.execute("DELETE FROM product_recalls WHERE batch_number LIKE 'ANLY-%%'")
+        cursor.execute("DELETE FROM products WHERE id LIKE 'ANLY\\_%%'")
+        deleted = cursor.rowcount
+        cursor.execute("DELETE FROM manufacturers WHERE id LIKE 'bench-analytics-%%'")
+        conn.commit()
+        sys.exit(f"Deleted {deleted:,} synthetic products")
+    seed(conn, args)
+
+    manufacturer_id = "bench-analytics-0"
+    cursor.execute("SELECT count(*) FROM traceability_log l JOIN products p ON p.id = l.product_id WHERE p.manufacturer_id = %s",
+                   (manufacturer_id,))
+    manufacturer_events = cursor.fetchone()[0]
+    cursor.execute("SELECT count(*) FROM analytics_stage_daily WHERE manufacturer_id = %s", (manufacturer_id,))
+    rollup_rows = cursor.fetchone()[0]
+    print(f"{args.products:,} products x {args.events} events; {manufacturer_id}: {manufacturer_events:,} events, "
+          f"{rollup_rows:,} stage rollup rows; {args.runs} runs of {args.window}-day ranges")
+
+    rng = random.Random(7)
+    ranges = []
+    for _ in range(args.runs):
+        start = SEED_START + datetime.timedelta(days=rng.randrange(max(args.days - args.window, 1)))
+        ranges.append((start, start + datetime.timedelta(days=args.window - 1)))
+
+    # Both sides must count the same events before their timings mean anything
+    start, end = ranges[0]
+    rollup_events = sum(row["event_count"] for row in json.loads(stage_stats(cursor, manufacturer_id, start, end)))
+    raw_events = sum(row[1] for row in raw(cursor, RAW_STAGES_SQL, manufacturer_id)(start, end))
+    print(f"events in {start}..{end}: rollup {rollup_events:,}, raw {raw_events:,}"
+          + ("" if rollup_events == raw_events else "  MISMATCH"))
+    conn.rollback()
+
+    queries = (
+        ("stages", lambda s, e: stage_stats(cursor, manufacturer_id, s, e), RAW_STAGES_SQL),
+        ("transit", lambda s, e: transit_stats(cursor, manufacturer_id, s, e), RAW_TRANSIT_SQL),
+        ("events-per-day", lambda s, e: events_per_day(cursor, manufacturer_id, s, e), RAW_EVENTS_PER_DAY_SQL),
+        ("recalls", lambda s, e: recall_stats(cursor, manufacturer_id, s, e), RAW_RECALLS_SQL),
+    )
+    for name, rollup_query, raw_sql in queries:
+        print(f"{name + ' (rollup)':<24} {timed(rollup_query, ranges, args.runs)}")
+        conn.rollback()
+        print(f"{name + ' (raw)':<24} {timed(raw(cursor, raw_sql, manufacturer_id), ranges, args.runs)}")
+        conn.rollback()
+    cursor.close()
+    conn.close()
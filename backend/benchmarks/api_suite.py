@@ -0,0 +1,234 @@
+# api_suite.py
+# Reproducible benchmark suite for a running API, over data seeded by seed_data.py.
+#
+# Drives the real endpoints with the accounts and product ids of a seed manifest:
+#   product_detail         GET /product/{id} of random seeded products
+#   product_deep_chain     GET /product/{id} of products with long chains
+#   product_review_heavy   GET /product/{id} of products with thousands of reviews
+#   manufacturer_products  GET /manufacturer/products?view=summary&limit=100 (keyset pages)
+#   trace_add              POST /traceability/add to random products (writes real rows)
+#   review_add             POST /reviews/add as seeded consumers (writes real rows)
+#   login                  POST /token with a seeded manufacturer (bcrypt bound)
+# Each scenario runs --requests requests (login: --login-requests) at every --concurrency
+# level, after --warmup unmeasured ones, and reports p50/p95/p99 latency and requests/sec.
+# --seed fixes the sequence of requests. The JSON report (--output) also records the
+# git commit, the server's /health/ready, /system/db-pool and /system/cache (these need
+# --operator-token, the server's METRICS_PROFILE_TOKEN) and the arguments, so runs can
+# be told apart. Anchoring competes with trace_add for the
+# database: run the server with ANCHOR_WORKER_ENABLED=false, or against a local dev chain
+# or mock_chain.py, the same way for every run you compare.
+#
+# --compare BASELINE CURRENT prints the change of every scenario and level between two
+# reports and exits with status 1 when a p95 grew by more than --threshold percent.
+#
+#   python benchmarks/api_suite.py --manifest seed.json --concurrency 1,16,64 --output run.json
+#   python benchmarks/api_suite.py --compare baseline.json run.json --threshold 10
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from load_test import summarize
+
+SCENARIOS = ("product_detail", "product_deep_chain", "product_review_heavy", "manufacturer_products",
+             "trace_add", "review_add", "login")
+
+
+class Suite:
+    def __init__(self, client: httpx.AsyncClient, manifest: dict, rng: random.Random):
+        self.client = client
+        self.manifest = manifest
+        self.rng = rng
+        self.manufacturer_headers = None
+        self.consumer_headers = []
+        self.cursor = None  # Next page of /manufacturer/products
+
+    async def login(self, path: str, email: str) -> dict:
+        response = await self.client.post(path, data={"username": email, "password": self.manifest["password"]})
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def setup(self):
+        self.manufacturer_headers = await self.login("/token", self.manifest["manufacturers"][0])
+        self.consumer_headers = [await self.login("/users/token", email) for email in self.manifest["consumers"][:10]]
+
+    # --- Requests: each returns (method, path, httpx keyword arguments) ---
+    def product_detail(self):
+        return "GET", f"/product/{self.rng.choice(self.manifest['product_ids'])}", {}
+
+    def product_deep_chain(self):
+        return "GET", f"/product/{self.rng.choice(self.manifest['deep_product_ids'])}", {}
+
+    def product_review_heavy(self):
+        return "GET", f"/product/{self.rng.choice(self.manifest['review_heavy_product_ids'])}", {}
+
+    def manufacturer_products(self):
+        params = {"view": "summary", "limit": 100}
+        if self.cursor:
+            params["after"] = self.cursor
+        return "GET", "/manufacturer/products", {"params": params, "headers": self.manufacturer_headers}
+
+    def trace_add(self):
+        return "POST", "/traceability/add", {"json": {
+            "product_id": self.rng.choice(self.manifest["product_ids"]), "location": f"Benchmark Hub {self.rng.randrange(100)}",
+            "stage": "distribution", "actor": "api_suite.py", "status": "In Transit", "notes": None,
+        }}
+
+    def review_add(self):
+        return "POST", "/reviews/add", {"json": {
+            "product_id": self.rng.choice(self.manifest["product_ids"]), "rating": self.rng.randint(1, 5), "comment": "api_suite.py",
+        }, "headers": self.rng.choice(self.consumer_headers)}
+
+    def login_request(self):
+        return "POST", "/token", {"data": {"username": self.rng.choice(self.manifest["manufacturers"]),
+                                           "password": self.manifest["password"]}}
+
+    def request_factory(self, scenario: str):
+        return self.login_request if scenario == "login" else getattr(self, scenario)
+
+    async def run_level(self, scenario: str, concurrency: int, total: int) -> dict:
+        make_request = self.request_factory(scenario)
+        latencies = []
+        errors = 0
+        remaining = total
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                method, path, kwargs = make_request()
+                started = time.perf_counter()
+                try:
+                    response = await self.client.request(method, path, **kwargs)
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if scenario == "manufacturer_products":
+                    self.cursor = response.headers.get("X-Next-Cursor")  # Wraps around to the first page
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        result = summarize(latencies, errors, time.perf_counter() - started)
+        result["concurrency"] = concurrency
+        return result
+
+
+async def server_state(client: httpx.AsyncClient, operator_token: str = None) -> dict:
+    state = {}
+    headers = {"Authorization": f"Bearer {operator_token}"} if operator_token else {}
+    for path in ("/health/ready", "/system/db-pool", "/system/cache"):
+        try:
+            state[path] = (await client.get(path, headers=headers)).json()
+        except (httpx.HTTPError, ValueError) as e:
+            state[path] = {"error": str(e)}
+    return state
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+async def main(args):
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    scenarios = args.scenarios.split(",") if args.scenarios else SCENARIOS
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    report = {
+        "meta": {
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "base_url": args.base_url,
+            "manifest_seed": manifest.get("seed"),
+            "manifest_products": manifest.get("products"),
+            "args": {key: value for key, value in vars(args).items() if key != "operator_token"},
+        },
+        "scenarios": {},
+    }
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        suite = Suite(client, manifest, random.Random(args.seed))
+        await suite.setup()
+        report["meta"]["server_before"] = await server_state(client, args.operator_token)
+        for scenario in scenarios:
+            total = args.login_requests if scenario == "login" else args.requests
+            if args.warmup:
+                await suite.run_level(scenario, min(levels), args.warmup)
+            results = report["scenarios"][scenario] = []
+            for level in levels:
+                result = await suite.run_level(scenario, level, total)
+                results.append(result)
+                print(f"{scenario:<22} concurrency={level:<4} req/s={result['requests_per_sec']:<8} p50={result['p50_ms']}ms "
+                      f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms errors={result['errors']}", flush=True)
+        report["meta"]["server_after"] = await server_state(client, args.operator_token)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """Prints the regression report; returns the number of p95 regressions over threshold percent."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    print(f"baseline {baseline['meta'].get('git_commit') or '?'} ({baseline['meta']['started_at']}) -> "
+          f"current {current['meta'].get('git_commit') or '?'} ({current['meta']['started_at']})")
+    print(f"{'scenario':<22} {'conc':>5} {'req/s':>18} {'p50 ms':>20} {'p95 ms':>20} {'p99 ms':>20}")
+
+    def change(old: float, new: float) -> str:
+        percent = (new - old) / old * 100 if old else 0.0
+        return f"{new:>8} ({percent:+6.1f}%)"
+
+    regressions = 0
+    for scenario, results in current["scenarios"].items():
+        before = {result["concurrency"]: result for result in baseline["scenarios"].get(scenario, [])}
+        for result in results:
+            old = before.get(result["concurrency"])
+            if old is None:
+                continue
+            regressed = old["p95_ms"] and (result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 > threshold
+            regressions += bool(regressed)
+            print(f"{scenario:<22} {result['concurrency']:>5} {change(old['requests_per_sec'], result['requests_per_sec']):>18} "
+                  f"{change(old['p50_ms'], result['p50_ms']):>20} {change(old['p95_ms'], result['p95_ms']):>20} "
+                  f"{change(old['p99_ms'], result['p99_ms']):>20}{'  REGRESSION' if regressed else ''}")
+    print(f"{regressions} p95 regression(s) over {threshold}%")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API's main endpoints over seeded data.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--manifest", default="seed_manifest.json", help="Written by seed_data.py")
+    parser.add_argument("--scenarios", help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario and level")
+    parser.add_argument("--login-requests", type=int, default=100, help="Requests per level for the login scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests before each scenario")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--operator-token", default=os.getenv("METRICS_PROFILE_TOKEN"), help="For the /system/* snapshots")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two reports instead of running")
+    parser.add_argument("--threshold", type=float, default=10.0, help="p95 growth in percent that counts as a regression")
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    asyncio.run(main(args))
@@ -0,0 +1,112 @@
+# chain_stress.py
+# Stress check for concurrent hash-chain appends.
+#
+# Runs many appender threads (one connection each) against a mix of "hot" products
+# that every thread hammers and "cold" products that are touched rarely, then checks
+# every touched chain: each event must link to the one before it and no two events
+# may share a previous_hash. Exits with status 1 if any chain forked. Writes real rows.
+#
+#   python benchmarks/chain_stress.py --threads 32 --appends 200 --hot 3 --cold 200
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ledger import append_events  # noqa: E402
+
+Scan = namedtuple("Scan", "product_id location stage actor status notes")
+
+
+def appender(database_url: str, hot, cold, appends: int, hot_ratio: float, max_batch: int, seed: int, failures: list):
+    rng = random.Random(seed)
+    conn = psycopg2.connect(database_url)
+    cursor = conn.cursor()
+    done = 0
+    while done < appends:
+        size = min(rng.randint(1, max_batch), appends - done)
+        scans = [Scan(rng.choice(hot) if rng.random() < hot_ratio else rng.choice(cold),
+                      f"Stress {seed}-{done + i}", "distribution", f"thread-{seed}", None, None)
+                 for i in range(size)]
+        try:
+            append_events(cursor, scans)
+            conn.commit()
+            done += size
+        except Exception as e:
+            conn.rollback()
+            failures.append(repr(e))
+            done += size
+    cursor.close()
+    conn.close()
+
+
+def check_chains(conn, product_ids) -> list:
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT product_id, previous_hash, current_hash FROM traceability_log WHERE product_id = ANY(%s) ORDER BY product_id, log_id",
+        (list(product_ids),)
+    )
+    problems, last, seen_previous = [], {}, set()
+    for product_id, previous_hash, current_hash in cursor.fetchall():
+        if product_id in last and previous_hash != last[product_id]:
+            problems.append(f"{product_id}: event {current_hash[:12]} links to {previous_hash[:12]}, expected {last[product_id][:12]}")
+        if (product_id, previous_hash) in seen_previous:
+            problems.append(f"{product_id}: fork at {previous_hash[:12]}")
+        seen_previous.add((product_id, previous_hash))
+        last[product_id] = current_hash
+    cursor.execute("SELECT product_id, head_hash FROM traceability_heads WHERE product_id = ANY(%s)", (list(product_ids),))
+    for product_id, head_hash in cursor.fetchall():
+        if last.get(product_id) != head_hash:
+            problems.append(f"{product_id}: head {head_hash[:12]} is not the last event")
+    cursor.close()
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent append stress test for traceability hash chains.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--appends", type=int, default=200, help="Events per thread")
+    parser.add_argument("--hot", type=int, default=3, help="Number of hot products")
+    parser.add_argument("--cold", type=int, default=100, help="Number of cold products")
+    parser.add_argument("--hot-ratio", type=float, default=0.8)
+    parser.add_argument("--max-batch", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM products ORDER BY random() LIMIT %s", (args.hot + args.cold,))
+    product_ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    if len(product_ids) < 2:
+        sys.exit("Need at least two products; seed the database first.")
+    hot, cold = product_ids[:args.hot], product_ids[args.hot:] or product_ids[:args.hot]
+
+    failures = []
+    threads = [threading.Thread(target=appender, args=(args.database_url, hot, cold, args.appends, args.hot_ratio, args.max_batch, seed, failures))
+               for seed in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    problems = check_chains(conn, product_ids)
+    conn.close()
+    total = args.threads * args.appends
+    print(f"{total} appends from {args.threads} threads in {elapsed:.2f}s ({total / elapsed:,.0f} events/sec), {len(failures)} failed transactions")
+    for failure in failures[:10]:
+        print("  failure:", failure)
+    if problems:
+        print(f"{len(problems)} chain problems:")
+        for problem in problems[:20]:
+            print("  " + problem)
+        sys.exit(1)
+    print(f"All {len(product_ids)} chains are linear.")
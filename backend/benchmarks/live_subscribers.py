@@ -0,0 +1,175 @@
+# live_subscribers.py
+# Thousands of idle /live subscribers, and how fast a new trace event reaches all of them.
+#
+# Opens `--subscribers` Server-Sent Events connections to /live for one product (plain
+# asyncio sockets, so the client is not the bottleneck). Then it posts `--events` trace
+# events to /traceability/add, one every `--interval` seconds. For every subscriber and
+# event it records the time from the start of the POST to the event's arrival. The
+# report has p50/p95/p99 delivery latency, how many deliveries arrived, resyncs (slow
+# subscribers whose queue overflowed) and the server's /system/live counters (with
+# --operator-token, the server's METRICS_PROFILE_TOKEN). When the
+# server runs on this host, its resident memory before and after the connections were
+# opened is included too. Open connections are per worker process and capped by
+# LIVE_MAX_SUBSCRIBERS; the client raises its own open-file limit as far as allowed.
+#
+#   python benchmarks/live_subscribers.py --product-id BFT_B1_ABC123 --subscribers 5000 --events 20
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+from urllib.parse import quote, urlsplit
+
+import httpx
+
+from load_test import percentile
+
+
+def raise_file_limit(wanted: int) -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    if target > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    return max(soft, target)
+
+
+def server_rss_mb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None  # Not on this host
+    return None
+
+
+class Subscriber:
+    """One SSE connection; records the arrival time of each trace event by its notes marker."""
+
+    def __init__(self):
+        self.arrivals = {}
+        self.resyncs = 0
+        self.connected = False
+        self.error = None
+
+    async def run(self, host: str, port: int, path: str, ready: asyncio.Event):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            if b" 200 " not in status_line:
+                self.error = status_line.decode(errors="replace").strip()
+                writer.close()
+                return
+            self.connected = True
+            ready.set()
+            event_type = None
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.startswith(b"event: "):
+                    event_type = line[7:].strip().decode()
+                elif line.startswith(b"data: ") and event_type == "trace":
+                    notes = json.loads(line[6:])["event"]["notes"] or ""
+                    if notes.startswith("live-bench:"):
+                        self.arrivals[int(notes.split(":")[1])] = time.perf_counter()
+                elif line.startswith(b"data: ") and event_type == "resync":
+                    self.resyncs += 1
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            self.error = self.error or str(e)
+
+
+async def open_subscribers(base_url: str, path: str, count: int, concurrency: int):
+    url = urlsplit(base_url)
+    subscribers = [Subscriber() for _ in range(count)]
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+
+    async def start(subscriber):
+        ready = asyncio.Event()
+        async with semaphore:
+            tasks.append(asyncio.create_task(subscriber.run(url.hostname, url.port or 80, path, ready)))
+            await asyncio.wait([tasks[-1], asyncio.create_task(ready.wait())], return_when=asyncio.FIRST_COMPLETED)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start(subscriber) for subscriber in subscribers))
+    return subscribers, tasks, time.perf_counter() - started
+
+
+async def main(args):
+    limit = raise_file_limit(args.subscribers + 256)
+    if limit < args.subscribers + 64:
+        print(f"warning: open-file limit is {limit}, fewer than {args.subscribers} connections may open")
+    path = f"/live?product_id={quote(args.product_id)}"
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+        pid = (await client.get("/health/live")).json()["pid"]
+        rss_before = server_rss_mb(pid)
+
+        subscribers, tasks, connect_s = await open_subscribers(args.base_url, path, args.subscribers, args.connect_concurrency)
+        connected = sum(subscriber.connected for subscriber in subscribers)
+        rss_idle = server_rss_mb(pid)
+        print(f"subscribers: {connected}/{args.subscribers} connected in {connect_s:.2f}s, server rss {rss_before} -> {rss_idle} MB")
+
+        sent = {}
+        for seq in range(args.events):
+            sent[seq] = time.perf_counter()
+            response = await client.post("/traceability/add", json={
+                "product_id": args.product_id, "location": "Benchmark", "stage": "In Transit",
+                "actor": "live_subscribers.py", "status": "OK", "notes": f"live-bench:{seq}",
+            })
+            response.raise_for_status()
+            await asyncio.sleep(args.interval)
+        await asyncio.sleep(args.settle)
+        headers = {"Authorization": f"Bearer {args.operator_token}"} if args.operator_token else {}
+        server = (await client.get("/system/live", headers=headers)).json()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = [subscriber.arrivals[seq] - sent[seq] for subscriber in subscribers for seq in subscriber.arrivals if seq in sent]
+    expected = connected * args.events
+    errors = sorted({subscriber.error for subscriber in subscribers if subscriber.error})
+    report = {
+        "subscribers": args.subscribers,
+        "connected": connected,
+        "connect_s": round(connect_s, 3),
+        "events": args.events,
+        "deliveries_expected": expected,
+        "deliveries": len(latencies),
+        "delivery_ratio": round(len(latencies) / expected, 4) if expected else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+        "resyncs": sum(subscriber.resyncs for subscriber in subscribers),
+        "server_rss_mb": {"before": rss_before, "idle_subscribers": rss_idle},
+        "server_live": server,
+        "errors": errors[:10],
+    }
+    print(f"deliveries={report['deliveries']}/{expected} p50={report['p50_ms']}ms p95={report['p95_ms']}ms "
+          f"p99={report['p99_ms']}ms max={report['max_ms']}ms resyncs={report['resyncs']}")
+    if errors:
+        print(f"errors: {errors[:3]}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure fan-out latency of /live to many idle subscribers.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--product-id", required=True, help="Existing product the subscribers follow")
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=20, help="Trace events posted while everyone listens")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between posted events")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="Connections being opened at once")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to wait for stragglers after the last event")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--operator-token", default=os.getenv("METRICS_PROFILE_TOKEN"), help="For /system/live")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+# load_test.py
+# Concurrency scaling benchmark for a running Bharat FoodTrace API.
+#
+# Fires a fixed number of GET requests at each concurrency level and reports
+# throughput and latency percentiles. Run it against the server before and after a
+# change; with a blocking event loop requests/sec stays flat as concurrency grows,
+# with the thread-pooled handlers it scales until the DB pool is saturated.
+#
+#   python benchmarks/load_test.py --path /product/BFT_B1_ABC123 --concurrency 1,8,32,128
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run_level(client: httpx.AsyncClient, path: str, concurrency: int, total: int, headers=None) -> dict:
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await client.get(path, headers=headers)
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, errors, time.perf_counter() - started)
+    result["concurrency"] = concurrency
+    return result
+
+
+async def main(args):
+    levels = [int(level) for level in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else None
+    results = []
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        for level in levels:
+            result = await run_level(client, args.path, level, args.requests, headers)
+            results.append(result)
+            print(f"concurrency={level:<5} req/s={result['requests_per_sec']:<9} p50={result['p50_ms']}ms p95={result['p95_ms']}ms errors={result['errors']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"path": args.path, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API throughput as concurrency grows.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--path", required=True, help="GET path to hit, e.g. /product/<id>")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per concurrency level")
+    parser.add_argument("--token", help="Bearer token for authenticated endpoints")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
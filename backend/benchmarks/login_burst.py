@@ -0,0 +1,103 @@
+# login_burst.py
+# Login throughput under a burst, and what the burst does to everything else.
+#
+# Fires `--logins` password logins at each concurrency level. Meanwhile a probe keeps
+# requesting a cheap database-backed path (--probe-path) one request at a time. It
+# reports logins/sec with latency percentiles, and the probe's percentiles during the
+# burst. bcrypt runs on its own PASSWORD_HASH_THREADS limiter, so logins/sec should
+# level off near cores / bcrypt time. The probe should stay fast: a login burst no
+# longer takes the threads and connections other requests need. Compare
+# PASSWORD_BCRYPT_ROUNDS values by restarting the server between runs.
+#
+#   python benchmarks/login_burst.py --username m@x.com --password pw --concurrency 1,8,32,128
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from load_test import summarize
+
+
+async def login_burst(client: httpx.AsyncClient, path: str, form: dict, concurrency: int, total: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, data=form)
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(latencies, errors, time.perf_counter() - started)
+    result["concurrency"] = concurrency
+    return result
+
+
+async def probe(client: httpx.AsyncClient, path: str, stop: asyncio.Event) -> dict:
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    while not stop.is_set():
+        request_started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - request_started)
+        except httpx.HTTPError:
+            errors += 1
+        await asyncio.sleep(0.01)
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def main(args):
+    levels = [int(level) for level in args.concurrency.split(",")]
+    path = "/token" if args.scope == "manufacturer" else "/users/token"
+    form = {"username": args.username, "password": args.password}
+    limits = httpx.Limits(max_connections=max(levels) + 1, max_keepalive_connections=max(levels) + 1)
+    results = []
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        if (await client.post(path, data=form)).status_code != 200:
+            raise SystemExit(f"Login as {args.username} failed; check --username/--password/--scope")
+        for level in levels:
+            stop = asyncio.Event()
+            probe_task = asyncio.create_task(probe(client, args.probe_path, stop))
+            result = await login_burst(client, path, form, level, args.logins)
+            stop.set()
+            result["probe"] = await probe_task
+            results.append(result)
+            print(f"concurrency={level:<5} logins/s={result['requests_per_sec']:<8} p50={result['p50_ms']}ms "
+                  f"p99={result['p99_ms']}ms errors={result['errors']} | probe p50={result['probe']['p50_ms']}ms "
+                  f"p99={result['probe']['p99_ms']}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"path": path, "probe_path": args.probe_path, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure login throughput and its effect on other requests.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--scope", choices=("manufacturer", "consumer"), default="manufacturer")
+    parser.add_argument("--concurrency", default="1,8,32,128", help="Comma-separated concurrency levels")
+    parser.add_argument("--logins", type=int, default=200, help="Logins per concurrency level")
+    parser.add_argument("--probe-path", default="/health/ready", help="Cheap GET path timed during each burst")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
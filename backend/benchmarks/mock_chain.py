@@ -0,0 +1,126 @@
+# mock_chain.py
+# A stand-in JSON-RPC node for benchmarks: anchoring runs without a real chain.
+#
+# Answers the handful of methods the anchoring worker and /health/ready?chain_probe=true
+# use (chain id, block number, nonce, gas price, sendRawTransaction, receipts). Every
+# transaction is "mined" at once into its own block with status 1, after an optional
+# --latency per call to mimic a remote RPC. It does not execute the contract or emit
+# logs (view calls such as batchRecordedAt return zero), so leave the chain indexer off. Point the API at it with any well-formed
+# contract address and key, e.g. the Hardhat defaults:
+#
+#   python benchmarks/mock_chain.py --port 8545 --latency-ms 20
+#   BLOCKCHAIN_RPC_URL=http://127.0.0.1:8545 CHAIN_ID=31337 \
+#   CONTRACT_ADDRESS=0x5FbDB2315678afecb367f032d93F642f64180aa3 \
+#   SERVER_PRIVATE_KEY=0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80 uvicorn main:app
+#
+# For a real EVM use a local dev chain instead (`npx hardhat node`, then deploy.js
+# with `--network localhost`).
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eth_account import Account
+from web3 import Web3
+
+ZERO_HASH = "0x" + "00" * 32
+EMPTY_BLOOM = "0x" + "00" * 256
+
+
+class MockChain:
+    def __init__(self, chain_id: int, gas_price: int, latency: float):
+        self.chain_id = chain_id
+        self.gas_price = gas_price
+        self.latency = latency
+        self.block_number = 0
+        self.nonces = {}
+        self.receipts = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send_raw_transaction(self, raw: str) -> str:
+        tx_hash = Web3.to_hex(Web3.keccak(hexstr=raw))
+        sender = Account.recover_transaction(raw)
+        with self._lock:
+            self.block_number += 1
+            self.nonces[sender] = self.nonces.get(sender, 0) + 1
+            self.receipts[tx_hash] = {
+                "transactionHash": tx_hash, "transactionIndex": "0x0", "type": "0x0",
+                "blockHash": Web3.to_hex(Web3.keccak(text=f"block-{self.block_number}")),
+                "blockNumber": hex(self.block_number), "from": sender, "to": None,
+                "cumulativeGasUsed": "0x5208", "gasUsed": "0x5208", "effectiveGasPrice": hex(self.gas_price),
+                "contractAddress": None, "logs": [], "logsBloom": EMPTY_BLOOM, "status": "0x1",
+            }
+        return tx_hash
+
+    def call(self, method: str, params: list):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == "eth_chainId":
+            return hex(self.chain_id)
+        if method == "net_version":
+            return str(self.chain_id)
+        if method == "eth_blockNumber":
+            return hex(self.block_number)
+        if method == "eth_gasPrice":
+            return hex(self.gas_price)
+        if method == "eth_getTransactionCount":
+            return hex(self.nonces.get(Web3.to_checksum_address(params[0]), 0))
+        if method == "eth_estimateGas":
+            return hex(100000)
+        if method == "eth_sendRawTransaction":
+            return self.send_raw_transaction(params[0])
+        if method == "eth_call":
+            return ZERO_HASH
+        if method == "eth_getTransactionReceipt":
+            return self.receipts.get(params[0])
+        if method == "eth_getBlockByNumber":
+            return {"number": hex(self.block_number), "hash": ZERO_HASH, "parentHash": ZERO_HASH,
+                    "timestamp": hex(int(time.time())), "transactions": [], "baseFeePerGas": hex(self.gas_price)}
+        raise NotImplementedError(method)
+
+
+def make_handler(chain: MockChain):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            requests = request if isinstance(request, list) else [request]
+            responses = []
+            for item in requests:
+                try:
+                    responses.append({"jsonrpc": "2.0", "id": item.get("id"), "result": chain.call(item["method"], item.get("params") or [])})
+                except NotImplementedError as e:
+                    responses.append({"jsonrpc": "2.0", "id": item.get("id"), "error": {"code": -32601, "message": f"Method not found: {e}"}})
+                except Exception as e:
+                    responses.append({"jsonrpc": "2.0", "id": item.get("id"), "error": {"code": -32000, "message": str(e)}})
+            body = json.dumps(responses if isinstance(request, list) else responses[0]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a minimal mock JSON-RPC node for anchoring benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--chain-id", type=int, default=31337)
+    parser.add_argument("--gas-price", type=int, default=1_000_000_000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every RPC call")
+    args = parser.parse_args()
+
+    chain = MockChain(args.chain_id, args.gas_price, args.latency_ms / 1000)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(chain))
+    print(f"Mock chain {args.chain_id} listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"{chain.block_number} transactions, {chain.calls} calls")
@@ -0,0 +1,84 @@
+# product_detail.py
+# Compares the single-query product detail path with the original four-query path.
+#
+# Both paths run against the same database and product. For each one the script
+# reports latency percentiles and, via tracemalloc, the Python memory allocated per
+# call. The legacy path is kept here verbatim (4 round-trips + Pydantic assembly +
+# JSON serialization) so the comparison stays possible after it left main.py.
+#
+#   python benchmarks/product_detail.py --product-id BFT_B1_ABC123 --iterations 500
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import AllergenInfo, CertificationInfo, Product, ProductNutrition, ProductRecall, Review, TraceabilityEntry, settings  # noqa: E402
+from product_queries import fetch_product_json  # noqa: E402
+from load_test import percentile  # noqa: E402
+
+
+def legacy_product_json(conn, product_id: str) -> str:
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
+    product_row = cursor.fetchone()
+    cursor.execute("SELECT * FROM traceability_log WHERE product_id = %s ORDER BY timestamp ASC", (product_id,))
+    traceability_log = [TraceabilityEntry(**row) for row in cursor.fetchall()]
+    cursor.execute("SELECT * FROM product_recalls WHERE batch_number = %s", (product_row['batch_number'],))
+    recalls = [ProductRecall(**row) for row in cursor.fetchall()]
+    cursor.execute("SELECT * FROM reviews WHERE product_id = %s ORDER BY review_date DESC", (product_id,))
+    reviews = [Review(**row) for row in cursor.fetchall()]
+    cursor.close()
+
+    product_data = dict(product_row)
+    product_data['nutrition'] = ProductNutrition(**{k: product_row[k] for k in ProductNutrition.model_fields})
+    product_data['allergens'] = AllergenInfo(**{k: product_row[k] for k in AllergenInfo.model_fields})
+    product_data['certifications'] = CertificationInfo(**{k: product_row[k] for k in CertificationInfo.model_fields})
+    product_data['traceability'] = traceability_log
+    product_data['recalls'] = recalls
+    product_data['reviews'] = reviews
+    return Product(**product_data).model_dump_json()
+
+
+def measure(label: str, fn, conn, product_id: str, iterations: int) -> dict:
+    fn(conn, product_id)  # warm-up
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(conn, product_id)
+        latencies.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    fn(conn, product_id)
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "path": label,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_alloc_kb": round((peak - before) / 1024, 1),
+        "retained_kb": round((after - before) / 1024, 1),
+    }
+    print(f"{label:<14} p50={result['p50_ms']}ms p95={result['p95_ms']}ms peak_alloc={result['peak_alloc_kb']}KiB")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark product detail assembly paths.")
+    parser.add_argument("--product-id", required=True)
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.DATABASE_URL)
+    measure("legacy (4 q)", legacy_product_json, conn, args.product_id, args.iterations)
+    measure("single query", fetch_product_json, conn, args.product_id, args.iterations)
+    conn.close()
@@ -0,0 +1,152 @@
+# recall_impact.py
+# Recall impact lookups on a large synthetic supply chain: the precomputed index
+# (recall_impact.batch_impact) against the same answer computed by scanning
+# traceability_log and reviews, plus the throughput of the streamed export.
+#
+# --batches B --products P --events E seeds B*P products (ids RIMP_*) with E events
+# each, spread over --locations sites, and one review per five products, all with
+# generate_series; the index rows are then filled with recall_impact.rebuild().
+# --cleanup removes the synthetic rows.
+#
+#   python benchmarks/recall_impact.py --batches 2000 --products 100 --events 8 --runs 200
+import argparse
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from load_test import percentile  # noqa: E402
+from recall_impact import batch_impact, iter_impact_export, rebuild  # noqa: E402
+
+SEED_PRODUCTS_SQL = """
+INSERT INTO products (id, name, brand, category, batch_number, manufacturer_id)
+SELECT 'RIMP_' || lpad(i::text, 9, '0'), 'Recall Bench ' || i, 'Brand ' || (i %% 50), 'Snacks',
+       'RIMP-' || (i / %(products)s), 'bench-manufacturer'
+FROM generate_series(%(start)s, %(stop)s) AS i
+"""
+
+SEED_EVENTS_SQL = """
+INSERT INTO traceability_log (product_id, timestamp, location, stage, actor, status, previous_hash, current_hash)
+SELECT 'RIMP_' || lpad(i::text, 9, '0'), TIMESTAMPTZ '2026-01-01' + make_interval(hours => n),
+       'Site ' || ((i / %(products)s * 7 + n * 13 + i %% 3) %% %(locations)s),
+       (ARRAY['manufacturing', 'warehouse', 'distribution', 'retail'])[1 + least(n, 3)],
+       'actor-' || ((i / %(products)s + n) %% 97), 'Completed', 'rimp', 'rimp-' || i || '-' || n
+FROM generate_series(%(start)s, %(stop)s) AS i, generate_series(0, %(events)s - 1) AS n
+"""
+
+SEED_REVIEWS_SQL = """
+INSERT INTO reviews (product_id, consumer_email, rating, review_date)
+SELECT 'RIMP_' || lpad(i::text, 9, '0'), 'consumer' || (i %% 5000) || '@example.com', 1 + i %% 5,
+       TIMESTAMPTZ '2026-02-01' + make_interval(mins => i %% 10000)
+FROM generate_series(%(start)s, %(stop)s) AS i WHERE i %% 5 = 0
+"""
+
+# The same answer without the index: every event and review of the batch's products
+SCAN_IMPACT_SQL = """
+SELECT
+    (SELECT count(*) FROM products p WHERE p.batch_number = %(batch)s),
+    (SELECT json_agg(k) FROM (
+        SELECT last.location, last.actor, last.stage, count(*) AS product_count
+        FROM (
+            SELECT DISTINCT ON (l.product_id) l.location, l.actor, l.stage
+            FROM products p JOIN traceability_log l ON l.product_id = p.id
+            WHERE p.batch_number = %(batch)s
+            ORDER BY l.product_id, l.log_id DESC
+        ) last GROUP BY 1, 2, 3
+    ) k),
+    (SELECT json_agg(t) FROM (
+        SELECT l.location, l.actor, min(l.timestamp) AS first_seen, max(l.timestamp) AS last_seen, count(*) AS event_count
+        FROM products p JOIN traceability_log l ON l.product_id = p.id
+        WHERE p.batch_number = %(batch)s GROUP BY 1, 2
+    ) t),
+    (SELECT json_agg(c) FROM (
+        SELECT v.consumer_email, count(*) AS review_count
+        FROM products p JOIN reviews v ON v.product_id = p.id
+        WHERE p.batch_number = %(batch)s GROUP BY 1
+    ) c)
+"""
+
+
+def seed(conn, batches: int, products: int, events: int, locations: int, chunk: int = 50000):
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO manufacturers (id, company_name, email, hashed_password, fssai_license)
+        VALUES ('bench-manufacturer', 'Benchmark Foods', 'bench@example.com', 'x', 'FSSAI-BENCH')
+        ON CONFLICT (id) DO NOTHING
+        """
+    )
+    cursor.execute("SELECT count(*) FROM products WHERE id LIKE 'RIMP\\_%%'")
+    existing, total = cursor.fetchone()[0], batches * products
+    params = {"products": products, "events": events, "locations": locations}
+    for start in range(existing, total, chunk):
+        stop = min(start + chunk, total) - 1
+        for sql in (SEED_PRODUCTS_SQL, SEED_EVENTS_SQL, SEED_REVIEWS_SQL):
+            cursor.execute(sql, {**params, "start": start, "stop": stop})
+        conn.commit()
+        print(f"  seeded {stop + 1:,} products", flush=True)
+    if existing < total:
+        started = time.perf_counter()
+        rebuild(cursor, [f"RIMP-{b}" for b in range(batches)])
+        conn.commit()
+        print(f"  rebuilt the recall impact index in {time.perf_counter() - started:.1f}s", flush=True)
+    cursor.execute("ANALYZE")
+    conn.commit()
+    cursor.close()
+
+
+def timed(fn, batch_numbers, runs: int, rng: random.Random) -> dict:
+    samples = []
+    for _ in range(runs):
+        batch_number = rng.choice(batch_numbers)
+        started = time.perf_counter()
+        fn(batch_number)
+        samples.append(time.perf_counter() - started)
+    return {name: round(percentile(samples, pct) * 1000, 2) for name, pct in (("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recall impact lookups and exports.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--batches", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=100, help="Products per batch")
+    parser.add_argument("--events", type=int, default=8, help="Traceability events per product")
+    parser.add_argument("--locations", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic rows and exit")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+    cursor = conn.cursor()
+    if args.cleanup:
+        cursor.execute("DELETE FROM batch_touchpoints WHERE batch_number LIKE 'RIMP-%%'")
+        cursor.execute("DELETE FROM batch_consumers WHERE batch_number LIKE 'RIMP-%%'")
+        cursor.execute("DELETE FROM products WHERE id LIKE 'RIMP\\_%%'")
+        conn.commit()
+        sys.exit(f"Deleted {cursor.rowcount:,} synthetic products")
+    seed(conn, args.batches, args.products, args.events, args.locations)
+
+    cursor.execute("SELECT count(*) FROM traceability_log")
+    print(f"{args.batches:,} batches x {args.products} products x {args.events} events "
+          f"({cursor.fetchone()[0]:,} events in total), {args.runs} runs per query")
+    rng = random.Random(7)
+    batch_numbers = [f"RIMP-{b}" for b in range(args.batches)]
+    print(f"{'indexed (batch_impact)':<26} {timed(lambda b: batch_impact(cursor, b), batch_numbers, args.runs, rng)}")
+    conn.rollback()
+    print(f"{'scan (traceability_log)':<26} {timed(lambda b: cursor.execute(SCAN_IMPACT_SQL, {'batch': b}) or cursor.fetchone(), batch_numbers, args.runs, rng)}")
+    conn.rollback()
+    cursor.close()
+
+    for fmt in ("csv", "ndjson"):
+        started, rows, size = time.perf_counter(), 0, 0
+        for batch_number in batch_numbers[:20]:
+            for chunk in iter_impact_export(conn, batch_number, fmt):
+                rows += chunk.count("\n")
+                size += len(chunk)
+        elapsed = time.perf_counter() - started
+        print(f"{'export ' + fmt:<26} {rows:,} lines, {size / 1e6:.1f} MB in {elapsed:.2f}s ({rows / elapsed:,.0f} lines/sec)")
+    conn.close()
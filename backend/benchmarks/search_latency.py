@@ -0,0 +1,128 @@
+# search_latency.py
+# Latency of catalog search (product_search.py) over a large synthetic catalog.
+#
+# --seed N inserts N synthetic products (ids BENCH_*) with generate_series, so a
+# 1M-row catalog loads in a few minutes. Each query shape (browse, filters, free
+# text, expiry window, ingredients, deep keyset pages, facets) then runs --runs
+# times and is reported as p50/p95/p99 in milliseconds. --cleanup removes the synthetic rows.
+#
+#   python benchmarks/search_latency.py --seed 1000000 --runs 200
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from load_test import percentile  # noqa: E402
+from product_search import search_facets, search_products  # noqa: E402
+
+SEED_SQL = """
+INSERT INTO products (
+    id, name, brand, category, sub_category, image_url, ingredients,
+    sodium, sugar, calories_per_100g, protein_g, carbs_g, fat_g, fiber_g,
+    contains_peanuts, contains_tree_nuts, contains_milk, contains_eggs,
+    contains_fish, contains_shellfish, contains_wheat, contains_soy,
+    organic_certified, fssai_license, batch_number, manufacturing_date, expiry_date, mrp, net_weight, manufacturer_id
+)
+SELECT
+    'BENCH_' || lpad(i::text, 8, '0'),
+    (ARRAY['Masala', 'Classic', 'Crunchy', 'Golden', 'Spicy', 'Lite', 'Royal', 'Desi'])[1 + i %% 8] || ' ' ||
+        (ARRAY['Oats', 'Biscuits', 'Namkeen', 'Muesli', 'Chips', 'Atta', 'Ghee', 'Paneer', 'Juice', 'Poha'])[1 + (i / 8) %% 10] || ' ' || (i %% 997),
+    'Brand ' || (i %% 500),
+    (ARRAY['Snacks', 'Breakfast', 'Dairy', 'Beverages', 'Staples', 'Bakery'])[1 + i %% 6],
+    'Sub ' || (i %% 40),
+    'https://example.com/img/' || i || '.png',
+    ARRAY[(ARRAY['Wheat Flour', 'Rice', 'Oats', 'Milk Solids', 'Sugar', 'Salt', 'Palm Oil', 'Peanuts', 'Soy Lecithin', 'Turmeric', 'Cumin', 'Jaggery'])[1 + i %% 12],
+          (ARRAY['Salt', 'Sugar', 'Spices', 'Almonds', 'Cashews', 'Egg', 'Curry Leaves', 'Millet'])[1 + (i / 12) %% 8]],
+    i %% 900, i %% 40, 100 + i %% 400, (i %% 200) / 10.0, (i %% 700) / 10.0, (i %% 300) / 10.0, (i %% 90) / 10.0,
+    i %% 9 = 0, i %% 13 = 0, i %% 5 = 0, i %% 11 = 0, i %% 37 = 0, i %% 41 = 0, i %% 3 = 0, i %% 7 = 0,
+    i %% 4 = 0, 'FSSAI' || (i %% 10000), 'BATCH' || (i / 50),
+    DATE '2026-01-01' + (i %% 365), DATE '2026-06-01' + (i %% 730), 10 + i %% 990, (50 + i %% 950) || 'g', %(manufacturer_id)s
+FROM generate_series(%(start)s, %(stop)s) AS i
+"""
+
+QUERIES = {
+    "browse": ({}, None),
+    "category+brand": ({"category": "Snacks", "brand": "Brand 42"}, None),
+    "free_from peanuts+milk": ({"free_from": ["peanuts", "milk"], "category": "Breakfast"}, None),
+    "organic": ({"organic": True}, None),
+    "text 'masala oats'": ({"q": "masala oats"}, None),
+    "text partial 'crunch'": ({"q": "crunch"}, "id"),
+    "text + filters": ({"q": "ghee", "free_from": ["milk"], "organic": False}, None),
+    "expiry window": ({"expires_after": "2026-09-01", "expires_before": "2026-09-30"}, "expiry"),
+    "ingredient 'curry leaves'": ({"ingredient": ["Curry Leaves"]}, None),
+    "ingredients jaggery+millet": ({"ingredient": ["jaggery", "millet"]}, None),
+}
+
+
+def seed(conn, count: int, chunk: int = 100000):
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO manufacturers (id, company_name, email, hashed_password, fssai_license)
+        VALUES ('bench-manufacturer', 'Benchmark Foods', 'bench@example.com', 'x', 'FSSAI-BENCH')
+        ON CONFLICT (id) DO NOTHING
+        """
+    )
+    cursor.execute("SELECT count(*) FROM products WHERE id LIKE 'BENCH\\_%%'")
+    existing = cursor.fetchone()[0]
+    for start in range(existing + 1, count + 1, chunk):
+        cursor.execute(SEED_SQL, {"manufacturer_id": "bench-manufacturer", "start": start, "stop": min(start + chunk - 1, count)})
+        conn.commit()
+        print(f"  seeded {min(start + chunk - 1, count):,} products", flush=True)
+    cursor.execute("ANALYZE products")
+    conn.commit()
+    cursor.close()
+
+
+def timed(fn, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return {name: round(percentile(samples, pct) * 1000, 2) for name, pct in (("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99))}
+
+
+def deep_page(conn, filters: dict, sort, pages: int):
+    after = None
+    for _ in range(pages):
+        _, after = search_products(conn, filters, sort, after, 20)
+        if after is None:
+            break
+    return after
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark product search latency.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--seed", type=int, default=0, help="Make sure this many synthetic products exist first")
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic products and exit")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+    if args.cleanup:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM products WHERE manufacturer_id = 'bench-manufacturer'")
+        conn.commit()
+        sys.exit(f"Deleted {cursor.rowcount:,} synthetic products")
+    if args.seed:
+        seed(conn, args.seed)
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*) FROM products")
+    print(f"{cursor.fetchone()[0]:,} products, {args.runs} runs per query")
+    cursor.close()
+
+    for name, (filters, sort) in QUERIES.items():
+        print(f"{name:<28} page 1:   {timed(lambda: search_products(conn, filters, sort, None, 20), args.runs)}")
+        conn.rollback()
+    after = deep_page(conn, {"category": "Dairy"}, None, 50)
+    print(f"{'category page 51 (keyset)':<28}         {timed(lambda: search_products(conn, {'category': 'Dairy'}, None, after, 20), args.runs)}")
+    print(f"{'facets (no filter)':<28}         {timed(lambda: search_facets(conn, {}), max(args.runs // 10, 3))}")
+    print(f"{'facets (q=masala)':<28}         {timed(lambda: search_facets(conn, {'q': 'masala'}), args.runs)}")
+    conn.close()
@@ -0,0 +1,312 @@
+# seed_data.py
+# Synthetic data at production volumes, for the API benchmark suite (api_suite.py) and
+# for trying changes by hand against a realistic database.
+#
+# Fills the schema of database_setup.sql with:
+#   - --manufacturers manufacturers and --consumers consumers (Swasth Wallet profiles
+#     included), all with the password --password;
+#   - --products products in batches of --batch-size, each with a valid hash chain of
+#     1 to 2 x --events events (the genesis event of product_ingest, then links from
+#     ledger.event_hash), so /traceability/{id}/verify and chain_audit.py pass;
+#   - --deep-products of them with --deep-events events instead;
+#   - a few reviews on one product in three, and --hot-reviews reviews on each of the
+#     --hot-products review-heavy products;
+#   - a recall of one batch in --recall-every.
+# Rows are written with COPY, --chunk products per transaction; a rerun continues after
+# the last complete chunk. The same --seed and --until give the same data. Each chunk also
+# fills its chain heads, review summaries and recall impact index; the analytics rollups
+# are rebuilt at the end. Seeded events are not queued for anchoring. The manifest
+# (--manifest) lists the accounts and sample product ids that api_suite.py drives.
+# --cleanup removes every seeded row (ids SEED*).
+#
+#   python benchmarks/seed_data.py --products 1000000 --events 8 --consumers 50000 --manifest seed.json
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import analytics  # noqa: E402
+import recall_impact  # noqa: E402
+import review_stats  # noqa: E402
+from auth import PasswordHasher  # noqa: E402
+from ledger import EVENT_COLUMNS, event_hash  # noqa: E402
+from product_ingest import PRODUCT_COLUMNS, genesis_log_values  # noqa: E402
+from product_search import ALLERGENS  # noqa: E402
+from swasth_scoring import CONDITION_LIMITS, DIETS  # noqa: E402
+
+HEAD_COLUMNS = ("product_id", "head_hash", "event_count", "last_location", "last_actor", "last_stage", "last_event_at")
+REVIEW_COLUMNS = ("product_id", "consumer_email", "rating", "comment", "review_date")
+
+BRAND_WORDS = ("Amrit", "Desi", "Ganga", "Himalaya", "Kisan", "Nandi", "Prakriti", "Sattva", "Shakti", "Vedic")
+CATALOG = {
+    "Snacks": (("Namkeen", "Chips", "Bhujia"), ("gram flour", "potato", "rice bran oil", "salt", "peanuts", "spices")),
+    "Beverages": (("Tea", "Coffee", "Juice"), ("tea leaves", "coffee beans", "sugar", "mango pulp", "water", "citric acid")),
+    "Dairy": (("Ghee", "Paneer", "Curd"), ("milk", "milk solids", "cream", "salt", "lactic culture")),
+    "Bakery": (("Biscuits", "Rusk", "Cake"), ("wheat flour", "sugar", "palm oil", "eggs", "milk solids", "baking soda")),
+    "Staples": (("Atta", "Millet Flour", "Poha"), ("whole wheat", "ragi", "jowar", "bajra", "rice")),
+    "Sweets": (("Ladoo", "Barfi", "Halwa"), ("sugar", "ghee", "cashew", "almonds", "milk solids", "cardamom")),
+}
+STAGES = ("warehouse", "distribution", "retail")
+SITES = {"warehouse": "Warehouse", "distribution": "Distribution Centre", "retail": "Store"}
+COMMENTS = (None, "Tastes fresh.", "Packaging was damaged.", "Good value.", "Too salty for me.", "Will buy again.")
+
+
+def product_id(i: int) -> str:
+    return f"SEED_{i:09d}"
+
+
+def manufacturer_id(m: int) -> str:
+    return f"SEEDM_{m:05d}"
+
+
+def manufacturer_email(m: int) -> str:
+    return f"seed-mfr-{m}@example.com"
+
+
+def consumer_email(n: int) -> str:
+    return f"seed-consumer-{n}@example.com"
+
+
+def copy_rows(cursor, table: str, columns, rows):
+    """COPY rows into table; values must not contain tabs, newlines or backslashes."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def pg_array(values) -> str:
+    return "{" + ",".join(f'"{value}"' for value in values) + "}"
+
+
+class Seeder:
+    def __init__(self, conn, args):
+        self.conn = conn
+        self.args = args
+        self.end = datetime.datetime.combine(args.until, datetime.time(), datetime.timezone.utc)
+        self.deep_every = max(1, args.products // args.deep_products) if args.deep_products else 0
+        self.hot_every = max(1, args.products // args.hot_products) if args.hot_products else 0
+
+    # --- Accounts ---
+    def seed_accounts(self, cursor, hashed_password: str):
+        rng = random.Random(f"{self.args.seed}-accounts")
+        copy_rows(cursor, "manufacturers", ("id", "company_name", "email", "hashed_password", "fssai_license"), [
+            (manufacturer_id(m), f"{BRAND_WORDS[m % len(BRAND_WORDS)]} Foods {m}", manufacturer_email(m), hashed_password,
+             f"FSSAI-SEED-{m:05d}") for m in range(self.args.manufacturers)
+        ])
+        conditions, goals = sorted(CONDITION_LIMITS), ("weight loss", "muscle gain", "heart health")
+        for start in range(0, self.args.consumers, 50000):
+            copy_rows(cursor, "consumers", ("id", "email", "hashed_password", "profile"), [
+                (f"SEEDC_{n:09d}", consumer_email(n), hashed_password, json.dumps({
+                    "allergies": rng.sample(ALLERGENS, rng.choice((0, 0, 1, 2))),
+                    "diet": rng.sample(DIETS, rng.choice((0, 1))),
+                    "conditions": rng.sample(conditions, rng.choice((0, 0, 1))),
+                    "age": rng.randint(18, 80), "gender": None, "height_cm": None, "weight_kg": None,
+                    "activity_level": None, "goals": rng.sample(goals, rng.choice((0, 1))),
+                })) for n in range(start, min(start + 50000, self.args.consumers))
+            ])
+
+    # --- Products, chains and reviews ---
+    def product_values(self, i: int, rng: random.Random) -> dict:
+        batch = i // self.args.batch_size
+        m = batch % self.args.manufacturers
+        category = rng.choice(sorted(CATALOG))
+        kinds, ingredients = CATALOG[category]
+        brand = f"{BRAND_WORDS[m % len(BRAND_WORDS)]} {m}"
+        made = (self.end - datetime.timedelta(days=rng.randint(1, self.args.days))).date()
+        contains = set(rng.sample(ALLERGENS, rng.choice((0, 0, 1, 2))))
+        values = {
+            "id": product_id(i), "name": f"{brand} {rng.choice(kinds)} {i % 1000}", "brand": brand, "category": category,
+            "sub_category": rng.choice(kinds), "image_url": None,
+            "ingredients": pg_array(rng.sample(ingredients, rng.randint(2, len(ingredients)))),
+            "sodium": rng.randint(0, 1500), "sugar": rng.randint(0, 60), "calories_per_100g": rng.randint(20, 600),
+            "protein_g": round(rng.uniform(0, 25), 1), "carbs_g": round(rng.uniform(0, 80), 1),
+            "fat_g": round(rng.uniform(0, 40), 1), "fiber_g": round(rng.uniform(0, 12), 1),
+            "organic_certified": rng.random() < 0.1, "fssai_license": f"FSSAI-SEED-{m:05d}",
+            "iso_certification": rng.choice((None, "ISO 22000")), "batch_number": f"SEED-{batch:07d}",
+            "manufacturing_date": made, "expiry_date": made + datetime.timedelta(days=rng.choice((90, 180, 365))),
+            "mrp": rng.choice((20, 45, 99, 150, 250, 499)), "net_weight": rng.choice(("100g", "200g", "500g", "1kg")),
+            "manufacturer_id": manufacturer_id(m), "actor": manufacturer_email(m),
+        }
+        values.update({f"contains_{allergen}": allergen in contains for allergen in ALLERGENS})
+        return values
+
+    def chain(self, i: int, product: dict, rng: random.Random):
+        """EVENT_COLUMNS rows of one product, oldest first, all before self.end."""
+        deep = self.deep_every and i % self.deep_every == 0
+        length = self.args.deep_events if deep else rng.randint(1, 2 * self.args.events)
+        started = self.end - datetime.timedelta(days=rng.uniform(1, self.args.days))
+        step = (self.end - started) / (length + 1)
+        rows = [genesis_log_values(product["id"], product["brand"], product["actor"], started)]
+        timestamp = started
+        for n in range(1, length):
+            stage = STAGES[min(len(STAGES) - 1, (n - 1) * len(STAGES) // max(1, length - 1))]
+            timestamp += step * rng.uniform(0.5, 1.0)
+            timestamp = timestamp.replace(microsecond=0)
+            location = f"{SITES[stage]} {rng.randrange(self.args.locations)}"
+            actor = f"Handler {rng.randrange(500)}"
+            previous_hash = rows[-1][-1]
+            rows.append((product["id"], timestamp, location, stage, actor, rng.choice(("Received", "In Transit")), None,
+                         previous_hash, event_hash(product["id"], timestamp, location, stage, actor, previous_hash)))
+        return rows
+
+    def reviews(self, i: int, product: dict, rng: random.Random):
+        hot = self.hot_every and i % self.hot_every == self.hot_every // 2
+        count = self.args.hot_reviews if hot else (rng.randint(1, 5) if rng.random() < 1 / 3 else 0)
+        made = datetime.datetime.combine(product["manufacturing_date"], datetime.time(), datetime.timezone.utc)
+        for _ in range(count):
+            yield (product["id"], consumer_email(rng.randrange(self.args.consumers)), rng.choice((1, 2, 3, 4, 4, 5, 5, 5)),
+                   rng.choice(COMMENTS), made + datetime.timedelta(minutes=rng.randrange(60 * 24 * 90)))
+
+    def seed_chunk(self, cursor, start: int, stop: int):
+        rng = random.Random(f"{self.args.seed}-{start}")
+        products, events, heads, reviews = [], [], [], []
+        for i in range(start, stop):
+            product = self.product_values(i, rng)
+            products.append(tuple(product[column] for column in PRODUCT_COLUMNS))
+            chain = self.chain(i, product, rng)
+            events.extend(chain)
+            last = chain[-1]
+            heads.append((product["id"], last[-1], len(chain), last[2], last[4], last[3], last[1]))
+            reviews.extend(self.reviews(i, product, rng))
+        copy_rows(cursor, "products", PRODUCT_COLUMNS, products)
+        copy_rows(cursor, "traceability_log", EVENT_COLUMNS, events)
+        copy_rows(cursor, "traceability_hashes", ("current_hash", "product_id"), [(row[-1], row[0]) for row in events])
+        copy_rows(cursor, "traceability_heads", HEAD_COLUMNS, heads)
+        copy_rows(cursor, "reviews", REVIEW_COLUMNS, reviews)
+        batches = sorted({row[PRODUCT_COLUMNS.index("batch_number")] for row in products})
+        recalled = [batch for batch in batches if int(batch[5:]) % self.args.recall_every == self.args.recall_every - 1]
+        if recalled:
+            copy_rows(cursor, "product_recalls", ("batch_number", "reason", "recall_date"), [
+                (batch, "Synthetic recall: undeclared allergen", self.end - datetime.timedelta(days=rng.randint(0, 30)))
+                for batch in recalled
+            ])
+        review_stats.rebuild(cursor, [row[0] for row in products])
+        recall_impact.rebuild(cursor, batches)
+        return len(events), len(reviews)
+
+    def run(self):
+        args = self.args
+        cursor = self.conn.cursor()
+        cursor.execute("SET TIME ZONE 'UTC'")
+        cursor.execute("SELECT count(*) FROM manufacturers WHERE id LIKE 'SEEDM\\_%%'")
+        if cursor.fetchone()[0] == 0:
+            started = time.perf_counter()
+            hashed_password = PasswordHasher(args.bcrypt_rounds).hash_blocking(args.password)
+            self.seed_accounts(cursor, hashed_password)
+            self.conn.commit()
+            print(f"  seeded {args.manufacturers:,} manufacturers and {args.consumers:,} consumers "
+                  f"in {time.perf_counter() - started:.1f}s", flush=True)
+        cursor.execute("SELECT count(*) FROM ensure_traceability_partitions(%s, %s)",
+                       (self.end - datetime.timedelta(days=args.days + 1), self.end))
+        self.conn.commit()
+
+        cursor.execute("SELECT count(*) FROM products WHERE id LIKE 'SEED\\_%%'")
+        existing = cursor.fetchone()[0] // args.chunk * args.chunk  # Chunks commit whole
+        started = time.perf_counter()
+        for start in range(existing, args.products, args.chunk):
+            stop = min(start + args.chunk, args.products)
+            events, reviews = self.seed_chunk(cursor, start, stop)
+            self.conn.commit()
+            rate = (stop - existing) / (time.perf_counter() - started)
+            print(f"  seeded {stop:,} products (+{events:,} events, +{reviews:,} reviews), {rate:,.0f} products/s", flush=True)
+        if existing < args.products:
+            analytics.rebuild(cursor, [manufacturer_id(m) for m in range(args.manufacturers)])
+            cursor.execute("ANALYZE")
+            self.conn.commit()
+        cursor.close()
+
+    def manifest(self) -> dict:
+        """What api_suite.py needs: accounts and product ids of each shape."""
+        args = self.args
+        deep = [product_id(i) for i in range(0, args.products, self.deep_every)][:20] if self.deep_every else []
+        hot = [product_id(i) for i in range(self.hot_every // 2, args.products, self.hot_every)][:20] if self.hot_every else []
+        rng = random.Random(f"{args.seed}-manifest")
+        return {
+            "seed": args.seed,
+            "products": args.products,
+            "password": args.password,
+            "manufacturers": [manufacturer_email(m) for m in range(min(args.manufacturers, 20))],
+            "consumers": [consumer_email(n) for n in range(min(args.consumers, 50))],
+            "product_ids": [product_id(rng.randrange(args.products)) for _ in range(1000)],
+            "deep_product_ids": deep,
+            "review_heavy_product_ids": hot,
+        }
+
+
+def cleanup(conn):
+    cursor = conn.cursor()
+    for sql in (
+        "DELETE FROM analytics_stage_daily WHERE manufacturer_id LIKE 'SEEDM\\_%%'",
+        "DELETE FROM analytics_transit_daily WHERE manufacturer_id LIKE 'SEEDM\\_%%'",
+        "DELETE FROM analytics_recall_daily WHERE manufacturer_id LIKE 'SEEDM\\_%%'",
+        "DELETE FROM batch_touchpoints WHERE batch_number LIKE 'SEED-%%'",
+        "DELETE FROM batch_consumers WHERE batch_number LIKE 'SEED-%%'",
+        "DELETE FROM product_recalls WHERE batch_number LIKE 'SEED-%%'",
+        "DELETE FROM anchor_outbox o USING traceability_log l WHERE l.log_id = o.log_id AND l.product_id LIKE 'SEED\\_%%'",
+        "DELETE FROM traceability_hashes WHERE product_id LIKE 'SEED\\_%%'",
+        "DELETE FROM products WHERE id LIKE 'SEED\\_%%'",
+        "DELETE FROM manufacturers WHERE id LIKE 'SEEDM\\_%%'",
+        "DELETE FROM consumers WHERE id LIKE 'SEEDC\\_%%'",
+    ):
+        cursor.execute(sql)
+        print(f"  {cursor.rowcount:>10,}  {sql.split(' WHERE')[0].split(' USING')[0]}")
+    conn.commit()
+    cursor.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the database with synthetic products, chains, reviews and accounts.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--manufacturers", type=int, default=100)
+    parser.add_argument("--consumers", type=int, default=10000)
+    parser.add_argument("--password", default="seed-password", help="Password of every seeded account")
+    parser.add_argument("--bcrypt-rounds", type=int, default=int(os.getenv("PASSWORD_BCRYPT_ROUNDS", 12)),
+                        help="Match the server's PASSWORD_BCRYPT_ROUNDS, or logins re-hash the password")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=500, help="Products per batch")
+    parser.add_argument("--events", type=int, default=8, help="Average traceability events per product")
+    parser.add_argument("--deep-products", type=int, default=100, help="Products with long chains")
+    parser.add_argument("--deep-events", type=int, default=2000, help="Events per long chain")
+    parser.add_argument("--hot-products", type=int, default=100, help="Review-heavy products")
+    parser.add_argument("--hot-reviews", type=int, default=2000, help="Reviews per review-heavy product")
+    parser.add_argument("--recall-every", type=int, default=200, help="Recall one batch in this many")
+    parser.add_argument("--days", type=int, default=365, help="Days the events are spread over")
+    parser.add_argument("--until", type=datetime.date.fromisoformat, default=datetime.datetime.now(datetime.timezone.utc).date(),
+                        help="Events end before this UTC date (default today)")
+    parser.add_argument("--locations", type=int, default=2000, help="Sites per stage")
+    parser.add_argument("--chunk", type=int, default=10000, help="Products per transaction")
+    parser.add_argument("--manifest", default="seed_manifest.json", help="Where to write the manifest for api_suite.py")
+    parser.add_argument("--cleanup", action="store_true", help="Delete the synthetic rows and exit")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+    if args.cleanup:
+        cleanup(conn)
+        sys.exit(0)
+    started = time.perf_counter()
+    seeder = Seeder(conn, args)
+    seeder.run()
+    with open(args.manifest, "w") as f:
+        json.dump(seeder.manifest(), f, indent=2)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT (SELECT count(*) FROM products WHERE id LIKE 'SEED\\_%%'),
+               (SELECT sum(event_count) FROM traceability_heads WHERE product_id LIKE 'SEED\\_%%'),
+               (SELECT sum(review_count) FROM review_summaries WHERE product_id LIKE 'SEED\\_%%')
+    """)
+    products, events, reviews = cursor.fetchone()
+    print(f"{products:,} products, {events or 0:,} events, {reviews or 0:,} reviews seeded "
+          f"in {time.perf_counter() - started:.1f}s; manifest written to {args.manifest}")
+    conn.close()
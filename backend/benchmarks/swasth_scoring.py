@@ -0,0 +1,109 @@
+# swasth_scoring.py
+# Throughput of Swasth Wallet scoring (swasth_scoring.py) over a large catalog.
+#
+# Builds a synthetic CatalogSnapshot of --products rows in memory (or loads the real
+# one with --from-db), then scores it for --profiles random wallets: profile
+# compilation cold and cached, a full vectorized pass (score_catalog), a ranked page
+# (rank_safe_products) and, for comparison, the per-product Python loop the consumer
+# dashboard runs (analyzeProduct), applied to every product.
+#
+#   python benchmarks/swasth_scoring.py --products 100000 --profiles 200
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from load_test import percentile  # noqa: E402
+from swasth_scoring import (  # noqa: E402
+    ALLERGENS, CONDITION_ALLERGENS, CONDITION_LIMITS, DIETS, GOAL_WEIGHTS, KEY_SEPARATOR, NUTRIENTS,
+    CatalogSnapshot, compile_profile, rank_safe_products, score_catalog,
+)
+
+CATEGORIES = ("Snacks", "Breakfast", "Dairy", "Beverages", "Staples", "Bakery")
+INGREDIENTS = ("wheat flour", "rice", "oats", "milk solids", "sugar", "salt", "palm oil", "onion powder", "garlic",
+               "egg", "paneer", "honey", "potato", "spices", "curry leaves", "jaggery", "millet", "gelatin")
+
+
+def synthetic_rows(count: int, rng: random.Random) -> list:
+    rows = []
+    for i in range(count):
+        allergen_bits = sum(1 << bit for bit in range(len(ALLERGENS)) if rng.random() < 0.15)
+        ingredients = KEY_SEPARATOR.join(rng.sample(INGREDIENTS, rng.randint(1, 5)))
+        nutrients = (rng.uniform(0, 1200), rng.uniform(0, 40), rng.uniform(50, 600), rng.uniform(0, 30),
+                     rng.uniform(0, 80), rng.uniform(0, 35), rng.uniform(0, 15))
+        rows.append((f"SYN_{i:08d}", rng.choice(CATEGORIES), allergen_bits, ingredients, *nutrients,
+                     rng.random() < 0.01, 20000 + rng.randint(0, 1000)))
+    return rows
+
+
+def random_wallet(rng: random.Random) -> str:
+    return json.dumps({
+        "allergies": rng.sample(ALLERGENS, rng.randint(0, 2)),
+        "diet": rng.sample(DIETS, rng.randint(0, 1)),
+        "conditions": rng.sample(sorted(CONDITION_LIMITS) + sorted(CONDITION_ALLERGENS), rng.randint(0, 2)),
+        "goals": rng.sample(sorted(GOAL_WEIGHTS), rng.randint(0, 1)),
+    })
+
+
+def python_loop(snapshot: CatalogSnapshot, wallet: dict) -> int:
+    """The dashboard's analyzeProduct() rules, one product at a time."""
+    allergies, conditions = set(wallet["allergies"]), set(wallet["conditions"])
+    sodium, sugar = NUTRIENTS.index("sodium"), NUTRIENTS.index("sugar")
+    safe = 0
+    for index in range(len(snapshot)):
+        bits, nutrients = int(snapshot.allergen_bits[index]), snapshot.nutrients[index].tolist()
+        issues = [a for bit, a in enumerate(ALLERGENS) if bits & (1 << bit) and a in allergies]
+        if nutrients[sodium] > 400 and "high blood pressure" in conditions:
+            issues.append("sodium")
+        if nutrients[sugar] > 10 and "diabetes" in conditions:
+            issues.append("sugar")
+        if bits & (1 << ALLERGENS.index("wheat")) and "celiac disease" in conditions:
+            issues.append("gluten")
+        safe += not issues
+    return safe
+
+
+def timed(fn, runs) -> dict:
+    samples = []
+    for run in range(runs):
+        started = time.perf_counter()
+        fn(run)
+        samples.append(time.perf_counter() - started)
+    return {name: round(percentile(samples, pct) * 1000, 3) for name, pct in (("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Swasth Wallet scoring throughput.")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--profiles", type=int, default=200)
+    parser.add_argument("--from-db", action="store_true", help="Score the real catalog (DATABASE_URL) instead")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    started = time.perf_counter()
+    if args.from_db:
+        import psycopg2
+
+        conn = psycopg2.connect(args.database_url)
+        snapshot = CatalogSnapshot.load(conn.cursor())
+        conn.close()
+    else:
+        snapshot = CatalogSnapshot(synthetic_rows(args.products, rng))
+    print(f"{len(snapshot):,} products, snapshot built in {time.perf_counter() - started:.2f}s")
+
+    wallets = [random_wallet(rng) for _ in range(args.profiles)]
+    print(f"{'compile (cold)':<22} {timed(lambda i: compile_profile(wallets[i]), args.profiles)}")
+    print(f"{'compile (cached)':<22} {timed(lambda i: compile_profile(wallets[i]), args.profiles)}")
+
+    score = timed(lambda i: score_catalog(snapshot, compile_profile(wallets[i])), args.profiles)
+    print(f"{'score whole catalog':<22} {score}  ({len(snapshot) / (score['p50_ms'] / 1000):,.0f} products/sec at p50)")
+    print(f"{'ranked page of 20':<22} {timed(lambda i: rank_safe_products(snapshot, compile_profile(wallets[i]), 20), args.profiles)}")
+
+    loop_runs = max(3, args.profiles // 20)
+    loop = timed(lambda i: python_loop(snapshot, json.loads(wallets[i])), loop_runs)
+    print(f"{'python loop':<22} {loop}  ({len(snapshot) / (loop['p50_ms'] / 1000):,.0f} products/sec at p50)")
@@ -0,0 +1,56 @@
+# trace_ingest.py
+# Throughput of traceability event ingestion: one event per transaction (the
+# /traceability/add path) versus batched appends (the /traceability/batch path).
+#
+# Events are spread round-robin over existing products, so each batch touches many
+# chains at once, like a warehouse handheld syncing its queue. Writes real rows.
+#
+#   python benchmarks/trace_ingest.py --events 5000 --batch-sizes 1,50,500
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ledger import append_events  # noqa: E402
+
+Scan = namedtuple("Scan", "product_id location stage actor status notes")
+
+
+def run(conn, product_ids, total: int, batch_size: int) -> float:
+    scans = [Scan(product_ids[i % len(product_ids)], f"Benchmark Hub {i}", "distribution", "Benchmark Scanner", "In Transit", None)
+             for i in range(total)]
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    for offset in range(0, total, batch_size):
+        append_events(cursor, scans[offset:offset + batch_size])
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    cursor.close()
+    return total / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark traceability event ingestion.")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=100, help="How many existing products to spread events over")
+    parser.add_argument("--batch-sizes", default="1,10,100,1000")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.database_url)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM products ORDER BY id LIMIT %s", (args.products,))
+    product_ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    if not product_ids:
+        sys.exit("No products found; seed the database first.")
+
+    for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+        rate = run(conn, product_ids, args.events, batch_size)
+        print(f"batch_size={batch_size:<6} events/sec={rate:,.0f}")
+    conn.close()
@@ -0,0 +1,113 @@
+# worker_scaling.py
+# Cold start and throughput of serve.py as the worker count grows.
+#
+# For each worker count it starts `serve.py --workers N` on a spare port, then records
+# three things. First, the time to the first 200 from /health/ready. Second, the time
+# until N different worker pids have answered, i.e. every worker finished its lifespan
+# startup. Third, requests/sec at a fixed concurrency, measured with load_test.run_level
+# after a short warm-up. It then sends SIGTERM and times the graceful drain. It also
+# reports the plain import time of main.py once (serve.py --check). Run it against a
+# database with data in it. Throughput should grow with workers until the CPU cores or
+# the database are saturated.
+#
+#   python benchmarks/worker_scaling.py --workers 1,2,4,8 --path /products/search?q=millet --output workers.json
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from load_test import run_level
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVE = os.path.join(BACKEND_DIR, "serve.py")
+
+
+def import_seconds() -> float:
+    output = subprocess.run([sys.executable, SERVE, "--check"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().split()[-1].rstrip("s"))
+
+
+def wait_for_workers(base_url: str, workers: int, timeout: float):
+    """(seconds to the first ready answer, seconds until `workers` distinct pids were ready)."""
+    started = time.perf_counter()
+    first_ready = None
+    pids = set()
+    while time.perf_counter() - started < timeout:
+        try:
+            # A fresh connection per probe, so the kernel spreads probes across the workers
+            response = httpx.get(f"{base_url}/health/ready", timeout=2.0, headers={"Connection": "close"})
+            if response.status_code == 200:
+                first_ready = first_ready or time.perf_counter() - started
+                pids.add(response.json()["pid"])
+                if len(pids) >= workers:
+                    return first_ready, time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{workers} workers not ready after {timeout}s ({len(pids)} answered)")
+
+
+async def measure_throughput(base_url: str, path: str, concurrency: int, requests: int, timeout: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        await run_level(client, path, concurrency, min(requests // 10, 200))  # Warm-up: pool connections and response cache
+        return await run_level(client, path, concurrency, requests)
+
+
+def run_workers(args, workers: int) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    command = [sys.executable, SERVE, "--workers", str(workers), "--bind", f"127.0.0.1:{args.port}"]
+    if not args.preload:
+        command.append("--no-preload")
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_ready, all_ready = wait_for_workers(base_url, workers, args.startup_timeout)
+        result = asyncio.run(measure_throughput(base_url, args.path, args.concurrency, args.requests, args.timeout))
+    finally:
+        stopping = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        shutdown = time.perf_counter() - stopping
+    return {"workers": workers, "first_ready_s": round(first_ready, 3), "all_workers_ready_s": round(all_ready, 3),
+            "shutdown_s": round(shutdown, 3), **result}
+
+
+def main(args):
+    levels = [int(level) for level in args.workers.split(",")]
+    report = {"path": args.path, "concurrency": args.concurrency, "preload": args.preload, "import_s": round(import_seconds(), 3)}
+    print(f"import main:app: {report['import_s']}s")
+    results = []
+    for workers in levels:
+        result = run_workers(args, workers)
+        results.append(result)
+        print(f"workers={workers:<3} ready={result['first_ready_s']}s all={result['all_workers_ready_s']}s "
+              f"req/s={result['requests_per_sec']:<9} p50={result['p50_ms']}ms p99={result['p99_ms']}ms "
+              f"errors={result['errors']} shutdown={result['shutdown_s']}s")
+    report["results"] = results
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold start and requests/sec of serve.py per worker count.")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--path", default="/health/ready", help="GET path to load, e.g. /product/<id>")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per worker count")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-preload", dest="preload", action="store_false")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    main(parser.parse_args())
@@ -0,0 +1,234 @@
+# cache.py
+# Read-through response cache for hot consumer endpoints (product pages, review lists).
+#
+# Entries are (etag, body) pairs keyed by strings such as "product:<id>". They expire
+# after a TTL and are also deleted explicitly by the write endpoints, so a cached page
+# is never staler than the last write that touched it (search facet counts are the
+# exception: they span many products and rely on the TTL alone). RedisCache shares
+# entries (and invalidations) between workers and hosts. MemoryCache is per process, so
+# writes also NOTIFY their keys on CHANNEL inside the write transaction, and every
+# process runs an InvalidationListener that drops them from its own cache.
+#
+# A miss that loads while a write commits could store the pre-write body after the
+# write's invalidation. Readers therefore take generation(key) before loading and pass
+# it to set(), which skips the store if the key was invalidated in between.
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from db import NotificationListener
+
+CHANNEL = "foodtrace_cache"
+MAX_PAYLOAD_BYTES = 7500  # NOTIFY payloads must stay under 8000 bytes
+
+CachedResponse = Tuple[str, bytes]  # (etag, body)
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class _Counters:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class MemoryCache:
+    """In-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.counters = _Counters()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        # Invalidation clock: key -> tick of its last invalidation, the newest max_entries
+        # keys only. Generations older than _floor may have lost their tick and are stale.
+        self._tick = 0
+        self._floor = 0
+        self._invalidated = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.counters.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.counters.misses += 1
+            return None
+
+    def generation(self, key: str) -> int:
+        with self._lock:
+            return self._tick
+
+    def set(self, key: str, value: CachedResponse, generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None and (generation < self._floor or self._invalidated.get(key, 0) > generation):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters.evictions += 1
+
+    def invalidate(self, *keys: str):
+        with self._lock:
+            self._tick += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.counters.invalidations += 1
+                self._invalidated[key] = self._tick
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_entries:
+                self._floor = self._invalidated.popitem(last=False)[1]
+
+    def clear(self):
+        with self._lock:
+            self.counters.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tick += 1
+            self._floor = self._tick
+            self._invalidated.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "max_entries": self.max_entries,
+                    "ttl_seconds": self.ttl_seconds, **self.counters.as_dict()}
+
+
+class RedisCache:
+    """Redis-backed cache; Redis handles TTL expiry and LRU eviction (maxmemory-policy).
+
+    Pass `client` to use an existing client or a local stand-in such as fakeredis.
+    """
+
+    def __init__(self, url: str = None, ttl_seconds: float = 300.0, prefix: str = "bft:cache:", client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis)")
+            client = redis.Redis.from_url(url)
+        from redis.exceptions import WatchError
+        self._watch_error = WatchError
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.counters = _Counters()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        etag, body = self.client.hmget(self.prefix + key, "etag", "body")
+        if body is None:
+            self.counters.incr("misses")
+            return None
+        self.counters.incr("hits")
+        return etag.decode(), body
+
+    def _generation_key(self, key: str) -> str:
+        return self.prefix + "gen:" + key
+
+    def generation(self, key: str) -> int:
+        return int(self.client.get(self._generation_key(key)) or 0)
+
+    def set(self, key: str, value: CachedResponse, generation: Optional[int] = None):
+        etag, body = value
+        with self.client.pipeline() as pipe:
+            try:
+                if generation is not None:
+                    # The store only goes through if no invalidate() bumped the generation since
+                    pipe.watch(self._generation_key(key))
+                    if int(pipe.get(self._generation_key(key)) or 0) != generation:
+                        return
+                    pipe.multi()
+                pipe.hset(self.prefix + key, mapping={"etag": etag, "body": body})
+                pipe.expire(self.prefix + key, int(self.ttl_seconds))
+                pipe.execute()
+            except self._watch_error:
+                pass
+
+    def invalidate(self, *keys: str):
+        if keys:
+            pipe = self.client.pipeline()
+            for key in keys:
+                # Outlives any load that started before it, like the entries it guards
+                pipe.incr(self._generation_key(key))
+                pipe.expire(self._generation_key(key), int(self.ttl_seconds))
+            pipe.delete(*(self.prefix + key for key in keys))
+            self.counters.incr("invalidations", pipe.execute()[-1])
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "ttl_seconds": self.ttl_seconds, **self.counters.as_dict()}
+
+
+def create_cache(backend: str, max_entries: int, ttl_seconds: float, redis_url: str = None):
+    if backend == "redis":
+        return RedisCache(redis_url, ttl_seconds=ttl_seconds)
+    return MemoryCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+
+def notify_invalidations(cursor, keys: Iterable[str]):
+    """NOTIFYs `keys` on CHANNEL, split into payloads under the size limit; delivered on commit."""
+    payloads, batch, size = [], [], 2
+    for key in keys:
+        if batch and size + len(key) + 4 > MAX_PAYLOAD_BYTES:
+            payloads.append(json.dumps(batch))
+            batch, size = [], 2
+        batch.append(key)
+        size += len(key) + 4
+    if batch:
+        payloads.append(json.dumps(batch))
+    if payloads:
+        cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload", (CHANNEL, payloads))
+
+
+class InvalidationListener(NotificationListener):
+    """Drops the keys NOTIFYd on CHANNEL by any process from this process's MemoryCache."""
+
+    def __init__(self, dsn: str, cache: MemoryCache):
+        super().__init__(dsn, CHANNEL, "cache-invalidation-listener")
+        self.cache = cache
+
+    def handle(self, payload: str):
+        self.cache.invalidate(*json.loads(payload))
+
+    def on_reconnected(self):
+        # Invalidations sent while disconnected are lost
+        self.cache.clear()
+
+
+def product_key(product_id: str) -> str:
+    return f"product:{product_id}"
+
+
+def reviews_key(product_id: str) -> str:
+    return f"reviews:{product_id}"
+
+
+def facets_key(filters: dict) -> str:
+    """Search facet counts, keyed by a digest of the normalized filters."""
+    normalized = json.dumps(filters, sort_keys=True, default=str)
+    return "facets:" + hashlib.sha1(normalized.encode()).hexdigest()
@@ -0,0 +1,349 @@
+# chain_audit.py
+# Integrity verification of the traceability hash chains, for one product
+# (GET /traceability/{product_id}/verify) or the whole ledger (the bulk auditor below).
+#
+# Each event's current_hash is recomputed from its fields and checked against the
+# previous event's hash; events anchored in Merkle batches also have their proof
+# checked against merkle_root. Anchored hashes are then looked up on-chain: per
+# product through the contract's view functions or the local chain_events index
+# (chain_indexer.py), or for a full audit through one windowed scan of the
+# contract's EventRecorded / BatchRootRecorded logs.
+#
+# The bulk auditor streams the log with a server-side cursor, recomputes chains in a
+# process pool and stores a checkpoint (last verified log_id + head hash) per product,
+# so a re-audit only reads rows added since the last run.
+#
+# Events archived out of traceability_log (log_partitions.py) were verified when their
+# partition was archived; the live chain is checked from the archived boundary hash
+# (traceability_heads.archived_hash), or from genesis when the archived rows are passed in.
+#
+#   python chain_audit.py --workers 8 --from-block 0
+import datetime
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Callable, Iterator, List, Optional
+
+from psycopg2.extras import execute_values
+
+from anchoring import product_batch_id
+from ledger import event_hash
+from merkle import verify_proof
+
+# Row layout consumed by verify_chain (product_id is passed separately)
+CHAIN_ROW_SQL = """
+    l.log_id, l.timestamp, l.location, l.stage, l.actor, l.previous_hash, l.current_hash,
+    l.blockchain_tx_id, l.merkle_root, l.merkle_proof, o.log_id IS NOT NULL AS anchor_pending
+"""
+
+PRODUCT_CHAIN_SQL = f"""
+SELECT {CHAIN_ROW_SQL}
+FROM traceability_log l
+LEFT JOIN anchor_outbox o ON o.log_id = l.log_id
+WHERE l.product_id = %s
+ORDER BY l.log_id
+"""
+
+# Chains resume after the checkpoint, or after the archived boundary when that is further on
+AUDIT_STREAM_SQL = f"""
+SELECT l.product_id,
+       CASE WHEN c.last_log_id >= COALESCE(h.archived_log_id, 0) THEN c.head_hash ELSE h.archived_hash END,
+       {CHAIN_ROW_SQL}
+FROM traceability_log l
+LEFT JOIN chain_audit_checkpoints c ON c.product_id = l.product_id AND %(incremental)s
+LEFT JOIN traceability_heads h ON h.product_id = l.product_id
+LEFT JOIN anchor_outbox o ON o.log_id = l.log_id
+WHERE l.log_id > GREATEST(c.last_log_id, h.archived_log_id, 0)
+ORDER BY l.product_id, l.log_id
+"""
+
+
+def verify_chain(product_id: str, rows: List[tuple], previous_hash: str = "0") -> dict:
+    """
+    Recomputes one product's chain from rows in log_id order (CHAIN_ROW_SQL layout),
+    starting after `previous_hash` ("0" for the genesis event, or a checkpointed head).
+    Pure function, so it can run in a worker process.
+    """
+    problems, anchors, pending, chain = [], [], [], []
+    for log_id, timestamp, location, stage, actor, prev, current, tx_id, root, proof, anchor_pending in rows:
+        if prev != previous_hash:
+            problems.append({"log_id": log_id, "error": "previous_hash does not match the preceding event"})
+        timestamp = timestamp.astimezone(datetime.timezone.utc)
+        if event_hash(product_id, timestamp, location, stage, actor, prev) != current:
+            problems.append({"log_id": log_id, "error": "current_hash does not match the event data"})
+        if root is not None and not verify_proof(current, proof or [], root):
+            problems.append({"log_id": log_id, "error": "Merkle proof does not lead to merkle_root"})
+        if anchor_pending:
+            pending.append(log_id)
+        elif tx_id is not None:
+            anchors.append((log_id, current, root))
+        chain.append((log_id, current))
+        previous_hash = current
+    return {"product_id": product_id, "events": len(rows), "head_hash": previous_hash,
+            "problems": problems, "anchors": anchors, "pending": pending, "chain": chain}
+
+
+def verify_chains(chains: List[tuple]) -> List[dict]:
+    """Process pool entry point: verify_chain over (product_id, rows, previous_hash) tuples."""
+    return [verify_chain(*chain) for chain in chains]
+
+
+# --- On-chain lookups ---
+class ContractLookup:
+    """
+    Answers anchor lookups with view calls; one getTraceEvents call per product.
+    `get_contract` is only called on the first lookup, so a chain that cannot be
+    reached fails the lookup (anchors unchecked), not the off-chain verification.
+    """
+
+    def __init__(self, get_contract: Callable):
+        self.get_contract = get_contract
+        self._events = {}
+
+    def event_hashes(self, product_id: str) -> set:
+        if product_id not in self._events:
+            hashes = self.get_contract().functions.getTraceEvents(product_batch_id(product_id)).call()
+            self._events[product_id] = {bytes(h).hex() for h in hashes}
+        return self._events[product_id]
+
+    def root_recorded(self, root: str) -> bool:
+        return self.get_contract().functions.batchRecordedAt(bytes.fromhex(root)).call() > 0
+
+
+class LogIndex:
+    """Answers anchor lookups from the contract's event logs, fetched once in block windows."""
+
+    def __init__(self, contract, from_block: int = 0, to_block: Optional[int] = None, block_step: int = 5000):
+        self.contract = contract
+        self.from_block = from_block
+        self.to_block = to_block
+        self.block_step = block_step
+        self.events = {}  # product_batch_id -> {event hash}
+        self.roots = set()
+
+    def scan(self) -> "LogIndex":
+        to_block = self.to_block if self.to_block is not None else self.contract.w3.eth.block_number
+        for start in range(self.from_block, to_block + 1, self.block_step):
+            end = min(start + self.block_step - 1, to_block)
+            for log in self.contract.events.EventRecorded.get_logs(from_block=start, to_block=end):
+                self.events.setdefault(bytes(log.args.productBatchId), set()).add(bytes(log.args.eventHash).hex())
+            for log in self.contract.events.BatchRootRecorded.get_logs(from_block=start, to_block=end):
+                self.roots.add(bytes(log.args.merkleRoot).hex())
+        return self
+
+    def load_index(self, cursor) -> "LogIndex":
+        """Fills the index from chain_events instead of the node."""
+        cursor.execute("SELECT event_name, product_batch_id, event_hash FROM chain_events")
+        for event_name, batch_id, event_hash in cursor:
+            if event_name == "BatchRootRecorded":
+                self.roots.add(event_hash)
+            else:
+                self.events.setdefault(bytes.fromhex(batch_id), set()).add(event_hash)
+        return self
+
+    def event_hashes(self, product_id: str) -> set:
+        return self.events.get(product_batch_id(product_id), set())
+
+    def root_recorded(self, root: str) -> bool:
+        return root in self.roots
+
+
+class IndexLookup:
+    """Answers anchor lookups from the local chain_events index kept by chain_indexer.py."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def event_hashes(self, product_id: str) -> set:
+        self.cursor.execute(
+            "SELECT event_hash FROM chain_events WHERE product_batch_id = %s AND event_name = 'EventRecorded'",
+            (product_batch_id(product_id).hex(),)
+        )
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def root_recorded(self, root: str) -> bool:
+        self.cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM chain_events WHERE event_hash = %s AND event_name = 'BatchRootRecorded')",
+            (root,)
+        )
+        return self.cursor.fetchone()[0]
+
+
+def check_anchors(result: dict, lookup):
+    """Adds a problem for every anchored event whose hash (or Merkle root) the chain does not know."""
+    missing = []
+    for log_id, current, root in result["anchors"]:
+        if root is not None:
+            found = lookup.root_recorded(root)
+        else:
+            found = current in lookup.event_hashes(result["product_id"])
+        if not found:
+            missing.append({"log_id": log_id, "error": "Anchored hash not found on-chain"})
+    result["problems"].extend(missing)
+    result["problems"].sort(key=lambda problem: problem["log_id"])
+
+
+def report(result: dict, onchain_checked: bool) -> dict:
+    return {
+        "product_id": result["product_id"],
+        "valid": not result["problems"],
+        "events": result["events"],
+        "anchored": len(result["anchors"]),
+        "pending": len(result["pending"]),
+        "onchain_checked": onchain_checked,
+        "head_hash": result["head_hash"],
+        "problems": result["problems"],
+    }
+
+
+def verify_product(cursor, product_id: str, lookup, archived_rows: Optional[List[tuple]] = None) -> Optional[dict]:
+    """
+    Full verification of one product's chain; None if the product has no events. The
+    live events are checked from the archived boundary, unless the archived events are
+    passed in (log_partitions.archived_chain_rows), in which case all is checked from genesis.
+    """
+    cursor.execute(PRODUCT_CHAIN_SQL, (product_id,))
+    rows = cursor.fetchall()
+    if archived_rows is not None:
+        rows, previous_hash = archived_rows + rows, "0"
+    else:
+        cursor.execute("SELECT archived_hash FROM traceability_heads WHERE product_id = %s", (product_id,))
+        head = cursor.fetchone()
+        previous_hash = head[0] if head and head[0] else "0"
+    if not rows and previous_hash == "0":
+        return None
+    result = verify_chain(product_id, rows, previous_hash)
+    try:
+        check_anchors(result, lookup)
+        onchain_checked = True
+    except Exception:
+        # The off-chain chain is still verified; anchors are reported as unchecked.
+        onchain_checked = False
+    return report(result, onchain_checked)
+
+
+# --- Bulk audit ---
+def _verified_prefix(result: dict) -> Optional[tuple]:
+    """(last_log_id, head_hash) of the events before the first problem or pending anchor."""
+    stop = min([p["log_id"] for p in result["problems"]] + result["pending"], default=None)
+    prefix = [link for link in result["chain"] if stop is None or link[0] < stop]
+    return prefix[-1] if prefix else None
+
+
+def _chain_tasks(cursor, products_per_task: int) -> Iterator[List[tuple]]:
+    task = []
+    for product_id, rows in groupby(cursor, key=lambda row: row[0]):
+        rows = list(rows)
+        task.append((product_id, [row[2:] for row in rows], rows[0][1] or "0"))
+        if len(task) == products_per_task:
+            yield task
+            task = []
+    if task:
+        yield task
+
+
+def _save_checkpoints(conn, results: List[dict]):
+    checkpoints = []
+    for result in results:
+        prefix = _verified_prefix(result)
+        if prefix:
+            checkpoints.append((result["product_id"], prefix[0], prefix[1]))
+    if checkpoints:
+        cursor = conn.cursor()
+        execute_values(
+            cursor,
+            """
+            INSERT INTO chain_audit_checkpoints (product_id, last_log_id, head_hash) VALUES %s
+            ON CONFLICT (product_id) DO UPDATE
+            SET last_log_id = EXCLUDED.last_log_id, head_hash = EXCLUDED.head_hash, verified_at = now()
+            """,
+            checkpoints, page_size=len(checkpoints)
+        )
+        cursor.close()
+    conn.commit()
+
+
+def audit(read_conn, write_conn, lookup, workers: int = 4, products_per_task: int = 200,
+          incremental: bool = True, fetch_size: int = 10000) -> dict:
+    """
+    Verifies every chain (or, with `incremental`, only rows after each product's
+    checkpoint) and advances the checkpoints. Anchors are not looked up when `lookup`
+    is None. Returns throughput counters and the problems found.
+    """
+    stats = {"products": 0, "events": 0, "pending": 0, "problems": []}
+    started = time.perf_counter()
+    cursor = read_conn.cursor(name="chain_audit")
+    cursor.itersize = fetch_size
+    cursor.execute(AUDIT_STREAM_SQL, {"incremental": incremental})
+
+    def collect(future):
+        results = future.result()
+        for result in results:
+            if lookup is not None:
+                check_anchors(result, lookup)
+            stats["products"] += 1
+            stats["events"] += result["events"]
+            stats["pending"] += len(result["pending"])
+            stats["problems"].extend({"product_id": result["product_id"], **p} for p in result["problems"])
+        _save_checkpoints(write_conn, results)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for task in _chain_tasks(cursor, products_per_task):
+            in_flight.append(pool.submit(verify_chains, task))
+            # Bound the rows held in memory while workers catch up with the cursor
+            if len(in_flight) >= workers * 2:
+                collect(in_flight.popleft())
+        while in_flight:
+            collect(in_flight.popleft())
+    cursor.close()
+    read_conn.commit()
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["products_per_sec"] = round(stats["products"] / elapsed, 1) if elapsed else 0.0
+    stats["events_per_sec"] = round(stats["events"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import psycopg2
+
+    from main import chain, settings
+
+    parser = argparse.ArgumentParser(description="Verify every traceability hash chain against its data and the chain anchors.")
+    parser.add_argument("--workers", type=int, default=4, help="Hash-recomputation processes")
+    parser.add_argument("--products-per-task", type=int, default=200)
+    parser.add_argument("--full", action="store_true", help="Ignore checkpoints and re-verify every row")
+    parser.add_argument("--from-block", type=int, default=0, help="First block of the contract log scan (e.g. the deployment block)")
+    parser.add_argument("--block-step", type=int, default=5000, help="Blocks per eth_getLogs request")
+    parser.add_argument("--from-index", action="store_true", help="Check anchors against chain_events instead of scanning the node")
+    parser.add_argument("--skip-onchain", action="store_true", help="Only verify the off-chain hash chains")
+    args = parser.parse_args()
+
+    read_conn = psycopg2.connect(settings.DATABASE_URL)
+    write_conn = psycopg2.connect(settings.DATABASE_URL)
+    if args.skip_onchain:
+        lookup = None
+    elif args.from_index:
+        lookup = LogIndex(chain.contract).load_index(write_conn.cursor())
+        write_conn.commit()
+    else:
+        print("Scanning contract logs...")
+        lookup = LogIndex(chain.contract, from_block=args.from_block, block_step=args.block_step).scan()
+        print(f"  {sum(len(hashes) for hashes in lookup.events.values())} event hashes, {len(lookup.roots)} batch roots")
+
+    stats = audit(read_conn, write_conn, lookup, workers=args.workers,
+                  products_per_task=args.products_per_task, incremental=not args.full)
+    read_conn.close()
+    write_conn.close()
+
+    print(f"products={stats['products']} events={stats['events']} pending_anchors={stats['pending']} "
+          f"seconds={stats['seconds']} products/sec={stats['products_per_sec']:,} events/sec={stats['events_per_sec']:,}")
+    for problem in stats["problems"]:
+        print(f"  {problem['product_id']} log_id={problem['log_id']}: {problem['error']}")
+    sys.exit(1 if stats["problems"] else 0)
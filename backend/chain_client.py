@@ -0,0 +1,88 @@
+# chain_client.py
+# Lazily built web3 client for the Traceability contract.
+#
+# Nothing here runs at import. The web3 client, signing account and contract object
+# are built on first use; that validates the settings (RPC URL, contract address,
+# private key) but does not contact the node. So importing main.py, forking preloaded
+# workers (serve.py) and running tests need no RPC configuration. The API builds the
+# client in its lifespan hook only when anchoring or the chain indexer is enabled.
+# With missing or invalid settings it keeps serving and queues anchors in
+# anchor_outbox. check() is the deep readiness probe: one eth_blockNumber call with a
+# short timeout.
+import threading
+from typing import Callable, Optional
+
+from web3 import Web3
+
+from anchoring import CONTRACT_ABI
+
+
+class ChainUnavailable(RuntimeError):
+    """The blockchain settings are missing or invalid."""
+
+
+class ChainClient:
+    def __init__(self, rpc_url: Optional[str], contract_address: Optional[str], private_key: Optional[str],
+                 wrap_provider: Optional[Callable] = None, request_timeout: float = 10.0, probe_timeout: float = 2.0):
+        self.rpc_url = rpc_url
+        self.contract_address = contract_address
+        self.private_key = private_key
+        self.wrap_provider = wrap_provider  # e.g. metrics.instrument_provider
+        self.request_timeout = request_timeout
+        self.probe_timeout = probe_timeout
+        self._w3 = None
+        self._account = None
+        self._contract = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        with self._lock:
+            if self._contract is not None:
+                return
+            if self._error is not None:  # Settings only change with a restart
+                raise ChainUnavailable(self._error)
+            try:
+                if not (self.rpc_url and self.contract_address and self.private_key):
+                    raise ValueError("BLOCKCHAIN_RPC_URL, CONTRACT_ADDRESS and SERVER_PRIVATE_KEY must all be set")
+                provider = Web3.HTTPProvider(self.rpc_url, request_kwargs={"timeout": self.request_timeout})
+                if self.wrap_provider:
+                    provider = self.wrap_provider(provider)
+                w3 = Web3(provider)
+                account = w3.eth.account.from_key(self.private_key)
+                contract = w3.eth.contract(address=self.contract_address, abi=CONTRACT_ABI)
+            except Exception as e:
+                self._error = f"Invalid blockchain settings: {e}"
+                raise ChainUnavailable(self._error) from e
+            self._w3, self._account, self._contract = w3, account, contract
+
+    @property
+    def w3(self):
+        self._build()
+        return self._w3
+
+    @property
+    def account(self):
+        self._build()
+        return self._account
+
+    @property
+    def contract(self):
+        self._build()
+        return self._contract
+
+    def check(self, probe: bool = False) -> dict:
+        """Whether the settings are valid and, with probe=True, whether the node answers."""
+        try:
+            self._build()
+        except ChainUnavailable as e:
+            return {"configured": False, "error": str(e)}
+        result = {"configured": True, "contract_address": self._contract.address}
+        if probe:
+            # A separate short-timeout provider, so a hung node cannot stall the probe for request_timeout
+            probe_w3 = Web3(Web3.HTTPProvider(self.rpc_url, request_kwargs={"timeout": self.probe_timeout}))
+            try:
+                result.update(connected=True, block_number=probe_w3.eth.block_number)
+            except Exception as e:
+                result.update(connected=False, error=str(e)[:300])
+        return result
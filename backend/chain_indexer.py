@@ -0,0 +1,332 @@
+# chain_indexer.py
+# Local index of the Traceability contract's anchoring logs.
+#
+# ChainIndexer tails EventRecorded (one per anchored event) and BatchRootRecorded (one
+# per Merkle batch) with eth_getLogs in block-range chunks and stores them in
+# chain_events, so "is this hash on-chain?" becomes an indexed lookup instead of an
+# RPC round-trip. It also remembers the hash of the last indexed block(s) near the
+# head. Each pass first compares the newest one with the node; after a reorg it walks
+# back to the last block both agree on, deletes the logs above it and re-indexes.
+#
+# reconcile() compares the index with traceability_log.blockchain_tx_id: events the
+# database believes are anchored but the chain does not show, anchors recorded under a
+# different transaction, and on-chain hashes with no matching row.
+#
+#   python chain_indexer.py --from-block 0        # index up to the head, then reconcile
+#   python chain_indexer.py --follow              # keep tailing (e.g. a local anvil node)
+import datetime
+import logging
+import threading
+from typing import List, Optional
+
+from psycopg2.extras import execute_values
+
+from anchoring import enqueue_anchors
+
+logger = logging.getLogger("bharatfoodtrace.chain_indexer")
+
+CHAIN_EVENT_COLUMNS = ("contract_address", "event_name", "product_batch_id", "event_hash", "block_number",
+                       "block_hash", "tx_hash", "log_index", "recorder", "recorded_at")
+
+
+def _hex(value) -> str:
+    return bytes(value).hex()
+
+
+class ChainIndexer:
+    """Keeps chain_events in sync with the contract's logs, including across reorgs.
+
+    The indexer cursor is locked with FOR UPDATE SKIP LOCKED, so several API processes
+    can run an indexer and only one advances it at a time. run_once() indexes one
+    block range and is what tests drive directly, e.g. against a local Hardhat/anvil node.
+    """
+
+    def __init__(self, get_conn, release_conn, w3, contract, start_block: int = 0, block_step: int = 2000,
+                 reorg_depth: int = 64, poll_interval: float = 5.0, on_indexed=None):
+        self.get_conn = get_conn
+        self.release_conn = release_conn
+        self.w3 = w3
+        self.contract = contract
+        self.address = contract.address
+        self.start_block = start_block
+        self.block_step = block_step
+        self.reorg_depth = reorg_depth
+        self.poll_interval = poll_interval
+        self.on_indexed = on_indexed  # Called with the product ids whose on-chain status changed
+        self._stopping = threading.Event()
+        self._thread = None
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="chain-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                indexed = self.run_once()
+            except Exception:
+                logger.exception("Chain indexing pass failed")
+                indexed = 0
+            # Catching up: go straight to the next range. At the head: wait for new blocks.
+            if indexed < self.block_step:
+                self._stopping.wait(self.poll_interval)
+
+    # --- Indexing ---
+    def run_once(self) -> int:
+        """Indexes the next block range. Returns how many blocks the cursor advanced."""
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor()
+            last_block = self._lock_cursor(cursor)
+            if last_block is None:
+                conn.rollback()  # Another process is indexing
+                return 0
+            last_block, dropped = self._rewind_reorg(cursor, last_block)
+            head = self.w3.eth.block_number
+            from_block, to_block = last_block + 1, min(last_block + self.block_step, head)
+            added = []
+            if from_block <= to_block:
+                # Remember the range's last block before fetching, so a reorg in between is caught next pass
+                self._remember_blocks(cursor, [(to_block, _hex(self.w3.eth.get_block(to_block)["hash"]))])
+                rows = self._fetch_logs(from_block, to_block)
+                added = self._store_logs(cursor, rows)
+                self._remember_blocks(cursor, sorted({(row[4], row[5]) for row in rows}))
+                cursor.execute(
+                    "DELETE FROM chain_indexer_blocks WHERE contract_address = %s AND block_number <= %s",
+                    (self.address, to_block - self.reorg_depth)
+                )
+                last_block = to_block
+            cursor.execute(
+                "UPDATE chain_indexer_state SET last_block = %s, updated_at = now() WHERE contract_address = %s",
+                (last_block, self.address)
+            )
+            product_ids = affected_products(cursor, dropped + added)
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release_conn(conn)
+        if self.on_indexed and product_ids:
+            try:
+                self.on_indexed(product_ids)
+            except Exception:
+                logger.exception("on_indexed callback failed")
+        return max(to_block - from_block + 1, 0)
+
+    def _lock_cursor(self, cursor) -> Optional[int]:
+        cursor.execute(
+            "INSERT INTO chain_indexer_state (contract_address, last_block) VALUES (%s, %s) ON CONFLICT (contract_address) DO NOTHING",
+            (self.address, self.start_block - 1)
+        )
+        cursor.execute(
+            "SELECT last_block FROM chain_indexer_state WHERE contract_address = %s FOR UPDATE SKIP LOCKED",
+            (self.address,)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _rewind_reorg(self, cursor, last_block: int):
+        """Returns (last_block, dropped event hashes) after undoing blocks the node no longer has."""
+        cursor.execute(
+            "SELECT block_number, block_hash FROM chain_indexer_blocks WHERE contract_address = %s ORDER BY block_number DESC",
+            (self.address,)
+        )
+        remembered = cursor.fetchall()
+        common = None
+        for block_number, block_hash in remembered:
+            try:
+                if _hex(self.w3.eth.get_block(block_number)["hash"]) == block_hash:
+                    common = block_number
+                    break
+            except Exception:
+                continue  # Block no longer exists (the new branch is shorter)
+        if not remembered or common == remembered[0][0]:
+            return last_block, []
+        if common is None:
+            # The reorg is deeper than what we remember: re-index the whole window
+            common = remembered[-1][0] - 1
+        logger.warning("Chain reorg detected: rewinding the index from block %s to %s", last_block, common)
+        cursor.execute(
+            "DELETE FROM chain_events WHERE contract_address = %s AND block_number > %s RETURNING event_hash",
+            (self.address, common)
+        )
+        dropped = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "DELETE FROM chain_indexer_blocks WHERE contract_address = %s AND block_number > %s",
+            (self.address, common)
+        )
+        return common, dropped
+
+    def _fetch_logs(self, from_block: int, to_block: int) -> List[tuple]:
+        rows = []
+        for log in self.contract.events.EventRecorded.get_logs(from_block=from_block, to_block=to_block):
+            rows.append(self._row(log, "EventRecorded", _hex(log.args.productBatchId), _hex(log.args.eventHash)))
+        for log in self.contract.events.BatchRootRecorded.get_logs(from_block=from_block, to_block=to_block):
+            rows.append(self._row(log, "BatchRootRecorded", None, _hex(log.args.merkleRoot)))
+        return rows
+
+    def _row(self, log, event_name: str, product_batch_id: Optional[str], event_hash: str) -> tuple:
+        recorded_at = datetime.datetime.fromtimestamp(log.args.timestamp, datetime.timezone.utc)
+        return (self.address, event_name, product_batch_id, event_hash, log.blockNumber, _hex(log.blockHash),
+                self.w3.to_hex(log.transactionHash), log.logIndex, log.args.recorder, recorded_at)
+
+    def _store_logs(self, cursor, rows: List[tuple]) -> List[str]:
+        if not rows:
+            return []
+        inserted = execute_values(
+            cursor,
+            f"""
+            INSERT INTO chain_events ({', '.join(CHAIN_EVENT_COLUMNS)}) VALUES %s
+            ON CONFLICT (block_hash, log_index) DO NOTHING
+            RETURNING event_hash
+            """,
+            rows, page_size=len(rows), fetch=True
+        )
+        return [row[0] for row in inserted]
+
+    def _remember_blocks(self, cursor, blocks: List[tuple]):
+        if blocks:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO chain_indexer_blocks (contract_address, block_number, block_hash) VALUES %s
+                ON CONFLICT (contract_address, block_number) DO UPDATE SET block_hash = EXCLUDED.block_hash
+                """,
+                [(self.address, number, block_hash) for number, block_hash in blocks], page_size=len(blocks)
+            )
+
+    def status(self, cursor) -> dict:
+        cursor.execute("SELECT last_block, updated_at FROM chain_indexer_state WHERE contract_address = %s", (self.address,))
+        row = cursor.fetchone()
+        cursor.execute("SELECT count(*) FROM chain_events WHERE contract_address = %s", (self.address,))
+        return {"contract_address": self.address, "last_block": row[0] if row else None,
+                "updated_at": row[1] if row else None, "events": cursor.fetchone()[0]}
+
+
+def affected_products(cursor, event_hashes: List[str]) -> List[str]:
+    """Products with an event (or a Merkle batch) among the given on-chain hashes."""
+    if not event_hashes:
+        return []
+    cursor.execute(
+        """
+        SELECT product_id FROM traceability_log WHERE current_hash = ANY(%(hashes)s)
+        UNION
+        SELECT l.product_id FROM anchor_batches b JOIN traceability_log l ON l.anchor_batch_id = b.batch_id
+        WHERE b.merkle_root = ANY(%(hashes)s)
+        """,
+        {"hashes": list(set(event_hashes))}
+    )
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+# --- Reconciliation ---
+# An event is confirmed when the index holds its own hash (single mode) or its batch's root.
+CONFIRMED_SQL = """
+    EXISTS (SELECT 1 FROM chain_events e WHERE e.event_hash = COALESCE(l.merkle_root, l.current_hash){tx_filter})
+"""
+
+
+def reconcile(cursor, requeue_missing: bool = False) -> dict:
+    """
+    Compares the index with traceability_log. Only meaningful once the indexer has
+    caught up with the head. With `requeue_missing`, events whose recorded transaction
+    is not on-chain (e.g. dropped by a reorg) are queued for anchoring again; Merkle
+    batch events are only reported, since their batch has to be re-sent as a whole.
+    """
+    confirmed = CONFIRMED_SQL.format(tx_filter="")
+    cursor.execute(
+        f"""
+        SELECT l.log_id, l.product_id, l.blockchain_tx_id, l.merkle_root IS NOT NULL
+        FROM traceability_log l
+        WHERE l.blockchain_tx_id IS NOT NULL AND NOT {confirmed}
+        ORDER BY l.log_id
+        """
+    )
+    missing = cursor.fetchall()
+    cursor.execute(
+        f"""
+        SELECT count(*) FROM traceability_log l
+        WHERE l.blockchain_tx_id IS NOT NULL AND {confirmed}
+        AND NOT {CONFIRMED_SQL.format(tx_filter=" AND e.tx_hash = l.blockchain_tx_id")}
+        """
+    )
+    mismatched = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        SELECT e.event_name, e.event_hash, e.tx_hash, e.block_number FROM chain_events e
+        WHERE CASE e.event_name
+            WHEN 'BatchRootRecorded' THEN NOT EXISTS (SELECT 1 FROM anchor_batches b WHERE b.merkle_root = e.event_hash)
+            ELSE NOT EXISTS (SELECT 1 FROM traceability_log l WHERE l.current_hash = e.event_hash)
+        END
+        ORDER BY e.block_number, e.log_index
+        """
+    )
+    unknown = cursor.fetchall()
+
+    requeued = []
+    if requeue_missing:
+        requeued = [log_id for log_id, _, _, batched in missing if not batched]
+        if requeued:
+            cursor.execute("UPDATE traceability_log SET blockchain_tx_id = NULL WHERE log_id = ANY(%s)", (requeued,))
+            enqueue_anchors(cursor, requeued)
+    return {
+        "missing": [{"log_id": log_id, "product_id": product_id, "blockchain_tx_id": tx_id}
+                    for log_id, product_id, tx_id, _ in missing],
+        "mismatched": mismatched,
+        "unknown_onchain": [{"event_name": name, "event_hash": event_hash, "tx_hash": tx_hash, "block_number": block}
+                            for name, event_hash, tx_hash, block in unknown],
+        "requeued": requeued,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import psycopg2
+
+    from main import chain, settings
+
+    parser = argparse.ArgumentParser(description="Index the Traceability contract's logs into chain_events.")
+    parser.add_argument("--from-block", type=int, default=settings.CHAIN_INDEXER_START_BLOCK, help="Where to start on a fresh index (e.g. the deployment block)")
+    parser.add_argument("--block-step", type=int, default=settings.CHAIN_INDEXER_BLOCK_STEP)
+    parser.add_argument("--reorg-depth", type=int, default=settings.CHAIN_INDEXER_REORG_DEPTH)
+    parser.add_argument("--follow", action="store_true", help="Keep tailing new blocks instead of exiting at the head")
+    parser.add_argument("--requeue-missing", action="store_true", help="Re-anchor events whose transaction is not on-chain")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.DATABASE_URL)
+    indexer = ChainIndexer(lambda: conn, lambda c: None, chain.w3, chain.contract, start_block=args.from_block,
+                           block_step=args.block_step, reorg_depth=args.reorg_depth)
+    started = time.perf_counter()
+    while True:
+        indexed = indexer.run_once()
+        if indexed == 0:
+            if not args.follow:
+                break
+            time.sleep(settings.CHAIN_INDEXER_POLL_INTERVAL)
+    cursor = conn.cursor()
+    status = indexer.status(cursor)
+    print(f"Indexed up to block {status['last_block']}: {status['events']} events ({time.perf_counter() - started:.1f}s)")
+    result = reconcile(cursor, requeue_missing=args.requeue_missing)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"missing={len(result['missing'])} mismatched={result['mismatched']} "
+          f"unknown_onchain={len(result['unknown_onchain'])} requeued={len(result['requeued'])}")
+    for row in result["missing"]:
+        print(f"  not on-chain: log_id={row['log_id']} product={row['product_id']} tx={row['blockchain_tx_id']}")
+    for row in result["unknown_onchain"]:
+        print(f"  no matching row: {row['event_name']} {row['event_hash']} tx={row['tx_hash']} block={row['block_number']}")
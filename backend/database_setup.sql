@@ -3,15 +3,49 @@
 -- This script will create all necessary tables and relationships for the application.
 
 -- Drop tables in reverse order of dependency to ensure a clean setup
+DROP TABLE IF EXISTS analytics_recall_daily;
+DROP TABLE IF EXISTS analytics_transit_daily;
+DROP TABLE IF EXISTS analytics_stage_daily;
+DROP TABLE IF EXISTS chain_events;
+DROP TABLE IF EXISTS chain_indexer_blocks;
+DROP TABLE IF EXISTS chain_indexer_state;
+DROP TABLE IF EXISTS chain_audit_checkpoints;
+DROP TABLE IF EXISTS traceability_archive_products;
+DROP TABLE IF EXISTS traceability_archives;
+DROP TABLE IF EXISTS batch_consumers;
+DROP TABLE IF EXISTS batch_touchpoints;
+DROP TABLE IF EXISTS traceability_heads;
+DROP TABLE IF EXISTS traceability_hashes;
+DROP TABLE IF EXISTS anchor_outbox;
+DROP TABLE IF EXISTS review_summaries;
 DROP TABLE IF EXISTS reviews;
 DROP TABLE IF EXISTS product_recalls;
 DROP TABLE IF EXISTS traceability_log;
+DROP TABLE IF EXISTS anchor_batches;
 DROP TABLE IF EXISTS products;
 DROP TABLE IF EXISTS manufacturers;
 DROP TABLE IF EXISTS consumers;
 DROP TABLE IF EXISTS fpos;
 DROP TABLE IF EXISTS farmers;
 
+-- Ingredient helpers used by the generated columns of products (and by product_search.py).
+-- canonical_ingredient folds case and whitespace so "Milk  Solids" and "milk solids" match.
+CREATE OR REPLACE FUNCTION canonical_ingredient(name TEXT) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+    AS $$ SELECT lower(btrim(regexp_replace(name, '\s+', ' ', 'g'))) $$;
+
+CREATE OR REPLACE FUNCTION canonical_ingredients(names TEXT[]) RETURNS TEXT[]
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    AS $$
+        SELECT coalesce(array_agg(DISTINCT canonical_ingredient(n)) FILTER (WHERE btrim(n) <> ''), '{}')
+        FROM unnest(names) AS n
+    $$;
+
+-- array_to_string is only STABLE in general; for TEXT[] it is immutable, as generated columns require
+CREATE OR REPLACE FUNCTION ingredients_text(names TEXT[]) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    AS $$ SELECT array_to_string(names, ' ') $$;
+
 -- Table for Farmers
 -- Stores basic information about individual farmers.
 CREATE TABLE farmers (
@@ -36,15 +70,18 @@ CREATE TABLE fpos (
 );
 
 -- Table for Consumers (End Users)
--- Stores consumer login details and their Swasth Wallet profile as JSON.
+-- Stores consumer login details and their Swasth Wallet profile as JSONB.
 CREATE TABLE consumers (
     id VARCHAR(255) PRIMARY KEY,
     email VARCHAR(255) UNIQUE NOT NULL,
     hashed_password TEXT NOT NULL,
-    profile_json TEXT, -- Stores the SwasthWallet Pydantic model as a JSON string
+    profile JSONB NOT NULL DEFAULT '{}', -- The SwasthWallet Pydantic model, list values normalized
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Cohort counts (profile @> '{"allergies": ["peanuts"]}', see profile_cohorts.py)
+CREATE INDEX idx_consumers_profile ON consumers USING GIN (profile jsonb_path_ops);
+
 -- Table for Manufacturers / Food Business Operators (FBOs)
 -- Stores manufacturer login details and company information.
 CREATE TABLE manufacturers (
@@ -65,7 +102,8 @@ CREATE TABLE products (
     category TEXT,
     sub_category TEXT,
     image_url TEXT,
-    ingredients TEXT,
+    ingredients TEXT[] NOT NULL DEFAULT '{}', -- As listed on the label, in order
+    ingredient_keys TEXT[] GENERATED ALWAYS AS (canonical_ingredients(ingredients)) STORED,
     -- Nutritional Information
     sodium INTEGER,
     sugar INTEGER,
@@ -96,13 +134,37 @@ CREATE TABLE products (
     -- Foreign Key to link to the manufacturer
     manufacturer_id VARCHAR(255) NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    -- Full-text search document: name ranks above brand, brand above ingredients
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(brand, '')), 'B') ||
+        setweight(to_tsvector('english', ingredients_text(ingredients)), 'C')
+    ) STORED,
     FOREIGN KEY(manufacturer_id) REFERENCES manufacturers(id)
 );
 
+-- Table for Anchor Batches
+-- Each row is one Merkle tree of event hashes whose root is anchored with a single recordBatchRoot transaction.
+CREATE TABLE anchor_batches (
+    batch_id SERIAL PRIMARY KEY,
+    merkle_root TEXT UNIQUE NOT NULL,
+    leaf_count INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- 'pending', 'anchored' or 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    tx_hash TEXT,
+    last_error TEXT,
+    blockchain_tx_id TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    anchored_at TIMESTAMP WITH TIME ZONE
+);
+
 -- Table for Traceability Log (The Digital Ledger)
 -- This is the core of the TraceChain, storing every event in a product's journey.
+-- Partitioned by timestamp into UTC months (traceability_log_YYYY_MM, see log_partitions.py);
+-- the key therefore includes timestamp, and current_hash is kept unique by traceability_hashes.
 CREATE TABLE traceability_log (
-    log_id SERIAL PRIMARY KEY,
+    log_id BIGSERIAL,
     product_id VARCHAR(255) NOT NULL,
     timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
     location TEXT NOT NULL, -- Could store a GS1 GLN
@@ -112,11 +174,189 @@ CREATE TABLE traceability_log (
     notes TEXT,
     -- Blockchain / Digital Ledger Columns
     previous_hash TEXT NOT NULL, -- Hash of the previous entry in the chain for this product
-    current_hash TEXT UNIQUE NOT NULL, -- Hash of the current entry's data + previous_hash
+    current_hash TEXT NOT NULL, -- Hash of the current entry's data + previous_hash
     blockchain_tx_id TEXT, -- To be used in Step 3
+    -- Merkle batch anchoring (set when the event is anchored as part of a batch)
+    anchor_batch_id INTEGER,
+    merkle_root TEXT,
+    merkle_proof JSONB, -- Sibling hashes from this event's leaf up to merkle_root
+    PRIMARY KEY (log_id, timestamp),
+    FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE,
+    FOREIGN KEY(anchor_batch_id) REFERENCES anchor_batches(batch_id)
+) PARTITION BY RANGE (timestamp);
+
+-- Events with no month partition yet; ensure_traceability_partitions moves them out.
+CREATE TABLE traceability_log_default PARTITION OF traceability_log DEFAULT;
+
+-- Creates the month partitions from from_month through to_month (and those of any month
+-- with rows in the default partition, moving the rows), serialized by an advisory lock.
+-- Months already archived (see traceability_archives) are not recreated.
+CREATE OR REPLACE FUNCTION ensure_traceability_partitions(from_month TIMESTAMPTZ, to_month TIMESTAMPTZ)
+    RETURNS SETOF TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    month_start TIMESTAMPTZ;
+    part_name TEXT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('traceability_log_partitions'));
+    FOR month_start IN
+        SELECT date_trunc('month', d.timestamp, 'UTC') FROM traceability_log_default d
+        UNION
+        SELECT generate_series(date_trunc('month', from_month, 'UTC'), date_trunc('month', to_month, 'UTC'), interval '1 month')
+        ORDER BY 1
+    LOOP
+        part_name := 'traceability_log_' || to_char(month_start AT TIME ZONE 'UTC', 'YYYY_MM');
+        CONTINUE WHEN to_regclass(part_name) IS NOT NULL
+            OR EXISTS (SELECT 1 FROM traceability_archives a WHERE a.partition_name = part_name);
+        EXECUTE format('CREATE TABLE %I (LIKE traceability_log INCLUDING DEFAULTS)', part_name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM traceability_log_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+            month_start, month_start + interval '1 month', part_name
+        );
+        EXECUTE format(
+            'ALTER TABLE traceability_log ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            part_name, month_start, month_start + interval '1 month'
+        );
+        RETURN NEXT part_name;
+    END LOOP;
+END $$;
+
+-- Table for Traceability Archives
+-- Month partitions exported to Parquet and dropped by log_partitions.archive_partition.
+CREATE TABLE traceability_archives (
+    archive_id SERIAL PRIMARY KEY,
+    partition_name TEXT UNIQUE NOT NULL,
+    range_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    range_end TIMESTAMP WITH TIME ZONE NOT NULL,
+    uri TEXT NOT NULL, -- Path of the Parquet file
+    row_count BIGINT NOT NULL,
+    sha256 TEXT NOT NULL, -- Of the file, checked by log_partitions.py --verify-archives
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Which products have events in which archive, so archived reads open only their files.
+CREATE TABLE traceability_archive_products (
+    archive_id INTEGER NOT NULL REFERENCES traceability_archives(archive_id),
+    product_id VARCHAR(255) NOT NULL,
+    event_count INTEGER NOT NULL,
+    first_log_id BIGINT NOT NULL,
+    last_log_id BIGINT NOT NULL,
+    PRIMARY KEY (product_id, archive_id)
+);
+
+-- Table for Traceability Hashes
+-- Every current_hash ever written (archived events included), so hashes stay unique across
+-- partitions. Written next to the events by ledger.record_hashes. No foreign key, so the log
+-- writers do not pay for one; whoever deletes products deletes their hashes.
+CREATE TABLE traceability_hashes (
+    current_hash TEXT PRIMARY KEY,
+    product_id VARCHAR(255) NOT NULL
+);
+
+-- Table for Traceability Chain Heads
+-- One row per product pointing at the latest hash in its chain. Appenders lock this row
+-- (SELECT ... FOR UPDATE) so concurrent scans of a product are serialized and cannot fork the chain.
+CREATE TABLE traceability_heads (
+    product_id VARCHAR(255) PRIMARY KEY,
+    head_hash TEXT NOT NULL,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    -- Last known position of the product (its newest event), for recall impact lookups
+    last_location TEXT,
+    last_actor TEXT,
+    last_stage VARCHAR(255),
+    last_event_at TIMESTAMP WITH TIME ZONE,
+    -- Last archived event of the chain (see log_partitions.py); the live chain continues from archived_hash
+    archived_log_id BIGINT,
+    archived_hash TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+);
+
+-- Table for Batch Touchpoints
+-- Every location/actor pair that handled a product of a batch, kept up to date by
+-- ledger.append_events (see recall_impact.py), so a recall can list the affected
+-- locations without scanning traceability_log.
+CREATE TABLE batch_touchpoints (
+    batch_number TEXT NOT NULL,
+    location TEXT NOT NULL,
+    actor TEXT NOT NULL,
+    last_stage VARCHAR(255) NOT NULL,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    event_count INTEGER NOT NULL,
+    PRIMARY KEY (batch_number, location, actor)
+);
+
+-- Table for Batch Consumers
+-- Consumers who reviewed a product of a batch, kept up to date by POST /reviews/add.
+CREATE TABLE batch_consumers (
+    batch_number TEXT NOT NULL,
+    consumer_email VARCHAR(255) NOT NULL,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    review_count INTEGER NOT NULL,
+    PRIMARY KEY (batch_number, consumer_email)
+);
+
+-- Table for Chain Audit Checkpoints
+-- The last log_id (and its hash) up to which the bulk auditor has verified a product's chain,
+-- so a re-audit only recomputes events added since then.
+CREATE TABLE chain_audit_checkpoints (
+    product_id VARCHAR(255) PRIMARY KEY,
+    last_log_id BIGINT NOT NULL,
+    head_hash TEXT NOT NULL,
+    verified_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
 );
 
+-- Table for the Anchoring Outbox
+-- Traceability events waiting to be recorded on-chain by the background anchoring worker.
+-- A row is written in the same transaction as its traceability_log entry and deleted once anchored.
+-- log_id has no foreign key: traceability_log is partitioned, so its key is (log_id, timestamp).
+CREATE TABLE anchor_outbox (
+    log_id BIGINT PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- 'pending' or 'failed' (gave up after max attempts)
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    tx_hash TEXT, -- Set once sent, so a retry checks the receipt instead of re-sending
+    last_error TEXT,
+    batch_id INTEGER, -- Set in Merkle batch mode once the row is part of an anchor batch
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(batch_id) REFERENCES anchor_batches(batch_id)
+);
+
+-- Tables for the On-Chain Event Index
+-- chain_events mirrors the contract's EventRecorded / BatchRootRecorded logs (filled by chain_indexer.py),
+-- so anchoring can be confirmed with a local lookup. Hashes are hex without 0x, like current_hash.
+CREATE TABLE chain_events (
+    event_id BIGSERIAL PRIMARY KEY,
+    contract_address TEXT NOT NULL,
+    event_name VARCHAR(50) NOT NULL, -- 'EventRecorded' or 'BatchRootRecorded'
+    product_batch_id TEXT, -- sha256 of the product id; NULL for batch roots
+    event_hash TEXT NOT NULL, -- The anchored event hash, or the Merkle root for batch roots
+    block_number BIGINT NOT NULL,
+    block_hash TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    log_index INTEGER NOT NULL,
+    recorder TEXT,
+    recorded_at TIMESTAMP WITH TIME ZONE,
+    UNIQUE (block_hash, log_index)
+);
+
+-- Indexer cursor (last fully indexed block) per contract
+CREATE TABLE chain_indexer_state (
+    contract_address TEXT PRIMARY KEY,
+    last_block BIGINT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Hashes of recently indexed blocks, compared with the node on every pass to detect reorgs
+CREATE TABLE chain_indexer_blocks (
+    contract_address TEXT NOT NULL,
+    block_number BIGINT NOT NULL,
+    block_hash TEXT NOT NULL,
+    PRIMARY KEY (contract_address, block_number)
+);
+
 -- Table for Product Recalls
 -- Stores recall information linked to a specific batch number.
 CREATE TABLE product_recalls (
@@ -138,10 +378,92 @@ CREATE TABLE reviews (
     FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
 );
 
+-- Table for Review Summaries
+-- Rating count, total and histogram per reviewed product, kept up to date by POST /reviews/add
+-- (see review_stats.py) so product pages never aggregate the reviews table.
+CREATE TABLE review_summaries (
+    product_id VARCHAR(255) PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    review_count INTEGER NOT NULL,
+    rating_total INTEGER NOT NULL,
+    rating_1 INTEGER NOT NULL DEFAULT 0,
+    rating_2 INTEGER NOT NULL DEFAULT 0,
+    rating_3 INTEGER NOT NULL DEFAULT 0,
+    rating_4 INTEGER NOT NULL DEFAULT 0,
+    rating_5 INTEGER NOT NULL DEFAULT 0
+);
+
+-- Tables for Supply-Chain Analytics
+-- Daily rollups per manufacturer, kept up to date by the event and recall writers (see
+-- analytics.py) so the /analytics endpoints never aggregate traceability_log.
+-- Events per stage, and the dwell of the stage: time from an event in it to the product's next event
+CREATE TABLE analytics_stage_daily (
+    manufacturer_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    batch_number TEXT NOT NULL,
+    stage VARCHAR(255) NOT NULL,
+    event_count INTEGER NOT NULL,
+    dwell_count INTEGER NOT NULL,
+    dwell_seconds DOUBLE PRECISION NOT NULL,
+    dwell_seconds_max DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (manufacturer_id, day, batch_number, stage)
+);
+
+-- Consecutive events of a product at different locations, with the time between them
+CREATE TABLE analytics_transit_daily (
+    manufacturer_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    batch_number TEXT NOT NULL,
+    from_location TEXT NOT NULL,
+    to_location TEXT NOT NULL,
+    trip_count INTEGER NOT NULL,
+    transit_seconds DOUBLE PRECISION NOT NULL,
+    transit_seconds_min DOUBLE PRECISION NOT NULL,
+    transit_seconds_max DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (manufacturer_id, day, batch_number, from_location, to_location)
+);
+
+-- Recalls touching the manufacturer's products, per brand
+CREATE TABLE analytics_recall_daily (
+    manufacturer_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    brand TEXT NOT NULL,
+    recall_count INTEGER NOT NULL,
+    product_count INTEGER NOT NULL,
+    PRIMARY KEY (manufacturer_id, day, brand)
+);
+
 -- Add indexes for faster lookups on frequently queried columns
-CREATE INDEX idx_traceability_product_id ON traceability_log(product_id);
-CREATE INDEX idx_products_batch_number ON products(batch_number);
-CREATE INDEX idx_reviews_product_id ON reviews(product_id);
+CREATE INDEX idx_traceability_product_id ON traceability_log(product_id, log_id);
+CREATE INDEX idx_traceability_current_hash ON traceability_log(current_hash);
+CREATE INDEX idx_products_batch_number ON products(batch_number, id);
+-- Product search (see product_search.py)
+CREATE INDEX idx_products_search_vector ON products USING GIN (search_vector);
+CREATE INDEX idx_products_ingredient_keys ON products USING GIN (ingredient_keys);
+CREATE INDEX idx_products_category ON products(category, sub_category, id);
+CREATE INDEX idx_products_brand ON products(brand, id);
+CREATE INDEX idx_products_expiry_date ON products(expiry_date, id);
+CREATE INDEX idx_products_organic ON products(id) WHERE organic_certified;
+CREATE INDEX idx_products_peanut_free ON products(id) WHERE NOT contains_peanuts;
+CREATE INDEX idx_products_tree_nut_free ON products(id) WHERE NOT contains_tree_nuts;
+CREATE INDEX idx_products_milk_free ON products(id) WHERE NOT contains_milk;
+CREATE INDEX idx_products_egg_free ON products(id) WHERE NOT contains_eggs;
+CREATE INDEX idx_products_fish_free ON products(id) WHERE NOT contains_fish;
+CREATE INDEX idx_products_shellfish_free ON products(id) WHERE NOT contains_shellfish;
+CREATE INDEX idx_products_wheat_free ON products(id) WHERE NOT contains_wheat;
+CREATE INDEX idx_products_soy_free ON products(id) WHERE NOT contains_soy;
+-- Keyset pages of a product's reviews, newest first (see review_stats.py)
+CREATE INDEX idx_reviews_product_date ON reviews(product_id, review_date DESC, review_id DESC);
 CREATE INDEX idx_recalls_batch_number ON product_recalls(batch_number);
+CREATE INDEX idx_anchor_outbox_due ON anchor_outbox(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX idx_anchor_outbox_batch_id ON anchor_outbox(batch_id);
+CREATE INDEX idx_traceability_anchor_batch_id ON traceability_log(anchor_batch_id);
+CREATE INDEX idx_anchor_batches_due ON anchor_batches(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX idx_chain_events_event_hash ON chain_events(event_hash);
+CREATE INDEX idx_chain_events_product_batch_id ON chain_events(product_batch_id, event_hash);
+CREATE INDEX idx_chain_events_block ON chain_events(contract_address, block_number);
+
+
+-- Month partitions for the current and the next three months (log_partitions.py keeps creating them)
+DO $$ BEGIN PERFORM ensure_traceability_partitions(now(), now() + interval '3 months'); END $$;
 
 -- End of script
@@ -0,0 +1,351 @@
+# db.py
+# Bounded, health-checked psycopg2 connection pool shared by the API and background workers,
+# LeaderLock, which elects one process for background work that must not run twice, and
+# NotificationListener, the LISTEN loop behind cross-process events.
+import abc
+import logging
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger("bharatfoodtrace.db")
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the acquire timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool with min/max size, acquire timeouts and health checks.
+
+    Connections are opened lazily (open() pre-fills min_size). A connection that
+    sat idle for longer than health_check_interval is pinged with SELECT 1 before
+    it is handed out, and broken ones are replaced transparently. putconn() always
+    leaves the connection idle: an open transaction is rolled back, so a handler
+    that raised half-way can never leak a transaction or a connection.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10,
+                 acquire_timeout: float = 5.0, health_check_interval: float = 30.0, connection_factory=None):
+        if min_size > max_size:
+            raise ValueError("min_size cannot be larger than max_size")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.connection_factory = connection_factory  # e.g. metrics.TimedConnection
+        self._idle = []  # (connection, time it was returned)
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # Metrics
+        self._acquired_total = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._exhausted_total = 0
+        self._timeouts_total = 0
+        self._health_check_failures = 0
+
+    def open(self):
+        """Pre-fills the pool up to min_size connections."""
+        with self._cond:
+            self._closed = False
+        conns = [self.getconn() for _ in range(max(self.min_size - self._size, 0))]
+        for conn in conns:
+            self.putconn(conn)
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=self.connection_factory)
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: float = None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        counted_exhaustion = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                if not counted_exhaustion:
+                    self._exhausted_total += 1
+                    counted_exhaustion = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts_total += 1
+                    raise PoolTimeout(f"No database connection available within {timeout}s")
+                self._waiting += 1
+                self._cond.wait(remaining)
+                self._waiting -= 1
+
+        # Connect / health-check outside the lock so other threads are not held up.
+        if conn is not None and not self._is_healthy(conn, idle_since):
+            with self._cond:
+                self._health_check_failures += 1
+            self._discard(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._acquired_total += 1
+            self._wait_seconds_total += waited
+            self._wait_seconds_max = max(self._wait_seconds_max, waited)
+        return conn
+
+    def putconn(self, conn):
+        if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+        with self._cond:
+            if conn.closed or self._closed:
+                self._size -= 1
+                if not conn.closed:
+                    conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        """Closes a broken connection but keeps its slot reserved for a replacement."""
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._size - len(self._idle),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "acquired_total": self._acquired_total,
+                "wait_seconds_total": round(self._wait_seconds_total, 6),
+                "wait_seconds_max": round(self._wait_seconds_max, 6),
+                "exhausted_total": self._exhausted_total,
+                "timeouts_total": self._timeouts_total,
+                "health_check_failures": self._health_check_failures,
+            }
+
+
+class LeaderLock:
+    """Elects one process among all API workers and hosts through a Postgres advisory lock.
+
+    Every process runs one. A background thread holds a dedicated connection and tries
+    pg_try_advisory_lock every `interval` seconds; the process that gets it calls
+    on_elected() and then keeps pinging its session. The lock belongs to that session,
+    so when the leader stops or its connection drops, Postgres releases it, the leader
+    calls on_deposed() and another process takes over within `interval` seconds.
+    """
+
+    def __init__(self, dsn: str, name: str, on_elected, on_deposed, interval: float = 5.0):
+        self.dsn = dsn
+        self.name = name
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.interval = interval
+        self.is_leader = False
+        self.elections = 0
+        self._conn = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except psycopg2.Error as e:
+                logger.warning("Leader lock %s lost its connection: %s", self.name, e)
+                self._release()
+            except Exception:
+                logger.exception("Leader lock %s: on_elected failed, stepping down", self.name)
+                self._release()
+            self._stopping.wait(self.interval)
+        self._release()
+
+    def run_once(self) -> bool:
+        """One election round (or, for the leader, one session check); returns whether this process leads."""
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn)
+            self._conn.autocommit = True
+        cursor = self._conn.cursor()
+        try:
+            if self.is_leader:
+                cursor.execute("SELECT 1")
+            else:
+                cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (self.name,))
+                if cursor.fetchone()[0]:
+                    self.is_leader = True
+                    self.elections += 1
+                    logger.info("Elected leader for %s", self.name)
+                    self.on_elected()
+        finally:
+            cursor.close()
+        return self.is_leader
+
+    def _release(self):
+        """Steps down (if leading) and closes the session, which frees the lock."""
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                self.on_deposed()
+            except Exception:
+                logger.exception("Leader lock %s: on_deposed failed", self.name)
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+    def status(self) -> dict:
+        return {"name": self.name, "leader": self.is_leader, "elections": self.elections}
+
+
+class NotificationListener(abc.ABC):
+    """LISTENs on one channel over a dedicated connection and hands each payload to handle().
+
+    Runs on its own thread and reconnects with backoff. NOTIFYs sent while it was
+    disconnected are lost, so subclasses catch up in on_reconnected().
+    """
+
+    def __init__(self, dsn: str, channel: str, name: str, reconnect_interval: float = 2.0, max_reconnect_interval: float = 30.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.name = name
+        self.reconnect_interval = reconnect_interval
+        self.max_reconnect_interval = max_reconnect_interval
+        self.connected = False
+        self.reconnects = 0
+        self.received = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @abc.abstractmethod
+    def handle(self, payload: str):
+        """Called on the listener thread with the payload of every NOTIFY."""
+
+    def on_reconnected(self):
+        """Called after every reconnect (not the first connect)."""
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        delay = self.reconnect_interval
+        first = True
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {self.channel}")
+                self.connected = True
+                if not first:
+                    self.reconnects += 1
+                    self.on_reconnected()
+                first = False
+                delay = self.reconnect_interval
+                self._listen(conn)
+            except Exception as e:
+                logger.warning("%s disconnected: %s", self.name, e)
+            finally:
+                self.connected = False
+                if conn is not None:
+                    conn.close()
+            if self._stopping.wait(delay):
+                break
+            delay = min(delay * 2, self.max_reconnect_interval)
+
+    def _listen(self, conn):
+        while not self._stopping.is_set():
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self.received += 1
+                self.handle(notify.payload)
+
+    def status(self) -> dict:
+        return {"connected": self.connected, "reconnects": self.reconnects, "received": self.received}
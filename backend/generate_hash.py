@@ -1,7 +1,9 @@
+import os
+
 from passlib.context import CryptContext
 
-# This uses the same settings as main.py
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# This uses the same settings as main.py (auth.PasswordHasher)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=int(os.getenv("PASSWORD_BCRYPT_ROUNDS", 12)))
 password_to_hash = "testpassword"
 hashed_password = pwd_context.hash(password_to_hash)
 
@@ -0,0 +1,163 @@
+# ledger.py
+# Appending events to the per-product hash chains in traceability_log.
+#
+# Every event's current_hash is sha256 over its fields plus the previous event's
+# current_hash. append_events() is the single write path for new events: it groups
+# a list of events per product, locks every chain head in one query, links the
+# events in memory in their original order and writes them with one multi-row
+# INSERT (plus their anchor_outbox rows). The caller owns the transaction.
+#
+# Chain heads live in traceability_heads, one row per product. Appenders lock the
+# head rows FOR UPDATE (always in product_id order, so batches cannot deadlock) and
+# move them forward before committing. Concurrent scans of the same product are
+# therefore serialized and can never fork the chain, while different products never
+# wait on each other. The head row also saves the ORDER BY log_id DESC lookup, and
+# records the product's last known location for recall impact (see recall_impact.py),
+# whose per-batch touchpoints are upserted in the same transaction as the events, as
+# are the analytics rollups (see analytics.py). Locking a head also reads the product's
+# previous event and its manufacturer and batch, which is all the rollups need.
+#
+# traceability_log is partitioned and cannot enforce a unique current_hash, so every
+# write also inserts the hashes into traceability_hashes, whose primary key does.
+import datetime
+import hashlib
+from collections import OrderedDict, namedtuple
+from typing import List, Tuple
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from analytics import record_events
+from anchoring import enqueue_anchors
+from recall_impact import record_touchpoints
+
+EVENT_COLUMNS = ("product_id", "timestamp", "location", "stage", "actor", "status", "notes", "previous_hash", "current_hash")
+
+# A locked chain head: the newest event's hash, time, location and stage, and the product's owner and batch
+ChainHead = namedtuple("ChainHead", "head_hash last_event_at last_location last_stage manufacturer_id batch_number")
+
+
+def event_hash(product_id: str, timestamp: datetime.datetime, location: str, stage: str, actor: str, previous_hash: str) -> str:
+    hash_data = f"{product_id}{timestamp.isoformat()}{location}{stage}{actor}{previous_hash}"
+    return hashlib.sha256(hash_data.encode()).hexdigest()
+
+
+def record_hashes(cursor, log_rows: List[tuple]):
+    """Claims the current_hash of new LOG rows (EVENT_COLUMNS order); a duplicate fails the transaction."""
+    execute_values(
+        cursor,
+        "INSERT INTO traceability_hashes (current_hash, product_id) VALUES %s",
+        [(row[-1], row[0]) for row in log_rows], page_size=len(log_rows)
+    )
+
+
+def init_chain_heads(cursor, log_rows: List[tuple]):
+    """Creates head rows for new products from their genesis LOG rows (EVENT_COLUMNS order)."""
+    execute_values(
+        cursor,
+        "INSERT INTO traceability_heads (product_id, head_hash, event_count, last_location, last_actor, last_stage, last_event_at) VALUES %s",
+        [(row[0], row[-1], 1, row[2], row[4], row[3], row[1]) for row in log_rows], page_size=len(log_rows)
+    )
+
+
+def lock_chain_heads(cursor, product_ids: List[str]) -> dict:
+    """
+    Locks and returns the ChainHead of each product's chain, held until the transaction
+    ends. Products whose head row is missing (rows written before the table existed)
+    get one backfilled from traceability_log. The backfill first rolls back the locks
+    already taken and then relocks every head in one sorted upsert, so lock order holds.
+    """
+    product_ids = sorted(set(product_ids))
+    cursor.execute(
+        """
+        SAVEPOINT chain_heads;
+        SELECT h.product_id, h.head_hash, h.last_event_at, h.last_location, h.last_stage, p.manufacturer_id, p.batch_number
+        FROM traceability_heads h JOIN products p ON p.id = h.product_id
+        WHERE h.product_id = ANY(%s) ORDER BY h.product_id FOR UPDATE OF h
+        """,
+        (product_ids,)
+    )
+    heads = {row[0]: ChainHead(*row[1:]) for row in cursor.fetchall()}
+    if len(heads) == len(product_ids):
+        return heads
+    cursor.execute("ROLLBACK TO SAVEPOINT chain_heads")
+    cursor.execute(
+        """
+        WITH heads AS (
+            INSERT INTO traceability_heads (product_id, head_hash, event_count, last_location, last_actor, last_stage, last_event_at)
+            SELECT product_id, (array_agg(current_hash ORDER BY log_id DESC))[1], count(*),
+                   (array_agg(location ORDER BY log_id DESC))[1], (array_agg(actor ORDER BY log_id DESC))[1],
+                   (array_agg(stage ORDER BY log_id DESC))[1], (array_agg(timestamp ORDER BY log_id DESC))[1]
+            FROM traceability_log WHERE product_id = ANY(%s)
+            GROUP BY product_id ORDER BY product_id
+            ON CONFLICT (product_id) DO UPDATE SET head_hash = traceability_heads.head_hash
+            RETURNING product_id, head_hash, last_event_at, last_location, last_stage
+        )
+        SELECT h.product_id, h.head_hash, h.last_event_at, h.last_location, h.last_stage, p.manufacturer_id, p.batch_number
+        FROM heads h JOIN products p ON p.id = h.product_id
+        """,
+        (product_ids,)
+    )
+    return {row[0]: ChainHead(*row[1:]) for row in cursor.fetchall()}
+
+
+def append_events(cursor, events: list) -> Tuple[List[dict], List[dict]]:
+    """
+    Chains and inserts LocationUpdate-like events. Returns (entries, errors): the
+    inserted rows in input order, and {"index", "product_id", "error"} for events whose
+    product has no chain. Events are queued for anchoring in the same transaction.
+    """
+    by_product = OrderedDict()
+    for index, event in enumerate(events):
+        by_product.setdefault(event.product_id, []).append((index, event))
+
+    heads = lock_chain_heads(cursor, list(by_product.keys()))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    rows, indexes, errors, new_heads, steps = [], [], [], [], []
+    for product_id, product_events in by_product.items():
+        head = heads.get(product_id)
+        if head is None:
+            errors.extend({"index": index, "product_id": product_id, "error": "Product ID not found or has no initial log."}
+                          for index, _ in product_events)
+            continue
+        previous_hash, previous = head.head_hash, (head.last_event_at, head.last_location, head.last_stage)
+        for index, event in product_events:
+            # Distinct, increasing timestamps keep the batch order when the log is sorted by time.
+            timestamp = now + datetime.timedelta(microseconds=index)
+            current_hash = event_hash(product_id, timestamp, event.location, event.stage, event.actor, previous_hash)
+            rows.append((product_id, timestamp, event.location, event.stage, event.actor, event.status, event.notes, previous_hash, current_hash))
+            indexes.append(index)
+            steps.append((head.manufacturer_id, head.batch_number, timestamp, event.location, event.stage, *previous))
+            previous_hash, previous = current_hash, (timestamp, event.location, event.stage)
+        last = rows[-1]
+        new_heads.append((product_id, previous_hash, len(product_events), last[2], last[4], last[3], last[1]))
+
+    if not rows:
+        return [], errors
+
+    record_hashes(cursor, rows)
+    dict_cursor = cursor.connection.cursor(cursor_factory=RealDictCursor)
+    inserted = execute_values(
+        dict_cursor,
+        f"INSERT INTO traceability_log ({', '.join(EVENT_COLUMNS)}) VALUES %s RETURNING *",
+        rows, page_size=len(rows), fetch=True
+    )
+    dict_cursor.close()
+    execute_values(
+        cursor,
+        """
+        UPDATE traceability_heads h
+        SET head_hash = v.head_hash, event_count = h.event_count + v.added, last_location = v.location,
+            last_actor = v.actor, last_stage = v.stage, last_event_at = v.timestamp, updated_at = now()
+        FROM (VALUES %s) AS v (product_id, head_hash, added, location, actor, stage, timestamp)
+        WHERE h.product_id = v.product_id
+        """,
+        new_heads, page_size=len(new_heads)
+    )
+    record_touchpoints(cursor, rows)
+    record_events(cursor, steps)
+    enqueue_anchors(cursor, [row["log_id"] for row in inserted])
+
+    # Return the entries in request order (current_hash is unique, see record_hashes).
+    inserted_by_hash = {row["current_hash"]: dict(row) for row in inserted}
+    order = sorted(range(len(rows)), key=lambda i: indexes[i])
+    return [inserted_by_hash[rows[i][-1]] for i in order], errors
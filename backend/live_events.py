@@ -0,0 +1,231 @@
+# live_events.py
+# Live product tracking: new trace events, recalls and anchoring confirmations pushed to
+# subscribers (GET /live over Server-Sent Events, or the /live/ws WebSocket).
+#
+# Fan-out goes through Postgres LISTEN/NOTIFY, so an event written by any API worker or
+# host reaches the subscribers of every worker:
+#   - the write endpoints call notify_trace_events() / notify_recall() inside their own
+#     transaction (NOTIFY is delivered on commit and dropped on rollback), and the
+#     anchoring / indexer callbacks call notify_products() for confirmations;
+#   - one LiveListener thread per process holds a dedicated LISTEN connection and hands
+#     each payload to the process's Broadcaster on the event loop;
+#   - Broadcaster indexes subscriptions by product id and batch number, so delivering an
+#     event touches only its own subscribers and idle subscribers cost nothing but a
+#     queue each. An event is JSON-encoded once, not once per subscriber.
+# Backpressure is per connection: every subscription has a bounded queue. When a slow
+# client lets it fill up, its queued events are dropped and replaced by one "resync"
+# event (the client re-fetches /product/{id}); other subscribers are unaffected. The
+# listener also sends "resync" to everyone after it had to reconnect, since NOTIFYs sent
+# while it was away are lost. Payloads stay well under the 8000 byte NOTIFY limit: long
+# texts are cut and clients re-fetch the full entry when they need it.
+import asyncio
+import json
+import logging
+from typing import Iterable, List, NamedTuple, Optional, Set
+
+from psycopg2.extras import execute_values
+
+from db import NotificationListener
+
+logger = logging.getLogger("bharatfoodtrace.live")
+
+CHANNEL = "foodtrace_live"
+
+TRACE_NOTIFY_SQL = f"""
+SELECT pg_notify('{CHANNEL}', json_build_object(
+    'type', 'trace', 'product_id', e.product_id, 'batch_number', p.batch_number,
+    'event', json_build_object(
+        'log_id', e.log_id, 'timestamp', e.timestamp, 'location', left(e.location, 500), 'stage', left(e.stage, 255),
+        'actor', left(e.actor, 500), 'status', left(e.status, 255), 'notes', left(e.notes, 1000), 'current_hash', e.current_hash
+    )
+)::text)
+FROM (VALUES %s) AS e (log_id, product_id, timestamp, location, stage, actor, status, notes, current_hash)
+JOIN products p ON p.id = e.product_id
+"""
+
+PRODUCTS_NOTIFY_SQL = f"""
+SELECT pg_notify('{CHANNEL}', json_build_object('type', %(type)s, 'product_id', p.id, 'batch_number', p.batch_number)::text)
+FROM products p
+WHERE p.id = ANY(%(product_ids)s)
+"""
+
+RECALL_NOTIFY_SQL = f"""
+SELECT pg_notify('{CHANNEL}', json_build_object(
+    'type', 'recall', 'batch_number', %(batch_number)s, 'recall_id', %(recall_id)s,
+    'reason', left(%(reason)s, 2000), 'recall_date', %(recall_date)s::timestamptz
+)::text)
+"""
+
+
+# --- Publishing (inside the writer's transaction) ---
+def notify_trace_events(cursor, entries: List[dict]):
+    """One "trace" event per new traceability_log row (as returned by ledger.append_events)."""
+    if entries:
+        execute_values(cursor, TRACE_NOTIFY_SQL, [
+            (e["log_id"], e["product_id"], e["timestamp"], e["location"], e["stage"], e["actor"], e["status"],
+             e["notes"], e["current_hash"]) for e in entries
+        ], template="(%s::bigint, %s, %s::timestamptz, %s, %s, %s, %s, %s, %s)", page_size=len(entries))
+
+
+def notify_products(cursor, event_type: str, product_ids: Iterable[str]):
+    """A bare per-product event, e.g. "anchored" or "confirmed"; subscribers re-fetch what changed."""
+    product_ids = sorted(set(product_ids))
+    if product_ids:
+        cursor.execute(PRODUCTS_NOTIFY_SQL, {"type": event_type, "product_ids": product_ids})
+
+
+def notify_recall(cursor, recall_id: int, batch_number: str, reason: str, recall_date):
+    cursor.execute(RECALL_NOTIFY_SQL, {"recall_id": recall_id, "batch_number": batch_number, "reason": reason,
+                                       "recall_date": recall_date})
+
+
+# --- Subscribing (per process) ---
+class Message(NamedTuple):
+    """An event as sent to clients: its type and its JSON text."""
+    type: str
+    data: str
+
+
+def encode(event: dict) -> Message:
+    return Message(event.get("type", "message"), json.dumps(event, default=str))
+
+
+class Subscription:
+    """One connected client: the products and batches it follows and its bounded queue."""
+
+    def __init__(self, product_ids: Set[str], batch_numbers: Set[str], recall_batches: Set[str], max_queue: int):
+        self.product_ids = product_ids
+        self.batch_numbers = batch_numbers
+        self.recall_batches = recall_batches  # Batches of the followed products: their recalls apply too
+        self.queue = asyncio.Queue(max_queue)
+        self.dropped = 0
+        self.delivered = 0
+
+    def offer(self, message: Message) -> int:
+        """
+        Queues an event without waiting. On overflow the backlog and the event are
+        replaced by one "resync" event; returns how many events were dropped.
+        """
+        try:
+            self.queue.put_nowait(message)
+            self.delivered += 1
+            return 0
+        except asyncio.QueueFull:
+            dropped = self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped += dropped
+            self.queue.put_nowait(encode({"type": "resync", "reason": "overflow", "dropped": dropped}))
+            return dropped
+
+    async def next_message(self, timeout: float) -> Optional[Message]:
+        """The next event, or None after `timeout` seconds without one (time for a keep-alive)."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broadcaster:
+    """Routes events to subscriptions on the event loop; publish_threadsafe() may be called from any thread."""
+
+    def __init__(self, max_subscribers: int = 10000, max_queue: int = 100):
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscriptions: Set[Subscription] = set()
+        self._by_product = {}
+        self._by_batch = {}
+        self._by_recall_batch = {}
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def _index(self, index: dict, keys: Iterable[str], subscription: Subscription, add: bool):
+        for key in keys:
+            if add:
+                index.setdefault(key, set()).add(subscription)
+            else:
+                subscribers = index.get(key)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del index[key]
+
+    def subscribe(self, product_ids: Iterable[str] = (), batch_numbers: Iterable[str] = (),
+                  recall_batches: Iterable[str] = ()) -> Optional[Subscription]:
+        """A new subscription, or None when the process already serves max_subscribers (call on the loop)."""
+        if len(self._subscriptions) >= self.max_subscribers:
+            self.rejected += 1
+            return None
+        subscription = Subscription(set(product_ids), set(batch_numbers), set(recall_batches), self.max_queue)
+        self._subscriptions.add(subscription)
+        self._index(self._by_product, subscription.product_ids, subscription, True)
+        self._index(self._by_batch, subscription.batch_numbers, subscription, True)
+        self._index(self._by_recall_batch, subscription.recall_batches, subscription, True)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.discard(subscription)
+            self._index(self._by_product, subscription.product_ids, subscription, False)
+            self._index(self._by_batch, subscription.batch_numbers, subscription, False)
+            self._index(self._by_recall_batch, subscription.recall_batches, subscription, False)
+
+    def publish(self, event: dict):
+        """Delivers an event to its subscribers (call on the loop)."""
+        self.published += 1
+        if event.get("type") == "resync" and event.get("product_id") is None:
+            targets = self._subscriptions
+        else:
+            batch_number = event.get("batch_number")
+            targets = set(self._by_product.get(event.get("product_id"), ()))
+            targets.update(self._by_batch.get(batch_number, ()))
+            if event.get("type") == "recall":
+                targets.update(self._by_recall_batch.get(batch_number, ()))
+        if targets:
+            message = encode(event)
+            for subscription in targets:
+                self.dropped += subscription.offer(message)
+
+    def publish_threadsafe(self, event: dict):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.publish, event)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscriptions),
+            "max_subscribers": self.max_subscribers,
+            "queue_size": self.max_queue,
+            "products_followed": len(self._by_product),
+            "batches_followed": len(self._by_batch),
+            "published": self.published,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+        }
+
+
+class LiveListener(NotificationListener):
+    """LISTENs on CHANNEL over a dedicated connection and feeds the Broadcaster; reconnects with backoff."""
+
+    def __init__(self, dsn: str, broadcaster: Broadcaster, reconnect_interval: float = 2.0, max_reconnect_interval: float = 30.0):
+        super().__init__(dsn, CHANNEL, "live-listener", reconnect_interval, max_reconnect_interval)
+        self.broadcaster = broadcaster
+
+    def handle(self, payload: str):
+        try:
+            self.broadcaster.publish_threadsafe(json.loads(payload))
+        except ValueError:
+            logger.warning("Ignoring malformed live event payload: %.200s", payload)
+
+    def on_reconnected(self):
+        # Whatever was notified while disconnected is gone
+        self.broadcaster.publish_threadsafe({"type": "resync", "reason": "reconnected"})
+
+
+def format_sse(message: Message) -> str:
+    """One Server-Sent Events message; the event type doubles as the SSE event name."""
+    return f"event: {message.type}\ndata: {message.data}\n\n"
@@ -0,0 +1,424 @@
+# log_partitions.py
+# Monthly partitions of traceability_log and their archival to Parquet.
+#
+# traceability_log is range-partitioned by timestamp into UTC months
+# (traceability_log_YYYY_MM) plus traceability_log_default, which catches events with
+# no partition yet. ensure_traceability_partitions() (database_setup.sql) creates the
+# coming months ahead of time and moves any default rows into their month.
+#
+# archive_partition() retires the oldest month: it streams the partition in
+# (product_id, log_id) order into a zstd-compressed Parquet file, verifying every
+# product's chain segment on the way, records the file in traceability_archives (and
+# which products it holds in traceability_archive_products), moves each product's
+# archived boundary (archived_log_id / archived_hash on traceability_heads) forward and
+# finally detaches and drops the partition. A product's events are chained in log_id
+# and timestamp order, so archiving months oldest-first always archives a prefix of
+# each chain: the live chain then starts at archived_hash instead of "0", and the
+# archived part can still be read (archived_events) and re-verified (verify_archive).
+#
+# Parquet needs the optional 'pyarrow' package (pip install pyarrow); partition
+# maintenance does not. PartitionMaintainer runs both periodically in the API process.
+#
+#   python log_partitions.py --ensure --months-ahead 3
+#   python log_partitions.py --archive-before 2026-01-01 --archive-dir /srv/trace-archive
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from itertools import groupby
+from typing import List, Optional
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from chain_audit import verify_chain
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^traceability_log_(\d{4})_(\d{2})$")
+
+ARCHIVE_COLUMNS = (
+    "log_id", "product_id", "timestamp", "location", "stage", "actor", "status", "notes",
+    "previous_hash", "current_hash", "blockchain_tx_id", "anchor_batch_id", "merkle_root", "merkle_proof",
+)
+
+PARTITIONS_SQL = """
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'traceability_log'::regclass
+ORDER BY c.relname
+"""
+
+ARCHIVE_STREAM_SQL = """
+SELECT l.log_id, l.product_id, l.timestamp, l.location, l.stage, l.actor, l.status, l.notes,
+       l.previous_hash, l.current_hash, l.blockchain_tx_id, l.anchor_batch_id, l.merkle_root, l.merkle_proof,
+       COALESCE(h.archived_hash, '0')
+FROM {partition} l LEFT JOIN traceability_heads h ON h.product_id = l.product_id
+ORDER BY l.product_id, l.log_id
+"""
+
+
+class ArchiveError(Exception):
+    """The partition cannot be archived (yet); nothing was changed."""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Archiving traceability partitions requires the 'pyarrow' package (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+
+def _archive_schema(pa):
+    return pa.schema([
+        ("log_id", pa.int64()), ("product_id", pa.string()), ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("location", pa.string()), ("stage", pa.string()), ("actor", pa.string()), ("status", pa.string()),
+        ("notes", pa.string()), ("previous_hash", pa.string()), ("current_hash", pa.string()),
+        ("blockchain_tx_id", pa.string()), ("anchor_batch_id", pa.int32()), ("merkle_root", pa.string()),
+        ("merkle_proof", pa.string()),  # JSON text
+    ])
+
+
+def month_start(moment: datetime.datetime) -> datetime.datetime:
+    moment = moment.astimezone(datetime.timezone.utc)
+    return datetime.datetime(moment.year, moment.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(month: datetime.datetime, months: int) -> datetime.datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def ensure_partitions(cursor, months_ahead: int = 3, now: Optional[datetime.datetime] = None) -> List[str]:
+    """Creates the partitions of this month and the next `months_ahead`; returns the new ones."""
+    start = month_start(now or datetime.datetime.now(datetime.timezone.utc))
+    cursor.execute("SELECT ensure_traceability_partitions(%s, %s)", (start, add_months(start, months_ahead)))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def list_partitions(cursor) -> List[dict]:
+    """Attached partitions with their month (None for the default partition) and estimated rows."""
+    cursor.execute(PARTITIONS_SQL)
+    partitions = []
+    for name, bound, rows in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        month = datetime.datetime(int(match[1]), int(match[2]), 1, tzinfo=datetime.timezone.utc) if match else None
+        partitions.append({"name": name, "month": month, "bound": bound, "estimated_rows": max(rows, 0)})
+    return sorted(partitions, key=lambda p: (p["month"] is None, p["month"] or 0))
+
+
+def _check_archivable(cursor, partition: dict, now: datetime.datetime):
+    month_partitions = [p for p in list_partitions(cursor) if p["month"] is not None]
+    if partition["month"] is None:
+        raise ArchiveError("The default partition cannot be archived")
+    upper = add_months(partition["month"], 1)
+    if upper > month_start(now):
+        raise ArchiveError(f"{partition['name']} still receives events")
+    if month_partitions[0]["name"] != partition["name"]:
+        raise ArchiveError(f"Archive {month_partitions[0]['name']} first: months are archived oldest-first")
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM traceability_log_default WHERE timestamp < %s)", (upper,))
+    if cursor.fetchone()[0]:
+        raise ArchiveError("traceability_log_default holds older events; run ensure_partitions first")
+    cursor.execute(
+        sql.SQL("SELECT count(*) FROM anchor_outbox o JOIN {} l ON l.log_id = o.log_id").format(sql.Identifier(partition["name"]))
+    )
+    pending = cursor.fetchone()[0]
+    if pending:
+        raise ArchiveError(f"{partition['name']} has {pending} events still waiting to be anchored")
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def archive_partition(conn, name: str, archive_dir: str, chunk_size: int = 50000,
+                      now: Optional[datetime.datetime] = None) -> dict:
+    """
+    Writes partition `name` to <archive_dir>/<name>.parquet, verifying each product's
+    chain segment against its archived boundary, then detaches and drops the partition
+    in one transaction. Raises ArchiveError (leaving everything in place) if the
+    partition is not the oldest finished month, has unanchored events or a broken chain.
+    """
+    pa, pq = _pyarrow()
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    cursor = conn.cursor()
+    try:
+        partition = next((p for p in list_partitions(cursor) if p["name"] == name), None)
+        if partition is None:
+            raise ArchiveError(f"No partition named {name}")
+        # Keeps the rows still (e.g. a late blockchain_tx_id) between the checks, the file and the detach
+        cursor.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(sql.Identifier(name)))
+        _check_archivable(cursor, partition, now)
+    except BaseException:
+        conn.rollback()
+        cursor.close()
+        raise
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(archive_dir, f"{name}.parquet"))
+    schema = _archive_schema(pa)
+    rows_written, products, buffer = 0, [], []
+    stream = conn.cursor(name="archive_partition")
+    stream.itersize = chunk_size
+    stream.execute(sql.SQL(ARCHIVE_STREAM_SQL).format(partition=sql.Identifier(name)))
+    try:
+        with pq.ParquetWriter(path + ".tmp", schema, compression="zstd") as writer:
+            for product_id, rows in groupby(stream, key=lambda row: row[1]):
+                rows = list(rows)
+                chain = [(r[0], r[2], r[3], r[4], r[5], r[8], r[9], r[10], r[12], r[13], False) for r in rows]
+                result = verify_chain(product_id, chain, rows[0][14])
+                if result["problems"]:
+                    problem = result["problems"][0]
+                    raise ArchiveError(f"Chain of {product_id} is broken at log_id {problem['log_id']}: {problem['error']}")
+                products.append((product_id, len(rows), rows[0][0], rows[-1][0], result["head_hash"]))
+                buffer.extend(r[:13] + (None if r[13] is None else json.dumps(r[13]),) for r in rows)
+                if len(buffer) >= chunk_size:
+                    writer.write_table(pa.Table.from_pylist([dict(zip(ARCHIVE_COLUMNS, r)) for r in buffer], schema=schema))
+                    rows_written += len(buffer)
+                    buffer = []
+            if buffer:
+                writer.write_table(pa.Table.from_pylist([dict(zip(ARCHIVE_COLUMNS, r)) for r in buffer], schema=schema))
+                rows_written += len(buffer)
+        stream.close()
+        os.replace(path + ".tmp", path)
+    except BaseException:
+        conn.rollback()
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        raise
+
+    upper = add_months(partition["month"], 1)
+    try:
+        cursor.execute(
+            """
+            INSERT INTO traceability_archives (partition_name, range_start, range_end, uri, row_count, sha256)
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING archive_id
+            """,
+            (name, partition["month"], upper, path, rows_written, _file_sha256(path))
+        )
+        archive_id = cursor.fetchone()[0]
+        for start in range(0, len(products), 10000):
+            page = products[start:start + 10000]
+            execute_values(
+                cursor,
+                """
+                INSERT INTO traceability_archive_products (archive_id, product_id, event_count, first_log_id, last_log_id)
+                VALUES %s
+                """,
+                [(archive_id, *product[:4]) for product in page], page_size=len(page)
+            )
+            # Same lock order as ledger.lock_chain_heads, so appenders and the archiver cannot deadlock
+            cursor.execute(
+                "SELECT 1 FROM traceability_heads WHERE product_id = ANY(%s) ORDER BY product_id FOR UPDATE",
+                ([product[0] for product in page],)
+            )
+            execute_values(
+                cursor,
+                """
+                UPDATE traceability_heads h SET archived_log_id = v.last_log_id, archived_hash = v.head_hash
+                FROM (VALUES %s) AS v (product_id, last_log_id, head_hash)
+                WHERE h.product_id = v.product_id
+                """,
+                [(product[0], product[3], product[4]) for product in page], page_size=len(page)
+            )
+        # DETACH locks the whole log: give up rather than queue every appender behind a long query
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        cursor.execute(sql.SQL("ALTER TABLE traceability_log DETACH PARTITION {}").format(sql.Identifier(name)))
+        cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        os.remove(path)
+        raise
+    finally:
+        cursor.close()
+    return {"archive_id": archive_id, "partition": name, "uri": path, "rows": rows_written, "products": len(products)}
+
+
+def _read_product_rows(pq, uri: str, product_id: str) -> List[dict]:
+    # Files are sorted by product_id, so the filter only decodes the matching row groups
+    table = pq.read_table(uri, filters=[("product_id", "=", product_id)])
+    rows = table.to_pylist()
+    for row in rows:
+        row["merkle_proof"] = None if row["merkle_proof"] is None else json.loads(row["merkle_proof"])
+    return sorted(rows, key=lambda row: row["log_id"])
+
+
+def archived_events(cursor, product_id: str) -> List[dict]:
+    """The product's archived events (ARCHIVE_COLUMNS keys), oldest first; [] if none were archived."""
+    cursor.execute(
+        """
+        SELECT a.uri FROM traceability_archive_products ap
+        JOIN traceability_archives a ON a.archive_id = ap.archive_id
+        WHERE ap.product_id = %s ORDER BY a.range_start
+        """,
+        (product_id,)
+    )
+    uris = [row[0] for row in cursor.fetchall()]
+    if not uris:
+        return []
+    _, pq = _pyarrow()
+    return [row for uri in uris for row in _read_product_rows(pq, uri, product_id)]
+
+
+def archived_chain_rows(events: List[dict]) -> List[tuple]:
+    """archived_events() rows in the chain_audit.CHAIN_ROW_SQL layout, for verify_chain."""
+    return [(e["log_id"], e["timestamp"], e["location"], e["stage"], e["actor"], e["previous_hash"],
+             e["current_hash"], e["blockchain_tx_id"], e["merkle_root"], e["merkle_proof"], False) for e in events]
+
+
+def verify_archive(cursor, archive_id: int) -> dict:
+    """Checks an archive file's checksum and row count against traceability_archives."""
+    cursor.execute("SELECT partition_name, uri, row_count, sha256 FROM traceability_archives WHERE archive_id = %s", (archive_id,))
+    name, uri, row_count, sha256 = cursor.fetchone()
+    _, pq = _pyarrow()
+    problems = []
+    if not os.path.exists(uri):
+        problems.append("file is missing")
+    else:
+        if _file_sha256(uri) != sha256:
+            problems.append("checksum does not match")
+        if pq.ParquetFile(uri).metadata.num_rows != row_count:
+            problems.append("row count does not match")
+    return {"archive_id": archive_id, "partition": name, "uri": uri, "valid": not problems, "problems": problems}
+
+
+def archive_due(conn, archive_dir: str, archive_after_months: int, now: Optional[datetime.datetime] = None) -> List[dict]:
+    """Archives, oldest first, every month partition that ended more than `archive_after_months` ago."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    cutoff = add_months(month_start(now), -archive_after_months)
+    cursor = conn.cursor()
+    due = [p["name"] for p in list_partitions(cursor) if p["month"] is not None and add_months(p["month"], 1) <= cutoff]
+    cursor.close()
+    conn.rollback()
+    return [archive_partition(conn, name, archive_dir, now=now) for name in due]
+
+
+class PartitionMaintainer:
+    """Background thread that keeps partitions created ahead and, if enabled, archives old months.
+
+    Several API processes may run one: partition creation is serialized by an advisory
+    lock inside ensure_traceability_partitions, and archiving a partition twice fails
+    harmlessly because the first run dropped it.
+    """
+
+    def __init__(self, get_conn, release_conn, months_ahead: int = 3, archive_after_months: int = 0,
+                 archive_dir: str = "archive", interval: float = 3600.0):
+        self.get_conn = get_conn
+        self.release_conn = release_conn
+        self.months_ahead = months_ahead
+        self.archive_after_months = archive_after_months  # 0 disables archiving
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.last_run = None
+        self.last_error = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="log-partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                logger.exception("Traceability partition maintenance failed")
+                self.last_error = str(e)
+            self._stopping.wait(self.interval)
+
+    def run_once(self) -> dict:
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor()
+            created = ensure_partitions(cursor, self.months_ahead)
+            conn.commit()
+            cursor.close()
+            archived = []
+            if self.archive_after_months > 0:
+                archived = archive_due(conn, self.archive_dir, self.archive_after_months)
+            self.last_run = datetime.datetime.now(datetime.timezone.utc)
+            return {"created": created, "archived": archived}
+        finally:
+            conn.rollback()
+            self.release_conn(conn)
+
+    def status(self, cursor) -> dict:
+        cursor.execute("SELECT archive_id, partition_name, range_start, range_end, uri, row_count, archived_at FROM traceability_archives ORDER BY range_start")
+        columns = [c[0] for c in cursor.description]
+        archives = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return {
+            "partitions": list_partitions(cursor),
+            "archives": archives,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import psycopg2
+
+    from main import settings
+
+    parser = argparse.ArgumentParser(description="Create, list and archive traceability_log partitions.")
+    parser.add_argument("--ensure", action="store_true", help="Create the partitions of this month and the next --months-ahead")
+    parser.add_argument("--months-ahead", type=int, default=settings.TRACE_PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--archive", metavar="PARTITION", help="Archive one partition, e.g. traceability_log_2026_01")
+    parser.add_argument("--archive-before", type=datetime.date.fromisoformat, metavar="DATE",
+                        help="Archive every partition that ends on or before DATE")
+    parser.add_argument("--archive-dir", default=settings.TRACE_ARCHIVE_DIR)
+    parser.add_argument("--verify-archives", action="store_true", help="Check every archive file's checksum and row count")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.DATABASE_URL)
+    cursor = conn.cursor()
+    failed = False
+    try:
+        if args.ensure:
+            print(f"Created: {', '.join(ensure_partitions(cursor, args.months_ahead)) or 'nothing'}")
+            conn.commit()
+        names = [args.archive] if args.archive else []
+        if args.archive_before:
+            before = datetime.datetime.combine(args.archive_before, datetime.time(), datetime.timezone.utc)
+            names += [p["name"] for p in list_partitions(cursor) if p["month"] and add_months(p["month"], 1) <= before]
+            conn.rollback()
+        for name in names:
+            result = archive_partition(conn, name, args.archive_dir)
+            print(f"Archived {result['partition']}: {result['rows']:,} events of {result['products']:,} products -> {result['uri']}")
+        if args.verify_archives:
+            cursor.execute("SELECT archive_id FROM traceability_archives ORDER BY range_start")
+            for (archive_id,) in cursor.fetchall():
+                result = verify_archive(cursor, archive_id)
+                failed |= not result["valid"]
+                print(f"{result['partition']}: {'ok' if result['valid'] else ', '.join(result['problems'])}")
+        for partition in list_partitions(cursor):
+            print(f"  {partition['name']:<32} ~{partition['estimated_rows']:,} rows")
+    except ArchiveError as e:
+        sys.exit(f"Not archived: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    sys.exit(1 if failed else 0)
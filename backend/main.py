@@ -3,65 +3,189 @@
 import uvicorn
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, status, Response, Query, Request, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, conint
-from typing import List, Optional
+from anyio import to_thread
+from pydantic import BaseModel, Field, conint, field_validator
+from typing import Dict, List, Optional, Union
 import datetime
+import hmac
 import uuid
 import json
-import hashlib
-from passlib.context import CryptContext
+import io
+import csv
+import logging
+import asyncio
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import jwt
 from pydantic_settings import BaseSettings
 import os
 from dotenv import load_dotenv
-from web3 import Web3
+from contextlib import asynccontextmanager, contextmanager
+from analytics import events_per_day, recall_stats, record_recall, stage_stats, transit_stats
+from anchoring import AnchorWorker, BatchAnchorWorker
+from auth import SCOPE_TABLES, PasswordHasher, Principal, PrincipalCache
+from db import ConnectionPool, LeaderLock, PoolTimeout
+from chain_audit import ContractLookup, IndexLookup, verify_product
+from chain_client import ChainClient, ChainUnavailable
+from chain_indexer import ChainIndexer
+from cache import InvalidationListener, MemoryCache, create_cache, facets_key, make_etag, notify_invalidations, product_key, reviews_key
+from ledger import append_events
+from live_events import Broadcaster, LiveListener, encode, format_sse, notify_products, notify_recall, notify_trace_events
+from log_partitions import PartitionMaintainer, archived_chain_rows, archived_events
+from metrics import REGISTRY, CallbackMetric, MetricsMiddleware, TimedConnection, instrument_provider, recent_profile
+from product_ingest import genesis_log_values, import_products, insert_products, new_product_id, parse_records, product_values
+from product_search import InvalidSearch, decode_listing_cursor, listing_cursor, search_facets, search_products
+from profile_cohorts import cohort_document, cohort_summary, count_cohort, normalize_values
+from recall_impact import batch_impact, iter_impact_export, record_consumer
+from review_stats import fetch_review_page, fetch_review_summary, record_review, review_cursor
+from swasth_scoring import Catalog, compile_profile, fetch_ranked_products, rank_safe_products
+from product_queries import fetch_manufacturer_products, fetch_product_json, iter_manufacturer_products
 
 # --- 0. Configuration ---
 load_dotenv()
 
 class Settings(BaseSettings):
     DATABASE_URL: str = os.getenv("DATABASE_URL")
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", 20))
+    DB_POOL_ACQUIRE_TIMEOUT: float = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5.0))
+    DB_POOL_HEALTH_CHECK_INTERVAL: float = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", 30.0))
+    # Blocking work (psycopg2 queries, bcrypt) runs on a bounded thread pool off the event loop
+    BLOCKING_THREADS: int = int(os.getenv("BLOCKING_THREADS", 40))
+    # Response cache for product pages and review lists ("memory" or "redis")
+    CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "memory")
+    CACHE_TTL_SECONDS: float = float(os.getenv("CACHE_TTL_SECONDS", 300))
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+    REDIS_URL: Optional[str] = os.getenv("REDIS_URL")
+    # Swasth scoring keeps the catalog in memory as NumPy columns, reloaded after this many seconds
+    SWASTH_CATALOG_TTL_SECONDS: float = float(os.getenv("SWASTH_CATALOG_TTL_SECONDS", 60))
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-    # Blockchain settings
-    BLOCKCHAIN_RPC_URL: str = os.getenv("BLOCKCHAIN_RPC_URL")
-    CONTRACT_ADDRESS: str = os.getenv("CONTRACT_ADDRESS")
-    SERVER_PRIVATE_KEY: str = os.getenv("SERVER_PRIVATE_KEY")
+    # Accounts behind tokens are re-checked against the database at most this often (see auth.py)
+    AUTH_PRINCIPAL_CACHE_TTL_SECONDS: float = float(os.getenv("AUTH_PRINCIPAL_CACHE_TTL_SECONDS", 60))
+    AUTH_PRINCIPAL_CACHE_MAX_ENTRIES: int = int(os.getenv("AUTH_PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+    # bcrypt cost (2^rounds iterations); stored hashes at another cost are upgraded on login
+    PASSWORD_BCRYPT_ROUNDS: int = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", 12))
+    PASSWORD_HASH_THREADS: int = int(os.getenv("PASSWORD_HASH_THREADS", os.cpu_count() or 2))
+    # Blockchain settings, only needed once anchoring or the chain indexer runs (see chain_client.py)
+    BLOCKCHAIN_RPC_URL: Optional[str] = os.getenv("BLOCKCHAIN_RPC_URL")
+    CONTRACT_ADDRESS: Optional[str] = os.getenv("CONTRACT_ADDRESS")
+    SERVER_PRIVATE_KEY: Optional[str] = os.getenv("SERVER_PRIVATE_KEY")
     CHAIN_ID: int = int(os.getenv("CHAIN_ID", 80001)) # Default to Polygon Mumbai Testnet
+    # Background anchoring worker settings
+    ANCHOR_WORKER_ENABLED: bool = os.getenv("ANCHOR_WORKER_ENABLED", "true").lower() == "true"
+    ANCHOR_BATCH_SIZE: int = int(os.getenv("ANCHOR_BATCH_SIZE", 20))
+    ANCHOR_POLL_INTERVAL: float = float(os.getenv("ANCHOR_POLL_INTERVAL", 2.0))
+    ANCHOR_MAX_ATTEMPTS: int = int(os.getenv("ANCHOR_MAX_ATTEMPTS", 10))
+    ANCHOR_MODE: str = os.getenv("ANCHOR_MODE", "single") # "single" (one tx per event) or "batch" (Merkle root per batch)
+    ANCHOR_MERKLE_BATCH_SIZE: int = int(os.getenv("ANCHOR_MERKLE_BATCH_SIZE", 256))
+    # Local index of the contract's anchoring logs (chain_events)
+    CHAIN_INDEXER_ENABLED: bool = os.getenv("CHAIN_INDEXER_ENABLED", "false").lower() == "true"
+    CHAIN_INDEXER_START_BLOCK: int = int(os.getenv("CHAIN_INDEXER_START_BLOCK", 0)) # e.g. the contract's deployment block
+    CHAIN_INDEXER_BLOCK_STEP: int = int(os.getenv("CHAIN_INDEXER_BLOCK_STEP", 2000))
+    CHAIN_INDEXER_REORG_DEPTH: int = int(os.getenv("CHAIN_INDEXER_REORG_DEPTH", 64))
+    CHAIN_INDEXER_POLL_INTERVAL: float = float(os.getenv("CHAIN_INDEXER_POLL_INTERVAL", 5.0))
+    # Monthly partitions of traceability_log and their archival to Parquet (see log_partitions.py)
+    TRACE_PARTITION_MAINTENANCE_ENABLED: bool = os.getenv("TRACE_PARTITION_MAINTENANCE_ENABLED", "true").lower() == "true"
+    TRACE_PARTITION_MONTHS_AHEAD: int = int(os.getenv("TRACE_PARTITION_MONTHS_AHEAD", 3))
+    TRACE_PARTITION_INTERVAL: float = float(os.getenv("TRACE_PARTITION_INTERVAL", 3600))
+    TRACE_ARCHIVE_AFTER_MONTHS: int = int(os.getenv("TRACE_ARCHIVE_AFTER_MONTHS", 0)) # 0 = never archive automatically
+    TRACE_ARCHIVE_DIR: str = os.getenv("TRACE_ARCHIVE_DIR", "trace-archive")
+    # Request, SQL and RPC instrumentation served at /metrics (see metrics.py)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_PROFILE_TOKEN: Optional[str] = os.getenv("METRICS_PROFILE_TOKEN") # Operator token for /metrics, /system/* and profiles; unset = all off
+    METRICS_PROFILE_HISTORY: int = int(os.getenv("METRICS_PROFILE_HISTORY", 100))
+    # Live trace/recall/anchoring events over SSE and WebSocket, fanned out with LISTEN/NOTIFY (see live_events.py)
+    LIVE_EVENTS_ENABLED: bool = os.getenv("LIVE_EVENTS_ENABLED", "true").lower() == "true"
+    LIVE_MAX_SUBSCRIBERS: int = int(os.getenv("LIVE_MAX_SUBSCRIBERS", 10000)) # Per worker process
+    LIVE_QUEUE_SIZE: int = int(os.getenv("LIVE_QUEUE_SIZE", 100)) # Undelivered events per connection before a resync
+    LIVE_KEEPALIVE_SECONDS: float = float(os.getenv("LIVE_KEEPALIVE_SECONDS", 15))
 
 settings = Settings()
+logger = logging.getLogger("bharatfoodtrace.api")
 
 # --- Blockchain Connection ---
-w3 = Web3(Web3.HTTPProvider(settings.BLOCKCHAIN_RPC_URL))
-server_account = w3.eth.account.from_key(settings.SERVER_PRIVATE_KEY)
-
-# Minimal ABI needed for our contract interaction
-contract_abi = [
-    {"name":"recordTraceEvent","type":"function","stateMutability":"nonpayable","inputs":[{"type":"bytes32","name":"_productBatchId"},{"type":"bytes32","name":"_eventHash"}],"outputs":[]},
-    {"name":"EventRecorded","type":"event","inputs":[{"type":"bytes32","name":"productBatchId","indexed":True},{"type":"bytes32","name":"eventHash","indexed":False},{"type":"address","name":"recorder","indexed":False},{"type":"uint256","name":"timestamp","indexed":False}],"anonymous":False}
-]
-contract = w3.eth.contract(address=settings.CONTRACT_ADDRESS, abi=contract_abi)
+# Built on first use (see chain_client.py): importing this module needs no RPC settings.
+chain = ChainClient(
+    settings.BLOCKCHAIN_RPC_URL,
+    settings.CONTRACT_ADDRESS,
+    settings.SERVER_PRIVATE_KEY,
+    wrap_provider=instrument_provider if settings.METRICS_ENABLED else None,
+)
 
 
 # --- Database Connection ---
-def get_db_connection():
-    conn = psycopg2.connect(settings.DATABASE_URL)
-    return conn
+db_pool = ConnectionPool(
+    settings.DATABASE_URL,
+    min_size=settings.DB_POOL_MIN_SIZE,
+    max_size=settings.DB_POOL_MAX_SIZE,
+    acquire_timeout=settings.DB_POOL_ACQUIRE_TIMEOUT,
+    health_check_interval=settings.DB_POOL_HEALTH_CHECK_INTERVAL,
+    connection_factory=TimedConnection if settings.METRICS_ENABLED else None,
+)
+
+@contextmanager
+def pooled_connection():
+    try:
+        conn = db_pool.getconn()
+    except PoolTimeout:
+        raise HTTPException(status_code=503, detail="Database is busy, please retry")
+    except psycopg2.Error:
+        raise HTTPException(status_code=503, detail="Database is unavailable, please retry")
+    try:
+        yield conn
+    finally:
+        db_pool.putconn(conn)
+
+def get_db():
+    """FastAPI dependency: a pooled connection, always returned to the pool after the request."""
+    with pooled_connection() as conn:
+        yield conn
+
+# --- Response Cache ---
+response_cache = create_cache(settings.CACHE_BACKEND, settings.CACHE_MAX_ENTRIES, settings.CACHE_TTL_SECONDS, settings.REDIS_URL)
+# A per-process cache hears the other workers' writes over NOTIFY (started in lifespan)
+cache_listener = InvalidationListener(settings.DATABASE_URL, response_cache) if isinstance(response_cache, MemoryCache) else None
+
+def broadcast_invalidation(cursor, keys):
+    """Queues `keys` for the other workers' memory caches; the NOTIFY goes out on commit."""
+    if cache_listener is not None:
+        notify_invalidations(cursor, keys)
+
+# --- Swasth Scoring Catalog ---
+# Product writes in this process invalidate it; writes in other workers show up within the TTL.
+swasth_catalog = Catalog(ttl_seconds=settings.SWASTH_CATALOG_TTL_SECONDS)
+
+def cached_json_response(request: Request, key: str, load) -> Optional[Response]:
+    """
+    Serves `key` from the response cache, calling `load()` (JSON bytes, or None for
+    "not found") on a miss. Honors If-None-Match with a bodyless 304.
+    """
+    cached = response_cache.get(key)
+    if cached is None:
+        generation = response_cache.generation(key)  # Before loading: a write from here on wins
+        body = load()
+        if body is None:
+            return None
+        cached = (make_etag(body), body)
+        response_cache.set(key, cached, generation)
+    etag, body = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    client_etags = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in client_etags or "*" in client_etags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # --- 1. Security & Hashing ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+passwords = PasswordHasher(rounds=settings.PASSWORD_BCRYPT_ROUNDS, threads=settings.PASSWORD_HASH_THREADS)
+pwd_context = passwords.context
+principal_cache = PrincipalCache(ttl_seconds=settings.AUTH_PRINCIPAL_CACHE_TTL_SECONDS,
+                                 max_entries=settings.AUTH_PRINCIPAL_CACHE_MAX_ENTRIES)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -72,9 +196,6 @@ def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta]
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def create_hash(data: str):
-    return hashlib.sha256(data.encode()).hexdigest()
-
 # --- 2. Pydantic Data Models ---
 
 # Base Models
@@ -115,6 +236,9 @@ class TraceabilityEntry(BaseModel):
     previous_hash: str
     current_hash: str
     blockchain_tx_id: Optional[str] = None
+    merkle_root: Optional[str] = None
+    merkle_proof: Optional[List[str]] = None
+    onchain_confirmed: Optional[bool] = None # Seen in the local chain_events index (requires the chain indexer)
 
 class ProductRecall(BaseModel):
     recall_id: int
@@ -130,6 +254,11 @@ class Review(BaseModel):
     comment: Optional[str] = None
     review_date: datetime.datetime
 
+class ReviewSummary(BaseModel):
+    review_count: int = 0
+    average_rating: Optional[float] = None
+    histogram: Dict[str, int] = {}
+
 class Product(BaseModel):
     id: str
     name: str
@@ -149,7 +278,62 @@ class Product(BaseModel):
     net_weight: str
     manufacturer_id: str
     recalls: List[ProductRecall] = []
-    reviews: List[Review] = []
+    review_summary: ReviewSummary = ReviewSummary()
+    reviews: List[Review] = []  # the most recent few; GET /reviews/{product_id} pages through all
+
+class ProductSummary(BaseModel):
+    id: str
+    name: str
+    brand: str
+    category: str
+    sub_category: str
+    image_url: str
+    ingredients: List[str]
+    nutrition: ProductNutrition
+    allergens: AllergenInfo
+    certifications: CertificationInfo
+    batch_number: str
+    manufacturing_date: datetime.date
+    expiry_date: datetime.date
+    mrp: float
+    net_weight: str
+    manufacturer_id: str
+    event_count: int
+    latest_event: Optional[TraceabilityEntry] = None
+    recall_count: int
+    review_count: int
+    average_rating: Optional[float] = None
+
+class ProductSearchHit(BaseModel):
+    id: str
+    name: str
+    brand: str
+    category: str
+    sub_category: str
+    image_url: str
+    ingredients: List[str]
+    nutrition: ProductNutrition
+    allergens: AllergenInfo
+    certifications: CertificationInfo
+    batch_number: str
+    manufacturing_date: datetime.date
+    expiry_date: datetime.date
+    mrp: float
+    net_weight: str
+    manufacturer_id: str
+    score: Optional[float] = None # Text relevance, only with sort=relevance
+
+class FacetBucket(BaseModel):
+    value: Optional[str] = None
+    count: int
+
+class SearchFacets(BaseModel):
+    total: int
+    category: List[FacetBucket] = []
+    sub_category: List[FacetBucket] = []
+    brand: List[FacetBucket] = []
+    organic: int
+    free_from: Dict[str, int] = {}
 
 # Create/Input Models
 class ProductCreate(BaseModel):
@@ -179,6 +363,24 @@ class SwasthWallet(BaseModel):
     activity_level: Optional[str] = None
     goals: List[str] = []
 
+    @field_validator("allergies", "diet", "conditions", "goals")
+    @classmethod
+    def normalize_lists(cls, values, info):
+        # Stored normalized so cohort counts (profile_cohorts.py) can match with @>
+        return normalize_values(info.field_name, values)
+
+class SwasthWalletPatch(SwasthWallet):
+    """A partial SwasthWallet for PATCH /users/me: only the fields sent are changed."""
+    allergies: Optional[List[str]] = None
+    diet: Optional[List[str]] = None
+    conditions: Optional[List[str]] = None
+    goals: Optional[List[str]] = None
+
+    @field_validator("allergies", "diet", "conditions", "goals")
+    @classmethod
+    def normalize_lists(cls, values, info):
+        return normalize_values(info.field_name, values or [])
+
 class User(BaseModel):
     email: str
     profile: SwasthWallet
@@ -199,6 +401,116 @@ class LocationUpdate(BaseModel):
     notes: Optional[str] = None
     actor: str = "Supply Chain Partner"
 
+class TraceabilityBatch(BaseModel):
+    events: List[LocationUpdate] = Field(..., min_length=1, max_length=5000)
+
+class TraceabilityBatchError(BaseModel):
+    index: int
+    product_id: str
+    error: str
+
+class TraceabilityBatchResult(BaseModel):
+    inserted: int
+    entries: List[TraceabilityEntry]
+    errors: List[TraceabilityBatchError] = []
+
+class ChainProblem(BaseModel):
+    log_id: int
+    error: str
+
+class ChainVerification(BaseModel):
+    product_id: str
+    valid: bool
+    events: int
+    anchored: int
+    pending: int
+    onchain_checked: bool
+    head_hash: str
+    problems: List[ChainProblem] = []
+
+class ImpactLocation(BaseModel):
+    location: Optional[str] = None
+    actor: Optional[str] = None
+    stage: Optional[str] = None
+    product_count: int
+    last_event_at: Optional[datetime.datetime] = None
+
+class ImpactTouchpoint(BaseModel):
+    location: str
+    actor: str
+    last_stage: str
+    first_seen: datetime.datetime
+    last_seen: datetime.datetime
+    event_count: int
+
+class ImpactConsumer(BaseModel):
+    consumer_email: str
+    first_seen: datetime.datetime
+    last_seen: datetime.datetime
+    review_count: int
+
+class RecallImpact(BaseModel):
+    batch_number: str
+    product_count: int
+    last_known_locations: List[ImpactLocation]
+    touchpoints: List[ImpactTouchpoint]
+    consumers: List[ImpactConsumer]
+
+class CohortCount(BaseModel):
+    count: int
+    filters: Dict[str, List[str]]
+
+class CohortSummary(BaseModel):
+    total: int
+    allergies: Dict[str, int]
+    conditions: Dict[str, int]
+    diet: Dict[str, int]
+    goals: Dict[str, int]
+
+class SafeProductHit(BaseModel):
+    id: str
+    name: str
+    brand: str
+    category: str
+    sub_category: str
+    image_url: str
+    ingredients: List[str]
+    nutrition: ProductNutrition
+    allergens: AllergenInfo
+    certifications: CertificationInfo
+    batch_number: str
+    manufacturing_date: datetime.date
+    expiry_date: datetime.date
+    mrp: float
+    net_weight: str
+    manufacturer_id: str
+    swasth_score: float # 0-100, lowered by warnings, raised or lowered by goals
+    warnings: List[str] = [] # e.g. "high_sodium" for a consumer with high blood pressure
+
+class StageStats(BaseModel):
+    stage: str
+    event_count: int
+    dwell_count: int # Events followed by another event of the product in the range
+    avg_dwell_seconds: Optional[float] = None # Time from an event in this stage to the product's next event
+    max_dwell_seconds: Optional[float] = None
+
+class TransitStats(BaseModel):
+    from_location: str
+    to_location: str
+    trip_count: int
+    avg_seconds: float
+    min_seconds: float
+    max_seconds: float
+
+class DailyEventCount(BaseModel):
+    day: datetime.date
+    event_count: int
+
+class BrandRecallStats(BaseModel):
+    brand: str
+    recall_count: int
+    product_count: int
+
 class ProductRecallCreate(BaseModel):
     batch_number: str
     reason: str
@@ -210,10 +522,145 @@ class ReviewCreate(BaseModel):
 
 
 # --- 3. FastAPI App Initialization ---
+# Nothing below connects at import: the pool is filled, the chain client built and the
+# background workers started in lifespan, once per worker process (see serve.py).
+def on_products_changed(event_type: str):
+    """Callback for the background workers: drop cached product pages and tell live subscribers."""
+    def callback(product_ids):
+        keys = [product_key(pid) for pid in product_ids]
+        response_cache.invalidate(*keys)
+        if settings.LIVE_EVENTS_ENABLED or cache_listener is not None:
+            with db_pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    broadcast_invalidation(cursor, keys)
+                    if settings.LIVE_EVENTS_ENABLED:
+                        notify_products(cursor, event_type, product_ids)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+    return callback
+
+def create_anchor_worker():
+    anchor_worker_class = BatchAnchorWorker if settings.ANCHOR_MODE == "batch" else AnchorWorker
+    return anchor_worker_class(
+        get_conn=db_pool.getconn,
+        release_conn=db_pool.putconn,
+        w3=chain.w3,
+        contract=chain.contract,
+        account=chain.account,
+        chain_id=settings.CHAIN_ID,
+        batch_size=settings.ANCHOR_MERKLE_BATCH_SIZE if settings.ANCHOR_MODE == "batch" else settings.ANCHOR_BATCH_SIZE,
+        poll_interval=settings.ANCHOR_POLL_INTERVAL,
+        max_attempts=settings.ANCHOR_MAX_ATTEMPTS,
+        on_anchored=on_products_changed("anchored"),
+    )
+
+def create_chain_indexer():
+    return ChainIndexer(
+        get_conn=db_pool.getconn,
+        release_conn=db_pool.putconn,
+        w3=chain.w3,
+        contract=chain.contract,
+        start_block=settings.CHAIN_INDEXER_START_BLOCK,
+        block_step=settings.CHAIN_INDEXER_BLOCK_STEP,
+        reorg_depth=settings.CHAIN_INDEXER_REORG_DEPTH,
+        poll_interval=settings.CHAIN_INDEXER_POLL_INTERVAL,
+        on_indexed=on_products_changed("confirmed"),
+    )
+
+# Set while this process is the chain leader, when enabled and the chain settings are valid
+anchor_worker: Optional[AnchorWorker] = None
+chain_indexer: Optional[ChainIndexer] = None
+
+def start_chain_workers():
+    """
+    Runs in the one process elected by chain_leader. All processes sign with the same
+    SERVER_PRIVATE_KEY and AnchorWorker counts nonces locally, so a second anchoring
+    process would reuse nonces; the indexer would only duplicate work.
+    """
+    global anchor_worker, chain_indexer
+    if settings.ANCHOR_WORKER_ENABLED:
+        anchor_worker = create_anchor_worker()
+        anchor_worker.start()
+    if settings.CHAIN_INDEXER_ENABLED:
+        chain_indexer = create_chain_indexer()
+        chain_indexer.start()
+
+def stop_chain_workers():
+    global anchor_worker, chain_indexer
+    for worker in (anchor_worker, chain_indexer):
+        if worker is not None:
+            worker.stop()
+    anchor_worker = chain_indexer = None
+
+def wake_anchor_worker():
+    """Starts an anchoring pass now if this process leads; a leader elsewhere polls every ANCHOR_POLL_INTERVAL."""
+    worker = anchor_worker
+    if worker is not None:
+        worker.notify()
+
+chain_leader = LeaderLock(settings.DATABASE_URL, "foodtrace_chain_workers", start_chain_workers, stop_chain_workers)
+# "starting" until lifespan startup completes, "draining" once shutdown begins
+lifecycle = {"state": "starting", "started_at": None, "startup_seconds": None, "startup_errors": []}
+
+partition_maintainer = PartitionMaintainer(
+    get_conn=db_pool.getconn,
+    release_conn=db_pool.putconn,
+    months_ahead=settings.TRACE_PARTITION_MONTHS_AHEAD,
+    archive_after_months=settings.TRACE_ARCHIVE_AFTER_MONTHS,
+    archive_dir=settings.TRACE_ARCHIVE_DIR,
+    interval=settings.TRACE_PARTITION_INTERVAL,
+)
+
+live_broadcaster = Broadcaster(max_subscribers=settings.LIVE_MAX_SUBSCRIBERS, max_queue=settings.LIVE_QUEUE_SIZE)
+live_listener = LiveListener(settings.DATABASE_URL, live_broadcaster)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Fail-soft startup: an unreachable database or invalid chain settings are logged
+    and reported by /health/ready instead of keeping the worker from starting. The
+    pool reconnects on demand, and events queue in anchor_outbox until anchoring runs.
+    """
+    started = datetime.datetime.now(datetime.timezone.utc)
+    errors = []
+    to_thread.current_default_thread_limiter().total_tokens = settings.BLOCKING_THREADS
+    try:
+        await to_thread.run_sync(db_pool.open)
+    except Exception as e:
+        logger.error("Database unavailable at startup, connecting on demand: %s", e)
+        errors.append(f"database: {e}")
+    try:
+        if settings.ANCHOR_WORKER_ENABLED or settings.CHAIN_INDEXER_ENABLED:
+            chain.contract  # Validates the settings here; the workers start once this process is elected
+            chain_leader.start()
+    except ChainUnavailable as e:
+        logger.error("%s; anchoring and the chain indexer stay off, events queue in anchor_outbox", e)
+        errors.append(f"chain: {e}")
+    if cache_listener is not None:
+        cache_listener.start()
+    if settings.TRACE_PARTITION_MAINTENANCE_ENABLED:
+        partition_maintainer.start()
+    if settings.LIVE_EVENTS_ENABLED:
+        live_broadcaster.bind(asyncio.get_running_loop())
+        live_listener.start()
+    lifecycle.update(state="ready", started_at=started, startup_errors=errors,
+                     startup_seconds=round((datetime.datetime.now(datetime.timezone.utc) - started).total_seconds(), 3))
+    yield
+    lifecycle["state"] = "draining"
+    for worker in filter(None, (chain_leader, cache_listener, partition_maintainer, live_listener)):
+        await to_thread.run_sync(worker.stop)
+    db_pool.closeall()
+
 app = FastAPI(
     title="Bharat FoodTrace API",
     description="The complete backend for the Bharat FoodTrace ecosystem.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -222,11 +669,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing", "X-Profile-Id"],
 )
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, profile_token=settings.METRICS_PROFILE_TOKEN,
+                       profile_history=settings.METRICS_PROFILE_HISTORY)
 
 # --- 4. Authentication & User Management ---
+# Handlers that query Postgres or run bcrypt are plain `def`: FastAPI runs them on the
+# bounded thread pool (BLOCKING_THREADS), so a slow query never stalls the event loop.
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> dict:
+    """The verified claims of the bearer token (sub, scope and, for new tokens, uid)."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -234,197 +688,185 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        return username
     except (jwt.PyJWTError, AttributeError):
         raise credentials_exception
+    if payload.get("sub") is None:
+        raise credentials_exception
+    return payload
 
-@app.post("/token", response_model=Token, tags=["Authentication"])
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT id, hashed_password FROM manufacturers WHERE email = %s", (form_data.username,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    if not user or not verify_password(form_data.password, user['hashed_password']):
+async def get_current_user(claims: dict = Depends(get_token_claims)) -> str:
+    return claims["sub"]
+
+def get_current_manufacturer(claims: dict = Depends(get_token_claims), conn=Depends(get_db)) -> Principal:
+    """
+    The calling manufacturer, with its id from the token. The account is confirmed
+    through principal_cache, so most requests run no query for it.
+    """
+    if claims.get("scope", "manufacturer") != "manufacturer":
+        raise HTTPException(status_code=403, detail="Invalid manufacturer credentials")
+    cursor = conn.cursor()
+    try:
+        principal = principal_cache.resolve(cursor, "manufacturer", claims["sub"], claims.get("uid"))
+    finally:
+        cursor.close()
+    if principal is None:
+        raise HTTPException(status_code=403, detail="Invalid manufacturer credentials")
+    return principal
+
+def _fetch_credentials(scope: str, email: str) -> Optional[tuple]:
+    table = SCOPE_TABLES[scope]
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id, hashed_password FROM {table} WHERE email = %s", (email,))
+        row = cursor.fetchone()
+        cursor.close()
+    return row
+
+def _store_rehash(scope: str, account_id: str, hashed_password: str):
+    table = SCOPE_TABLES[scope]
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"UPDATE {table} SET hashed_password = %s WHERE id = %s", (hashed_password, account_id))
+        conn.commit()
+        cursor.close()
+
+async def _login(scope: str, form_data: OAuth2PasswordRequestForm) -> dict:
+    """
+    Login handlers are async so the connection is returned before bcrypt runs; bcrypt
+    itself waits for one of PASSWORD_HASH_THREADS instead of a BLOCKING_THREADS thread.
+    """
+    user = await to_thread.run_sync(_fetch_credentials, scope, form_data.username)
+    matches, new_hash = await passwords.verify(form_data.password, user[1]) if user else (False, None)
+    if not matches:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": form_data.username, "scope": "manufacturer"})
+    if new_hash:
+        await to_thread.run_sync(_store_rehash, scope, user[0], new_hash)
+    access_token = create_access_token(data={"sub": form_data.username, "scope": scope, "uid": user[0]})
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/token", response_model=Token, tags=["Authentication"])
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+    return await _login("manufacturer", form_data)
+
+def _insert_consumer(email: str, hashed_password: str, profile: SwasthWallet) -> bool:
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO consumers (id, email, hashed_password, profile) VALUES (%s, %s, %s, %s::jsonb) ON CONFLICT (email) DO NOTHING",
+            (str(uuid.uuid4()), email, hashed_password, profile.model_dump_json())
+        )
+        inserted = cursor.rowcount == 1
+        conn.commit()
+        cursor.close()
+    return inserted
+
 @app.post("/users/register", response_model=User, status_code=status.HTTP_201_CREATED, tags=["Consumer Management"])
 async def register_consumer(form_data: UserRegister):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT id FROM consumers WHERE email = %s", (form_data.email,))
-    if cursor.fetchone():
-        cursor.close()
-        conn.close()
+    hashed_password = await passwords.hash(form_data.password)
+    empty_profile = SwasthWallet()
+    if not await to_thread.run_sync(_insert_consumer, form_data.email, hashed_password, empty_profile):
         raise HTTPException(status_code=400, detail="Email already registered")
-
-    user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(form_data.password)
-    empty_profile = SwasthWallet().model_dump_json()
-
-    cursor.execute(
-        "INSERT INTO consumers (id, email, hashed_password, profile_json) VALUES (%s, %s, %s, %s)",
-        (user_id, form_data.email, hashed_password, empty_profile)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return User(email=form_data.email, profile=json.loads(empty_profile))
+    return User(email=form_data.email, profile=empty_profile)
 
 @app.post("/users/token", response_model=Token, tags=["Authentication"])
 async def login_consumer_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT id, hashed_password FROM consumers WHERE email = %s", (form_data.username,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    if not user or not verify_password(form_data.password, user['hashed_password']):
-        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    return await _login("consumer", form_data)
 
-    access_token = create_access_token(data={"sub": form_data.username, "scope": "consumer"})
-    return {"access_token": access_token, "token_type": "bearer"}
+# The stored profile is already a validated SwasthWallet, so Postgres renders the User document
+USER_DOCUMENT_SQL = "json_build_object('email', email, 'profile', profile)::text"
 
 @app.get("/users/me", response_model=User, tags=["Consumer Management"])
-async def read_users_me(current_user_email: str = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT profile_json FROM consumers WHERE email = %s", (current_user_email,))
+def read_users_me(current_user_email: str = Depends(get_current_user), conn=Depends(get_db)):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {USER_DOCUMENT_SQL} FROM consumers WHERE email = %s", (current_user_email,))
     row = cursor.fetchone()
     cursor.close()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
-
-    profile_data = json.loads(row['profile_json'])
-    return User(email=current_user_email, profile=profile_data)
+    return Response(content=row[0], media_type="application/json")
 
 @app.put("/users/me", response_model=User, tags=["Consumer Management"])
-async def update_users_me(wallet: SwasthWallet, current_user_email: str = Depends(get_current_user)):
-    conn = get_db_connection()
+def update_users_me(wallet: SwasthWallet, current_user_email: str = Depends(get_current_user), conn=Depends(get_db)):
     cursor = conn.cursor()
-    wallet_json = wallet.model_dump_json()
-    cursor.execute("UPDATE consumers SET profile_json = %s WHERE email = %s", (wallet_json, current_user_email))
+    cursor.execute(
+        f"UPDATE consumers SET profile = %s::jsonb WHERE email = %s RETURNING {USER_DOCUMENT_SQL}",
+        (wallet.model_dump_json(), current_user_email)
+    )
+    row = cursor.fetchone()
     conn.commit()
     cursor.close()
-    conn.close()
-    return User(email=current_user_email, profile=wallet)
-
-# --- 5. Product & Traceability Endpoints ---
-
-async def _get_full_product_details(product_id: str, conn) -> Optional[Product]:
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Fetch Product
-    cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product_row = cursor.fetchone()
-    if not product_row:
-        return None
-
-    # Fetch Traceability
-    cursor.execute("SELECT * FROM traceability_log WHERE product_id = %s ORDER BY timestamp ASC", (product_id,))
-    log_rows = cursor.fetchall()
-    traceability_log = [TraceabilityEntry(**row) for row in log_rows]
-
-    # Fetch Recalls
-    cursor.execute("SELECT * FROM product_recalls WHERE batch_number = %s", (product_row['batch_number'],))
-    recall_rows = cursor.fetchall()
-    recalls = [ProductRecall(**row) for row in recall_rows]
-
-    # Fetch Reviews
-    cursor.execute("SELECT * FROM reviews WHERE product_id = %s ORDER BY review_date DESC", (product_id,))
-    review_rows = cursor.fetchall()
-    reviews = [Review(**row) for row in review_rows]
-
-    cursor.close()
+    if not row:
+        raise HTTPException(status_code=404, detail="User not found")
+    return Response(content=row[0], media_type="application/json")
 
-    # Assemble the final Product object
-    product_data = dict(product_row)
-    product_data['ingredients'] = [i.strip() for i in product_row['ingredients'].split(',')]
-    product_data['nutrition'] = ProductNutrition(
-        sodium=product_row['sodium'], sugar=product_row['sugar'], calories_per_100g=product_row['calories_per_100g'],
-        protein_g=product_row['protein_g'], carbs_g=product_row['carbs_g'], fat_g=product_row['fat_g'], fiber_g=product_row['fiber_g']
-    )
-    product_data['allergens'] = AllergenInfo(
-        contains_peanuts=product_row['contains_peanuts'], contains_tree_nuts=product_row['contains_tree_nuts'],
-        contains_milk=product_row['contains_milk'], contains_eggs=product_row['contains_eggs'],
-        contains_fish=product_row['contains_fish'], contains_shellfish=product_row['contains_shellfish'],
-        contains_wheat=product_row['contains_wheat'], contains_soy=product_row['contains_soy']
-    )
-    product_data['certifications'] = CertificationInfo(
-        organic_certified=product_row['organic_certified'], fssai_license=product_row['fssai_license'], iso_certification=product_row['iso_certification']
+@app.patch("/users/me", response_model=User, tags=["Consumer Management"])
+def patch_users_me(changes: SwasthWalletPatch, current_user_email: str = Depends(get_current_user), conn=Depends(get_db)):
+    """Updates only the Swasth Wallet fields sent; lists are replaced as a whole."""
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE consumers SET profile = profile || %s::jsonb WHERE email = %s RETURNING {USER_DOCUMENT_SQL}",
+        (changes.model_dump_json(exclude_unset=True), current_user_email)
     )
-    product_data['traceability'] = traceability_log
-    product_data['recalls'] = recalls
-    product_data['reviews'] = reviews
-
-    return Product(**product_data)
+    row = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    if not row:
+        raise HTTPException(status_code=404, detail="User not found")
+    return Response(content=row[0], media_type="application/json")
+
+@app.get("/users/me/safe-products", response_model=List[SafeProductHit], tags=["Consumer Management"])
+def get_safe_products(
+    category: Optional[str] = None,
+    strict: bool = Query(False, description="Also leave out products with warnings"),
+    min_score: float = Query(0, ge=0, le=100),
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    current_user_email: str = Depends(get_current_user),
+    conn=Depends(get_db),
+):
+    """
+    Products from the whole catalog that are safe for the consumer's Swasth Wallet: no
+    allergens they avoid (wheat with celiac disease), nothing against their diet, not
+    recalled or expired. Best `swasth_score` first; the cursor for the next page is sent
+    in the X-Next-Cursor header (pass it as `after`).
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT profile::text FROM consumers WHERE email = %s", (current_user_email,))
+    row = cursor.fetchone()
+    if not row:
+        cursor.close()
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        ranked, next_cursor = rank_safe_products(swasth_catalog.snapshot(cursor), compile_profile(row[0]), limit, after,
+                                                 category, strict, min_score)
+    except InvalidSearch as e:
+        cursor.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    documents = fetch_ranked_products(cursor, ranked)
+    cursor.close()
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(content="[" + ",".join(documents) + "]", media_type="application/json", headers=headers)
 
+# --- 5. Product & Traceability Endpoints ---
 
 @app.post("/products/add", response_model=Product, status_code=status.HTTP_201_CREATED, tags=["Products"])
-async def add_product(product_data: ProductCreate, current_user_email: str = Depends(get_current_user)):
-    conn = get_db_connection()
+def add_product(product_data: ProductCreate, manufacturer: Principal = Depends(get_current_manufacturer), conn=Depends(get_db)):
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute("SELECT id FROM manufacturers WHERE email = %s", (current_user_email,))
-    manufacturer_id_tuple = cursor.fetchone()
-    if not manufacturer_id_tuple:
-        cursor.close()
-        conn.close()
-        raise HTTPException(status_code=403, detail="Invalid manufacturer credentials")
-
-    manufacturer_id = manufacturer_id_tuple['id']
-    product_id = f"BFT_{product_data.batch_number.replace(' ','')}_{uuid.uuid4().hex[:6].upper()}"
+    product_id = new_product_id(product_data.batch_number)
 
     try:
-        cursor.execute(
-            """
-            INSERT INTO products (
-                id, name, brand, category, sub_category, image_url, ingredients,
-                sodium, sugar, calories_per_100g, protein_g, carbs_g, fat_g, fiber_g,
-                contains_peanuts, contains_tree_nuts, contains_milk, contains_eggs,
-                contains_fish, contains_shellfish, contains_wheat, contains_soy,
-                organic_certified, fssai_license, iso_certification,
-                batch_number, manufacturing_date, expiry_date, mrp, net_weight, manufacturer_id
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                product_id, product_data.name, product_data.brand, product_data.category, product_data.sub_category,
-                product_data.image_url, ','.join(product_data.ingredients),
-                product_data.nutrition.sodium, product_data.nutrition.sugar, product_data.nutrition.calories_per_100g,
-                product_data.nutrition.protein_g, product_data.nutrition.carbs_g, product_data.nutrition.fat_g,
-                product_data.nutrition.fiber_g,
-                product_data.allergens.contains_peanuts, product_data.allergens.contains_tree_nuts,
-                product_data.allergens.contains_milk, product_data.allergens.contains_eggs,
-                product_data.allergens.contains_fish, product_data.allergens.contains_shellfish,
-                product_data.allergens.contains_wheat, product_data.allergens.contains_soy,
-                product_data.certifications.organic_certified, product_data.certifications.fssai_license,
-                product_data.certifications.iso_certification,
-                product_data.batch_number, product_data.manufacturing_date, product_data.expiry_date,
-                product_data.mrp, product_data.net_weight, manufacturer_id
-            )
-        )
-
-        # Create the genesis traceability log
+        # The product row plus its genesis traceability log
         timestamp = datetime.datetime.now(datetime.timezone.utc)
-        first_event_location = f"Manufacturing Unit, {product_data.brand}"
-        genesis_hash_data = f"{product_id}{timestamp.isoformat()}{first_event_location}manufacturing{current_user_email}0"
-        genesis_hash = create_hash(genesis_hash_data)
-
-        cursor.execute(
-            'INSERT INTO traceability_log (product_id, timestamp, location, stage, actor, status, notes, previous_hash, current_hash) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
-            (product_id, timestamp, first_event_location, "manufacturing", current_user_email, "Completed", "Product created.", "0", genesis_hash)
+        insert_products(
+            cursor,
+            [product_values(product_id, product_data, manufacturer.account_id)],
+            [genesis_log_values(product_id, product_data.brand, manufacturer.email, timestamp)]
         )
+        broadcast_invalidation(cursor, [product_key(product_id)])
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -432,141 +874,375 @@ async def add_product(product_data: ProductCreate, current_user_email: str = Dep
     finally:
         cursor.close()
 
-    product_details = await _get_full_product_details(product_id, conn)
-    conn.close()
-    return product_details
-
+    response_cache.invalidate(product_key(product_id))
+    swasth_catalog.invalidate()
+    return Response(content=fetch_product_json(conn, product_id), media_type="application/json", status_code=status.HTTP_201_CREATED)
+
+
+@app.post("/products/bulk", tags=["Products"])
+def add_products_bulk(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """
+    Imports a catalogue of ProductCreate records from a CSV (flat columns as in the
+    products table, comma-separated ingredients) or NDJSON upload. Rows are validated
+    and inserted in chunks; invalid rows are reported and skipped, the rest commit.
+    """
+    fmt = format or ("csv" if (file.filename or "").lower().endswith(".csv") or file.content_type == "text/csv" else "ndjson")
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    try:
+        report = import_products(conn, parse_records(stream, fmt), ProductCreate.model_validate,
+                                 manufacturer.account_id, manufacturer.email, chunk_size)
+        swasth_catalog.invalidate()
+        return report
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read upload: {e}")
+    finally:
+        stream.detach()
+
+
+def _load_product(product_id: str) -> Optional[bytes]:
+    # Assembled and serialized by Postgres in one round-trip; sent as-is.
+    with pooled_connection() as conn:
+        product_json = fetch_product_json(conn, product_id)
+    return product_json.encode() if product_json else None
+
+def _load_product_with_archive(product_id: str) -> Optional[bytes]:
+    # Archived events come from Parquet files, prepended to the live traceability list
+    with pooled_connection() as conn:
+        product_json = fetch_product_json(conn, product_id)
+        if not product_json:
+            return None
+        cursor = conn.cursor()
+        events = archived_events(cursor, product_id)
+        confirmed = set()
+        if events:
+            cursor.execute(
+                "SELECT event_hash FROM chain_events WHERE event_hash = ANY(%s)",
+                (list({e["merkle_root"] or e["current_hash"] for e in events}),)
+            )
+            confirmed = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+    product = json.loads(product_json)
+    archived = [
+        TraceabilityEntry(**event, onchain_confirmed=(event["merkle_root"] or event["current_hash"]) in confirmed).model_dump(mode="json")
+        for event in events
+    ]
+    product["traceability"] = archived + product["traceability"]
+    return json.dumps(product).encode()
 
 @app.get("/product/{product_id}", response_model=Product, tags=["Products"])
-async def get_product(product_id: str):
-    conn = get_db_connection()
-    product = await _get_full_product_details(product_id, conn)
-    conn.close()
-    if not product:
+def get_product(
+    product_id: str,
+    request: Request,
+    include_archived: bool = Query(False, description="Also return traceability events archived out of the database"),
+):
+    if include_archived:
+        body = _load_product_with_archive(product_id)
+        response = Response(content=body, media_type="application/json") if body else None
+    else:
+        response = cached_json_response(request, product_key(product_id), lambda: _load_product(product_id))
+    if response is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
-
-@app.get("/manufacturer/products", response_model=List[Product], tags=["Products"])
-async def get_manufacturer_products(current_user_email: str = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute("SELECT id FROM manufacturers WHERE email = %s", (current_user_email,))
-    manufacturer_id_tuple = cursor.fetchone()
-    if not manufacturer_id_tuple:
-        cursor.close()
-        conn.close()
-        raise HTTPException(status_code=403, detail="Invalid manufacturer")
-
-    manufacturer_id = manufacturer_id_tuple['id']
-    cursor.execute("SELECT id FROM products WHERE manufacturer_id = %s", (manufacturer_id,))
-    product_ids = [row['id'] for row in cursor.fetchall()]
-    cursor.close()
-
-    products = []
-    for product_id in product_ids:
-        product = await _get_full_product_details(product_id, conn)
-        if product:
-            products.append(product)
+    return response
+
+@app.get("/manufacturer/products", response_model=Union[List[Product], List[ProductSummary]], tags=["Products"])
+def get_manufacturer_products(
+    view: str = Query("full", pattern="^(full|summary)$"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """
+    Lists the manufacturer's products ordered by id. `view=summary` skips the full
+    traceability and review lists. With `limit`, one keyset page is returned and the
+    cursor for the next one is sent in the X-Next-Cursor header (pass it as `after`).
+    `format=ndjson` streams one product per line with bounded memory.
+    """
+    manufacturer_id = manufacturer.account_id
+    try:
+        after = decode_listing_cursor(after) if after else None
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        def stream():
+            # The request's connection is released when the handler returns, so the stream holds its own.
+            with db_pool.connection() as stream_conn:
+                for document in iter_manufacturer_products(stream_conn, manufacturer_id, view, after):
+                    yield document + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    documents = fetch_manufacturer_products(conn, manufacturer_id, view, after, limit)
+    headers = {}
+    if limit is not None and len(documents) == limit:
+        headers["X-Next-Cursor"] = listing_cursor(json.loads(documents[-1])["id"])
+    return Response(content="[" + ",".join(documents) + "]", media_type="application/json", headers=headers)
+
+def product_search_filters(
+    q: Optional[str] = Query(None, min_length=1, max_length=200, description="Free text over name, brand and ingredients"),
+    category: Optional[str] = None,
+    sub_category: Optional[str] = None,
+    brand: Optional[str] = None,
+    ingredient: List[str] = Query([], description="Ingredients every result must contain (case-insensitive)"),
+    free_from: List[str] = Query([], description="Allergens to exclude, e.g. free_from=peanuts&free_from=milk"),
+    organic: Optional[bool] = None,
+    expires_after: Optional[datetime.date] = None,
+    expires_before: Optional[datetime.date] = None,
+) -> dict:
+    return {"q": q, "category": category, "sub_category": sub_category, "brand": brand,
+            "ingredient": sorted({" ".join(name.lower().split()) for name in ingredient if name.strip()}),
+            "free_from": sorted(set(free_from)),
+            "organic": organic, "expires_after": expires_after, "expires_before": expires_before}
+
+@app.get("/products/search", response_model=List[ProductSearchHit], tags=["Products"])
+def search_catalog(
+    filters: dict = Depends(product_search_filters),
+    sort: Optional[str] = Query(None, pattern="^(relevance|id|expiry)$"),
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    conn=Depends(get_db),
+):
+    """
+    Searches the catalog. Results are ordered by relevance when `q` is given, otherwise
+    by id (`sort=expiry` lists the soonest-expiring first). If there may be more
+    results, the cursor for the next page is sent in the X-Next-Cursor header (pass it as `after`).
+    """
+    try:
+        documents, next_cursor = search_products(conn, filters, sort, after, limit)
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(content="[" + ",".join(documents) + "]", media_type="application/json", headers=headers)
+
+@app.get("/products/search/facets", response_model=SearchFacets, tags=["Products"])
+def search_catalog_facets(request: Request, filters: dict = Depends(product_search_filters)):
+    """
+    Counts per category, sub-category and brand, plus organic and allergen-free totals,
+    for the same filters. Facets scan every match, so they are cached (they are not
+    invalidated on writes and may lag by up to CACHE_TTL_SECONDS).
+    """
+    def load() -> bytes:
+        with pooled_connection() as conn:
+            return json.dumps(search_facets(conn, filters)).encode()
 
-    conn.close()
-    return products
+    try:
+        return cached_json_response(request, facets_key(filters), load)
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/ingredients/{ingredient}/products", response_model=List[ProductSearchHit], tags=["Products"])
+def get_products_by_ingredient(
+    ingredient: str,
+    limit: int = Query(20, ge=1, le=100),
+    after: Optional[str] = None,
+    conn=Depends(get_db),
+):
+    """
+    Lists the products containing an ingredient, ordered by id. Names are matched
+    case- and whitespace-insensitively ("Milk Solids" finds "milk  solids"). The cursor
+    for the next page is sent in the X-Next-Cursor header (pass it as `after`).
+    """
+    if not ingredient.strip():
+        raise HTTPException(status_code=400, detail="Ingredient must not be blank")
+    try:
+        documents, next_cursor = search_products(conn, {"ingredient": [ingredient]}, "id", after, limit)
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(content="[" + ",".join(documents) + "]", media_type="application/json", headers=headers)
 
 @app.post("/traceability/add", response_model=TraceabilityEntry, status_code=status.HTTP_201_CREATED, tags=["Traceability"])
-async def add_traceability_event(update_data: LocationUpdate):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute("SELECT current_hash FROM traceability_log WHERE product_id = %s ORDER BY log_id DESC LIMIT 1", (update_data.product_id,))
-    last_hash_row = cursor.fetchone()
-    if not last_hash_row:
+def add_traceability_event(update_data: LocationUpdate, conn=Depends(get_db)):
+    cursor = conn.cursor()
+    try:
+        entries, errors = append_events(cursor, [update_data])
+        if errors:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail=errors[0]["error"])
+        if settings.LIVE_EVENTS_ENABLED:
+            notify_trace_events(cursor, entries)
+        broadcast_invalidation(cursor, [product_key(update_data.product_id)])
+        # Anchoring happens in the background worker; the outbox row commits with the event.
+        conn.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
         cursor.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Product ID not found or has no initial log.")
-
-    previous_hash = last_hash_row['current_hash']
-    timestamp = datetime.datetime.now(datetime.timezone.utc)
 
-    hash_data = f"{update_data.product_id}{timestamp.isoformat()}{update_data.location}{update_data.stage}{update_data.actor}{previous_hash}"
-    current_hash = create_hash(hash_data)
-    log_id = None
+    response_cache.invalidate(product_key(update_data.product_id))
+    wake_anchor_worker()
+    return TraceabilityEntry(**entries[0])
+
+@app.post("/traceability/batch", response_model=TraceabilityBatchResult, status_code=status.HTTP_201_CREATED, tags=["Traceability"])
+def add_traceability_events_batch(batch: TraceabilityBatch, conn=Depends(get_db)):
+    """
+    Records many scans (e.g. a handheld's offline queue) in one transaction. Events are
+    chained per product in the order given; events for unknown products are returned
+    in `errors` and the rest are still recorded.
+    """
+    cursor = conn.cursor()
     try:
-        cursor.execute(
-            'INSERT INTO traceability_log (product_id, timestamp, location, stage, actor, status, notes, previous_hash, current_hash) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING log_id',
-            (update_data.product_id, timestamp, update_data.location, update_data.stage, update_data.actor, update_data.status, update_data.notes, previous_hash, current_hash)
-        )
-        log_id = cursor.fetchone()['log_id']
+        entries, errors = append_events(cursor, batch.events)
+        if settings.LIVE_EVENTS_ENABLED:
+            notify_trace_events(cursor, entries)
+        broadcast_invalidation(cursor, {product_key(entry["product_id"]) for entry in entries})
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
-    
-    # --- BLOCKCHAIN INTERACTION ---
-    try:
-        # Prepare data for smart contract (needs to be bytes32)
-        product_batch_id_bytes = hashlib.sha256(update_data.product_id.encode()).digest()
-        event_hash_bytes = bytes.fromhex(current_hash)
-
-        # Build and send the transaction
-        nonce = w3.eth.get_transaction_count(server_account.address)
-        tx_data = contract.functions.recordTraceEvent(product_batch_id_bytes, event_hash_bytes).build_transaction({
-            'chainId': settings.CHAIN_ID,
-            'gas': 2000000,
-            'gasPrice': w3.eth.gas_price,
-            'from': server_account.address,
-            'nonce': nonce,
-        })
-        signed_tx = w3.eth.account.sign_transaction(tx_data, private_key=settings.SERVER_PRIVATE_KEY)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        
-        # Wait for transaction receipt (optional but good practice)
-        tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-        
-        # Update the database with the transaction hash
-        cursor.execute(
-            'UPDATE traceability_log SET blockchain_tx_id = %s WHERE log_id = %s',
-            (tx_receipt.transactionHash.hex(), log_id)
-        )
-        conn.commit()
+    finally:
+        cursor.close()
 
-    except Exception as e:
-        # If blockchain fails, we don't fail the whole request, but we can log it.
-        # In a real production system, you'd add this to a retry queue.
-        print(f"!!! BLOCKCHAIN ERROR !!!: Could not anchor event for log_id {log_id}. Error: {e}")
+    response_cache.invalidate(*{product_key(entry["product_id"]) for entry in entries})
+    if entries:
+        wake_anchor_worker()
+    return TraceabilityBatchResult(inserted=len(entries), entries=entries, errors=errors)
+
+@app.get("/traceability/{product_id}/verify", response_model=ChainVerification, tags=["Traceability"])
+def verify_traceability_chain(
+    product_id: str,
+    include_archived: bool = Query(False, description="Re-verify archived events too, from the genesis event"),
+    conn=Depends(get_db),
+):
+    """
+    Recomputes every hash in the product's chain and checks each anchored event
+    against the contract (getTraceEvents, or batchRecordedAt for Merkle batches), or
+    against the local chain_events index when the chain indexer is enabled. Without
+    `include_archived`, the chain is checked from the last archived event onwards.
+    When the chain cannot be reached, the hashes are still verified and
+    `onchain_checked` is false.
+    """
+    cursor = conn.cursor()
+    try:
+        lookup = IndexLookup(cursor) if settings.CHAIN_INDEXER_ENABLED else ContractLookup(lambda: chain.contract)
+        archived_rows = archived_chain_rows(archived_events(cursor, product_id)) if include_archived else None
+        result = verify_product(cursor, product_id, lookup, archived_rows)
     finally:
         cursor.close()
-        conn.close()
-
-
-    return TraceabilityEntry(
-        log_id=log_id,
-        product_id=update_data.product_id,
-        timestamp=timestamp,
-        location=update_data.location,
-        stage=update_data.stage,
-        actor=update_data.actor,
-        status=update_data.status,
-        notes=update_data.notes,
-        previous_hash=previous_hash,
-        current_hash=current_hash,
-        blockchain_tx_id = tx_receipt.transactionHash.hex() if 'tx_receipt' in locals() else None
-    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Product ID not found or has no initial log.")
+    return result
+
+# --- Live tracking (see live_events.py) ---
+LIVE_MAX_TARGETS = 50
+
+def _live_recall_batches(product_ids: List[str], batch_numbers: List[str]) -> List[str]:
+    """Checks the requested products and batches exist; returns the batches of the products (their recalls apply)."""
+    if not product_ids and not batch_numbers:
+        raise HTTPException(status_code=400, detail="Give at least one product_id or batch_number")
+    if len(product_ids) + len(batch_numbers) > LIVE_MAX_TARGETS:
+        raise HTTPException(status_code=400, detail=f"At most {LIVE_MAX_TARGETS} products and batches per subscription")
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id, batch_number FROM products WHERE id = ANY(%s)", (product_ids,))
+            found = dict(cursor.fetchall())
+            missing = [product_id for product_id in product_ids if product_id not in found]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Product ID not found: {missing[0]}")
+            cursor.execute("SELECT DISTINCT batch_number FROM products WHERE batch_number = ANY(%s)", (batch_numbers,))
+            known_batches = {row[0] for row in cursor.fetchall()}
+            missing = [batch_number for batch_number in batch_numbers if batch_number not in known_batches]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Batch not found: {missing[0]}")
+        finally:
+            cursor.close()
+    return [batch_number for batch_number in found.values() if batch_number]
+
+async def _live_subscribe(product_ids: List[str], batch_numbers: List[str]):
+    if not settings.LIVE_EVENTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Live events are disabled")
+    recall_batches = await to_thread.run_sync(_live_recall_batches, product_ids, batch_numbers)
+    subscription = live_broadcaster.subscribe(product_ids, batch_numbers, recall_batches)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many live subscribers, please retry", headers={"Retry-After": "30"})
+    return subscription
+
+@app.get("/live", tags=["Traceability"])
+async def stream_live_events(
+    product_id: List[str] = Query([], description="Product to follow; repeat for several"),
+    batch_number: List[str] = Query([], description="Batch to follow; repeat for several"),
+):
+    """
+    Server-Sent Events stream of new trace events ("trace"), recalls ("recall") and
+    anchoring confirmations ("anchored", then "confirmed" once indexed) for the given
+    products and batches. A "resync" event means events were missed (slow client or a
+    lost database connection) and the product should be re-fetched. Comment lines are
+    sent as keep-alives.
+    """
+    subscription = await _live_subscribe(product_id, batch_number)
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n" + format_sse(encode({"type": "subscribed", "product_ids": product_id, "batch_numbers": batch_number}))
+            while True:
+                message = await subscription.next_message(settings.LIVE_KEEPALIVE_SECONDS)
+                yield ": keep-alive\n\n" if message is None else format_sse(message)
+        finally:
+            live_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    # Clients have nothing to send; reading is how a closed connection is noticed between events
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+@app.websocket("/live/ws")
+async def live_events_websocket(
+    websocket: WebSocket,
+    product_id: List[str] = Query([]),
+    batch_number: List[str] = Query([]),
+):
+    """The /live stream over a WebSocket: one JSON message per event, {"type": "keepalive"} when idle."""
+    try:
+        subscription = await _live_subscribe(product_id, batch_number)
+    except HTTPException as e:
+        await websocket.close(code=1013 if e.status_code == 503 else 1008, reason=str(e.detail)[:120])
+        return
+    disconnected = None
+    try:
+        await websocket.accept()
+        await websocket.send_json({"type": "subscribed", "product_ids": product_id, "batch_numbers": batch_number})
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(websocket))
+        while True:
+            next_message = asyncio.ensure_future(subscription.next_message(settings.LIVE_KEEPALIVE_SECONDS))
+            await asyncio.wait({next_message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_message.cancel()
+                break
+            message = next_message.result()
+            await websocket.send_text(message.data if message else '{"type": "keepalive"}')
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if disconnected is not None:
+            disconnected.cancel()
+        live_broadcaster.unsubscribe(subscription)
 
 # --- 6. Recalls and Reviews Endpoints ---
 @app.post("/recalls/add", response_model=ProductRecall, status_code=status.HTTP_201_CREATED, tags=["Recalls"])
-async def add_recall(recall_data: ProductRecallCreate, current_user_email: str = Depends(get_current_user)):
-    conn = get_db_connection()
+def add_recall(recall_data: ProductRecallCreate, manufacturer: Principal = Depends(get_current_manufacturer), conn=Depends(get_db)):
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    cursor.execute('''
-        SELECT p.id FROM products p
-        JOIN manufacturers m ON p.manufacturer_id = m.id
-        WHERE p.batch_number = %s AND m.email = %s
-    ''', (recall_data.batch_number, current_user_email))
+    cursor.execute(
+        'SELECT id FROM products WHERE batch_number = %s AND manufacturer_id = %s LIMIT 1',
+        (recall_data.batch_number, manufacturer.account_id)
+    )
     product = cursor.fetchone()
     if not product:
         cursor.close()
-        conn.close()
         raise HTTPException(status_code=403, detail="You can only recall products linked to your manufacturer account.")
 
     recall_date = datetime.datetime.now(datetime.timezone.utc)
@@ -576,19 +1252,125 @@ async def add_recall(recall_data: ProductRecallCreate, current_user_email: str =
             (recall_data.batch_number, recall_data.reason, recall_date)
         )
         recall_id = cursor.fetchone()['recall_id']
+        # Every product in the batch shows the recall, not only this manufacturer's.
+        cursor.execute('SELECT id FROM products WHERE batch_number = %s', (recall_data.batch_number,))
+        recalled_product_ids = [row['id'] for row in cursor.fetchall()]
+        record_recall(cursor, recall_data.batch_number, recall_date)
+        if settings.LIVE_EVENTS_ENABLED:
+            notify_recall(cursor, recall_id, recall_data.batch_number, recall_data.reason, recall_date)
+        broadcast_invalidation(cursor, [product_key(pid) for pid in recalled_product_ids])
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         cursor.close()
-        conn.close()
 
+    response_cache.invalidate(*(product_key(pid) for pid in recalled_product_ids))
+    swasth_catalog.invalidate()
     return ProductRecall(recall_id=recall_id, batch_number=recall_data.batch_number, reason=recall_data.reason, recall_date=recall_date)
 
+def _recall_batch_number(cursor, recall_id: int, manufacturer_id: str) -> str:
+    """Batch number of a recall the manufacturer may inspect (it owns a product of the batch)."""
+    cursor.execute('SELECT batch_number FROM product_recalls WHERE recall_id = %s', (recall_id,))
+    recall = cursor.fetchone()
+    if not recall:
+        raise HTTPException(status_code=404, detail="Recall not found")
+    cursor.execute(
+        'SELECT 1 FROM products WHERE batch_number = %s AND manufacturer_id = %s LIMIT 1',
+        (recall[0], manufacturer_id)
+    )
+    if not cursor.fetchone():
+        raise HTTPException(status_code=403, detail="You can only inspect recalls of batches linked to your manufacturer account.")
+    return recall[0]
+
+@app.get("/recalls/{recall_id}/impact", response_model=RecallImpact, tags=["Recalls"])
+def get_recall_impact(recall_id: int, manufacturer: Principal = Depends(get_current_manufacturer), conn=Depends(get_db)):
+    """
+    Everything the recalled batch has touched: its products grouped by last known
+    location, every location/actor that handled them and the consumers who reviewed them.
+    Served from the precomputed recall impact index (see recall_impact.py).
+    """
+    cursor = conn.cursor()
+    try:
+        batch_number = _recall_batch_number(cursor, recall_id, manufacturer.account_id)
+        document = batch_impact(cursor, batch_number)
+    finally:
+        cursor.close()
+    return Response(content=document, media_type="application/json")
+
+@app.get("/recalls/{recall_id}/impact/export", tags=["Recalls"])
+def export_recall_impact(
+    recall_id: int,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """
+    Streams the full impact of a recalled batch for regulators, one record per line:
+    every product with its last known position, then every touchpoint, then every consumer
+    (the `record` column tells them apart). Memory stays bounded for any batch size.
+    """
+    cursor = conn.cursor()
+    try:
+        batch_number = _recall_batch_number(cursor, recall_id, manufacturer.account_id)
+    finally:
+        cursor.close()
+
+    def stream():
+        # The request's connection is released when the handler returns, so the stream holds its own.
+        with db_pool.connection() as stream_conn:
+            yield from iter_impact_export(stream_conn, batch_number, format)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"recall-{recall_id}-impact.{format}"
+    return StreamingResponse(stream(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def _cohort_batch_number(cursor, recall_id: Optional[int], manufacturer: Principal) -> Optional[str]:
+    """Batch a cohort count is limited to (that of the recall), if any."""
+    if recall_id is not None:
+        return _recall_batch_number(cursor, recall_id, manufacturer.account_id)
+    return None
+
+@app.get("/consumers/cohorts/count", response_model=CohortCount, tags=["Recalls"])
+def count_consumer_cohort(
+    allergy: List[str] = Query([]),
+    condition: List[str] = Query([]),
+    diet: List[str] = Query([]),
+    goal: List[str] = Query([]),
+    recall_id: Optional[int] = Query(None, description="Only count consumers who reviewed a product of the recalled batch"),
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """
+    Number of consumers whose Swasth Wallet has every value given, e.g. `?allergy=peanuts`
+    to size a recall alert. Answered from the GIN index on consumers.profile.
+    """
+    filters = {"allergy": allergy, "condition": condition, "diet": diet, "goal": goal}
+    cursor = conn.cursor()
+    try:
+        batch_number = _cohort_batch_number(cursor, recall_id, manufacturer)
+        count = count_cohort(cursor, filters, batch_number)
+    finally:
+        cursor.close()
+    return CohortCount(count=count, filters=cohort_document(filters))
+
+@app.get("/consumers/cohorts", response_model=CohortSummary, tags=["Recalls"])
+def get_consumer_cohorts(
+    recall_id: Optional[int] = Query(None, description="Only count consumers who reviewed a product of the recalled batch"),
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """Consumers per known allergy, condition, diet and goal, one indexed count each."""
+    cursor = conn.cursor()
+    try:
+        batch_number = _cohort_batch_number(cursor, recall_id, manufacturer)
+        return cohort_summary(cursor, batch_number)
+    finally:
+        cursor.close()
+
 @app.post("/reviews/add", response_model=Review, status_code=status.HTTP_201_CREATED, tags=["Reviews"])
-async def add_review(review_data: ReviewCreate, current_user_email: str = Depends(get_current_user)):
-    conn = get_db_connection()
+def add_review(review_data: ReviewCreate, current_user_email: str = Depends(get_current_user), conn=Depends(get_db)):
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     review_date = datetime.datetime.now(datetime.timezone.utc)
 
@@ -598,14 +1380,17 @@ async def add_review(review_data: ReviewCreate, current_user_email: str = Depend
             (review_data.product_id, current_user_email, review_data.rating, review_data.comment, review_date)
         )
         review_id = cursor.fetchone()['review_id']
+        record_consumer(cursor, review_data.product_id, current_user_email, review_date)
+        record_review(cursor, review_data.product_id, review_data.rating)
+        broadcast_invalidation(cursor, [product_key(review_data.product_id), reviews_key(review_data.product_id)])
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         cursor.close()
-        conn.close()
 
+    response_cache.invalidate(product_key(review_data.product_id), reviews_key(review_data.product_id))
     return Review(
         review_id=review_id,
         product_id=review_data.product_id,
@@ -615,18 +1400,286 @@ async def add_review(review_data: ReviewCreate, current_user_email: str = Depend
         review_date=review_date,
     )
 
+REVIEW_PAGE_SIZE = 20
+
+def _load_reviews(product_id: str) -> bytes:
+    with pooled_connection() as conn:
+        documents, _ = fetch_review_page(conn, product_id, limit=REVIEW_PAGE_SIZE)
+    return ("[" + ",".join(documents) + "]").encode()
+
 @app.get("/reviews/{product_id}", response_model=List[Review], tags=["Reviews"])
-async def get_reviews_for_product(product_id: str):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT * FROM reviews WHERE product_id = %s ORDER BY review_date DESC", (product_id,))
-    review_rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return [Review(**row) for row in review_rows]
+def get_reviews_for_product(
+    product_id: str,
+    request: Request,
+    limit: int = Query(REVIEW_PAGE_SIZE, ge=1, le=100),
+    after: Optional[str] = None,
+):
+    """
+    A product's reviews, newest first, one keyset page at a time. If there may be more,
+    the cursor for the next page is sent in the X-Next-Cursor header (pass it as `after`).
+    """
+    if after is None and limit == REVIEW_PAGE_SIZE:
+        # The first page is what product pages link to, so it is served from the response cache
+        response = cached_json_response(request, reviews_key(product_id), lambda: _load_reviews(product_id))
+        if response.status_code == status.HTTP_200_OK:
+            page = json.loads(response.body)
+            if len(page) == limit:
+                response.headers["X-Next-Cursor"] = review_cursor(page[-1]["review_date"], page[-1]["review_id"])
+        return response
+    with pooled_connection() as conn:
+        try:
+            documents, next_cursor = fetch_review_page(conn, product_id, after, limit)
+        except InvalidSearch as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(content="[" + ",".join(documents) + "]", media_type="application/json", headers=headers)
+
+@app.get("/reviews/{product_id}/summary", response_model=ReviewSummary, tags=["Reviews"])
+def get_review_summary(product_id: str, conn=Depends(get_db)):
+    """Review count, average rating and histogram (by star), maintained as reviews are added."""
+    document = fetch_review_summary(conn, product_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return Response(content=document, media_type="application/json")
+
+# --- Analytics (see analytics.py) ---
+ANALYTICS_MAX_DAYS = 1096
+
+def analytics_range(
+    start: Optional[datetime.date] = Query(None, description="First day (UTC), default 30 days before `end`"),
+    end: Optional[datetime.date] = Query(None, description="Last day (UTC), inclusive; default today"),
+) -> tuple:
+    end = end or datetime.datetime.now(datetime.timezone.utc).date()
+    start = start or end - datetime.timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {ANALYTICS_MAX_DAYS} days per query")
+    return start, end
+
+@app.get("/analytics/stages", response_model=List[StageStats], tags=["Analytics"])
+def get_stage_analytics(
+    date_range: tuple = Depends(analytics_range),
+    batch_number: Optional[str] = None,
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """Events and average/maximum dwell per stage for the caller's products."""
+    cursor = conn.cursor()
+    try:
+        document = stage_stats(cursor, manufacturer.account_id, *date_range, batch_number)
+    finally:
+        cursor.close()
+    return Response(content=document, media_type="application/json")
+
+@app.get("/analytics/transit", response_model=List[TransitStats], tags=["Analytics"])
+def get_transit_analytics(
+    date_range: tuple = Depends(analytics_range),
+    batch_number: Optional[str] = None,
+    location: Optional[str] = Query(None, description="Only legs from or to this location"),
+    limit: int = Query(50, ge=1, le=1000),
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """Transit time between consecutive locations of the caller's products, busiest legs first."""
+    cursor = conn.cursor()
+    try:
+        document = transit_stats(cursor, manufacturer.account_id, *date_range, batch_number, location, limit)
+    finally:
+        cursor.close()
+    return Response(content=document, media_type="application/json")
+
+@app.get("/analytics/events-per-day", response_model=List[DailyEventCount], tags=["Analytics"])
+def get_daily_event_analytics(
+    date_range: tuple = Depends(analytics_range),
+    batch_number: Optional[str] = None,
+    stage: Optional[str] = None,
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """Traceability events recorded on the caller's products, for every day of the range."""
+    cursor = conn.cursor()
+    try:
+        document = events_per_day(cursor, manufacturer.account_id, *date_range, batch_number, stage)
+    finally:
+        cursor.close()
+    return Response(content=document, media_type="application/json")
+
+@app.get("/analytics/recalls", response_model=List[BrandRecallStats], tags=["Analytics"])
+def get_recall_analytics(
+    date_range: tuple = Depends(analytics_range),
+    manufacturer: Principal = Depends(get_current_manufacturer),
+    conn=Depends(get_db),
+):
+    """Recalls and recalled products per brand of the caller."""
+    cursor = conn.cursor()
+    try:
+        document = recall_stats(cursor, manufacturer.account_id, *date_range)
+    finally:
+        cursor.close()
+    return Response(content=document, media_type="application/json")
+
+# --- 7. System Endpoints ---
+# /metrics and /system/* expose internals (queue depths, SQL of profiled requests), so they
+# need "Authorization: Bearer <METRICS_PROFILE_TOKEN>"; /health/* stays open for probes.
+def require_operator(authorization: Optional[str] = Header(None)):
+    if not settings.METRICS_PROFILE_TOKEN:
+        raise HTTPException(status_code=403, detail="Set METRICS_PROFILE_TOKEN to enable the system endpoints")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.METRICS_PROFILE_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Operator token required", headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/system/db-pool", tags=["System"], dependencies=[Depends(require_operator)])
+async def get_db_pool_stats():
+    return db_pool.stats()
+
+@app.get("/system/cache", tags=["System"], dependencies=[Depends(require_operator)])
+async def get_cache_stats():
+    if cache_listener is None:
+        return response_cache.stats()
+    return {**response_cache.stats(), "listener": cache_listener.status()}
+
+@app.get("/system/auth", tags=["System"], dependencies=[Depends(require_operator)])
+async def get_auth_stats():
+    return {"principal_cache": principal_cache.stats(), "password_hashing": passwords.stats()}
+
+@app.get("/system/swasth", tags=["System"], dependencies=[Depends(require_operator)])
+async def get_swasth_catalog_stats():
+    return swasth_catalog.stats()
+
+@app.get("/system/live", tags=["System"], dependencies=[Depends(require_operator)])
+async def get_live_stats():
+    return {"enabled": settings.LIVE_EVENTS_ENABLED, **live_broadcaster.stats(), "listener": live_listener.status()}
+
+@app.get("/system/trace-partitions", tags=["System"], dependencies=[Depends(require_operator)])
+def get_trace_partitions(conn=Depends(get_db)):
+    cursor = conn.cursor()
+    try:
+        return {"enabled": settings.TRACE_PARTITION_MAINTENANCE_ENABLED, **partition_maintainer.status(cursor)}
+    finally:
+        cursor.close()
+
+@app.get("/system/chain-index", tags=["System"], dependencies=[Depends(require_operator)])
+def get_chain_index_status(conn=Depends(get_db)):
+    try:
+        indexer = chain_indexer or create_chain_indexer()
+    except ChainUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    cursor = conn.cursor()
+    try:
+        return {"enabled": settings.CHAIN_INDEXER_ENABLED, **indexer.status(cursor)}
+    finally:
+        cursor.close()
+
+@app.get("/health/live", tags=["System"])
+async def liveness():
+    """The process is up and its event loop answers; says nothing about the database or chain."""
+    return {"status": "alive", "pid": os.getpid()}
+
+@app.get("/health/ready", tags=["System"])
+def readiness(chain_probe: bool = Query(False, description="Also call the RPC node (eth_blockNumber)")):
+    """
+    503 until startup has finished, once shutdown has begun, or while the database does
+    not answer. The chain is reported but never makes the API unready: anchoring is
+    asynchronous and catches up from anchor_outbox.
+    """
+    database = {"ok": True}
+    try:
+        with db_pool.connection(timeout=1.0) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+    except Exception as e:
+        database = {"ok": False, "error": str(e)[:300]}
+    ready = lifecycle["state"] == "ready" and database["ok"]
+    body = {
+        "status": "ready" if ready else "unready",
+        "lifecycle": lifecycle["state"],
+        "pid": os.getpid(),
+        "startup_seconds": lifecycle["startup_seconds"],
+        "startup_errors": lifecycle["startup_errors"],
+        "database": database,
+        "chain": chain.check(probe=chain_probe) if chain_probe or settings.ANCHOR_WORKER_ENABLED or settings.CHAIN_INDEXER_ENABLED else {"used": False},
+        "chain_leader": chain_leader.is_leader,
+        "anchor_worker": anchor_worker is not None,
+        "chain_indexer": chain_indexer is not None,
+    }
+    return Response(content=json.dumps(body, default=str), media_type="application/json",
+                    status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@app.get("/system/profiles/{profile_id}", tags=["System"], dependencies=[Depends(require_operator)])
+async def get_request_profile(profile_id: str):
+    """Breakdown of a request sent with the X-Profile header (see METRICS_PROFILE_TOKEN)."""
+    profile = recent_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    return profile
+
+# Prometheus gauges for state kept outside metrics.py, read on every scrape
+def _anchor_queue_stats() -> Optional[List[tuple]]:
+    """
+    (status, rows, seconds since the oldest was queued) per anchor_outbox status; anchored
+    rows are deleted. None while the database is busy or down: the gauges are left out.
+    """
+    try:
+        with db_pool.connection(timeout=1.0) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, count(*), extract(epoch FROM now() - min(created_at)) FROM anchor_outbox GROUP BY status")
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+    except (PoolTimeout, psycopg2.Error):
+        return None
+
+def _anchor_queue_depth():
+    rows = _anchor_queue_stats()
+    if rows is None:
+        return []
+    depth = {"pending": 0, "failed": 0}
+    depth.update({row_status: count for row_status, count, _ in rows})
+    return [((row_status,), count) for row_status, count in sorted(depth.items())]
+
+def _anchor_queue_oldest():
+    rows = _anchor_queue_stats()
+    if rows is None:
+        return []
+    ages = {row_status: float(age or 0) for row_status, _, age in rows}
+    return [((), ages.get("pending", 0.0))]
+
+REGISTRY.register(CallbackMetric(
+    "foodtrace_anchor_queue_depth", "anchor_outbox rows waiting to be anchored, by status.",
+    _anchor_queue_depth, labels=("status",)))
+REGISTRY.register(CallbackMetric(
+    "foodtrace_anchor_queue_oldest_pending_seconds", "Age of the oldest pending anchor_outbox row.",
+    _anchor_queue_oldest))
+REGISTRY.register(CallbackMetric(
+    "foodtrace_db_pool_connections", "Database pool connections by state.",
+    lambda: [((state,), value) for state, value in db_pool.stats().items() if state in ("size", "in_use", "idle", "waiting")],
+    labels=("state",)))
+REGISTRY.register(CallbackMetric(
+    "foodtrace_db_pool_timeouts_total", "Requests that found no free database connection in time.",
+    lambda: [((), db_pool.stats()["timeouts_total"])], type="counter"))
+REGISTRY.register(CallbackMetric(
+    "foodtrace_response_cache_lookups_total", "Response cache lookups by result.",
+    lambda: [((result,), response_cache.stats()[result]) for result in ("hits", "misses")],
+    labels=("result",), type="counter"))
+REGISTRY.register(CallbackMetric(
+    "foodtrace_live_subscribers", "Open /live and /live/ws subscriptions in this worker.",
+    lambda: [((), live_broadcaster.stats()["subscribers"])]))
+REGISTRY.register(CallbackMetric(
+    "foodtrace_live_events_dropped_total", "Live events dropped for slow subscribers (replaced by a resync event).",
+    lambda: [((), live_broadcaster.dropped)], type="counter"))
+
+@app.get("/metrics", tags=["System"], dependencies=[Depends(require_operator)])
+def get_metrics():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 # --- Main Execution ---
+# Development server with auto-reload; run production with `python serve.py --workers N`.
 if __name__ == "__main__":
-    print("Starting Bharat FoodTrace API Server...")
+    print("Starting Bharat FoodTrace API Server (development, auto-reload)...")
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
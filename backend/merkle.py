@@ -0,0 +1,57 @@
+# merkle.py
+# SHA-256 Merkle trees over traceability event hashes, matching Traceability.verifyInclusion.
+#
+# Leaves and inner nodes are domain-separated (0x00 / 0x01 prefix) and pairs are
+# hashed in sorted order, so a proof is just the list of sibling hashes from the
+# leaf up to the root. A level with an odd number of nodes promotes its last node
+# unchanged. All values are exchanged as lowercase hex without a 0x prefix, the
+# same format as traceability_log.current_hash.
+import hashlib
+from typing import List
+
+
+def leaf_hash(event_hash: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(event_hash)).digest()
+
+
+def node_hash(a: bytes, b: bytes) -> bytes:
+    if b < a:
+        a, b = b, a
+    return hashlib.sha256(b"\x01" + a + b).digest()
+
+
+def build_tree(event_hashes: List[str]) -> List[List[bytes]]:
+    """Returns every level of the tree, leaves first and the root level last."""
+    if not event_hashes:
+        raise ValueError("Cannot build a Merkle tree without leaves")
+    levels = [[leaf_hash(h) for h in event_hashes]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(levels: List[List[bytes]]) -> str:
+    return levels[-1][0].hex()
+
+
+def merkle_proof(levels: List[List[bytes]], index: int) -> List[str]:
+    """Sibling hashes needed to recompute the root from the leaf at `index`."""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling].hex())
+        index //= 2
+    return proof
+
+
+def verify_proof(event_hash: str, proof: List[str], root: str) -> bool:
+    """Offline inclusion check for a single event, e.g. from a consumer's device."""
+    node = leaf_hash(event_hash)
+    for sibling in proof:
+        node = node_hash(node, bytes.fromhex(sibling))
+    return node.hex() == root.lower().removeprefix("0x")
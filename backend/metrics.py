@@ -0,0 +1,412 @@
+# metrics.py
+# Request and hot-path instrumentation, exposed in the Prometheus text format at /metrics.
+#
+# MetricsMiddleware times every request by route template (/product/{product_id} is one
+# series, not one per product) and counts the SQL statements each request ran and the
+# time they took, so an N+1 pattern shows up as a route with a high
+# foodtrace_request_db_queries. Statements are timed by TimedConnection, the psycopg2
+# connection class the pool opens, and labelled "<verb> <table>" ("select reviews") to
+# keep the number of series bounded. instrument_provider() times web3 JSON-RPC calls by
+# method, and timed(section) times any other hot path (bcrypt). Values that live
+# elsewhere (anchoring queue depth, pool and cache counters) are CallbackMetrics, read
+# at scrape time. Like MemoryCache, the registry is per process: scrape every worker.
+#
+# Profiling: a request sent with "X-Profile: <METRICS_PROFILE_TOKEN>" gets a
+# Server-Timing header (db, rpc, bcrypt, app and total time) and an X-Profile-Id. The
+# full breakdown, every statement with its duration, stays available for the last
+# `profile_history` profiled requests through recent_profile().
+import hmac
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from psycopg2 import extensions
+
+logger = logging.getLogger("bharatfoodtrace.metrics")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def add(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = self.header()
+        for key, values in series:
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-2] + [values[-1]]):
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {round(values[-2], 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {values[-1]}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """A gauge or counter read at scrape time: collect() returns [(label values, value)]."""
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]],
+                 labels: Iterable[str] = (), type: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.type = type
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            samples = list(self.collect())
+        except Exception:
+            logger.exception("Collecting %s failed", self.name)
+            return []
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in samples]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "foodtrace_http_request_seconds", "Request latency by route template.", ("method", "route", "status")))
+HTTP_REQUESTS_IN_PROGRESS = REGISTRY.register(Gauge(
+    "foodtrace_http_requests_in_progress", "Requests being handled right now."))
+REQUEST_DB_QUERIES = REGISTRY.register(Histogram(
+    "foodtrace_request_db_queries", "SQL statements run per request, by route template.", ("route",), QUERY_COUNT_BUCKETS))
+REQUEST_DB_SECONDS = REGISTRY.register(Histogram(
+    "foodtrace_request_db_seconds", "Time spent in SQL statements per request, by route template.", ("route",)))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "foodtrace_db_query_seconds", "SQL statement latency by statement label (<verb> <table>).", ("statement",)))
+DB_QUERY_ERRORS = REGISTRY.register(Counter(
+    "foodtrace_db_query_errors_total", "SQL statements that raised, by statement label.", ("statement",)))
+RPC_SECONDS = REGISTRY.register(Histogram(
+    "foodtrace_rpc_seconds", "Blockchain JSON-RPC latency by method.", ("method",)))
+RPC_ERRORS = REGISTRY.register(Counter(
+    "foodtrace_rpc_errors_total", "Blockchain JSON-RPC calls that failed or returned an error, by method.", ("method",)))
+SECTION_SECONDS = REGISTRY.register(Histogram(
+    "foodtrace_section_seconds", "Latency of instrumented hot paths (see metrics.timed).", ("section",)))
+
+
+# --- Per-request statistics ---
+class RequestStats:
+    """What one request spent its time on. Shared by the handler's threads through a ContextVar."""
+
+    def __init__(self, profile: bool = False):
+        self.profile = profile
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.sections: Dict[str, float] = {}  # "rpc", "bcrypt", ... -> seconds
+        self.statements: List[dict] = []  # Profiled requests only
+
+    def add_section(self, section: str, seconds: float):
+        self.sections[section] = self.sections.get(section, 0.0) + seconds
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def timed(section: str):
+    """Times a block into foodtrace_section_seconds and the current request's breakdown."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        SECTION_SECONDS.observe(elapsed, section)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.add_section(section, elapsed)
+
+
+# --- SQL statements ---
+_VERB = re.compile(r"^\s*(?:--[^\n]*\n\s*)*(\w+)")
+_TABLE = re.compile(r"\b(?:from|into|update|join)\s+(?:only\s+)?([a-z_][\w.]*)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=2048)
+def statement_label(sql: str) -> str:
+    """The "<verb> <first table>" label of a statement, e.g. "select reviews" (a regex guess, not a parser)."""
+    verb = _VERB.match(sql)
+    if not verb:
+        return "other"
+    table = _TABLE.search(sql)
+    return f"{verb.group(1).lower()} {table.group(1).lower()}" if table else verb.group(1).lower()
+
+
+def _record_query(cursor, query, elapsed: float, failed: bool):
+    if isinstance(query, bytes):
+        sql = query.decode(errors="replace")
+    elif isinstance(query, str):
+        sql = query
+    else:  # psycopg2.sql.Composed
+        sql = query.as_string(cursor)
+    label = statement_label(sql)
+    DB_QUERY_SECONDS.observe(elapsed, label)
+    if failed:
+        DB_QUERY_ERRORS.inc(label)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.profile:
+            stats.statements.append({"statement": label, "sql": " ".join(sql.split())[:500], "ms": round(elapsed * 1000, 3)})
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            _record_query(self, query, time.perf_counter() - started, failed)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().executemany(query, vars_list)
+            failed = False
+            return result
+        finally:
+            _record_query(self, query, time.perf_counter() - started, failed)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().copy_expert(sql, file, size)
+            failed = False
+            return result
+        finally:
+            _record_query(self, sql, time.perf_counter() - started, failed)
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(cursor_factory):
+    timed_class = _timed_cursor_classes.get(cursor_factory)
+    if timed_class is None:
+        timed_class = type(f"Timed{cursor_factory.__name__}", (_TimedCursorMixin, cursor_factory), {})
+        _timed_cursor_classes[cursor_factory] = timed_class
+    return timed_class
+
+
+class TimedConnection(extensions.connection):
+    """psycopg2 connection whose cursors (of any cursor_factory) time every statement."""
+
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _timed_cursor_class(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+
+# --- Blockchain RPC ---
+def _record_rpc(method: str, elapsed: float, failed: bool):
+    RPC_SECONDS.observe(elapsed, method)
+    if failed:
+        RPC_ERRORS.inc(method)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add_section("rpc", elapsed)
+
+
+def instrument_provider(provider):
+    """Times every JSON-RPC call a web3 provider makes. Call before the provider's first request."""
+    make_request = provider.make_request
+
+    def timed_make_request(method, params):
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = make_request(method, params)
+            failed = isinstance(response, dict) and "error" in response
+            return response
+        finally:
+            _record_rpc(str(method), time.perf_counter() - started, failed)
+
+    provider.make_request = timed_make_request
+    return provider
+
+
+# --- Middleware ---
+class MetricsMiddleware:
+    """Pure ASGI middleware, so the ContextVar it sets reaches handlers and streaming bodies."""
+
+    def __init__(self, app, profile_token: Optional[str] = None, profile_history: int = 100):
+        self.app = app
+        self.profile_token = profile_token
+        self.profile_history = profile_history
+
+    def _wants_profile(self, scope) -> bool:
+        if not self.profile_token:
+            return False
+        for name, value in scope.get("headers", []):
+            if name == b"x-profile":
+                return hmac.compare_digest(value.decode("latin-1"), self.profile_token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(profile=self._wants_profile(scope))
+        profile_id = uuid.uuid4().hex[:16] if stats.profile else None
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profile_id:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(stats, time.perf_counter() - started).encode()))
+                    headers.append((b"x-profile-id", profile_id.encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        token = _request_stats.set(stats)
+        HTTP_REQUESTS_IN_PROGRESS.add(amount=1)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.add(amount=-1)
+            _request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(elapsed, scope["method"], route, str(status_code))
+            REQUEST_DB_QUERIES.observe(stats.queries, route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, route)
+            if profile_id:
+                _store_profile(profile_id, {
+                    "profile_id": profile_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": route,
+                    "status": status_code,
+                    "total_ms": round(elapsed * 1000, 3),
+                    "db_ms": round(stats.db_seconds * 1000, 3),
+                    "queries": stats.queries,
+                    "sections_ms": {name: round(seconds * 1000, 3) for name, seconds in stats.sections.items()},
+                    "statements": stats.statements,
+                }, self.profile_history)
+
+
+def server_timing(stats: RequestStats, total: float) -> str:
+    """Server-Timing header value: db, each section, the remainder as "app", and total."""
+    parts = [f'db;dur={stats.db_seconds * 1000:.3f};desc="{stats.queries} queries"']
+    parts += [f"{name};dur={seconds * 1000:.3f}" for name, seconds in sorted(stats.sections.items())]
+    app_time = max(total - stats.db_seconds - sum(stats.sections.values()), 0.0)
+    parts += [f"app;dur={app_time * 1000:.3f}", f"total;dur={total * 1000:.3f}"]
+    return ", ".join(parts)
+
+
+_profiles: "OrderedDict[str, dict]" = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def _store_profile(profile_id: str, profile: dict, history: int):
+    with _profiles_lock:
+        _profiles[profile_id] = profile
+        while len(_profiles) > history:
+            _profiles.popitem(last=False)
+
+
+def recent_profile(profile_id: str) -> Optional[dict]:
+    with _profiles_lock:
+        return _profiles.get(profile_id)
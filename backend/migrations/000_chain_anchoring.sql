@@ -0,0 +1,102 @@
+-- 000_chain_anchoring.sql
+-- Adds the on-chain anchoring and chain integrity tables that predate the numbered
+-- migrations: anchor_outbox (anchoring.py), anchor_batches and the Merkle columns of
+-- traceability_log, traceability_heads (ledger.py, filled from the existing log),
+-- chain_audit_checkpoints (chain_audit.py) and the chain_events index (chain_indexer.py).
+-- Existing events are not queued for anchoring. Every later migration expects these
+-- tables, so run this one first, with writers stopped:
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/000_chain_anchoring.sql
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS anchor_batches (
+    batch_id SERIAL PRIMARY KEY,
+    merkle_root TEXT UNIQUE NOT NULL,
+    leaf_count INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    tx_hash TEXT,
+    last_error TEXT,
+    blockchain_tx_id TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    anchored_at TIMESTAMP WITH TIME ZONE
+);
+
+ALTER TABLE traceability_log
+    ADD COLUMN IF NOT EXISTS anchor_batch_id INTEGER REFERENCES anchor_batches(batch_id),
+    ADD COLUMN IF NOT EXISTS merkle_root TEXT,
+    ADD COLUMN IF NOT EXISTS merkle_proof JSONB;
+
+CREATE TABLE IF NOT EXISTS anchor_outbox (
+    log_id INTEGER PRIMARY KEY REFERENCES traceability_log(log_id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    tx_hash TEXT,
+    last_error TEXT,
+    batch_id INTEGER REFERENCES anchor_batches(batch_id),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS traceability_heads (
+    product_id VARCHAR(255) PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    head_hash TEXT NOT NULL,
+    event_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS chain_audit_checkpoints (
+    product_id VARCHAR(255) PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    last_log_id INTEGER NOT NULL,
+    head_hash TEXT NOT NULL,
+    verified_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS chain_events (
+    event_id BIGSERIAL PRIMARY KEY,
+    contract_address TEXT NOT NULL,
+    event_name VARCHAR(50) NOT NULL,
+    product_batch_id TEXT,
+    event_hash TEXT NOT NULL,
+    block_number BIGINT NOT NULL,
+    block_hash TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    log_index INTEGER NOT NULL,
+    recorder TEXT,
+    recorded_at TIMESTAMP WITH TIME ZONE,
+    UNIQUE (block_hash, log_index)
+);
+
+CREATE TABLE IF NOT EXISTS chain_indexer_state (
+    contract_address TEXT PRIMARY KEY,
+    last_block BIGINT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS chain_indexer_blocks (
+    contract_address TEXT NOT NULL,
+    block_number BIGINT NOT NULL,
+    block_hash TEXT NOT NULL,
+    PRIMARY KEY (contract_address, block_number)
+);
+
+-- Chain walks read a product's events in log_id order
+DROP INDEX IF EXISTS idx_traceability_product_id;
+CREATE INDEX idx_traceability_product_id ON traceability_log(product_id, log_id);
+CREATE INDEX IF NOT EXISTS idx_traceability_anchor_batch_id ON traceability_log(anchor_batch_id);
+CREATE INDEX IF NOT EXISTS idx_anchor_outbox_due ON anchor_outbox(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_anchor_outbox_batch_id ON anchor_outbox(batch_id);
+CREATE INDEX IF NOT EXISTS idx_anchor_batches_due ON anchor_batches(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_chain_events_event_hash ON chain_events(event_hash);
+CREATE INDEX IF NOT EXISTS idx_chain_events_product_batch_id ON chain_events(product_batch_id, event_hash);
+CREATE INDEX IF NOT EXISTS idx_chain_events_block ON chain_events(contract_address, block_number);
+
+-- One head per existing chain, pointing at its newest event
+INSERT INTO traceability_heads (product_id, head_hash, event_count)
+SELECT product_id, (array_agg(current_hash ORDER BY log_id DESC))[1], count(*)
+FROM traceability_log
+GROUP BY product_id
+ON CONFLICT (product_id) DO NOTHING;
+
+COMMIT;
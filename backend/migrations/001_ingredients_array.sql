@@ -0,0 +1,45 @@
+-- 001_ingredients_array.sql
+-- Converts products.ingredients from comma-joined TEXT to TEXT[] and adds the
+-- canonical ingredient_keys column with its GIN index (see database_setup.sql).
+-- Runs in one transaction and rewrites the products table, so run it off-peak:
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/001_ingredients_array.sql
+BEGIN;
+
+CREATE OR REPLACE FUNCTION canonical_ingredient(name TEXT) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+    AS $$ SELECT lower(btrim(regexp_replace(name, '\s+', ' ', 'g'))) $$;
+
+CREATE OR REPLACE FUNCTION canonical_ingredients(names TEXT[]) RETURNS TEXT[]
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    AS $$
+        SELECT coalesce(array_agg(DISTINCT canonical_ingredient(n)) FILTER (WHERE btrim(n) <> ''), '{}')
+        FROM unnest(names) AS n
+    $$;
+
+CREATE OR REPLACE FUNCTION ingredients_text(names TEXT[]) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    AS $$ SELECT array_to_string(names, ' ') $$;
+
+-- The search document depends on the column being converted; it is rebuilt below
+ALTER TABLE products DROP COLUMN IF EXISTS search_vector;
+
+-- "Wheat Flour, Sugar,,Salt " -> {"Wheat Flour","Sugar","Salt"}
+ALTER TABLE products
+    ALTER COLUMN ingredients TYPE TEXT[] USING coalesce(
+        array_remove(regexp_split_to_array(btrim(ingredients, E' ,\t\n'), '\s*,\s*'), ''), '{}'),
+    ALTER COLUMN ingredients SET DEFAULT '{}',
+    ALTER COLUMN ingredients SET NOT NULL;
+
+ALTER TABLE products
+    ADD COLUMN ingredient_keys TEXT[] GENERATED ALWAYS AS (canonical_ingredients(ingredients)) STORED,
+    ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(brand, '')), 'B') ||
+        setweight(to_tsvector('english', ingredients_text(ingredients)), 'C')
+    ) STORED;
+
+CREATE INDEX idx_products_ingredient_keys ON products USING GIN (ingredient_keys);
+CREATE INDEX idx_products_search_vector ON products USING GIN (search_vector);
+
+COMMIT;
@@ -0,0 +1,63 @@
+-- 002_recall_impact.sql
+-- Adds the recall impact index (see recall_impact.py): last known positions on
+-- traceability_heads, batch_touchpoints and batch_consumers, filled from the
+-- existing traceability_log and reviews rows. Run it with writers stopped.
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/002_recall_impact.sql
+BEGIN;
+
+ALTER TABLE traceability_heads
+    ADD COLUMN IF NOT EXISTS last_location TEXT,
+    ADD COLUMN IF NOT EXISTS last_actor TEXT,
+    ADD COLUMN IF NOT EXISTS last_stage VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS last_event_at TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE IF NOT EXISTS batch_touchpoints (
+    batch_number TEXT NOT NULL,
+    location TEXT NOT NULL,
+    actor TEXT NOT NULL,
+    last_stage VARCHAR(255) NOT NULL,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    event_count INTEGER NOT NULL,
+    PRIMARY KEY (batch_number, location, actor)
+);
+
+CREATE TABLE IF NOT EXISTS batch_consumers (
+    batch_number TEXT NOT NULL,
+    consumer_email VARCHAR(255) NOT NULL,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    review_count INTEGER NOT NULL,
+    PRIMARY KEY (batch_number, consumer_email)
+);
+
+-- Exports list a batch's products in id order straight from the index
+DROP INDEX IF EXISTS idx_products_batch_number;
+CREATE INDEX idx_products_batch_number ON products(batch_number, id);
+
+-- Same statements as recall_impact.rebuild() for every batch
+TRUNCATE batch_touchpoints, batch_consumers;
+
+INSERT INTO batch_touchpoints (batch_number, location, actor, last_stage, first_seen, last_seen, event_count)
+SELECT p.batch_number, l.location, l.actor, (array_agg(l.stage ORDER BY l.log_id DESC))[1],
+       min(l.timestamp), max(l.timestamp), count(*)
+FROM traceability_log l JOIN products p ON p.id = l.product_id
+GROUP BY p.batch_number, l.location, l.actor;
+
+INSERT INTO batch_consumers (batch_number, consumer_email, first_seen, last_seen, review_count)
+SELECT p.batch_number, v.consumer_email, min(v.review_date), max(v.review_date), count(*)
+FROM reviews v JOIN products p ON p.id = v.product_id
+GROUP BY p.batch_number, v.consumer_email;
+
+INSERT INTO traceability_heads (product_id, head_hash, event_count, last_location, last_actor, last_stage, last_event_at)
+SELECT l.product_id, (array_agg(l.current_hash ORDER BY l.log_id DESC))[1], count(*),
+       (array_agg(l.location ORDER BY l.log_id DESC))[1], (array_agg(l.actor ORDER BY l.log_id DESC))[1],
+       (array_agg(l.stage ORDER BY l.log_id DESC))[1], (array_agg(l.timestamp ORDER BY l.log_id DESC))[1]
+FROM traceability_log l
+GROUP BY l.product_id ORDER BY l.product_id
+ON CONFLICT (product_id) DO UPDATE SET
+    last_location = EXCLUDED.last_location, last_actor = EXCLUDED.last_actor,
+    last_stage = EXCLUDED.last_stage, last_event_at = EXCLUDED.last_event_at;
+
+COMMIT;
@@ -0,0 +1,39 @@
+-- 003_consumer_profiles.sql
+-- Moves the Swasth Wallet from consumers.profile_json (TEXT) to consumers.profile
+-- (JSONB) with the GIN index used by cohort counts (see profile_cohorts.py). List
+-- values are normalized the way the SwasthWallet model now stores them: lower-cased,
+-- whitespace collapsed, de-duplicated, and allergies with underscores ("tree_nuts").
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/003_consumer_profiles.sql
+BEGIN;
+
+CREATE FUNCTION pg_temp.normalized_values(list JSONB, space TEXT) RETURNS JSONB
+    LANGUAGE sql IMMUTABLE
+    AS $$
+        SELECT coalesce(jsonb_agg(value ORDER BY position), '[]')
+        FROM (
+            SELECT value, min(position) AS position
+            FROM jsonb_array_elements_text(CASE WHEN jsonb_typeof(list) = 'array' THEN list ELSE '[]' END)
+                 WITH ORDINALITY AS e (raw, position),
+                 LATERAL (SELECT replace(lower(btrim(regexp_replace(raw, '\s+', ' ', 'g'))), ' ', space) AS value) n
+            WHERE value <> ''
+            GROUP BY value
+        ) v
+    $$;
+
+ALTER TABLE consumers ADD COLUMN profile JSONB NOT NULL DEFAULT '{}';
+
+UPDATE consumers SET profile = p || jsonb_build_object(
+    'allergies', pg_temp.normalized_values(p -> 'allergies', '_'),
+    'diet', pg_temp.normalized_values(p -> 'diet', ' '),
+    'conditions', pg_temp.normalized_values(p -> 'conditions', ' '),
+    'goals', pg_temp.normalized_values(p -> 'goals', ' ')
+)
+FROM (SELECT id, coalesce(nullif(profile_json, '')::jsonb, '{}') AS p FROM consumers) old
+WHERE old.id = consumers.id;
+
+ALTER TABLE consumers DROP COLUMN profile_json;
+
+CREATE INDEX idx_consumers_profile ON consumers USING GIN (profile jsonb_path_ops);
+
+COMMIT;
@@ -0,0 +1,31 @@
+-- 004_review_summaries.sql
+-- Adds review_summaries (per-product rating count, total and histogram, see
+-- review_stats.py) filled from the existing reviews, and replaces the plain
+-- reviews(product_id) index with the one review pages are read in order from.
+-- Run it with writers stopped.
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/004_review_summaries.sql
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS review_summaries (
+    product_id VARCHAR(255) PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+    review_count INTEGER NOT NULL,
+    rating_total INTEGER NOT NULL,
+    rating_1 INTEGER NOT NULL DEFAULT 0,
+    rating_2 INTEGER NOT NULL DEFAULT 0,
+    rating_3 INTEGER NOT NULL DEFAULT 0,
+    rating_4 INTEGER NOT NULL DEFAULT 0,
+    rating_5 INTEGER NOT NULL DEFAULT 0
+);
+
+DELETE FROM review_summaries;
+INSERT INTO review_summaries (product_id, review_count, rating_total, rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT product_id, count(*), sum(rating), count(*) FILTER (WHERE rating = 1), count(*) FILTER (WHERE rating = 2),
+       count(*) FILTER (WHERE rating = 3), count(*) FILTER (WHERE rating = 4), count(*) FILTER (WHERE rating = 5)
+FROM reviews
+GROUP BY product_id;
+
+CREATE INDEX IF NOT EXISTS idx_reviews_product_date ON reviews(product_id, review_date DESC, review_id DESC);
+DROP INDEX IF EXISTS idx_reviews_product_id;
+
+COMMIT;
@@ -0,0 +1,127 @@
+-- 005_partition_traceability_log.sql
+-- Recreates traceability_log partitioned by month (see log_partitions.py), with a
+-- BIGINT log_id, and adds the archive tables plus the archived boundary columns of
+-- traceability_heads. Existing events are copied into their month partitions, so the
+-- migration rewrites the whole log: run it with writers stopped, off-peak.
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/005_partition_traceability_log.sql
+BEGIN;
+
+ALTER TABLE traceability_log RENAME TO traceability_log_legacy;
+ALTER SEQUENCE traceability_log_log_id_seq RENAME TO traceability_log_legacy_log_id_seq;
+ALTER TABLE anchor_outbox DROP CONSTRAINT IF EXISTS anchor_outbox_log_id_fkey;
+ALTER TABLE traceability_log_legacy DROP CONSTRAINT traceability_log_pkey;
+ALTER TABLE traceability_log_legacy DROP CONSTRAINT IF EXISTS traceability_log_current_hash_key;
+DROP INDEX IF EXISTS idx_traceability_product_id;
+DROP INDEX IF EXISTS idx_traceability_anchor_batch_id;
+
+CREATE TABLE traceability_log (
+    log_id BIGSERIAL,
+    product_id VARCHAR(255) NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    location TEXT NOT NULL,
+    stage VARCHAR(255) NOT NULL,
+    actor TEXT NOT NULL,
+    status VARCHAR(255),
+    notes TEXT,
+    previous_hash TEXT NOT NULL,
+    current_hash TEXT NOT NULL,
+    blockchain_tx_id TEXT,
+    anchor_batch_id INTEGER,
+    merkle_root TEXT,
+    merkle_proof JSONB,
+    PRIMARY KEY (log_id, timestamp),
+    FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE,
+    FOREIGN KEY(anchor_batch_id) REFERENCES anchor_batches(batch_id)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE traceability_log_default PARTITION OF traceability_log DEFAULT;
+
+CREATE TABLE traceability_archives (
+    archive_id SERIAL PRIMARY KEY,
+    partition_name TEXT UNIQUE NOT NULL,
+    range_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    range_end TIMESTAMP WITH TIME ZONE NOT NULL,
+    uri TEXT NOT NULL,
+    row_count BIGINT NOT NULL,
+    sha256 TEXT NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE traceability_archive_products (
+    archive_id INTEGER NOT NULL REFERENCES traceability_archives(archive_id),
+    product_id VARCHAR(255) NOT NULL,
+    event_count INTEGER NOT NULL,
+    first_log_id BIGINT NOT NULL,
+    last_log_id BIGINT NOT NULL,
+    PRIMARY KEY (product_id, archive_id)
+);
+
+CREATE OR REPLACE FUNCTION ensure_traceability_partitions(from_month TIMESTAMPTZ, to_month TIMESTAMPTZ)
+    RETURNS SETOF TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    month_start TIMESTAMPTZ;
+    part_name TEXT;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('traceability_log_partitions'));
+    FOR month_start IN
+        SELECT date_trunc('month', d.timestamp, 'UTC') FROM traceability_log_default d
+        UNION
+        SELECT generate_series(date_trunc('month', from_month, 'UTC'), date_trunc('month', to_month, 'UTC'), interval '1 month')
+        ORDER BY 1
+    LOOP
+        part_name := 'traceability_log_' || to_char(month_start AT TIME ZONE 'UTC', 'YYYY_MM');
+        CONTINUE WHEN to_regclass(part_name) IS NOT NULL
+            OR EXISTS (SELECT 1 FROM traceability_archives a WHERE a.partition_name = part_name);
+        EXECUTE format('CREATE TABLE %I (LIKE traceability_log INCLUDING DEFAULTS)', part_name);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM traceability_log_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+            month_start, month_start + interval '1 month', part_name
+        );
+        EXECUTE format(
+            'ALTER TABLE traceability_log ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            part_name, month_start, month_start + interval '1 month'
+        );
+        RETURN NEXT part_name;
+    END LOOP;
+END $$;
+
+-- Every month that has events, through three months ahead
+DO $$ BEGIN
+    PERFORM ensure_traceability_partitions(
+        COALESCE((SELECT min(timestamp) FROM traceability_log_legacy), now()), now() + interval '3 months'
+    );
+END $$;
+
+INSERT INTO traceability_log (log_id, product_id, timestamp, location, stage, actor, status, notes, previous_hash,
+                              current_hash, blockchain_tx_id, anchor_batch_id, merkle_root, merkle_proof)
+SELECT log_id, product_id, timestamp, location, stage, actor, status, notes, previous_hash,
+       current_hash, blockchain_tx_id, anchor_batch_id, merkle_root, merkle_proof
+FROM traceability_log_legacy;
+
+SELECT setval('traceability_log_log_id_seq', COALESCE(max(log_id), 1), max(log_id) IS NOT NULL) FROM traceability_log;
+
+-- Built once the rows are in, one partition at a time
+CREATE INDEX idx_traceability_product_id ON traceability_log(product_id, log_id);
+CREATE INDEX idx_traceability_current_hash ON traceability_log(current_hash);
+CREATE INDEX idx_traceability_anchor_batch_id ON traceability_log(anchor_batch_id);
+
+ALTER TABLE traceability_heads
+    ADD COLUMN IF NOT EXISTS archived_log_id BIGINT,
+    ADD COLUMN IF NOT EXISTS archived_hash TEXT;
+
+-- Archiving moves every product's boundary on its head row, so each chain needs one
+INSERT INTO traceability_heads (product_id, head_hash, event_count, last_location, last_actor, last_stage, last_event_at)
+SELECT product_id, (array_agg(current_hash ORDER BY log_id DESC))[1], count(*),
+       (array_agg(location ORDER BY log_id DESC))[1], (array_agg(actor ORDER BY log_id DESC))[1],
+       (array_agg(stage ORDER BY log_id DESC))[1], (array_agg(timestamp ORDER BY log_id DESC))[1]
+FROM traceability_log
+GROUP BY product_id
+ON CONFLICT (product_id) DO NOTHING;
+
+ALTER TABLE anchor_outbox ALTER COLUMN log_id TYPE BIGINT;
+ALTER TABLE chain_audit_checkpoints ALTER COLUMN last_log_id TYPE BIGINT;
+
+DROP TABLE traceability_log_legacy;
+
+COMMIT;
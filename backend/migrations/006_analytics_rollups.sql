@@ -0,0 +1,83 @@
+-- 006_analytics_rollups.sql
+-- Adds the supply-chain analytics rollups (see analytics.py): daily events and
+-- dwell per stage, transit times between locations and recalls per brand, filled
+-- from the existing traceability_log and product_recalls rows. Run it with writers
+-- stopped.
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/006_analytics_rollups.sql
+BEGIN;
+
+-- Events per stage, and the dwell of the stage: time from an event in it to the product's next event
+CREATE TABLE IF NOT EXISTS analytics_stage_daily (
+    manufacturer_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    batch_number TEXT NOT NULL,
+    stage VARCHAR(255) NOT NULL,
+    event_count INTEGER NOT NULL,
+    dwell_count INTEGER NOT NULL,
+    dwell_seconds DOUBLE PRECISION NOT NULL,
+    dwell_seconds_max DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (manufacturer_id, day, batch_number, stage)
+);
+
+-- Consecutive events of a product at different locations, with the time between them
+CREATE TABLE IF NOT EXISTS analytics_transit_daily (
+    manufacturer_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    batch_number TEXT NOT NULL,
+    from_location TEXT NOT NULL,
+    to_location TEXT NOT NULL,
+    trip_count INTEGER NOT NULL,
+    transit_seconds DOUBLE PRECISION NOT NULL,
+    transit_seconds_min DOUBLE PRECISION NOT NULL,
+    transit_seconds_max DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (manufacturer_id, day, batch_number, from_location, to_location)
+);
+
+-- Recalls touching the manufacturer's products, per brand
+CREATE TABLE IF NOT EXISTS analytics_recall_daily (
+    manufacturer_id VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    brand TEXT NOT NULL,
+    recall_count INTEGER NOT NULL,
+    product_count INTEGER NOT NULL,
+    PRIMARY KEY (manufacturer_id, day, brand)
+);
+
+-- Same statements as analytics.rebuild() for every manufacturer
+TRUNCATE analytics_stage_daily, analytics_transit_daily, analytics_recall_daily;
+
+CREATE TEMPORARY TABLE analytics_steps AS
+SELECT p.manufacturer_id, p.batch_number, l.location, l.stage, l.timestamp, (l.timestamp AT TIME ZONE 'UTC')::date AS day,
+       lag(l.timestamp) OVER w AS previous_at, lag(l.location) OVER w AS previous_location, lag(l.stage) OVER w AS previous_stage
+FROM traceability_log l JOIN products p ON p.id = l.product_id
+WINDOW w AS (PARTITION BY l.product_id ORDER BY l.log_id);
+
+INSERT INTO analytics_stage_daily (manufacturer_id, day, batch_number, stage, event_count, dwell_count, dwell_seconds, dwell_seconds_max)
+SELECT manufacturer_id, day, batch_number, stage, sum(events), sum(dwells), COALESCE(sum(seconds), 0), COALESCE(max(seconds), 0)
+FROM (
+    SELECT manufacturer_id, day, batch_number, stage, 1 AS events, 0 AS dwells, NULL::double precision AS seconds
+    FROM analytics_steps
+    UNION ALL
+    SELECT manufacturer_id, day, batch_number, previous_stage, 0, 1, extract(epoch FROM timestamp - previous_at)::double precision
+    FROM analytics_steps WHERE previous_at IS NOT NULL
+) s
+GROUP BY manufacturer_id, day, batch_number, stage;
+
+INSERT INTO analytics_transit_daily (manufacturer_id, day, batch_number, from_location, to_location,
+                                     trip_count, transit_seconds, transit_seconds_min, transit_seconds_max)
+SELECT manufacturer_id, day, batch_number, previous_location, location, count(*),
+       sum(extract(epoch FROM timestamp - previous_at)), min(extract(epoch FROM timestamp - previous_at)),
+       max(extract(epoch FROM timestamp - previous_at))
+FROM analytics_steps
+WHERE previous_at IS NOT NULL AND previous_location <> location
+GROUP BY manufacturer_id, day, batch_number, previous_location, location;
+
+INSERT INTO analytics_recall_daily (manufacturer_id, day, brand, recall_count, product_count)
+SELECT p.manufacturer_id, (r.recall_date AT TIME ZONE 'UTC')::date, p.brand, count(DISTINCT r.recall_id), count(*)
+FROM product_recalls r JOIN products p ON p.batch_number = r.batch_number
+GROUP BY 1, 2, 3;
+
+DROP TABLE analytics_steps;
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- 007_product_search_indexes.sql
+-- Adds the indexes behind product search filters (see product_search.py) to databases
+-- created before search existed; the search_vector index comes with 001. Building them
+-- locks products against writes, so run it off-peak:
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/007_product_search_indexes.sql
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category, sub_category, id);
+CREATE INDEX IF NOT EXISTS idx_products_brand ON products(brand, id);
+CREATE INDEX IF NOT EXISTS idx_products_expiry_date ON products(expiry_date, id);
+CREATE INDEX IF NOT EXISTS idx_products_organic ON products(id) WHERE organic_certified;
+CREATE INDEX IF NOT EXISTS idx_products_peanut_free ON products(id) WHERE NOT contains_peanuts;
+CREATE INDEX IF NOT EXISTS idx_products_tree_nut_free ON products(id) WHERE NOT contains_tree_nuts;
+CREATE INDEX IF NOT EXISTS idx_products_milk_free ON products(id) WHERE NOT contains_milk;
+CREATE INDEX IF NOT EXISTS idx_products_egg_free ON products(id) WHERE NOT contains_eggs;
+CREATE INDEX IF NOT EXISTS idx_products_fish_free ON products(id) WHERE NOT contains_fish;
+CREATE INDEX IF NOT EXISTS idx_products_shellfish_free ON products(id) WHERE NOT contains_shellfish;
+CREATE INDEX IF NOT EXISTS idx_products_wheat_free ON products(id) WHERE NOT contains_wheat;
+CREATE INDEX IF NOT EXISTS idx_products_soy_free ON products(id) WHERE NOT contains_soy;
+
+COMMIT;
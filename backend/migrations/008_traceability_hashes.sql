@@ -0,0 +1,19 @@
+-- 008_traceability_hashes.sql
+-- Restores the uniqueness of traceability_log.current_hash, which the partitioned log
+-- (005) cannot enforce itself: adds traceability_hashes (see ledger.record_hashes) and
+-- fills it from the live events (a hash the log already holds twice is recorded once).
+-- Run it with writers stopped:
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/008_traceability_hashes.sql
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS traceability_hashes (
+    current_hash TEXT PRIMARY KEY,
+    product_id VARCHAR(255) NOT NULL
+);
+
+INSERT INTO traceability_hashes (current_hash, product_id)
+SELECT current_hash, product_id FROM traceability_log
+ON CONFLICT (current_hash) DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,223 @@
+# product_ingest.py
+# Product onboarding: row builders shared with POST /products/add, and the bulk importer
+# behind POST /products/bulk and the command line.
+#
+# Bulk records (CSV or NDJSON) are parsed lazily, validated in chunks, and each valid
+# chunk is written with two multi-row inserts (products + genesis traceability logs)
+# inside a savepoint. A chunk that fails in the database is retried row by row, so
+# one bad record is reported instead of aborting the import.
+#
+#   python product_ingest.py catalog.csv --manufacturer-email ops@brand.example
+import csv
+import datetime
+import hashlib
+import io
+import json
+import uuid
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from psycopg2.extras import execute_values
+from pydantic import ValidationError
+
+from analytics import record_events
+from ledger import EVENT_COLUMNS, init_chain_heads, record_hashes
+from recall_impact import record_touchpoints
+
+PRODUCT_COLUMNS = (
+    "id", "name", "brand", "category", "sub_category", "image_url", "ingredients",
+    "sodium", "sugar", "calories_per_100g", "protein_g", "carbs_g", "fat_g", "fiber_g",
+    "contains_peanuts", "contains_tree_nuts", "contains_milk", "contains_eggs",
+    "contains_fish", "contains_shellfish", "contains_wheat", "contains_soy",
+    "organic_certified", "fssai_license", "iso_certification",
+    "batch_number", "manufacturing_date", "expiry_date", "mrp", "net_weight", "manufacturer_id",
+)
+MANUFACTURER_INDEX = PRODUCT_COLUMNS.index("manufacturer_id")
+BATCH_INDEX = PRODUCT_COLUMNS.index("batch_number")
+
+# CSV columns that belong to a nested ProductCreate object
+NESTED_CSV_FIELDS = {
+    "nutrition": ("sodium", "sugar", "calories_per_100g", "protein_g", "carbs_g", "fat_g", "fiber_g"),
+    "allergens": ("contains_peanuts", "contains_tree_nuts", "contains_milk", "contains_eggs",
+                  "contains_fish", "contains_shellfish", "contains_wheat", "contains_soy"),
+    "certifications": ("organic_certified", "fssai_license", "iso_certification"),
+}
+
+
+def new_product_id(batch_number: str) -> str:
+    return f"BFT_{batch_number.replace(' ','')}_{uuid.uuid4().hex[:6].upper()}"
+
+
+def clean_ingredients(ingredients: List[str]) -> List[str]:
+    """Label ingredients with blanks dropped and whitespace collapsed. The canonical keys
+    used for lookups (products.ingredient_keys) are derived from these by the database."""
+    return [" ".join(name.split()) for name in ingredients if name and name.strip()]
+
+
+def product_values(product_id: str, product_data, manufacturer_id: str) -> tuple:
+    """Values for PRODUCT_COLUMNS from a validated ProductCreate."""
+    return (
+        product_id, product_data.name, product_data.brand, product_data.category, product_data.sub_category,
+        product_data.image_url, clean_ingredients(product_data.ingredients),
+        product_data.nutrition.sodium, product_data.nutrition.sugar, product_data.nutrition.calories_per_100g,
+        product_data.nutrition.protein_g, product_data.nutrition.carbs_g, product_data.nutrition.fat_g,
+        product_data.nutrition.fiber_g,
+        product_data.allergens.contains_peanuts, product_data.allergens.contains_tree_nuts,
+        product_data.allergens.contains_milk, product_data.allergens.contains_eggs,
+        product_data.allergens.contains_fish, product_data.allergens.contains_shellfish,
+        product_data.allergens.contains_wheat, product_data.allergens.contains_soy,
+        product_data.certifications.organic_certified, product_data.certifications.fssai_license,
+        product_data.certifications.iso_certification,
+        product_data.batch_number, product_data.manufacturing_date, product_data.expiry_date,
+        product_data.mrp, product_data.net_weight, manufacturer_id
+    )
+
+
+def genesis_log_values(product_id: str, brand: str, actor: str, timestamp: datetime.datetime) -> tuple:
+    """Values for ledger.EVENT_COLUMNS of a product's first ("manufacturing") traceability event."""
+    first_event_location = f"Manufacturing Unit, {brand}"
+    genesis_hash_data = f"{product_id}{timestamp.isoformat()}{first_event_location}manufacturing{actor}0"
+    genesis_hash = hashlib.sha256(genesis_hash_data.encode()).hexdigest()
+    return (product_id, timestamp, first_event_location, "manufacturing", actor, "Completed", "Product created.", "0", genesis_hash)
+
+
+def insert_products(cursor, product_rows: List[tuple], log_rows: List[tuple]):
+    execute_values(cursor, f"INSERT INTO products ({', '.join(PRODUCT_COLUMNS)}) VALUES %s", product_rows, page_size=len(product_rows))
+    execute_values(cursor, f"INSERT INTO traceability_log ({', '.join(EVENT_COLUMNS)}) VALUES %s", log_rows, page_size=len(log_rows))
+    record_hashes(cursor, log_rows)
+    init_chain_heads(cursor, log_rows)
+    record_touchpoints(cursor, log_rows)
+    # Genesis events have no previous event: they only count towards events per stage
+    owners = {row[0]: (row[MANUFACTURER_INDEX], row[BATCH_INDEX]) for row in product_rows}
+    record_events(cursor, [(*owners[row[0]], row[1], row[2], row[3], None, None, None) for row in log_rows])
+
+
+# --- Parsing ---
+def _csv_record(row: dict) -> dict:
+    record = {key: (value if value != "" else None) for key, value in row.items() if key}
+    for group, fields in NESTED_CSV_FIELDS.items():
+        record[group] = {field: record.pop(field) for field in fields if field in record and record[field] is not None}
+    ingredients = record.get("ingredients") or ""
+    record["ingredients"] = [i.strip() for i in ingredients.split(",") if i.strip()]
+    return record
+
+
+def parse_records(stream: io.TextIOBase, fmt: str) -> Iterator[Tuple[int, object]]:
+    """Yields (row_number, record) lazily. A record that cannot be parsed is yielded as the exception."""
+    if fmt == "csv":
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, _csv_record(row)
+    elif fmt == "ndjson":
+        for row_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield row_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, ValueError(f"Invalid JSON: {e}")
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- Import ---
+def import_products(conn, records: Iterable[Tuple[int, object]], validate: Callable, manufacturer_id: str,
+                    actor: str, chunk_size: int = 1000) -> dict:
+    """
+    Validates and inserts (row_number, record) pairs chunk by chunk, committing after
+    each chunk. Returns counts, the created product ids and per-row errors.
+    """
+    report = {"received": 0, "inserted": 0, "failed": 0, "products": [], "errors": []}
+    cursor = conn.cursor()
+    for chunk in _chunks(records, chunk_size):
+        report["received"] += len(chunk)
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        valid = []
+        for row_number, record in chunk:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                product_data = validate(record)
+            except ValidationError as e:
+                report["errors"].append({"row": row_number, "error": json.loads(e.json(include_url=False, include_input=False))})
+                continue
+            except Exception as e:
+                report["errors"].append({"row": row_number, "error": str(e)})
+                continue
+            product_id = new_product_id(product_data.batch_number)
+            valid.append((
+                row_number,
+                product_values(product_id, product_data, manufacturer_id),
+                genesis_log_values(product_id, product_data.brand, actor, timestamp),
+            ))
+        if valid:
+            _insert_chunk(cursor, valid, report)
+        conn.commit()
+    cursor.close()
+    report["failed"] = len(report["errors"])
+    report["errors"].sort(key=lambda error: error["row"])
+    return report
+
+
+def _insert_chunk(cursor, valid: list, report: dict):
+    cursor.execute("SAVEPOINT bulk_chunk")
+    try:
+        insert_products(cursor, [v[1] for v in valid], [v[2] for v in valid])
+        cursor.execute("RELEASE SAVEPOINT bulk_chunk")
+        inserted = valid
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT bulk_chunk")
+        inserted = []
+        for item in valid:
+            cursor.execute("SAVEPOINT bulk_row")
+            try:
+                insert_products(cursor, [item[1]], [item[2]])
+                cursor.execute("RELEASE SAVEPOINT bulk_row")
+                inserted.append(item)
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT bulk_row")
+                report["errors"].append({"row": item[0], "error": f"Database error: {e}".strip()})
+    report["inserted"] += len(inserted)
+    report["products"].extend({"row": item[0], "id": item[1][0]} for item in inserted)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import psycopg2
+
+    from main import ProductCreate, settings
+
+    parser = argparse.ArgumentParser(description="Bulk-import a product catalogue (CSV or NDJSON of ProductCreate records).")
+    parser.add_argument("file")
+    parser.add_argument("--manufacturer-email", required=True)
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.file.lower().endswith(".csv") else "ndjson")
+    conn = psycopg2.connect(settings.DATABASE_URL)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM manufacturers WHERE email = %s", (args.manufacturer_email,))
+    manufacturer = cursor.fetchone()
+    cursor.close()
+    if not manufacturer:
+        sys.exit(f"No manufacturer registered with email {args.manufacturer_email}")
+
+    with open(args.file, newline="", encoding="utf-8") as f:
+        report = import_products(conn, parse_records(f, fmt), ProductCreate.model_validate, manufacturer[0],
+                                 args.manufacturer_email, args.chunk_size)
+    conn.close()
+    print(f"received={report['received']} inserted={report['inserted']} failed={report['failed']}")
+    for error in report["errors"]:
+        print(f"  row {error['row']}: {error['error']}")
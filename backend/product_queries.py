@@ -0,0 +1,182 @@
+# product_queries.py
+# SQL that assembles product payloads inside Postgres.
+#
+# The product detail document (product + traceability + recalls + reviews) is built
+# with lateral joins and JSON aggregation in a single round-trip, and returned as
+# JSON text so the API can send it as-is without building Pydantic objects. The
+# shape matches the Product response model in main.py.
+#
+# Reviews are not embedded in full: the document carries the rating summary kept by
+# review_stats.py and the EMBEDDED_REVIEWS most recent reviews; the rest are paged
+# through GET /reviews/{product_id}.
+#
+# Manufacturer listings reuse the same fragments for a whole keyset page at a time,
+# either as the full document or as a lighter summary (see PRODUCT_SUMMARY_SQL).
+from typing import Iterator, List, Optional
+
+EMBEDDED_REVIEWS = 5
+
+# Key/value pairs of the product row, with the nested objects the Product model uses.
+# Meant to be placed inside json_build_object(...) so callers can append more keys.
+PRODUCT_FIELDS = """
+        'id', p.id,
+        'name', p.name,
+        'brand', p.brand,
+        'category', p.category,
+        'sub_category', p.sub_category,
+        'image_url', p.image_url,
+        'ingredients', p.ingredients,
+        'nutrition', json_build_object(
+            'sodium', p.sodium, 'sugar', p.sugar, 'calories_per_100g', p.calories_per_100g,
+            'protein_g', p.protein_g, 'carbs_g', p.carbs_g, 'fat_g', p.fat_g, 'fiber_g', p.fiber_g
+        ),
+        'allergens', json_build_object(
+            'contains_peanuts', p.contains_peanuts, 'contains_tree_nuts', p.contains_tree_nuts,
+            'contains_milk', p.contains_milk, 'contains_eggs', p.contains_eggs,
+            'contains_fish', p.contains_fish, 'contains_shellfish', p.contains_shellfish,
+            'contains_wheat', p.contains_wheat, 'contains_soy', p.contains_soy
+        ),
+        'certifications', json_build_object(
+            'organic_certified', p.organic_certified, 'fssai_license', p.fssai_license,
+            'iso_certification', p.iso_certification
+        ),
+        'batch_number', p.batch_number,
+        'manufacturing_date', p.manufacturing_date,
+        'expiry_date', p.expiry_date,
+        'mrp', p.mrp,
+        'net_weight', p.net_weight,
+        'manufacturer_id', p.manufacturer_id
+"""
+
+TRACEABILITY_ENTRY_JSON = """
+    json_build_object(
+        'log_id', l.log_id, 'product_id', l.product_id, 'timestamp', l.timestamp,
+        'location', l.location, 'stage', l.stage, 'actor', l.actor, 'status', l.status, 'notes', l.notes,
+        'previous_hash', l.previous_hash, 'current_hash', l.current_hash, 'blockchain_tx_id', l.blockchain_tx_id,
+        'merkle_root', l.merkle_root, 'merkle_proof', l.merkle_proof,
+        'onchain_confirmed', EXISTS (SELECT 1 FROM chain_events e WHERE e.event_hash = COALESCE(l.merkle_root, l.current_hash))
+    )
+"""
+
+RECALL_JSON = """
+    json_build_object('recall_id', r.recall_id, 'batch_number', r.batch_number, 'reason', r.reason, 'recall_date', r.recall_date)
+"""
+
+REVIEW_JSON = """
+    json_build_object(
+        'review_id', v.review_id, 'product_id', v.product_id, 'consumer_email', v.consumer_email,
+        'rating', v.rating, 'comment', v.comment, 'review_date', v.review_date
+    )
+"""
+
+# Rating summary of a product from its review_summaries row `s` (LEFT JOINed, so it may be NULL)
+REVIEW_SUMMARY_JSON = """
+    json_build_object(
+        'review_count', COALESCE(s.review_count, 0),
+        'average_rating', round(s.rating_total::numeric / NULLIF(s.review_count, 0), 2),
+        'histogram', json_build_object(
+            '1', COALESCE(s.rating_1, 0), '2', COALESCE(s.rating_2, 0), '3', COALESCE(s.rating_3, 0),
+            '4', COALESCE(s.rating_4, 0), '5', COALESCE(s.rating_5, 0)
+        )
+    )
+"""
+
+PRODUCT_DOCUMENT_SQL = f"""
+SELECT json_build_object(
+    {PRODUCT_FIELDS},
+    'traceability', COALESCE(trace.entries, '[]'::json),
+    'recalls', COALESCE(recalls.entries, '[]'::json),
+    'review_summary', {REVIEW_SUMMARY_JSON},
+    'reviews', COALESCE(reviews.entries, '[]'::json)
+)::text AS document
+FROM products p
+LEFT JOIN review_summaries s ON s.product_id = p.id
+LEFT JOIN LATERAL (
+    SELECT json_agg({TRACEABILITY_ENTRY_JSON} ORDER BY l.timestamp, l.log_id) AS entries
+    FROM traceability_log l WHERE l.product_id = p.id
+) trace ON true
+LEFT JOIN LATERAL (
+    SELECT json_agg({RECALL_JSON} ORDER BY r.recall_date) AS entries
+    FROM product_recalls r WHERE r.batch_number = p.batch_number
+) recalls ON true
+LEFT JOIN LATERAL (
+    SELECT json_agg({REVIEW_JSON} ORDER BY v.review_date DESC, v.review_id DESC) AS entries
+    FROM (
+        SELECT * FROM reviews v WHERE v.product_id = p.id
+        ORDER BY v.review_date DESC, v.review_id DESC LIMIT {EMBEDDED_REVIEWS}
+    ) v
+) reviews ON true
+"""
+
+PRODUCT_DETAIL_SQL = PRODUCT_DOCUMENT_SQL + "WHERE p.id = %s"
+
+# Product fields plus counts and the latest traceability event, for dashboards.
+PRODUCT_SUMMARY_SQL = f"""
+SELECT json_build_object(
+    {PRODUCT_FIELDS},
+    'event_count', trace.event_count,
+    'latest_event', latest.entry,
+    'recall_count', recalls.recall_count,
+    'review_count', COALESCE(s.review_count, 0),
+    'average_rating', round(s.rating_total::numeric / NULLIF(s.review_count, 0), 2)
+)::text AS document
+FROM products p
+LEFT JOIN review_summaries s ON s.product_id = p.id
+LEFT JOIN LATERAL (
+    SELECT count(*) AS event_count FROM traceability_log l WHERE l.product_id = p.id
+) trace ON true
+LEFT JOIN LATERAL (
+    SELECT {TRACEABILITY_ENTRY_JSON} AS entry
+    FROM traceability_log l WHERE l.product_id = p.id
+    ORDER BY l.timestamp DESC, l.log_id DESC LIMIT 1
+) latest ON true
+LEFT JOIN LATERAL (
+    SELECT count(*) AS recall_count FROM product_recalls r WHERE r.batch_number = p.batch_number
+) recalls ON true
+"""
+
+MANUFACTURER_PAGE_FILTER = """
+WHERE p.manufacturer_id = %(manufacturer_id)s AND (%(after)s::text IS NULL OR p.id > %(after)s)
+ORDER BY p.id
+"""
+
+
+def fetch_product_json(conn, product_id: str) -> Optional[str]:
+    """Returns the full product document as JSON text, or None if the product does not exist."""
+    cursor = conn.cursor()
+    cursor.execute(PRODUCT_DETAIL_SQL, (product_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+
+def _manufacturer_products_sql(view: str, limited: bool) -> str:
+    base = PRODUCT_SUMMARY_SQL if view == "summary" else PRODUCT_DOCUMENT_SQL
+    return base + MANUFACTURER_PAGE_FILTER + ("LIMIT %(limit)s" if limited else "")
+
+
+def fetch_manufacturer_products(conn, manufacturer_id: str, view: str = "full",
+                                after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+    """One keyset page (ordered by product id) of product documents as JSON text."""
+    cursor = conn.cursor()
+    cursor.execute(
+        _manufacturer_products_sql(view, limit is not None),
+        {"manufacturer_id": manufacturer_id, "after": after, "limit": limit}
+    )
+    documents = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return documents
+
+
+def iter_manufacturer_products(conn, manufacturer_id: str, view: str = "full",
+                               after: Optional[str] = None, chunk_size: int = 200) -> Iterator[str]:
+    """Streams every matching document through a server-side cursor, chunk_size rows at a time."""
+    cursor = conn.cursor(name="manufacturer_products")
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(_manufacturer_products_sql(view, False), {"manufacturer_id": manufacturer_id, "after": after})
+        for row in cursor:
+            yield row[0]
+    finally:
+        cursor.close()
+        conn.rollback()
@@ -0,0 +1,179 @@
+# product_search.py
+# Catalog search and browse: filters, free text, keyset pages and facet counts.
+#
+# Every filter maps onto an index in database_setup.sql: free text onto the weighted
+# search_vector GIN index (every word is matched as a prefix, so "crunch" finds
+# "Crunchy"), category/brand/expiry onto b-tree indexes, ingredients onto the GIN
+# index of the canonical ingredient_keys, and "free from <allergen>" or organic onto
+# partial indexes. Pages are keyset-paginated on the sort key plus id,
+# and the opaque cursor of the last row is sent back as X-Next-Cursor, as in the
+# manufacturer listing. Facets are counted in one GROUPING SETS pass over the matches.
+import base64
+import json
+import re
+from typing import List, Optional, Tuple
+
+from product_queries import PRODUCT_FIELDS
+
+ALLERGENS = ("peanuts", "tree_nuts", "milk", "eggs", "fish", "shellfish", "wheat", "soy")
+SORTS = ("relevance", "id", "expiry")
+FACET_LIMIT = 20
+# Product ids are an upper-case prefix and an underscore (product_ingest.new_product_id,
+# the benchmark seeder); encoded cursors always start with "Wy" (base64 of '["').
+RAW_PRODUCT_ID = re.compile(r"[A-Z]+_\S+")
+
+RANK_SQL = "ts_rank(p.search_vector, to_tsquery('english', %(q)s))::float8"
+
+# Per sort: the sort key, the keyset condition after a cursor, and the ORDER BY
+SORT_SQL = {
+    "relevance": (RANK_SQL, f"({RANK_SQL} < %(after_key)s OR ({RANK_SQL} = %(after_key)s AND p.id > %(after_id)s))",
+                  f"{RANK_SQL} DESC, p.id"),
+    "expiry": ("p.expiry_date", "(p.expiry_date, p.id) > (%(after_key)s::date, %(after_id)s)", "p.expiry_date, p.id"),
+    "id": ("NULL", "p.id > %(after_id)s", "p.id"),
+}
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+def prefix_query(text: str) -> str:
+    """Search text as a tsquery that requires every word, each as a prefix ("masala oat" -> "masala:* & oat:*")."""
+    return " & ".join(f"{word}:*" for word in re.findall(r"\w+", text))
+
+
+def filter_sql(filters: dict) -> Tuple[str, dict]:
+    """WHERE clause (over products p) and its parameters for the given search filters."""
+    clauses, params = [], {}
+    if filters.get("q"):
+        query = prefix_query(filters["q"])
+        if not query:
+            raise InvalidSearch("Search text must contain at least one letter or digit")
+        clauses.append("p.search_vector @@ to_tsquery('english', %(q)s)")
+        params["q"] = query
+    for column in ("category", "sub_category", "brand"):
+        if filters.get(column):
+            clauses.append(f"p.{column} = %({column})s")
+            params[column] = filters[column]
+    if filters.get("ingredient"):
+        # canonical_ingredients() is immutable, so it folds to a constant and the GIN index applies
+        clauses.append("p.ingredient_keys @> canonical_ingredients(%(ingredient)s::text[])")
+        params["ingredient"] = list(filters["ingredient"])
+    for allergen in filters.get("free_from") or []:
+        if allergen not in ALLERGENS:
+            raise InvalidSearch(f"Unknown allergen '{allergen}'. Use one of: {', '.join(ALLERGENS)}")
+        clauses.append(f"NOT p.contains_{allergen}")
+    if filters.get("organic") is not None:
+        clauses.append("p.organic_certified = %(organic)s")
+        params["organic"] = filters["organic"]
+    if filters.get("expires_after"):
+        clauses.append("p.expiry_date >= %(expires_after)s")
+        params["expires_after"] = filters["expires_after"]
+    if filters.get("expires_before"):
+        clauses.append("p.expiry_date <= %(expires_before)s")
+        params["expires_before"] = filters["expires_before"]
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def encode_cursor(sort: str, key, product_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, key, product_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, str]:
+    try:
+        cursor_sort, key, product_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise InvalidSearch("Invalid cursor")
+    if cursor_sort != sort:
+        raise InvalidSearch("Cursor belongs to a different sort order")
+    return key, product_id
+
+
+def listing_cursor(product_id: str) -> str:
+    """The cursor of an id-ordered listing such as /manufacturer/products: the "id" sort one."""
+    return encode_cursor("id", None, product_id)
+
+
+def decode_listing_cursor(cursor: str) -> str:
+    """The product id a listing cursor points after. Raw product ids, which the listings
+    sent before their cursors were opaque, are still accepted; anything else that is not
+    an "id" sort cursor raises InvalidSearch."""
+    if RAW_PRODUCT_ID.fullmatch(cursor):
+        return cursor
+    return decode_cursor(cursor, "id")[1]
+
+
+def resolve_sort(filters: dict, sort: Optional[str]) -> str:
+    sort = sort or ("relevance" if filters.get("q") else "id")
+    if sort not in SORTS:
+        raise InvalidSearch(f"Unknown sort '{sort}'")
+    if sort == "relevance" and not filters.get("q"):
+        raise InvalidSearch("sort=relevance needs a search text (q)")
+    return sort
+
+
+def search_products(conn, filters: dict, sort: Optional[str] = None, after: Optional[str] = None,
+                    limit: int = 20) -> Tuple[List[str], Optional[str]]:
+    """One page of matching products as JSON text, plus the cursor of the next page (or None)."""
+    sort = resolve_sort(filters, sort)
+    where, params = filter_sql(filters)
+    sort_key, keyset, order_by = SORT_SQL[sort]
+    conditions = [where[len("WHERE "):]] if where else []
+    if sort == "expiry":
+        conditions.append("p.expiry_date IS NOT NULL")
+    if after:
+        params["after_key"], params["after_id"] = decode_cursor(after, sort)
+        conditions.append(keyset)
+    score = RANK_SQL if sort == "relevance" else "NULL"
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT json_build_object({PRODUCT_FIELDS}, 'score', {score})::text, {sort_key}, p.id
+        FROM products p
+        {("WHERE " + " AND ".join(conditions)) if conditions else ""}
+        ORDER BY {order_by}
+        LIMIT %(limit)s
+        """,
+        {**params, "limit": limit}
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    next_cursor = None
+    if len(rows) == limit:
+        key = rows[-1][1]
+        next_cursor = encode_cursor(sort, key.isoformat() if sort == "expiry" else key, rows[-1][2])
+    return [row[0] for row in rows], next_cursor
+
+
+def search_facets(conn, filters: dict) -> dict:
+    """Counts of the matching products per category, sub-category and brand (top FACET_LIMIT each),
+    plus how many of them are organic or free from each allergen."""
+    where, params = filter_sql(filters)
+    allergen_counts = ", ".join(f"count(*) FILTER (WHERE NOT p.contains_{allergen})" for allergen in ALLERGENS)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT GROUPING(p.category), GROUPING(p.sub_category), GROUPING(p.brand),
+               p.category, p.sub_category, p.brand, count(*),
+               count(*) FILTER (WHERE p.organic_certified), {allergen_counts}
+        FROM products p {where}
+        GROUP BY GROUPING SETS ((p.category), (p.sub_category), (p.brand), ())
+        """,
+        params
+    )
+    facets = {"total": 0, "category": [], "sub_category": [], "brand": [], "organic": 0, "free_from": {}}
+    for g_category, g_sub_category, g_brand, category, sub_category, brand, count, organic, *free in cursor.fetchall():
+        if not g_category:
+            facets["category"].append({"value": category, "count": count})
+        elif not g_sub_category:
+            facets["sub_category"].append({"value": sub_category, "count": count})
+        elif not g_brand:
+            facets["brand"].append({"value": brand, "count": count})
+        else:
+            facets["total"] = count
+            facets["organic"] = organic
+            facets["free_from"] = dict(zip(ALLERGENS, free))
+    cursor.close()
+    for name in ("category", "sub_category", "brand"):
+        facets[name] = sorted(facets[name], key=lambda bucket: (-bucket["count"], bucket["value"] or ""))[:FACET_LIMIT]
+    return facets
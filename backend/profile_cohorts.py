@@ -0,0 +1,71 @@
+# profile_cohorts.py
+# Counting consumers by Swasth Wallet contents, e.g. "how many users are allergic to
+# peanuts" to size a recall alert.
+#
+# Profiles live in consumers.profile (JSONB) under a GIN jsonb_path_ops index, so every
+# count is a containment query (profile @> '{"allergies": ["peanuts"]}') answered from
+# the index. Filters on several values must all match. A count can also be limited to
+# the consumers who reviewed a product of one batch (batch_consumers, see recall_impact.py).
+# Values are stored normalized (see normalize_values), and filters are normalized the same way.
+import json
+from typing import Dict, List, Optional
+
+from swasth_scoring import ALLERGENS, CONDITION_ALLERGENS, CONDITION_LIMITS, DIETS, GOAL_WEIGHTS
+
+# filter name -> profile key
+COHORT_FIELDS = {"allergy": "allergies", "condition": "conditions", "diet": "diet", "goal": "goals"}
+
+# Values the summary counts: the ones the consumer dashboard offers
+KNOWN_VALUES = {
+    "allergies": ALLERGENS,
+    "conditions": tuple(sorted({*CONDITION_LIMITS, *CONDITION_ALLERGENS})),
+    "diet": DIETS,
+    "goals": tuple(sorted(GOAL_WEIGHTS)),
+}
+
+
+def normalize_values(key: str, values: List[str]) -> List[str]:
+    """Lower-cased, whitespace-collapsed and de-duplicated (in order); allergies use underscores ("tree_nuts")."""
+    normalized = []
+    for value in values:
+        value = " ".join(value.lower().split())
+        if key == "allergies":
+            value = value.replace(" ", "_")
+        if value and value not in normalized:
+            normalized.append(value)
+    return normalized
+
+
+def cohort_document(filters: Dict[str, List[str]]) -> dict:
+    """The JSONB containment document for {filter name: [values]}."""
+    document = {}
+    for name, values in filters.items():
+        key = COHORT_FIELDS[name]
+        if values:
+            document[key] = normalize_values(key, values)
+    return document
+
+
+def count_cohort(cursor, filters: Dict[str, List[str]], batch_number: Optional[str] = None) -> int:
+    document = json.dumps(cohort_document(filters))
+    if batch_number is None:
+        cursor.execute("SELECT count(*) FROM consumers WHERE profile @> %s::jsonb", (document,))
+    else:
+        cursor.execute(
+            """
+            SELECT count(*) FROM batch_consumers b
+            JOIN consumers c ON c.email = b.consumer_email
+            WHERE b.batch_number = %s AND c.profile @> %s::jsonb
+            """,
+            (batch_number, document)
+        )
+    return cursor.fetchone()[0]
+
+
+def cohort_summary(cursor, batch_number: Optional[str] = None) -> dict:
+    """Counts per known allergy, condition, diet and goal, plus the total."""
+    summary = {"total": count_cohort(cursor, {}, batch_number)}
+    reverse = {key: name for name, key in COHORT_FIELDS.items()}
+    for key, values in KNOWN_VALUES.items():
+        summary[key] = {value: count_cohort(cursor, {reverse[key]: [value]}, batch_number) for value in values}
+    return summary
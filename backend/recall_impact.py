@@ -0,0 +1,242 @@
+# recall_impact.py
+# Recall impact: which products, locations, actors and consumers a batch has touched.
+#
+# The answer is kept precomputed so a recall never scans traceability_log or reviews:
+#   - traceability_heads carries each product's last known location/actor/stage,
+#   - batch_touchpoints has one row per (batch, location, actor) with first/last seen
+#     and an event count, upserted by ledger.append_events and product_ingest in the
+#     same transaction as the events (in key order, so concurrent appends cannot deadlock),
+#   - batch_consumers has one row per (batch, consumer) who reviewed one of its products.
+# batch_impact() builds the summary document in one query over those index rows, and
+# iter_impact_export() streams the full lists for regulators as NDJSON or CSV through
+# server-side cursors. rebuild() recomputes everything from traceability_log and
+# reviews, for rows written around the normal write path (restores, bulk SQL loads).
+#
+#   python recall_impact.py BATCH-42 --export impact.csv
+import csv
+import datetime
+import io
+import json
+from typing import Iterator, List, Optional
+
+from psycopg2.extras import execute_values
+
+EXPORT_COLUMNS = (
+    "record", "batch_number", "product_id", "product_name", "location", "actor", "stage",
+    "first_seen", "last_seen", "event_count", "consumer_email",
+)
+
+TOUCHPOINT_UPSERT_SQL = """
+INSERT INTO batch_touchpoints (batch_number, location, actor, last_stage, first_seen, last_seen, event_count)
+SELECT p.batch_number, v.location, v.actor, (array_agg(v.stage ORDER BY v.timestamp DESC))[1],
+       min(v.timestamp), max(v.timestamp), count(*)
+FROM (VALUES %s) AS v (product_id, timestamp, location, stage, actor)
+JOIN products p ON p.id = v.product_id
+GROUP BY p.batch_number, v.location, v.actor
+ORDER BY p.batch_number, v.location, v.actor
+ON CONFLICT (batch_number, location, actor) DO UPDATE SET
+    last_stage = CASE WHEN EXCLUDED.last_seen >= batch_touchpoints.last_seen
+                      THEN EXCLUDED.last_stage ELSE batch_touchpoints.last_stage END,
+    first_seen = LEAST(batch_touchpoints.first_seen, EXCLUDED.first_seen),
+    last_seen = GREATEST(batch_touchpoints.last_seen, EXCLUDED.last_seen),
+    event_count = batch_touchpoints.event_count + EXCLUDED.event_count
+"""
+
+CONSUMER_UPSERT_SQL = """
+INSERT INTO batch_consumers (batch_number, consumer_email, first_seen, last_seen, review_count)
+SELECT p.batch_number, %(email)s, %(seen_at)s, %(seen_at)s, 1 FROM products p WHERE p.id = %(product_id)s
+ON CONFLICT (batch_number, consumer_email) DO UPDATE SET
+    first_seen = LEAST(batch_consumers.first_seen, EXCLUDED.first_seen),
+    last_seen = GREATEST(batch_consumers.last_seen, EXCLUDED.last_seen),
+    review_count = batch_consumers.review_count + 1
+"""
+
+IMPACT_SQL = """
+SELECT json_build_object(
+    'batch_number', %(batch)s::text,
+    'product_count', (SELECT count(*) FROM products p WHERE p.batch_number = %(batch)s),
+    'last_known_locations', COALESCE((
+        SELECT json_agg(json_build_object(
+            'location', k.last_location, 'actor', k.last_actor, 'stage', k.last_stage,
+            'product_count', k.product_count, 'last_event_at', k.last_event_at
+        ) ORDER BY k.product_count DESC, k.last_location)
+        FROM (
+            SELECT h.last_location, h.last_actor, h.last_stage, count(*) AS product_count, max(h.last_event_at) AS last_event_at
+            FROM products p JOIN traceability_heads h ON h.product_id = p.id
+            WHERE p.batch_number = %(batch)s
+            GROUP BY h.last_location, h.last_actor, h.last_stage
+        ) k
+    ), '[]'::json),
+    'touchpoints', COALESCE((
+        SELECT json_agg(json_build_object(
+            'location', t.location, 'actor', t.actor, 'last_stage', t.last_stage,
+            'first_seen', t.first_seen, 'last_seen', t.last_seen, 'event_count', t.event_count
+        ) ORDER BY t.first_seen, t.location, t.actor)
+        FROM batch_touchpoints t WHERE t.batch_number = %(batch)s
+    ), '[]'::json),
+    'consumers', COALESCE((
+        SELECT json_agg(json_build_object(
+            'consumer_email', c.consumer_email, 'first_seen', c.first_seen,
+            'last_seen', c.last_seen, 'review_count', c.review_count
+        ) ORDER BY c.consumer_email)
+        FROM batch_consumers c WHERE c.batch_number = %(batch)s
+    ), '[]'::json)
+)::text
+"""
+
+# One statement per export section, each streamed through its own server-side cursor
+EXPORT_SQL = (
+    """
+    SELECT 'product', p.batch_number, p.id, p.name, h.last_location, h.last_actor, h.last_stage,
+           NULL::timestamptz, h.last_event_at, h.event_count, NULL
+    FROM products p LEFT JOIN traceability_heads h ON h.product_id = p.id
+    WHERE p.batch_number = %(batch)s ORDER BY p.id
+    """,
+    """
+    SELECT 'touchpoint', t.batch_number, NULL, NULL, t.location, t.actor, t.last_stage,
+           t.first_seen, t.last_seen, t.event_count, NULL
+    FROM batch_touchpoints t
+    WHERE t.batch_number = %(batch)s ORDER BY t.first_seen, t.location, t.actor
+    """,
+    """
+    SELECT 'consumer', c.batch_number, NULL, NULL, NULL, NULL, NULL,
+           c.first_seen, c.last_seen, c.review_count, c.consumer_email
+    FROM batch_consumers c
+    WHERE c.batch_number = %(batch)s ORDER BY c.consumer_email
+    """,
+)
+
+# Recomputes the index rows of the given batches (all batches when %(batches)s is NULL)
+REBUILD_SQL = """
+DELETE FROM batch_touchpoints WHERE %(batches)s::text[] IS NULL OR batch_number = ANY(%(batches)s);
+DELETE FROM batch_consumers WHERE %(batches)s::text[] IS NULL OR batch_number = ANY(%(batches)s);
+
+INSERT INTO batch_touchpoints (batch_number, location, actor, last_stage, first_seen, last_seen, event_count)
+SELECT p.batch_number, l.location, l.actor, (array_agg(l.stage ORDER BY l.log_id DESC))[1],
+       min(l.timestamp), max(l.timestamp), count(*)
+FROM traceability_log l JOIN products p ON p.id = l.product_id
+WHERE %(batches)s::text[] IS NULL OR p.batch_number = ANY(%(batches)s)
+GROUP BY p.batch_number, l.location, l.actor;
+
+INSERT INTO batch_consumers (batch_number, consumer_email, first_seen, last_seen, review_count)
+SELECT p.batch_number, v.consumer_email, min(v.review_date), max(v.review_date), count(*)
+FROM reviews v JOIN products p ON p.id = v.product_id
+WHERE %(batches)s::text[] IS NULL OR p.batch_number = ANY(%(batches)s)
+GROUP BY p.batch_number, v.consumer_email;
+
+INSERT INTO traceability_heads (product_id, head_hash, event_count, last_location, last_actor, last_stage, last_event_at)
+SELECT l.product_id, (array_agg(l.current_hash ORDER BY l.log_id DESC))[1], count(*),
+       (array_agg(l.location ORDER BY l.log_id DESC))[1], (array_agg(l.actor ORDER BY l.log_id DESC))[1],
+       (array_agg(l.stage ORDER BY l.log_id DESC))[1], (array_agg(l.timestamp ORDER BY l.log_id DESC))[1]
+FROM traceability_log l JOIN products p ON p.id = l.product_id
+WHERE %(batches)s::text[] IS NULL OR p.batch_number = ANY(%(batches)s)
+GROUP BY l.product_id ORDER BY l.product_id
+ON CONFLICT (product_id) DO UPDATE SET
+    last_location = EXCLUDED.last_location, last_actor = EXCLUDED.last_actor,
+    last_stage = EXCLUDED.last_stage, last_event_at = EXCLUDED.last_event_at;
+"""
+
+
+def record_touchpoints(cursor, log_rows: List[tuple]):
+    """Folds new traceability LOG rows (ledger.EVENT_COLUMNS order) into batch_touchpoints."""
+    if log_rows:
+        execute_values(cursor, TOUCHPOINT_UPSERT_SQL, [row[:5] for row in log_rows], page_size=len(log_rows))
+
+
+def record_consumer(cursor, product_id: str, consumer_email: str, seen_at: datetime.datetime):
+    cursor.execute(CONSUMER_UPSERT_SQL, {"product_id": product_id, "email": consumer_email, "seen_at": seen_at})
+
+
+def batch_impact(cursor, batch_number: str) -> str:
+    """The impact document of a batch (shape of the RecallImpact model in main.py) as JSON text."""
+    cursor.execute(IMPACT_SQL, {"batch": batch_number})
+    return cursor.fetchone()[0]
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def iter_impact_export(conn, batch_number: str, fmt: str = "ndjson", chunk_size: int = 500) -> Iterator[str]:
+    """
+    Streams every product (with its last known position), touchpoint and consumer of a
+    batch, one EXPORT_COLUMNS record per line, in chunks of about chunk_size records.
+    The sections are read from one REPEATABLE READ snapshot, so they agree with each other.
+    """
+    if fmt not in ("ndjson", "csv"):
+        raise ValueError(f"Unsupported format: {fmt}")
+    conn.rollback()
+    setup = conn.cursor()
+    setup.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    setup.close()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+    try:
+        for section, sql in enumerate(EXPORT_SQL):
+            cursor = conn.cursor(name=f"recall_impact_{section}")
+            cursor.itersize = chunk_size
+            cursor.execute(sql, {"batch": batch_number})
+            for count, row in enumerate(cursor, start=1):
+                values = [_export_value(value) for value in row]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    record = {key: value for key, value in zip(EXPORT_COLUMNS, values) if value is not None}
+                    buffer.write(json.dumps(record) + "\n")
+                if count % chunk_size == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            cursor.close()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        conn.rollback()
+
+
+def rebuild(cursor, batch_numbers: Optional[List[str]] = None):
+    """
+    Recomputes touchpoints, consumers and last known positions of the given batches (or
+    of all of them) from traceability_log and reviews. Run it with writers quiet: events
+    appended meanwhile may be counted twice. Events already archived out of the log
+    (log_partitions.py) are no longer seen. The caller owns the transaction.
+    """
+    cursor.execute(REBUILD_SQL, {"batches": batch_numbers})
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import psycopg2
+
+    from main import settings
+
+    parser = argparse.ArgumentParser(description="Show, export or rebuild the recall impact of batches.")
+    parser.add_argument("batch_numbers", nargs="*")
+    parser.add_argument("--export", metavar="FILE", help="Write the full export of the (single) batch to FILE")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Export format; defaults to the file extension")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the index rows (of every batch if none is given)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.DATABASE_URL)
+    cursor = conn.cursor()
+    if args.rebuild:
+        rebuild(cursor, args.batch_numbers or None)
+        conn.commit()
+        print(f"Rebuilt recall impact for {', '.join(args.batch_numbers) or 'every batch'}")
+    elif args.export:
+        if len(args.batch_numbers) != 1:
+            sys.exit("--export takes exactly one batch number")
+        fmt = args.format or ("csv" if args.export.lower().endswith(".csv") else "ndjson")
+        with open(args.export, "w", newline="", encoding="utf-8") as f:
+            for chunk in iter_impact_export(conn, args.batch_numbers[0], fmt):
+                f.write(chunk)
+        print(f"Wrote {args.export}")
+    else:
+        for batch_number in args.batch_numbers:
+            print(json.dumps(json.loads(batch_impact(cursor, batch_number)), indent=2))
+    cursor.close()
+    conn.close()
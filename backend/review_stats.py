@@ -0,0 +1,123 @@
+# review_stats.py
+# Per-product rating summaries and keyset pages of reviews.
+#
+# review_summaries holds one row per reviewed product (count, rating total and a 1-5
+# histogram). POST /reviews/add folds each new review into it with one upsert in the
+# review's own transaction, so summaries are served without reading `reviews` at all.
+# The upsert locks the product's summary row until commit, which serializes concurrent
+# reviews of the same product only. rebuild() recomputes rows from `reviews`, for
+# reviews written around the API (restores, bulk SQL loads).
+#
+# Review lists are paged newest first on (review_date, review_id), the order of
+# idx_reviews_product_date; the cursor is the product_search one (sort "review_date").
+#
+#   python review_stats.py            # rebuild every summary
+#   python review_stats.py BFT_B1_ABC123
+from typing import List, Optional, Tuple
+
+from product_queries import REVIEW_JSON, REVIEW_SUMMARY_JSON
+from product_search import decode_cursor, encode_cursor
+
+SUMMARY_UPSERT_SQL = """
+INSERT INTO review_summaries (product_id, review_count, rating_total, rating_1, rating_2, rating_3, rating_4, rating_5)
+VALUES (%(product_id)s, 1, %(rating)s, (%(rating)s = 1)::int, (%(rating)s = 2)::int, (%(rating)s = 3)::int,
+        (%(rating)s = 4)::int, (%(rating)s = 5)::int)
+ON CONFLICT (product_id) DO UPDATE SET
+    review_count = review_summaries.review_count + 1,
+    rating_total = review_summaries.rating_total + EXCLUDED.rating_total,
+    rating_1 = review_summaries.rating_1 + EXCLUDED.rating_1,
+    rating_2 = review_summaries.rating_2 + EXCLUDED.rating_2,
+    rating_3 = review_summaries.rating_3 + EXCLUDED.rating_3,
+    rating_4 = review_summaries.rating_4 + EXCLUDED.rating_4,
+    rating_5 = review_summaries.rating_5 + EXCLUDED.rating_5
+"""
+
+SUMMARY_SQL = f"""
+SELECT {REVIEW_SUMMARY_JSON}::text
+FROM products p LEFT JOIN review_summaries s ON s.product_id = p.id
+WHERE p.id = %s
+"""
+
+# {after} is empty for the first page: an "IS NULL OR" keyset test would keep the
+# planner from reading the page straight off the index
+REVIEW_PAGE_SQL = f"""
+SELECT {REVIEW_JSON}::text, v.review_date, v.review_id
+FROM reviews v
+WHERE v.product_id = %(product_id)s {{after}}
+ORDER BY v.review_date DESC, v.review_id DESC
+LIMIT %(limit)s
+"""
+REVIEW_PAGE_AFTER = "AND (v.review_date, v.review_id) < (%(after_date)s::timestamptz, %(after_id)s)"
+
+# Recomputes the summaries of the given products (all products when %(products)s is NULL)
+REBUILD_SQL = """
+DELETE FROM review_summaries WHERE %(products)s::text[] IS NULL OR product_id = ANY(%(products)s);
+
+INSERT INTO review_summaries (product_id, review_count, rating_total, rating_1, rating_2, rating_3, rating_4, rating_5)
+SELECT product_id, count(*), sum(rating), count(*) FILTER (WHERE rating = 1), count(*) FILTER (WHERE rating = 2),
+       count(*) FILTER (WHERE rating = 3), count(*) FILTER (WHERE rating = 4), count(*) FILTER (WHERE rating = 5)
+FROM reviews
+WHERE %(products)s::text[] IS NULL OR product_id = ANY(%(products)s)
+GROUP BY product_id;
+"""
+
+
+def record_review(cursor, product_id: str, rating: int):
+    cursor.execute(SUMMARY_UPSERT_SQL, {"product_id": product_id, "rating": rating})
+
+
+def fetch_review_summary(conn, product_id: str) -> Optional[str]:
+    """The ReviewSummary document of a product as JSON text, or None if the product does not exist."""
+    cursor = conn.cursor()
+    cursor.execute(SUMMARY_SQL, (product_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else None
+
+
+def fetch_review_page(conn, product_id: str, after: Optional[str] = None, limit: int = 50) -> Tuple[List[str], Optional[str]]:
+    """
+    One page of a product's reviews (newest first) as JSON texts, and the cursor of the
+    next page (None on the last one). Raises product_search.InvalidSearch on a bad cursor.
+    """
+    after_date, after_id = decode_cursor(after, "review_date") if after else (None, None)
+    cursor = conn.cursor()
+    sql = REVIEW_PAGE_SQL.format(after=REVIEW_PAGE_AFTER if after else "")
+    cursor.execute(sql, {"product_id": product_id, "after_date": after_date, "after_id": after_id, "limit": limit})
+    rows = cursor.fetchall()
+    cursor.close()
+    next_cursor = None
+    if len(rows) == limit:
+        _, review_date, review_id = rows[-1]
+        next_cursor = review_cursor(review_date.isoformat(), review_id)
+    return [row[0] for row in rows], next_cursor
+
+
+def review_cursor(review_date: str, review_id: int) -> str:
+    """Cursor of the page that follows the review with this (ISO) date and id."""
+    return encode_cursor("review_date", review_date, review_id)
+
+
+def rebuild(cursor, product_ids: Optional[List[str]] = None):
+    """Recomputes the summaries of the given products (or of all of them). The caller owns the transaction."""
+    cursor.execute(REBUILD_SQL, {"products": product_ids})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import psycopg2
+
+    from main import settings
+
+    parser = argparse.ArgumentParser(description="Rebuild per-product review summaries from the reviews table.")
+    parser.add_argument("product_ids", nargs="*", help="Products to rebuild (default: all)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(settings.DATABASE_URL)
+    cursor = conn.cursor()
+    rebuild(cursor, args.product_ids or None)
+    conn.commit()
+    print(f"Rebuilt review summaries for {', '.join(args.product_ids) or 'every product'}")
+    cursor.close()
+    conn.close()
@@ -0,0 +1,109 @@
+# serve.py
+# Production launcher: N worker processes on one socket, the app preloaded, graceful drain.
+#
+# With gunicorn installed (`pip install gunicorn`, Unix only), the master imports
+# main.py once before forking. A broken import or bad settings file fails before any
+# worker starts, and workers share the imported code copy-on-write. Preloading is safe
+# because main.py opens no connections and starts no threads at import. The pool, the
+# chain client and the background workers start in each worker's lifespan. The anchoring
+# worker and the chain indexer run in one process only: the workers elect a leader with
+# a Postgres advisory lock (db.LeaderLock, also across hosts), since every process signs
+# with the same key and a second anchorer would reuse nonces. When the leader exits,
+# another worker takes over within seconds. Events written through other workers are
+# picked up by the leader's next poll (ANCHOR_POLL_INTERVAL).
+# On SIGTERM (or SIGINT), workers stop accepting, finish in-flight requests for up to
+# --graceful-timeout seconds, then run the lifespan shutdown: background workers
+# stopped, pool closed. Without gunicorn it falls back to uvicorn's own process
+# supervisor, which imports the app in every worker (no preload).
+#
+# Each worker has its own pool, so the database sees up to workers x DB_POOL_MAX_SIZE
+# connections, and /metrics is per worker. With CACHE_BACKEND=memory each worker also
+# has its own response cache: writes NOTIFY the keys they invalidate, and every worker
+# listens on one more connection and drops them (cache.InvalidationListener), so no
+# worker serves a page older than the last committed write. CACHE_BACKEND=redis shares
+# one cache instead.
+#
+#   python serve.py --workers 4 --bind 0.0.0.0:8000
+#   python serve.py --check        # import the app, print the import time and exit
+import argparse
+import os
+import time
+
+DEFAULT_WORKERS = int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 1, 8)))
+
+
+def _uvicorn_worker_class() -> str:
+    try:
+        import uvicorn_worker  # noqa: F401  The maintained home of the gunicorn worker
+        return "uvicorn_worker.UvicornWorker"
+    except ImportError:
+        return "uvicorn.workers.UvicornWorker"
+
+
+def serve_gunicorn(args) -> bool:
+    """Runs under gunicorn; False when gunicorn is not installed."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        return False
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": _uvicorn_worker_class(),
+        "preload_app": args.preload,
+        "graceful_timeout": args.graceful_timeout,
+        "timeout": args.timeout,
+        "keepalive": args.keepalive,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests // 10,
+        "accesslog": "-" if args.access_log else None,
+    }
+
+    class Launcher(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    Launcher().run()
+    return True
+
+
+def serve_uvicorn(args):
+    import uvicorn
+
+    host, _, port = args.bind.rpartition(":")
+    print("gunicorn is not installed: running uvicorn's supervisor (no preloading)")
+    uvicorn.run("main:app", host=host or "0.0.0.0", port=int(port), workers=args.workers,
+                timeout_graceful_shutdown=args.graceful_timeout, timeout_keep_alive=args.keepalive,
+                limit_max_requests=args.max_requests or None, access_log=args.access_log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Bharat FoodTrace API with several worker processes.")
+    parser.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:8000"), help="host:port")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes (default: WEB_CONCURRENCY or CPUs, max 8)")
+    parser.add_argument("--no-preload", dest="preload", action="store_false", help="Import the app in each worker instead of the master")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--timeout", type=int, default=60, help="Seconds before a silent worker is killed and replaced")
+    parser.add_argument("--keepalive", type=int, default=5, help="Seconds an idle keep-alive connection stays open")
+    parser.add_argument("--max-requests", type=int, default=0, help="Recycle a worker after this many requests (0 = never)")
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Only import the app and report how long it took")
+    args = parser.parse_args()
+
+    if args.check:
+        started = time.perf_counter()
+        from main import app  # noqa: F401
+        print(f"Imported main:app in {time.perf_counter() - started:.3f}s")
+        return
+    if not serve_gunicorn(args):
+        serve_uvicorn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+# swasth_scoring.py
+# Server-side Swasth Wallet compatibility scoring over the whole catalog.
+#
+# A consumer's SwasthWallet is compiled into a CompiledProfile: a bitmask of the
+# allergens to avoid (allergies, plus wheat for celiac disease), a bitmask of the diets
+# they follow, per-nutrient upper limits from their conditions and per-nutrient goal
+# weights. Compilation is cached by profile text, so consumers with the same profile
+# share one entry. The catalog is held as a CatalogSnapshot of NumPy columns (allergen
+# bits, diet-violation bits, nutrients, recall and expiry), reloaded from Postgres
+# after a TTL or after a write invalidates it. Scoring every product is then a few
+# vector operations: allergen AND, diet AND, threshold comparisons and a dot product.
+#
+# The rules extend the consumer dashboard's analyzeProduct(): an allergen, celiac
+# disease + wheat, a diet violation, a recall or an expired product excludes it
+# ("danger"); a nutrient over a condition's limit is a warning that lowers the score.
+import datetime
+import functools
+import json
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from product_queries import PRODUCT_FIELDS
+from product_search import ALLERGENS, InvalidSearch, decode_cursor, encode_cursor
+
+NUTRIENTS = ("sodium", "sugar", "calories_per_100g", "protein_g", "carbs_g", "fat_g", "fiber_g")
+# Rough daily reference amounts, used to put nutrients on one scale for goal weights
+NUTRIENT_SCALE = np.array([2000.0, 50.0, 2000.0, 50.0, 300.0, 70.0, 30.0])
+
+# condition -> (nutrient, limit per 100g, warning)
+CONDITION_LIMITS = {
+    "high blood pressure": ("sodium", 400.0, "high_sodium"),
+    "diabetes": ("sugar", 10.0, "high_sugar"),
+    "high cholesterol": ("fat_g", 17.5, "high_fat"),
+}
+CONDITION_ALLERGENS = {"celiac disease": ("wheat",)}
+
+# diet -> (allergen flags it rules out, ingredient words it rules out). Words match whole
+# words of the canonical ingredient names, so the rules err on the side of excluding.
+DIET_RULES = {
+    "vegetarian": (("eggs", "fish", "shellfish"), ("egg", "chicken", "mutton", "meat", "gelatin", "fish")),
+    "vegan": (("milk", "eggs", "fish", "shellfish"),
+              ("egg", "chicken", "mutton", "meat", "gelatin", "fish", "honey", "ghee", "butter", "paneer",
+               "cheese", "curd", "yogurt", "cream", "whey", "milk")),
+    "jain": (("eggs", "fish", "shellfish"),
+             ("egg", "chicken", "mutton", "meat", "gelatin", "fish", "honey", "onion", "garlic", "potato",
+              "carrot", "beetroot", "ginger", "radish")),
+}
+DIETS = tuple(DIET_RULES)
+DIET_PATTERNS = tuple(re.compile(r"\b(" + "|".join(DIET_RULES[diet][1]) + r")\b") for diet in DIETS)
+KEY_SEPARATOR = "\x1f"  # joins a product's ingredient_keys in SNAPSHOT_SQL
+
+GOAL_WEIGHTS = {
+    "weight_loss": {"calories_per_100g": -1.0, "sugar": -0.5, "fiber_g": 0.5},
+    "weight_gain": {"calories_per_100g": 1.0, "protein_g": 0.5},
+    "muscle_building": {"protein_g": 1.0},
+    "general_fitness": {"fiber_g": 0.5, "sugar": -0.5, "sodium": -0.5},
+}
+
+# A safe product without warnings scores BASE_SCORE, each warning costs WARNING_PENALTY
+# and goals move the score by up to GOAL_POINTS either way
+BASE_SCORE = 80.0
+WARNING_PENALTY = 25.0
+GOAL_POINTS = 20.0
+
+SNAPSHOT_SQL = """
+SELECT p.id, p.category,
+       {allergen_bits} AS allergen_bits,
+       array_to_string(p.ingredient_keys, E'\\x1f') AS ingredient_keys,
+       {nutrients},
+       EXISTS (SELECT 1 FROM product_recalls r WHERE r.batch_number = p.batch_number) AS recalled,
+       p.expiry_date - DATE '1970-01-01' AS expiry_day
+FROM products p
+"""
+
+# Product documents for a ranked page, in rank order, with their score and warnings
+RANKED_PRODUCTS_SQL = f"""
+SELECT json_build_object({PRODUCT_FIELDS}, 'swasth_score', r.score, 'warnings', r.warnings::json)::text
+FROM unnest(%s::text[], %s::float8[], %s::text[]) WITH ORDINALITY AS r(id, score, warnings, n)
+JOIN products p ON p.id = r.id
+ORDER BY r.n
+"""
+
+
+def _bit_sum(conditions: List[str]) -> str:
+    return " | ".join(f"(CASE WHEN {condition} THEN {1 << bit} ELSE 0 END)" for bit, condition in enumerate(conditions))
+
+
+def snapshot_sql() -> str:
+    return SNAPSHOT_SQL.format(
+        allergen_bits=_bit_sum([f"p.contains_{allergen}" for allergen in ALLERGENS]),
+        nutrients=", ".join(f"p.{nutrient}::float8" for nutrient in NUTRIENTS),
+    )
+
+
+class CompiledProfile:
+    """A SwasthWallet reduced to the masks, limits and weights that score_catalog() applies."""
+
+    def __init__(self, allergen_mask: int, diet_mask: int, limits: np.ndarray, warnings: Tuple[Optional[str], ...],
+                 goal_weights: np.ndarray):
+        self.allergen_mask = allergen_mask
+        self.diet_mask = diet_mask
+        self.limits = limits            # per NUTRIENTS, inf where no condition applies
+        self.warnings = warnings        # warning name per NUTRIENTS limit
+        self.goal_weights = goal_weights  # per NUTRIENTS, applied to NUTRIENT_SCALE-scaled values
+
+
+@functools.lru_cache(maxsize=10000)
+def compile_profile(profile_json: str) -> CompiledProfile:
+    """Compiles a SwasthWallet (consumers.profile as JSON text). Unknown values are ignored."""
+    wallet = json.loads(profile_json or "{}")
+    allergies = {a.strip().lower().replace(" ", "_") for a in wallet.get("allergies") or []}
+    conditions = {c.strip().lower() for c in wallet.get("conditions") or []}
+    for condition, allergens in CONDITION_ALLERGENS.items():
+        if condition in conditions:
+            allergies.update(allergens)
+    allergen_mask = sum(1 << bit for bit, allergen in enumerate(ALLERGENS) if allergen in allergies)
+
+    diets = {d.strip().lower() for d in wallet.get("diet") or []}
+    diet_mask = 0
+    for bit, diet in enumerate(DIETS):
+        if diet in diets:
+            diet_mask |= 1 << bit
+            # A diet's allergen flags are as binding as an allergy
+            allergen_mask |= sum(1 << ALLERGENS.index(allergen) for allergen in DIET_RULES[diet][0])
+
+    limits = np.full(len(NUTRIENTS), np.inf)
+    warnings = [None] * len(NUTRIENTS)
+    for condition, (nutrient, limit, warning) in CONDITION_LIMITS.items():
+        if condition in conditions:
+            index = NUTRIENTS.index(nutrient)
+            limits[index] = min(limits[index], limit)
+            warnings[index] = warning
+
+    goal_weights = np.zeros(len(NUTRIENTS))
+    for goal in {g.strip().lower() for g in wallet.get("goals") or []}:
+        for nutrient, weight in GOAL_WEIGHTS.get(goal, {}).items():
+            goal_weights[NUTRIENTS.index(nutrient)] += weight
+    return CompiledProfile(allergen_mask, diet_mask, limits, tuple(warnings), goal_weights)
+
+
+def ingredient_diet_bits(ingredient: str) -> int:
+    """Bit per DIETS entry whose rules rule out this canonical ingredient."""
+    return sum(1 << bit for bit, pattern in enumerate(DIET_PATTERNS) if pattern.search(ingredient))
+
+
+def diet_bits(keys: List[str], memo: dict) -> np.ndarray:
+    """
+    Diet-violation bits per product from its joined ingredient_keys. Catalogs repeat the
+    same ingredients (and lists) endlessly, so both are classified once through `memo`.
+    """
+    bits = np.zeros(len(keys), dtype=np.uint8)
+    for index, joined in enumerate(keys):
+        value = memo.get(joined)
+        if value is None:
+            value = 0
+            for ingredient in joined.split(KEY_SEPARATOR) if joined else ():
+                if ingredient not in memo:
+                    memo[ingredient] = ingredient_diet_bits(ingredient)
+                value |= memo[ingredient]
+            memo[joined] = value
+        bits[index] = value
+    return bits
+
+
+class CatalogSnapshot:
+    """Column arrays over every product, sorted by id (Python string order)."""
+
+    def __init__(self, rows: list):
+        rows.sort(key=lambda row: row[0])
+        columns = list(zip(*rows)) if rows else [()] * (5 + len(NUTRIENTS))
+        self.ids = np.array(columns[0], dtype=str)
+        categories = columns[1]
+        self.category_codes = {category: code for code, category in enumerate(sorted(set(categories), key=str))}
+        self.categories = np.array([self.category_codes[c] for c in categories], dtype=np.int32)
+        self.allergen_bits = np.array(columns[2], dtype=np.uint8)
+        self.diet_bits = diet_bits(columns[3], {})
+        nutrients = np.array(columns[4:4 + len(NUTRIENTS)], dtype=np.float64).T.reshape(len(rows), len(NUTRIENTS))
+        self.nutrients = nutrients  # NaN where unknown: never over a limit
+        self.scaled = np.nan_to_num(nutrients / NUTRIENT_SCALE)
+        self.recalled = np.array(columns[4 + len(NUTRIENTS)], dtype=bool)
+        self.expiry_day = np.array([np.nan if day is None else day for day in columns[5 + len(NUTRIENTS)]], dtype=np.float64)
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, cursor) -> "CatalogSnapshot":
+        cursor.execute(snapshot_sql())
+        return cls(cursor.fetchall())
+
+
+def score_catalog(snapshot: CatalogSnapshot, profile: CompiledProfile, today: Optional[datetime.date] = None):
+    """
+    Returns (safe, scores, over): which products the profile may eat, their 0-100 scores
+    (rounded to 2 decimals, NaN where not safe) and a boolean matrix of nutrient limits exceeded.
+    """
+    today = today or datetime.date.today()
+    safe = (snapshot.allergen_bits & profile.allergen_mask) == 0
+    safe &= (snapshot.diet_bits & profile.diet_mask) == 0
+    safe &= ~snapshot.recalled
+    safe &= ~(snapshot.expiry_day < (today - datetime.date(1970, 1, 1)).days)
+    with np.errstate(invalid="ignore"):
+        over = snapshot.nutrients > profile.limits
+    goal = np.clip(snapshot.scaled @ profile.goal_weights, -1.0, 1.0)
+    scores = np.clip(BASE_SCORE - WARNING_PENALTY * over.sum(axis=1) + GOAL_POINTS * goal, 0.0, 100.0).round(2)
+    scores[~safe] = np.nan
+    return safe, scores, over
+
+
+def rank_safe_products(snapshot: CatalogSnapshot, profile: CompiledProfile, limit: int = 20, after: Optional[str] = None,
+                       category: Optional[str] = None, strict: bool = False,
+                       min_score: float = 0.0) -> Tuple[List[Tuple[str, float, List[str]]], Optional[str]]:
+    """
+    One page of (product_id, score, warnings) for the safe products, best score first
+    (ties by id), plus the cursor of the next page. `strict` also drops products with warnings.
+    """
+    safe, scores, over = score_catalog(snapshot, profile)
+    mask = safe & (scores >= min_score)
+    if strict:
+        mask &= ~over.any(axis=1)
+    if category is not None:
+        mask &= snapshot.categories == snapshot.category_codes.get(category, -1)
+    if after:
+        after_score, after_id = decode_cursor(after, "swasth")
+        if not isinstance(after_score, (int, float)):
+            raise InvalidSearch("Invalid cursor")
+        mask &= (scores < after_score) | ((scores == after_score) & (snapshot.ids > after_id))
+
+    candidates = np.flatnonzero(mask)
+    if len(candidates) > limit:
+        # Only the products scoring at least the limit-th best score need sorting
+        kth = -np.partition(-scores[candidates], limit - 1)[limit - 1]
+        candidates = candidates[scores[candidates] >= kth]
+    page = candidates[np.lexsort((candidates, -scores[candidates]))][:limit]
+
+    results = []
+    for index in page:
+        warnings = [profile.warnings[i] for i in np.flatnonzero(over[index])]
+        results.append((str(snapshot.ids[index]), float(scores[index]), warnings))
+    next_cursor = encode_cursor("swasth", results[-1][1], results[-1][0]) if len(results) == limit else None
+    return results, next_cursor
+
+
+def fetch_ranked_products(cursor, ranked: List[Tuple[str, float, List[str]]]) -> List[str]:
+    """JSON documents (SafeProductHit in main.py) for a page from rank_safe_products()."""
+    cursor.execute(RANKED_PRODUCTS_SQL, ([r[0] for r in ranked], [r[1] for r in ranked], [json.dumps(r[2]) for r in ranked]))
+    return [row[0] for row in cursor.fetchall()]
+
+
+class Catalog:
+    """
+    The current CatalogSnapshot. It is reloaded once older than ttl_seconds or after
+    invalidate(); while one thread reloads, the others keep scoring the previous snapshot.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0):
+        self.ttl_seconds = ttl_seconds
+        self.reloads = 0
+        self.last_load_seconds = None
+        self._snapshot = None
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def _expired(self) -> bool:
+        return self._stale or time.monotonic() - self._snapshot.loaded_at > self.ttl_seconds
+
+    def snapshot(self, cursor) -> CatalogSnapshot:
+        """The current snapshot, reloaded through `cursor` when it is due."""
+        current = self._snapshot
+        if current is not None and not self._expired():
+            return current
+        if not self._lock.acquire(blocking=current is None):
+            return current
+        try:
+            if self._snapshot is None or self._expired():
+                started = time.perf_counter()
+                self._stale = False
+                self._snapshot = CatalogSnapshot.load(cursor)
+                self.reloads += 1
+                self.last_load_seconds = round(time.perf_counter() - started, 4)
+            return self._snapshot
+        except Exception:
+            self._stale = True
+            raise
+        finally:
+            self._lock.release()
+
+    def stats(self) -> dict:
+        current = self._snapshot
+        return {
+            "products": len(current) if current is not None else 0,
+            "age_seconds": round(time.monotonic() - current.loaded_at, 1) if current is not None else None,
+            "ttl_seconds": self.ttl_seconds,
+            "reloads": self.reloads,
+            "last_load_seconds": self.last_load_seconds,
+            "compiled_profiles": compile_profile.cache_info()._asdict(),
+        }
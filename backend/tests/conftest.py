@@ -0,0 +1,162 @@
+# conftest.py
+# Shared fixtures for the backend tests.
+#
+# Tests that need Postgres run against TEST_DATABASE_URL and are skipped without it.
+# The database is rebuilt from database_setup.sql once per session and every table is
+# emptied before each test, so point it at a throwaway database, never a real one:
+#
+#   createdb foodtrace_test
+#   TEST_DATABASE_URL=postgresql://localhost/foodtrace_test python -m pytest tests
+#
+# Chain tests run on an in-memory EthereumTesterProvider chain with a hand-assembled
+# stand-in for the Traceability contract (no Solidity compiler needed): it records
+# batch roots, rejects a root recorded twice and emits the contract's events.
+import datetime
+import os
+import sys
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+from eth_account import Account
+from web3 import EthereumTesterProvider, Web3
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from anchoring import CONTRACT_ABI  # noqa: E402
+from db import ConnectionPool  # noqa: E402
+from product_ingest import PRODUCT_COLUMNS, genesis_log_values, insert_products  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def dsn():
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    conn = psycopg2.connect(url)
+    try:
+        with open(os.path.join(BACKEND_DIR, "database_setup.sql")) as f:
+            conn.cursor().execute(f.read())
+        conn.commit()
+    finally:
+        conn.close()
+    return url
+
+
+@pytest.fixture
+def conn(dsn):
+    conn = psycopg2.connect(dsn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT string_agg(quote_ident(tablename), ', ') FROM pg_tables WHERE schemaname = 'public'")
+    cursor.execute(f"TRUNCATE {cursor.fetchone()[0]} RESTART IDENTITY CASCADE")
+    cursor.execute(
+        "INSERT INTO manufacturers (id, company_name, email, hashed_password, fssai_license) "
+        "VALUES ('M1', 'Test Foods', 'ops@test.example', 'x', 'L1')"
+    )
+    conn.commit()
+    cursor.close()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def pool(dsn):
+    pool = ConnectionPool(dsn, min_size=1, max_size=5, acquire_timeout=2.0)
+    yield pool
+    pool.closeall()
+
+
+def create_product(conn, product_id: str, batch_number: str = "B1", created_at: datetime.datetime = None):
+    """A product of manufacturer M1 with its genesis event (at created_at, default now), committed."""
+    values = dict.fromkeys(PRODUCT_COLUMNS)
+    values.update(id=product_id, name="Atta", brand="Test Foods", ingredients=["Wheat"],
+                  batch_number=batch_number, manufacturer_id="M1")
+    genesis = genesis_log_values(product_id, "Test Foods", "ops@test.example",
+                                 created_at or datetime.datetime.now(datetime.timezone.utc))
+    cursor = conn.cursor()
+    insert_products(cursor, [tuple(values[column] for column in PRODUCT_COLUMNS)], [genesis])
+    conn.commit()
+    cursor.close()
+
+
+def event(product_id: str, location: str, stage: str = "distribution"):
+    """A LocationUpdate-like event for ledger.append_events."""
+    return SimpleNamespace(product_id=product_id, location=location, stage=stage, actor="tests", status=None, notes=None)
+
+
+# --- Chain ---
+OPCODES = {"STOP": 0x00, "EQ": 0x14, "ISZERO": 0x15, "SHR": 0x1C, "CALLER": 0x33, "CALLDATALOAD": 0x35,
+           "CODECOPY": 0x39, "TIMESTAMP": 0x42, "MSTORE": 0x52, "SLOAD": 0x54, "SSTORE": 0x55, "JUMPI": 0x57,
+           "JUMPDEST": 0x5B, "DUP1": 0x80, "LOG2": 0xA2, "RETURN": 0xF3, "REVERT": 0xFD}
+
+
+def assemble(program: list) -> bytes:
+    """EVM bytecode for a list of opcode names, ints (PUSH1), bytes (PUSHn) and labels (":name" marks, "@name" jumps)."""
+    def size(op):
+        if isinstance(op, str) and op.startswith(":"):
+            return 0
+        if isinstance(op, str) and op.startswith("@"):
+            return 3  # PUSH2 <offset>
+        if isinstance(op, int):
+            return 2
+        if isinstance(op, bytes):
+            return 1 + len(op)
+        return 1
+
+    labels, offset = {}, 0
+    for op in program:
+        if isinstance(op, str) and op.startswith(":"):
+            labels[op[1:]] = offset
+        offset += size(op)
+    code = bytearray()
+    for op in program:
+        if isinstance(op, str) and op.startswith(":"):
+            continue
+        if isinstance(op, str) and op.startswith("@"):
+            code += bytes([0x61]) + labels[op[1:]].to_bytes(2, "big")
+        elif isinstance(op, int):
+            code += bytes([0x60, op])
+        elif isinstance(op, bytes):
+            code += bytes([0x5F + len(op)]) + op
+        else:
+            code.append(OPCODES[op])
+    return bytes(code)
+
+
+def traceability_stand_in() -> bytes:
+    """Deployment code of the stand-in: recordTraceEvent, recordBatchRoot and batchRecordedAt."""
+    def selector(signature):
+        return bytes(Web3.keccak(text=signature)[:4])
+
+    def emit(event_signature):
+        # Data (word at 0x24, recorder, timestamp), topics (event, word at 0x04)
+        return [0x24, "CALLDATALOAD", 0, "MSTORE", "CALLER", 32, "MSTORE", "TIMESTAMP", 64, "MSTORE",
+                4, "CALLDATALOAD", bytes(Web3.keccak(text=event_signature)), 96, 0, "LOG2", "STOP"]
+
+    runtime = assemble([
+        0, "CALLDATALOAD", 0xE0, "SHR",
+        "DUP1", selector("batchRecordedAt(bytes32)"), "EQ", "@recorded_at", "JUMPI",
+        "DUP1", selector("recordBatchRoot(bytes32,uint256)"), "EQ", "@record_root", "JUMPI",
+        "DUP1", selector("recordTraceEvent(bytes32,bytes32)"), "EQ", "@record_event", "JUMPI",
+        "STOP",
+        ":recorded_at", "JUMPDEST", 4, "CALLDATALOAD", "SLOAD", 0, "MSTORE", 32, 0, "RETURN",
+        ":record_root", "JUMPDEST", 4, "CALLDATALOAD", "SLOAD", "ISZERO", "@new_root", "JUMPI", 0, "DUP1", "REVERT",
+        ":new_root", "JUMPDEST", "TIMESTAMP", 4, "CALLDATALOAD", "SSTORE",
+        *emit("BatchRootRecorded(bytes32,uint256,address,uint256)"),
+        ":record_event", "JUMPDEST", *emit("EventRecorded(bytes32,bytes32,address,uint256)"),
+    ])
+    # Constructor: copy the runtime code (placed right after these 12 bytes) to memory and return it
+    return assemble([len(runtime), 12, 0, "CODECOPY", len(runtime), 0, "RETURN"]) + runtime
+
+
+@pytest.fixture
+def chain():
+    """(w3, contract, account): the stand-in contract and a funded signing account."""
+    pytest.importorskip("eth_tester")
+    w3 = Web3(EthereumTesterProvider())
+    account = Account.from_key("0x" + "11" * 32)
+    w3.eth.send_transaction({"from": w3.eth.accounts[0], "to": account.address, "value": w3.to_wei(10, "ether")})
+    tx_hash = w3.eth.send_transaction({"from": w3.eth.accounts[0], "data": traceability_stand_in()})
+    address = w3.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+    return w3, w3.eth.contract(address=address, abi=CONTRACT_ABI), account
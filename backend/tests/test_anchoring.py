@@ -0,0 +1,111 @@
+import pytest
+
+from anchoring import AnchorWorker, BatchAnchorWorker
+from conftest import create_product, event
+from ledger import append_events
+from merkle import verify_proof
+
+
+def make_worker(worker_class, pool, chain, **kwargs):
+    w3, contract, account = chain
+    return worker_class(pool.getconn, pool.putconn, w3, contract, account, chain_id=w3.eth.chain_id,
+                        receipt_timeout=5.0, receipt_poll_interval=0.05, **kwargs)
+
+
+def queue_events(conn, count: int):
+    create_product(conn, "P1")
+    cursor = conn.cursor()
+    append_events(cursor, [event("P1", f"hub {i}") for i in range(count)])
+    conn.commit()
+    cursor.close()
+
+
+def fetch(conn, query: str):
+    cursor = conn.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    return rows
+
+
+def test_run_once_anchors_each_event(conn, pool, chain):
+    queue_events(conn, 3)
+    anchored = []
+    worker = make_worker(AnchorWorker, pool, chain, batch_size=2, on_anchored=anchored.extend)
+
+    assert worker.run_once() == 2
+    assert worker.run_once() == 1
+    assert worker.run_once() == 0
+    assert fetch(conn, "SELECT count(*) FROM anchor_outbox") == [(0,)]
+    tx_ids = fetch(conn, "SELECT blockchain_tx_id FROM traceability_log WHERE stage = 'distribution' ORDER BY log_id")
+    assert len({tx_id for (tx_id,) in tx_ids}) == 3 and all(tx_id for (tx_id,) in tx_ids)
+    w3 = chain[0]
+    assert all(w3.eth.get_transaction_receipt(tx_id).status == 1 for (tx_id,) in tx_ids)
+    assert set(anchored) == {"P1"}
+
+
+def test_batch_worker_stores_verifiable_proofs(conn, pool, chain):
+    queue_events(conn, 5)
+    worker = make_worker(BatchAnchorWorker, pool, chain, batch_size=10)
+
+    assert worker.run_once() == 5
+    assert worker.run_once() == 0
+    assert fetch(conn, "SELECT count(*) FROM anchor_outbox") == [(0,)]
+    assert fetch(conn, "SELECT status, leaf_count FROM anchor_batches") == [("anchored", 5)]
+    rows = fetch(conn, "SELECT current_hash, merkle_proof, merkle_root, blockchain_tx_id FROM traceability_log WHERE stage = 'distribution'")
+    assert len(rows) == 5
+    assert all(verify_proof(current_hash, proof, root) for current_hash, proof, root, _ in rows)
+    assert len({tx_id for *_, tx_id in rows}) == 1
+
+
+def test_lease_must_outlast_receipt_wait(pool, chain):
+    with pytest.raises(ValueError):
+        make_worker(AnchorWorker, pool, chain, lease_seconds=5.0)
+
+
+def record_root_out_of_band(chain, root: str) -> str:
+    w3, contract, _ = chain
+    tx_hash = contract.functions.recordBatchRoot(bytes.fromhex(root), 1).transact({"from": w3.eth.accounts[0]})
+    return w3.to_hex(tx_hash)
+
+
+def test_batch_retry_finds_its_root_already_recorded(conn, pool, chain, monkeypatch):
+    queue_events(conn, 2)
+    worker = make_worker(BatchAnchorWorker, pool, chain, batch_size=10, base_backoff=0.0)
+    transact = worker._transact
+
+    def send_then_fail(function_call):
+        transact(function_call)  # The node accepted it, but the worker never learns the hash
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(worker, "_transact", send_then_fail)
+    assert worker.run_once() == 2
+    [(root, status, attempts, tx_hash)] = fetch(conn, "SELECT merkle_root, status, attempts, tx_hash FROM anchor_batches")
+    assert (status, attempts, tx_hash) == ("pending", 1, None)
+
+    monkeypatch.setattr(worker, "_transact", transact)
+    assert worker.run_once() == 2
+    [(status, tx_id)] = fetch(conn, "SELECT status, blockchain_tx_id FROM anchor_batches")
+    assert status == "anchored"
+    assert chain[0].eth.get_transaction_receipt(tx_id).status == 1  # The send that raised
+    assert fetch(conn, "SELECT count(*) FROM anchor_outbox") == [(0,)]
+    assert fetch(conn, "SELECT DISTINCT blockchain_tx_id FROM traceability_log WHERE stage = 'distribution'") == [(tx_id,)]
+
+
+def test_batch_whose_root_another_sender_recorded_is_anchored(conn, pool, chain, monkeypatch):
+    queue_events(conn, 3)
+    worker = make_worker(BatchAnchorWorker, pool, chain, batch_size=10)
+    form_batch, recorded = worker._form_batch, []
+
+    def form_batch_then_race():
+        batch = form_batch()
+        recorded.append(record_root_out_of_band(chain, batch["merkle_root"]))
+        return batch
+
+    monkeypatch.setattr(worker, "_form_batch", form_batch_then_race)
+    assert worker.run_once() == 3
+    [(status, attempts, tx_id, our_tx)] = fetch(conn, "SELECT status, attempts, blockchain_tx_id, tx_hash FROM anchor_batches")
+    assert (status, attempts, tx_id) == ("anchored", 0, recorded[0])
+    assert chain[0].eth.get_transaction_receipt(our_tx).status == 0  # Our own send reverted
+    assert fetch(conn, "SELECT count(*) FROM anchor_outbox") == [(0,)]
@@ -0,0 +1,89 @@
+import pytest
+
+from cache import MemoryCache, RedisCache
+
+VALUE = ('"etag"', b"{}")
+
+
+def test_memory_set_stores_without_and_with_a_current_generation():
+    cache = MemoryCache()
+    cache.set("a", VALUE)
+    cache.set("b", VALUE, cache.generation("b"))
+    assert cache.get("a") == VALUE and cache.get("b") == VALUE
+
+
+def test_memory_set_after_invalidate_is_dropped():
+    cache = MemoryCache()
+    generation = cache.generation("product:1")  # A reader starts loading
+    cache.invalidate("product:1")  # A write commits meanwhile
+    cache.set("product:1", VALUE, generation)
+    assert cache.get("product:1") is None
+    cache.set("product:1", VALUE, cache.generation("product:1"))
+    assert cache.get("product:1") == VALUE
+
+
+def test_memory_invalidating_other_keys_does_not_drop_the_set():
+    cache = MemoryCache()
+    generation = cache.generation("product:1")
+    cache.invalidate("product:2")
+    cache.set("product:1", VALUE, generation)
+    assert cache.get("product:1") == VALUE
+
+
+def test_memory_generation_older_than_evicted_ticks_is_dropped():
+    cache = MemoryCache(max_entries=2)
+    generation = cache.generation("product:1")
+    cache.invalidate("product:1")
+    cache.invalidate("product:2", "product:3")  # Evicts product:1's tick and raises the floor
+    assert "product:1" not in cache._invalidated and cache._floor > generation
+    cache.set("product:1", VALUE, generation)
+    assert cache.get("product:1") is None
+
+
+def test_memory_generation_from_before_clear_is_dropped():
+    cache = MemoryCache()
+    generation = cache.generation("product:1")
+    cache.clear()  # E.g. after the invalidation listener reconnected
+    cache.set("product:1", VALUE, generation)
+    assert cache.get("product:1") is None
+
+
+@pytest.fixture
+def redis_cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCache(client=fakeredis.FakeRedis())
+
+
+def test_redis_set_stores_with_a_current_generation(redis_cache):
+    redis_cache.set("a", VALUE)
+    redis_cache.set("b", VALUE, redis_cache.generation("b"))
+    assert redis_cache.get("a") == VALUE and redis_cache.get("b") == VALUE
+
+
+def test_redis_set_after_invalidate_is_dropped(redis_cache):
+    generation = redis_cache.generation("product:1")
+    redis_cache.invalidate("product:1")
+    redis_cache.set("product:1", VALUE, generation)
+    assert redis_cache.get("product:1") is None
+    redis_cache.set("product:1", VALUE, redis_cache.generation("product:1"))
+    assert redis_cache.get("product:1") == VALUE
+
+
+def test_redis_set_is_dropped_when_invalidated_during_the_watch(redis_cache, monkeypatch):
+    generation = redis_cache.generation("product:1")
+    pipeline = redis_cache.client.pipeline
+
+    def racing_pipeline():
+        pipe = pipeline()
+        multi = pipe.multi
+
+        def invalidate_then_multi():
+            redis_cache.invalidate("product:1")  # Lands between WATCH and EXEC
+            multi()
+
+        pipe.multi = invalidate_then_multi
+        return pipe
+
+    monkeypatch.setattr(redis_cache.client, "pipeline", racing_pipeline)
+    redis_cache.set("product:1", VALUE, generation)
+    assert redis_cache.get("product:1") is None
@@ -0,0 +1,70 @@
+from anchoring import product_batch_id
+from chain_indexer import ChainIndexer
+
+
+def record_event(chain, product_id: str, event_hash: str):
+    w3, contract, _ = chain
+    tx_hash = contract.functions.recordTraceEvent(product_batch_id(product_id), bytes.fromhex(event_hash)).transact(
+        {"from": w3.eth.accounts[0]}
+    )
+    return w3.eth.wait_for_transaction_receipt(tx_hash).blockNumber
+
+
+def indexed(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT event_name, event_hash, block_number, block_hash FROM chain_events ORDER BY block_number, log_index")
+    rows = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    return rows
+
+
+def test_indexes_event_and_batch_logs(conn, pool, chain):
+    w3, contract, _ = chain
+    indexer = ChainIndexer(pool.getconn, pool.putconn, w3, contract)
+    record_event(chain, "P1", "aa" * 32)
+    contract.functions.recordBatchRoot(bytes.fromhex("bb" * 32), 4).transact({"from": w3.eth.accounts[0]})
+
+    assert indexer.run_once() == w3.eth.block_number + 1
+    assert [(name, event_hash) for name, event_hash, *_ in indexed(conn)] == [
+        ("EventRecorded", "aa" * 32), ("BatchRootRecorded", "bb" * 32)]
+    assert indexer.run_once() == 0
+
+
+def test_reorg_drops_orphaned_logs_and_indexes_the_new_branch(conn, pool, chain):
+    w3, contract, _ = chain
+    indexer = ChainIndexer(pool.getconn, pool.putconn, w3, contract, block_step=1000)
+    kept_block = record_event(chain, "P1", "01" * 32)
+    fork_point = w3.testing.snapshot()
+    record_event(chain, "P1", "02" * 32)
+    record_event(chain, "P2", "03" * 32)
+    indexer.run_once()
+    assert [row[1] for row in indexed(conn)] == ["01" * 32, "02" * 32, "03" * 32]
+
+    # Replace the last two blocks with a longer branch holding a different event
+    w3.testing.revert(fork_point)
+    w3.testing.mine(1)
+    new_block = record_event(chain, "P2", "04" * 32)
+    w3.testing.mine(2)
+    indexer.run_once()
+
+    rows = indexed(conn)
+    assert [(row[1], row[2]) for row in rows] == [("01" * 32, kept_block), ("04" * 32, new_block)]
+    assert all(bytes(w3.eth.get_block(number)["hash"]).hex() == block_hash for _, _, number, block_hash in rows)
+    assert indexer.run_once() == 0
+    assert len(indexed(conn)) == 2
+
+
+def test_reorg_to_a_shorter_branch(conn, pool, chain):
+    w3, contract, _ = chain
+    indexer = ChainIndexer(pool.getconn, pool.putconn, w3, contract, block_step=1000)
+    fork_point = w3.testing.snapshot()
+    record_event(chain, "P1", "05" * 32)
+    w3.testing.mine(3)
+    indexer.run_once()
+    assert len(indexed(conn)) == 1
+
+    w3.testing.revert(fork_point)
+    record_event(chain, "P1", "06" * 32)
+    indexer.run_once()
+    assert [row[1] for row in indexed(conn)] == ["06" * 32]
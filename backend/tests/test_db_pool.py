@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from db import ConnectionPool, PoolTimeout
+
+
+def test_acquire_times_out_when_exhausted(dsn):
+    pool = ConnectionPool(dsn, min_size=0, max_size=1, acquire_timeout=0.2)
+    held = pool.getconn()
+    try:
+        started = time.monotonic()
+        with pytest.raises(PoolTimeout):
+            pool.getconn()
+        assert time.monotonic() - started >= 0.2
+        stats = pool.stats()
+        assert stats["timeouts_total"] == 1 and stats["exhausted_total"] == 1 and stats["in_use"] == 1
+    finally:
+        pool.putconn(held)
+    with pool.connection() as conn:  # The slot is usable again
+        assert conn is held
+    pool.closeall()
+
+
+def test_broken_idle_connection_is_replaced(dsn, conn):
+    pool = ConnectionPool(dsn, min_size=1, max_size=1, health_check_interval=0)
+    pool.open()
+    with pool.connection() as pooled:
+        cursor = pooled.cursor()
+        cursor.execute("SELECT pg_backend_pid()")
+        pid = cursor.fetchone()[0]
+        pooled.rollback()
+    admin = conn.cursor()
+    admin.execute("SELECT pg_terminate_backend(%s)", (pid,))
+    conn.commit()
+    time.sleep(0.1)
+
+    with pool.connection() as pooled:
+        cursor = pooled.cursor()
+        cursor.execute("SELECT pg_backend_pid()")
+        assert cursor.fetchone()[0] != pid
+    assert pool.stats()["health_check_failures"] == 1
+    assert pool.stats()["size"] == 1
+    pool.closeall()
+
+
+def test_putconn_rolls_back_open_transactions(pool):
+    with pool.connection() as conn:
+        conn.cursor().execute("CREATE TEMP TABLE leaked (id INT)")
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('pg_temp.leaked')")
+        assert cursor.fetchone()[0] is None
+
+
+def test_failed_connect_frees_the_slot():
+    pool = ConnectionPool("postgresql://nobody@/nodb?host=/nonexistent", min_size=0, max_size=1, acquire_timeout=0.2)
+    for _ in range(2):
+        with pytest.raises(Exception) as raised:
+            pool.getconn()
+        assert not isinstance(raised.value, PoolTimeout)
+    assert pool.stats()["size"] == 0
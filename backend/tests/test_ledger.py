@@ -0,0 +1,106 @@
+import threading
+
+import psycopg2
+import pytest
+
+from conftest import create_product, event
+from ledger import append_events, event_hash, lock_chain_heads
+
+
+def chain_rows(conn, product_id):
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT timestamp, location, stage, actor, previous_hash, current_hash FROM traceability_log WHERE product_id = %s ORDER BY log_id",
+        (product_id,)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def assert_unforked(conn, product_id):
+    rows = chain_rows(conn, product_id)
+    previous = "0"
+    for timestamp, location, stage, actor, previous_hash, current_hash in rows:
+        assert previous_hash == previous
+        assert event_hash(product_id, timestamp, location, stage, actor, previous_hash) == current_hash
+        previous = current_hash
+    cursor = conn.cursor()
+    cursor.execute("SELECT head_hash, event_count FROM traceability_heads WHERE product_id = %s", (product_id,))
+    assert cursor.fetchone() == (previous, len(rows))
+    cursor.close()
+    return rows
+
+
+def test_batch_returns_entries_in_request_order(conn):
+    create_product(conn, "P1")
+    create_product(conn, "P2")
+    cursor = conn.cursor()
+    entries, errors = append_events(cursor, [event("P2", "a"), event("P1", "b"), event("P2", "c"), event("NOPE", "d")])
+    conn.commit()
+    assert [(entry["product_id"], entry["location"]) for entry in entries] == [("P2", "a"), ("P1", "b"), ("P2", "c")]
+    assert errors == [{"index": 3, "product_id": "NOPE", "error": "Product ID not found or has no initial log."}]
+    assert len(assert_unforked(conn, "P2")) == 3
+    cursor.execute("SELECT count(*) FROM anchor_outbox")
+    assert cursor.fetchone()[0] == 3
+
+
+def test_concurrent_appends_build_one_chain(dsn, conn):
+    create_product(conn, "P1")
+    threads, per_thread, failures = 8, 10, []
+    start = threading.Barrier(threads)
+
+    def writer(n):
+        writer_conn = psycopg2.connect(dsn)
+        try:
+            start.wait()
+            for i in range(per_thread):
+                cursor = writer_conn.cursor()
+                append_events(cursor, [event("P1", f"w{n}-{i}")])
+                writer_conn.commit()
+                cursor.close()
+        except Exception as e:
+            failures.append(e)
+        finally:
+            writer_conn.close()
+
+    workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert not failures
+    assert len(assert_unforked(conn, "P1")) == 1 + threads * per_thread
+
+
+def test_missing_head_is_backfilled_from_the_log(conn):
+    create_product(conn, "P1")
+    create_product(conn, "P2")
+    cursor = conn.cursor()
+    append_events(cursor, [event("P1", "a"), event("P1", "b"), event("P2", "c")])
+    cursor.execute("DELETE FROM traceability_heads WHERE product_id = 'P1'")  # As written before heads existed
+    conn.commit()
+    newest = chain_rows(conn, "P1")[-1]
+
+    heads = lock_chain_heads(cursor, ["P2", "P1", "P1"])
+    assert set(heads) == {"P1", "P2"}
+    assert heads["P1"].head_hash == newest[5] and heads["P1"].last_location == "b"
+    assert heads["P1"].manufacturer_id == "M1" and heads["P1"].batch_number == "B1"
+    entries, _ = append_events(cursor, [event("P1", "d")])
+    conn.commit()
+    assert entries[0]["previous_hash"] == newest[5]
+    assert len(assert_unforked(conn, "P1")) == 4
+
+
+def test_unknown_products_have_no_head(conn):
+    cursor = conn.cursor()
+    assert lock_chain_heads(cursor, ["NOPE"]) == {}
+
+
+def test_duplicate_hash_is_rejected(conn):
+    create_product(conn, "P1")
+    cursor = conn.cursor()
+    cursor.execute("SELECT current_hash FROM traceability_log WHERE product_id = 'P1'")
+    genesis_hash = cursor.fetchone()[0]
+    with pytest.raises(psycopg2.IntegrityError):
+        cursor.execute("INSERT INTO traceability_hashes (current_hash, product_id) VALUES (%s, 'P1')", (genesis_hash,))
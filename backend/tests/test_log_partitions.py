@@ -0,0 +1,128 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import ledger  # noqa: E402
+from chain_audit import verify_product  # noqa: E402
+from conftest import create_product, event  # noqa: E402
+from log_partitions import (ArchiveError, archive_partition, archived_chain_rows, archived_events,  # noqa: E402
+                            ensure_partitions, list_partitions)
+
+JANUARY, FEBRUARY = "traceability_log_2025_01", "traceability_log_2025_02"
+
+
+def at(month: int, day: int) -> datetime.datetime:
+    return datetime.datetime(2025, month, day, 12, tzinfo=datetime.timezone.utc)
+
+
+def append_at(conn, monkeypatch, moment: datetime.datetime, *events):
+    """append_events as if it ran at `moment`."""
+    class Clock(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment
+
+    cursor = conn.cursor()
+    with monkeypatch.context() as patch:
+        patch.setattr(ledger, "datetime", SimpleNamespace(datetime=Clock, timedelta=datetime.timedelta, timezone=datetime.timezone))
+        entries, _ = ledger.append_events(cursor, list(events))
+    conn.commit()
+    cursor.close()
+    return entries
+
+
+def query(conn, statement: str, params=None):
+    cursor = conn.cursor()
+    cursor.execute(statement, params)
+    rows = cursor.fetchall() if cursor.description else None
+    conn.commit()
+    cursor.close()
+    return rows
+
+
+@pytest.fixture
+def history(conn, monkeypatch):
+    """P1: genesis and one event in January 2025, one in February. P2: genesis in February."""
+    create_product(conn, "P1", created_at=at(1, 10))
+    append_at(conn, monkeypatch, at(1, 20), event("P1", "Hub A"))
+    append_at(conn, monkeypatch, at(2, 5), event("P1", "Hub B"))
+    create_product(conn, "P2", created_at=at(2, 3))
+    cursor = conn.cursor()
+    ensure_partitions(cursor, 2, now=at(1, 1))  # Moves the rows out of the default partition
+    cursor.execute("UPDATE traceability_log SET blockchain_tx_id = '0xfeed' WHERE location = 'Hub A'")
+    conn.commit()
+    cursor.close()
+    return conn
+
+
+def partition_names(conn):
+    cursor = conn.cursor()
+    names = [p["name"] for p in list_partitions(cursor)]
+    conn.commit()
+    cursor.close()
+    return names
+
+
+def anchored(conn):
+    query(conn, "DELETE FROM anchor_outbox")
+
+
+def assert_untouched(conn, tmp_path, heads_before):
+    assert {JANUARY, FEBRUARY} <= set(partition_names(conn))
+    assert query(conn, "SELECT count(*) FROM traceability_archives") == [(0,)]
+    assert query(conn, "SELECT product_id, archived_log_id, archived_hash FROM traceability_heads ORDER BY product_id") == heads_before
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_refuses_unanchored_events(history, tmp_path):
+    heads = query(history, "SELECT product_id, archived_log_id, archived_hash FROM traceability_heads ORDER BY product_id")
+    with pytest.raises(ArchiveError, match="waiting to be anchored"):
+        archive_partition(history, JANUARY, str(tmp_path))
+    assert_untouched(history, tmp_path, heads)
+
+
+def test_refuses_a_month_before_the_older_ones(history, tmp_path):
+    anchored(history)
+    heads = query(history, "SELECT product_id, archived_log_id, archived_hash FROM traceability_heads ORDER BY product_id")
+    with pytest.raises(ArchiveError, match="oldest-first"):
+        archive_partition(history, FEBRUARY, str(tmp_path))
+    assert_untouched(history, tmp_path, heads)
+
+
+def test_broken_chain_leaves_everything_in_place(history, tmp_path):
+    anchored(history)
+    heads = query(history, "SELECT product_id, archived_log_id, archived_hash FROM traceability_heads ORDER BY product_id")
+    query(history, "UPDATE traceability_log SET location = 'Elsewhere' WHERE location = 'Hub A'")
+    with pytest.raises(ArchiveError, match="Chain of P1 is broken"):
+        archive_partition(history, JANUARY, str(tmp_path))
+    assert_untouched(history, tmp_path, heads)
+    assert query(history, "SELECT count(*) FROM traceability_log_2025_01") == [(2,)]
+
+
+def test_archive_then_append_and_verify_from_genesis(history, tmp_path):
+    anchored(history)
+    january = archive_partition(history, JANUARY, str(tmp_path))
+    assert (january["rows"], january["products"]) == (2, 1)
+    february = archive_partition(history, FEBRUARY, str(tmp_path))
+    assert (february["rows"], february["products"]) == (2, 2)
+    assert JANUARY not in partition_names(history) and FEBRUARY not in partition_names(history)
+    assert query(history, "SELECT count(*) FROM traceability_log WHERE product_id = 'P1'") == [(0,)]
+
+    [(head_hash, archived_hash)] = query(history, "SELECT head_hash, archived_hash FROM traceability_heads WHERE product_id = 'P1'")
+    assert archived_hash == head_hash  # Every P1 event is archived
+    cursor = history.cursor()
+    [entry], _ = ledger.append_events(cursor, [event("P1", "Hub C")])
+    history.commit()
+    assert entry["previous_hash"] == archived_hash
+
+    events = archived_events(cursor, "P1")
+    assert [e["location"] for e in events] == ["Manufacturing Unit, Test Foods", "Hub A", "Hub B"]
+    lookup = SimpleNamespace(event_hashes=lambda product_id: {events[1]["current_hash"]})
+    full = verify_product(cursor, "P1", lookup, archived_rows=archived_chain_rows(events))
+    assert full["valid"] and full["events"] == 4 and full["anchored"] == 1 and full["onchain_checked"]
+    live = verify_product(cursor, "P1", lookup)
+    assert live["valid"] and live["events"] == 1
+    cursor.close()
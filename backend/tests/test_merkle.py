@@ -0,0 +1,39 @@
+import hashlib
+
+import pytest
+
+from merkle import build_tree, merkle_proof, merkle_root, verify_proof
+
+
+def hashes(n):
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(n)]
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 5, 7, 8, 9, 16, 17, 100])
+def test_every_leaf_proves_inclusion(n):
+    leaves = hashes(n)
+    levels = build_tree(leaves)
+    root = merkle_root(levels)
+    for index, leaf in enumerate(leaves):
+        assert verify_proof(leaf, merkle_proof(levels, index), root)
+
+
+def test_proof_rejects_other_leaf_and_root():
+    leaves = hashes(9)
+    levels = build_tree(leaves)
+    root = merkle_root(levels)
+    proof = merkle_proof(levels, 4)
+    assert not verify_proof(leaves[5], proof, root)
+    assert not verify_proof(hashlib.sha256(b"forged").hexdigest(), proof, root)
+    assert not verify_proof(leaves[4], proof, merkle_root(build_tree(hashes(8))))
+
+
+def test_root_accepts_0x_prefix():
+    leaves = hashes(3)
+    levels = build_tree(leaves)
+    assert verify_proof(leaves[2], merkle_proof(levels, 2), "0x" + merkle_root(levels).upper())
+
+
+def test_empty_tree_is_refused():
+    with pytest.raises(ValueError):
+        build_tree([])
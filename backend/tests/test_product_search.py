@@ -0,0 +1,20 @@
+import pytest
+
+from product_search import InvalidSearch, decode_listing_cursor, encode_cursor, listing_cursor
+
+
+@pytest.mark.parametrize("product_id", ["BFT_B1_0D9EDA", "BFT_LOT-7/A_ABC123", "SEED_000000042"])
+def test_listing_cursor_round_trip_and_raw_ids(product_id):
+    assert decode_listing_cursor(listing_cursor(product_id)) == product_id
+    assert decode_listing_cursor(product_id) == product_id
+
+
+@pytest.mark.parametrize("cursor", [
+    listing_cursor("BFT_B1_0D9EDA")[:-3],  # Truncated
+    "not-a-cursor",
+    encode_cursor("expiry", "2026-01-01", "BFT_B1_0D9EDA"),
+    encode_cursor("review_date", "2026-01-01T00:00:00", 7),
+])
+def test_garbled_or_foreign_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidSearch):
+        decode_listing_cursor(cursor)
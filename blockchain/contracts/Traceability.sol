@@ -10,6 +10,9 @@ contract Traceability {
     // Mapping from a product batch ID (bytes32) to an array of event hashes (bytes32)
     mapping(bytes32 => bytes32[]) private traceEvents;
 
+    // Mapping from a batch Merkle root to the block timestamp it was recorded at (0 if unknown)
+    mapping(bytes32 => uint256) public batchRecordedAt;
+
     // Event to be emitted when a new hash is recorded
     event EventRecorded(
         bytes32 indexed productBatchId,
@@ -18,6 +21,14 @@ contract Traceability {
         uint256 timestamp
     );
 
+    // Event to be emitted when the Merkle root of a batch of event hashes is recorded
+    event BatchRootRecorded(
+        bytes32 indexed merkleRoot,
+        uint256 leafCount,
+        address recorder,
+        uint256 timestamp
+    );
+
     /**
      * @dev Records a new traceability event hash for a given product batch.
      * Only the owner (the backend server) can call this function.
@@ -51,4 +62,52 @@ contract Traceability {
     ) external view returns (bytes32[] memory) {
         return traceEvents[_productBatchId];
     }
+
+    /**
+     * @dev Records the Merkle root of a batch of traceability event hashes.
+     * One transaction anchors every event in the batch; each event stays verifiable
+     * through its Merkle proof (see verifyInclusion).
+     * @param _merkleRoot Root of the SHA-256 Merkle tree built by the backend.
+     * @param _leafCount Number of event hashes in the batch.
+     */
+    function recordBatchRoot(
+        bytes32 _merkleRoot,
+        uint256 _leafCount
+    ) external {
+        require(batchRecordedAt[_merkleRoot] == 0, "Batch root already recorded");
+        batchRecordedAt[_merkleRoot] = block.timestamp;
+
+        emit BatchRootRecorded(
+            _merkleRoot,
+            _leafCount,
+            msg.sender,
+            block.timestamp
+        );
+    }
+
+    /**
+     * @dev Checks that an event hash is part of a recorded batch.
+     * Leaves are sha256(0x00 || eventHash) and inner nodes sha256(0x01 || min || max).
+     * @param _merkleRoot The recorded batch root.
+     * @param _eventHash The SHA-256 hash of the off-chain event data.
+     * @param _proof Sibling hashes from the leaf up to the root.
+     * @return True if the proof leads to a recorded root.
+     */
+    function verifyInclusion(
+        bytes32 _merkleRoot,
+        bytes32 _eventHash,
+        bytes32[] calldata _proof
+    ) external view returns (bool) {
+        if (batchRecordedAt[_merkleRoot] == 0) {
+            return false;
+        }
+        bytes32 node = sha256(abi.encodePacked(bytes1(0x00), _eventHash));
+        for (uint256 i = 0; i < _proof.length; i++) {
+            bytes32 sibling = _proof[i];
+            node = node < sibling
+                ? sha256(abi.encodePacked(bytes1(0x01), node, sibling))
+                : sha256(abi.encodePacked(bytes1(0x01), sibling, node));
+        }
+        return node == _merkleRoot;
+    }
 }